@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
+import json
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -23,7 +25,7 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = 'django-insecure-u9uo&b6)2t8g05(iu63v7yt7h_^mc^(89=j^c95gey%l4#pdwj'
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = os.environ.get("DJANGO_DEBUG", "1") == "1"
 
 ALLOWED_HOSTS = []
 
@@ -47,6 +49,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    "parking.middleware.TenantMiddleware",
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -56,12 +59,19 @@ WSGI_APPLICATION = 'forin_cars.wsgi.application'
 ASGI_APPLICATION = 'forin_cars.asgi.application'
 
 
+# en producción los templates se compilan una vez por proceso (cached loader);
+# en desarrollo se releen para ver los cambios sin reiniciar
+_TEMPLATE_LOADERS = [
+    "django.template.loaders.filesystem.Loader",
+    "django.template.loaders.app_directories.Loader",
+]
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [BASE_DIR / "templates"],
-        'APP_DIRS': True,
         'OPTIONS': {
+            'loaders': _TEMPLATE_LOADERS if DEBUG else [("django.template.loaders.cached.Loader", _TEMPLATE_LOADERS)],
             'context_processors': [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
@@ -76,13 +86,84 @@ TEMPLATES = [
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
 
+# SQLite con varios procesos escribiendo (puerta, worker, comandos): las
+# transacciones toman el lock de escritura al empezar (si no, dos que leyeron y
+# quieren escribir chocan con "database is locked" sin esperar), WAL para que
+# las lecturas no bloqueen y un timeout para esperar turno.
+SQLITE_OPTIONS = {
+    "transaction_mode": "IMMEDIATE",
+    "timeout": 20,
+    "init_command": "PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;",
+}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': SQLITE_OPTIONS,
+        # en archivo (no en memoria): los tests de concurrencia abren la base desde otros procesos
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
+# Shards por operador (tenant). Vacío = todo en default.
+# Ej. local: PARKING_SHARDS=shard1,shard2 -> db_shard1.sqlite3, db_shard2.sqlite3
+PARKING_SHARDS = [a.strip() for a in os.environ.get("PARKING_SHARDS", "").split(",") if a.strip()]
+for _alias in PARKING_SHARDS:
+    DATABASES[_alias] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / f'db_{_alias}.sqlite3',
+        'OPTIONS': SQLITE_OPTIONS,
+    }
+
+DATABASE_ROUTERS = ["parking.routers.TenantRouter"]
+
+# Cache compartida por todos los procesos (web, worker_tareas, servidor_porton,
+# despachar_outbox): versiones de lo compilado (parking.versiones), contadores
+# de ocupación (parking.contadores) y el mapa de shards. PARKING_CACHE:
+# - redis://host:6379/0 o memcached://host:11211: lo recomendado (los
+#   contadores suman con incr atómico, sin tocar la base)
+# - vacío: tabla "parking_cache" en la base default (manage.py createcachetable);
+#   los contadores se recuentan en la base con cada movimiento
+# - local: LocMem, solo para desarrollo con un único proceso (runserver); los
+#   comandos que corren aparte se niegan a arrancar
+PARKING_CACHE = os.environ.get("PARKING_CACHE", "")
+if PARKING_CACHE.startswith(("redis://", "rediss://")):
+    CACHES = {"default": {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": PARKING_CACHE}}
+elif PARKING_CACHE.startswith("memcached://"):
+    CACHES = {"default": {
+        "BACKEND": "django.core.cache.backends.memcached.PyMemcacheCache",
+        "LOCATION": PARKING_CACHE.removeprefix("memcached://"),
+    }}
+elif PARKING_CACHE == "local":
+    CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "OPTIONS": {"MAX_ENTRIES": 100_000}}}
+else:
+    CACHES = {"default": {
+        "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+        "LOCATION": "parking_cache",
+        "OPTIONS": {"MAX_ENTRIES": 100_000},
+    }}
+
+# Webhooks a sistemas externos (contabilidad, barreras, cartelería): cada
+# ingreso/egreso deja un MensajeOutbox por endpoint en la misma transacción y
+# `manage.py despachar_outbox` los entrega. Claves: nombre, url, secreto
+# (firma HMAC), eventos (por defecto INGRESO, EGRESO y AJUSTE, que son los
+# cierres en bloque y las correcciones; UMBRAL para las alertas de capacidad,
+# ver UmbralAlerta), cocheras (ids; vacío = todas), lote (eventos por POST),
+# timeout (segundos). Ej:
+# PARKING_WEBHOOKS='[{"nombre": "contable", "url": "https://...", "secreto": "xyz", "eventos": ["EGRESO"]}]'
+PARKING_WEBHOOKS = json.loads(os.environ.get("PARKING_WEBHOOKS", "[]"))
+
+# Secuenciador de movimientos (parking.secuenciador): hilos que corren los
+# ingresos/egresos, cada cochera siempre en el mismo y con group commit.
+# 0 = apagado (cada request escribe por su cuenta, con locks). Con SQLite, 1
+# por base: hay un solo escritor y más hilos se esperan entre ellos.
+PARKING_SECUENCIADOR = int(os.environ.get("PARKING_SECUENCIADOR", "0"))
+
+# Snapshot columnar de movimientos para reportes (parking.services_snapshot):
+# lo arma `manage.py snapshot_movimientos`, una carpeta por alias de base.
+PARKING_SNAPSHOTS = Path(os.environ.get("PARKING_SNAPSHOTS", BASE_DIR / "snapshots"))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
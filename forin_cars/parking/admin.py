@@ -1,16 +1,291 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.contrib.admin.utils import get_fields_from_path
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import models
+from django.shortcuts import redirect
+from django.utils import timezone
+from django.utils.functional import cached_property
+
 from .models import (
     TipoEspacio, Cochera, CocheraEmpleado, InvitacionEmpleado,
-    ConfigCapacidad, TarifaHora, Espacio, Cliente, Vehiculo, Movimiento
+    ConfigCapacidad, TarifaHora, ReglaTarifa, Espacio, Cliente, Vehiculo, Movimiento,
+    Reserva, Abonado, ShardOperador, EventoMovimiento, RecaudacionDiaria, Tarea,
+    MensajeOutbox, Dispositivo, UmbralAlerta,
 )
+from .services_eventos import _en_lotes
+from .services_movimientos import cerrar_movimientos
+from .services_reconciliacion import liberar_espacios
+from . import cola, tareas, tenancy
+
+
+# más allá de esto el admin no cuenta: muestra "10000+" páginas y listo
+TOPE_CONTEO = 10000
+# acciones sobre más filas que esto se mandan a la cola en lotes
+LOTE_ACCION = 500
+
+
+class ConteoAcotadoPaginator(Paginator):
+    """
+    Paginator que no hace COUNT(*) sobre la tabla entera: cuenta sobre un
+    subquery con LIMIT, así con millones de filas cuesta lo mismo que con diez mil.
+    """
+
+    @cached_property
+    def count(self):
+        return self.object_list[:TOPE_CONTEO + 1].count()
+
+
+class CocheraFilter(admin.SimpleListFilter):
+    """Filtro por cochera con id/nombre (el RelatedFieldListFilter llama __str__ por cochera)."""
+    title = "cochera"
+    parameter_name = "cochera"
+
+    def lookups(self, request, model_admin):
+        return list(Cochera.objects.order_by("nombre").values_list("id", "nombre"))
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(cochera_id=self.value())
+        return queryset
+
+
+class TablaGrandeAdmin(admin.ModelAdmin):
+    """Base para tablas que crecen sin techo (movimientos, eventos, espacios)."""
+    paginator = ConteoAcotadoPaginator
+    show_full_result_count = False
+    list_per_page = 50
+    # el buscador hace igualdad exacta contra este campo indexado (los "=campo"
+    # de Django son iexact: UPPER()/LIKE que no usan el índice)
+    busqueda_exacta = None
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not self.busqueda_exacta or not term:
+            return super().get_search_results(request, queryset, search_term)
+        campo = get_fields_from_path(self.model, self.busqueda_exacta)[-1]
+        if isinstance(campo, models.CharField):
+            # tickets y códigos se guardan en mayúsculas
+            term = term.upper()
+        try:
+            valor = campo.to_python(term)
+        except ValidationError:
+            return queryset.none(), False
+        return queryset.filter(**{self.busqueda_exacta: valor}), False
+
+    # Cochera.__str__ va a owner (otra query por fila, y con shards otra base)
+    @admin.display(description="Cochera", ordering="cochera__nombre")
+    def cochera_nombre(self, obj):
+        return obj.cochera.nombre
+
 
 admin.site.register(TipoEspacio)
-admin.site.register(Cochera)
 admin.site.register(CocheraEmpleado)
 admin.site.register(InvitacionEmpleado)
 admin.site.register(ConfigCapacidad)
 admin.site.register(TarifaHora)
-admin.site.register(Espacio)
-admin.site.register(Cliente)
-admin.site.register(Vehiculo)
-admin.site.register(Movimiento)
+admin.site.register(ReglaTarifa)
+admin.site.register(ShardOperador)
+
+
+@admin.register(Cochera)
+class CocheraAdmin(admin.ModelAdmin):
+    list_display = ("id", "nombre", "owner", "activa", "estrategia_asignacion", "horas_abandono")
+    list_filter = ("activa",)
+    search_fields = ("nombre",)
+    raw_id_fields = ("owner",)
+    actions = ["cerrar_abandonados"]
+
+    @admin.action(description="Cerrar movimientos abandonados (según horas de abandono, en segundo plano)")
+    def cerrar_abandonados(self, request, queryset):
+        for cochera_id in queryset.values_list("id", flat=True):
+            cola.encolar(tareas.cerrar_abandonados, cochera_id=cochera_id,
+                         clave=f"abandonados:{tenancy.clave(cochera_id)}")
+        self.message_user(request, "Se encoló el cierre de abandonados (worker_tareas).")
+
+    def get_queryset(self, request):
+        qs = super().get_queryset(request)
+        # con shards el owner vive en "default": no se puede joinear
+        return qs if tenancy.sharding_activo() else qs.select_related("owner")
+
+
+@admin.register(Espacio)
+class EspacioAdmin(TablaGrandeAdmin):
+    list_display = ("id", "cochera_nombre", "tipo", "etiqueta", "nivel", "orden", "ocupado")
+    list_select_related = ("cochera", "tipo")
+    list_filter = ("ocupado", "tipo", CocheraFilter)
+    raw_id_fields = ("cochera",)
+    actions = ["liberar"]
+
+    @admin.action(description="Liberar espacios seleccionados (sin movimiento ABIERTO)")
+    def liberar(self, request, queryset):
+        ids = list(queryset.filter(ocupado=True).values_list("id", flat=True))
+        n = sum(liberar_espacios(lote, motivo="admin") for lote in _en_lotes(ids))
+        self.message_user(request, f"Se liberaron {n} espacios.")
+        if n < len(ids):
+            self.message_user(request, f"{len(ids) - n} tienen un movimiento ABIERTO y quedaron ocupados.", messages.WARNING)
+
+
+@admin.register(Cliente)
+class ClienteAdmin(TablaGrandeAdmin):
+    list_display = ("id", "nombre", "apellido", "telefono", "email")
+    search_fields = ("=id",)
+    busqueda_exacta = "id"
+
+
+@admin.register(Vehiculo)
+class VehiculoAdmin(TablaGrandeAdmin):
+    list_display = ("id", "ticket", "patente_ult3", "tipo", "cliente_id")
+    list_select_related = ("tipo",)
+    list_filter = ("tipo",)
+    search_fields = ("=ticket",)
+    busqueda_exacta = "ticket"
+    raw_id_fields = ("cliente",)
+
+
+@admin.register(Movimiento)
+class MovimientoAdmin(TablaGrandeAdmin):
+    list_display = ("id", "ticket", "cochera_nombre", "espacio_etiqueta", "estado", "ingreso_at", "egreso_at", "monto")
+    list_select_related = ("vehiculo", "cochera", "espacio")
+    list_filter = ("estado", CocheraFilter)
+    date_hierarchy = "ingreso_at"
+    ordering = ("-ingreso_at",)
+    search_fields = ("=vehiculo__ticket",)
+    busqueda_exacta = "vehiculo__ticket"
+    raw_id_fields = ("vehiculo", "espacio", "operador", "abonado")
+    actions = ["cerrar"]
+
+    def changelist_view(self, request, extra_context=None):
+        # sin filtros arranca en el mes actual: la jerarquía de fechas sobre
+        # la tabla entera hace un DISTINCT por año que la recorre completa
+        if request.method == "GET" and not request.GET:
+            hoy = timezone.localdate()
+            return redirect(f"{request.path}?ingreso_at__year={hoy.year}&ingreso_at__month={hoy.month}")
+        return super().changelist_view(request, extra_context)
+
+    @admin.display(description="Ticket", ordering="vehiculo__ticket")
+    def ticket(self, obj):
+        return obj.vehiculo.ticket
+
+    @admin.display(description="Espacio")
+    def espacio_etiqueta(self, obj):
+        return obj.espacio.etiqueta or obj.espacio_id
+
+    @admin.action(description="Cerrar movimientos ABIERTOS seleccionados (cobra hasta ahora)")
+    def cerrar(self, request, queryset):
+        ids = list(queryset.filter(estado=Movimiento.ABIERTO).values_list("id", flat=True))
+        if len(ids) <= LOTE_ACCION:
+            n = cerrar_movimientos(ids, operador_id=request.user.id, motivo="admin")
+            self.message_user(request, f"Se cerraron {n} movimientos.")
+            return
+        # se cobra hasta el momento del click, aunque el worker corra después
+        ahora = timezone.now().isoformat()
+        for lote in _en_lotes(ids, LOTE_ACCION):
+            cola.encolar(tareas.cerrar_movimientos, movimiento_ids=lote, operador_id=request.user.id,
+                         motivo="admin", ahora=ahora, prioridad=5)
+        self.message_user(request, f"Se encolaron {len(ids)} movimientos para cerrar (worker_tareas).")
+
+
+@admin.register(Reserva)
+class ReservaAdmin(TablaGrandeAdmin):
+    list_display = ("id", "codigo", "cochera_nombre", "tipo", "estado", "desde", "hasta")
+    list_select_related = ("cochera", "tipo")
+    list_filter = ("estado", CocheraFilter)
+    search_fields = ("=codigo",)
+    busqueda_exacta = "codigo"
+    raw_id_fields = ("cochera", "cliente", "movimiento")
+
+
+@admin.register(Abonado)
+class AbonadoAdmin(TablaGrandeAdmin):
+    list_display = ("id", "cochera_nombre", "ticket", "tipo", "activo")
+    list_select_related = ("cochera", "tipo", "vehiculo")
+    list_filter = ("activo",)
+    raw_id_fields = ("cochera", "vehiculo", "espacio", "cliente")
+
+    @admin.display(description="Ticket", ordering="vehiculo__ticket")
+    def ticket(self, obj):
+        return obj.vehiculo.ticket
+
+
+@admin.register(EventoMovimiento)
+class EventoMovimientoAdmin(TablaGrandeAdmin):
+    """La bitácora es append-only: desde el admin solo se mira."""
+    list_display = ("id", "tipo", "cochera_id", "movimiento_id", "espacio_id", "monto", "ocurrido_at")
+    list_filter = ("tipo", CocheraFilter)
+    search_fields = ("=movimiento_id",)
+    busqueda_exacta = "movimiento"
+    ordering = ("-id",)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(Tarea)
+class TareaAdmin(TablaGrandeAdmin):
+    list_display = ("id", "nombre", "estado", "prioridad", "intentos", "alias", "disponible_at", "terminada_at")
+    list_filter = ("estado", "nombre")
+    search_fields = ("=clave",)
+    ordering = ("-id",)
+    readonly_fields = ("error",)
+    actions = ["reintentar"]
+
+    @admin.action(description="Reintentar fallidas (vuelven a PENDIENTE con los intentos en 0)")
+    def reintentar(self, request, queryset):
+        n = queryset.filter(estado=Tarea.FALLIDA).update(
+            estado=Tarea.PENDIENTE, intentos=0, disponible_at=timezone.now(), error=""
+        )
+        self.message_user(request, f"{n} tareas vuelven a la cola.")
+
+
+@admin.register(MensajeOutbox)
+class MensajeOutboxAdmin(TablaGrandeAdmin):
+    list_display = ("id", "destino", "estado", "intentos", "cochera_id", "evento_id", "disponible_at", "entregado_at")
+    list_filter = ("estado", "destino")
+    search_fields = ("=evento_id",)
+    busqueda_exacta = "evento"
+    ordering = ("-id",)
+    readonly_fields = ("cuerpo", "error")
+    actions = ["reintentar"]
+
+    @admin.action(description="Reintentar fallidos (vuelven a PENDIENTE con los intentos en 0)")
+    def reintentar(self, request, queryset):
+        n = queryset.filter(estado=MensajeOutbox.FALLIDO).update(
+            estado=MensajeOutbox.PENDIENTE, intentos=0, disponible_at=timezone.now(), error=""
+        )
+        self.message_user(request, f"{n} mensajes vuelven al outbox.")
+
+
+@admin.register(Dispositivo)
+class DispositivoAdmin(admin.ModelAdmin):
+    """El token se da de alta con `manage.py dispositivos alta` (acá solo se ve el hash)."""
+    list_display = ("id", "nombre", "cochera_id", "operador_id", "activo", "created_at")
+    list_filter = ("activo",)
+    readonly_fields = ("token_hash",)
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(UmbralAlerta)
+class UmbralAlertaAdmin(admin.ModelAdmin):
+    """Los avisos salen por el outbox: el endpoint tiene que tener "UMBRAL" en eventos."""
+    list_display = ("id", "cochera", "tipo", "porcentaje", "histeresis", "activo", "disparado", "disparado_at")
+    list_select_related = ("cochera", "tipo")
+    list_filter = ("activo", "disparado")
+    raw_id_fields = ("cochera",)
+    readonly_fields = ("disparado_at",)
+
+
+@admin.register(RecaudacionDiaria)
+class RecaudacionDiariaAdmin(TablaGrandeAdmin):
+    list_display = ("fecha", "cochera_nombre", "egresos", "total")
+    list_select_related = ("cochera",)
+    date_hierarchy = "fecha"
+    raw_id_fields = ("cochera",)
@@ -1,5 +1,12 @@
 from django.apps import AppConfig
+from django.utils.module_loading import autodiscover_modules
 
 
 class ParkingConfig(AppConfig):
     name = 'parking'
+
+    def ready(self):
+        from . import signals, versiones  # noqa: F401
+        versiones.verificar_cache()
+        # registra las tareas de la cola (módulos tareas.py de cada app)
+        autodiscover_modules("tareas")
@@ -0,0 +1,171 @@
+"""
+Cola de tareas en la base, sin broker.
+
+- `@tarea("nombre")` registra una función. Los módulos `tareas.py` de las apps
+  se importan solos al arrancar (autodiscover en ParkingConfig.ready).
+- `encolar(...)` crea la Tarea cuando commitea la transacción del tenant
+  actual (fuera de una transacción, en el momento). Con `clave` no se duplica
+  mientras haya una igual PENDIENTE o CORRIENDO.
+- `worker_tareas` las toma con un UPDATE condicional (pueden correr varios
+  workers a la vez), las ejecuta en un pool dentro del tenant en el que se
+  encolaron y reintenta con backoff exponencial. Mientras corren, el worker
+  renueva su latido: una tarea larga no se rescata por haber arrancado hace mucho.
+"""
+import logging
+import traceback
+from datetime import timedelta
+
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Tarea
+from . import tenancy
+
+
+log = logging.getLogger(__name__)
+
+# segundos de espera antes del reintento n: BACKOFF_BASE * 2**(n-1), con tope
+BACKOFF_BASE = 30
+BACKOFF_MAX = 60 * 60
+# cuánto guardamos del traceback
+LARGO_ERROR = 4000
+
+_registro = {}
+
+
+def tarea(nombre, *, prioridad=0, max_intentos=3):
+    """Registra la función como tarea. Los kwargs tienen que ser serializables a JSON."""
+    def deco(func):
+        _registro[nombre] = func
+        func.tarea = {"nombre": nombre, "prioridad": prioridad, "max_intentos": max_intentos}
+        return func
+    return deco
+
+
+def registradas():
+    return sorted(_registro)
+
+
+def encolar(func, *, clave=None, prioridad=None, demora=None, **kwargs):
+    """
+    Encola `func` (función registrada o su nombre) para después del commit.
+    `demora` (timedelta) la deja disponible más tarde.
+    """
+    nombre = func if isinstance(func, str) else func.tarea["nombre"]
+    if nombre not in _registro:
+        raise ValueError(f"Tarea no registrada: {nombre}")
+    config = _registro[nombre].tarea
+
+    datos = {
+        "nombre": nombre,
+        "kwargs": kwargs,
+        "alias": tenancy.alias_actual(),
+        "prioridad": config["prioridad"] if prioridad is None else prioridad,
+        "max_intentos": config["max_intentos"],
+        "clave": clave,
+        "disponible_at": timezone.now() + (demora or timedelta()),
+    }
+    transaction.on_commit(lambda: _crear(datos), using=tenancy.alias_actual())
+
+
+def _crear(datos):
+    try:
+        with transaction.atomic(using="default"):
+            Tarea.objects.create(**datos)
+    except IntegrityError:
+        # ya hay una con la misma clave esperando o corriendo
+        log.debug("tarea %s duplicada (clave=%s)", datos["nombre"], datos["clave"])
+
+
+# --------------------------------------------------------------------------
+# worker
+# --------------------------------------------------------------------------
+
+def reclamar(worker, n):
+    """
+    Toma hasta n tareas listas, por prioridad y antigüedad. El UPDATE exige
+    estado PENDIENTE, así dos workers nunca se llevan la misma.
+    """
+    ahora = timezone.now()
+    candidatas = (
+        Tarea.objects.filter(estado=Tarea.PENDIENTE, disponible_at__lte=ahora)
+        .order_by("-prioridad", "disponible_at", "id")
+        .values_list("id", flat=True)[:n * 2]
+    )
+    tomadas = []
+    for tarea_id in candidatas:
+        if Tarea.objects.filter(id=tarea_id, estado=Tarea.PENDIENTE).update(
+            estado=Tarea.CORRIENDO, tomada_por=worker, iniciada_at=ahora, latido_at=ahora,
+            intentos=F("intentos") + 1,
+        ):
+            tomadas.append(tarea_id)
+            if len(tomadas) == n:
+                break
+    return tomadas
+
+
+def ejecutar(tarea_id):
+    """Corre una tarea ya reclamada. Devuelve True si terminó bien."""
+    close_old_connections()
+    try:
+        t = Tarea.objects.get(id=tarea_id)
+        func = _registro.get(t.nombre)
+        if func is None:
+            _terminar(t, Tarea.FALLIDA, f"Tarea no registrada: {t.nombre}")
+            return False
+        try:
+            with tenancy.tenant(t.alias):
+                func(**t.kwargs)
+        except Exception:
+            error = traceback.format_exc()[-LARGO_ERROR:]
+            log.warning("tarea %s#%s falló (intento %s/%s)", t.nombre, t.id, t.intentos, t.max_intentos)
+            if t.intentos < t.max_intentos:
+                espera = min(BACKOFF_BASE * 2 ** (t.intentos - 1), BACKOFF_MAX)
+                Tarea.objects.filter(id=t.id).update(
+                    estado=Tarea.PENDIENTE,
+                    disponible_at=timezone.now() + timedelta(seconds=espera),
+                    error=error,
+                )
+            else:
+                _terminar(t, Tarea.FALLIDA, error)
+            return False
+        _terminar(t, Tarea.HECHA, "")
+        return True
+    finally:
+        close_old_connections()
+
+
+def _terminar(t, estado, error):
+    Tarea.objects.filter(id=t.id).update(estado=estado, terminada_at=timezone.now(), error=error)
+
+
+def latir(worker, tarea_ids):
+    """El worker avisa que sigue corriendo estas tareas."""
+    if tarea_ids:
+        Tarea.objects.filter(id__in=list(tarea_ids), estado=Tarea.CORRIENDO, tomada_por=worker).update(
+            latido_at=timezone.now()
+        )
+
+
+def rescatar_colgadas(vencimiento):
+    """
+    Las CORRIENDO sin latido hace más de `vencimiento` son de un worker que
+    murió: vuelven a PENDIENTE (o FALLIDA si ya no les quedan intentos).
+    Devuelve cuántas.
+    """
+    limite = timezone.now() - vencimiento
+    colgadas = Tarea.objects.filter(
+        Q(latido_at__lt=limite) | Q(latido_at__isnull=True, iniciada_at__lt=limite),
+        estado=Tarea.CORRIENDO,
+    )
+    n = colgadas.filter(intentos__gte=F("max_intentos")).update(
+        estado=Tarea.FALLIDA, terminada_at=timezone.now(), error="El worker no terminó la tarea."
+    )
+    return n + colgadas.update(estado=Tarea.PENDIENTE, disponible_at=timezone.now())
+
+
+def purgar(dias):
+    """Borra las HECHAS más viejas que `dias` (las FALLIDAS quedan para mirarlas)."""
+    limite = timezone.now() - timedelta(days=dias)
+    return Tarea.objects.filter(estado=Tarea.HECHA, terminada_at__lt=limite).delete()[0]
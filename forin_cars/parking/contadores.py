@@ -0,0 +1,118 @@
+"""
+Ocupados por (cochera, tipo) y de la cochera entera en la cache compartida,
+al día con cada ingreso/egreso sin contar en la base.
+
+services_alertas.ocupacion (en la transacción del ingreso/egreso) hace
+`sumar` cuando commitea; los que leen (alertas, cocheras cercanas) usan
+`ocupados`. Las claves llevan la versión de espacios: lo que pasa por
+invalidar_espacios (cambio de layout, cierres en bloque, reasignaciones,
+reconciliación) arranca contadores nuevos, que se siembran de la base la
+primera vez que se piden. También vencen cada TTL, por si alguno se corrió (un
+proceso que murió entre el commit y el incr, o una siembra que leyó justo
+antes de un commit).
+
+Sumar con incr necesita una cache compartida con incr atómico (Redis o
+Memcached, settings.PARKING_CACHE; o LocMem con un único proceso). Con la
+tabla de la base (el default) el incr es leer y escribir y dos procesos a la
+vez pierden sumas: ahí `sumar` no suma, recuenta la cochera en la base (una
+query agrupada, menos que el get y el set de cada clave) y deja ese número
+con TTL_RECUENTO. Las alertas evalúan con el recuento exacto de después del
+commit; los que leen pueden ver uno de atraso hasta el próximo movimiento o
+que venza la clave.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+
+from .models import Espacio
+from .services_asignacion import VERSION as VERSION_ESPACIOS
+from . import tenancy, versiones
+
+
+TTL = 10 * 60
+# con recuento (cache sin incr atómico) la clave dura poco: un set pisado por
+# un recuento más viejo se corrige solo
+TTL_RECUENTO = 30
+# tipo_id de los contadores de la cochera entera
+TODOS = 0
+
+
+def _key(cochera_id, version_espacios, tipo_id):
+    return f"ocupados:{tenancy.clave(cochera_id, version_espacios)}:{tipo_id}"
+
+
+def incr_atomico():
+    """True si cache.incr no pierde sumas entre procesos (o hay uno solo)."""
+    backend = settings.CACHES["default"]["BACKEND"].lower()
+    return "redis" in backend or "memcached" in backend or versiones.cache_local()
+
+
+def _contar(cochera_ids):
+    """{(cochera_id, tipo_id): ocupados} de la base, con el total en TODOS. Una query."""
+    base = {}
+    filas = (
+        Espacio.objects.filter(cochera_id__in=cochera_ids, ocupado=True)
+        .values_list("cochera_id", "tipo_id").annotate(n=Count("id")).order_by()
+    )
+    for cochera_id, tipo_id, n in filas:
+        base[(cochera_id, tipo_id)] = n
+        base[(cochera_id, TODOS)] = base.get((cochera_id, TODOS), 0) + n
+    return base
+
+
+def _sembrar(keys):
+    """Carga de la base los contadores que faltan: keys = {(cochera_id, tipo_id): key}. Una query."""
+    base = _contar({c for c, _ in keys})
+    ttl = TTL if incr_atomico() else TTL_RECUENTO
+    res = {}
+    for par, key in keys.items():
+        n = base.get(par, 0)
+        # si otro proceso lo sembró en el medio, vale el suyo
+        res[par] = n if cache.add(key, n, ttl) else cache.get(key, n)
+    return res
+
+
+def _recontar(cochera_id, tipo_id):
+    """sumar() sin incr: los ocupados de la base (ya con este cambio), guardados para los que leen."""
+    v = versiones.version(VERSION_ESPACIOS, cochera_id)
+    base = _contar([cochera_id])
+    res = {t: base.get((cochera_id, t), 0) for t in (tipo_id, TODOS)}
+    cache.set_many({_key(cochera_id, v, t): n for t, n in res.items()}, TTL_RECUENTO)
+    return res
+
+
+def sumar(cochera_id, tipo_id, delta):
+    """
+    Suma `delta` a los ocupados del tipo y de la cochera. Va después del
+    commit (una siembra ya incluye este cambio). Devuelve {tipo_id: n, TODOS: n}.
+    """
+    if not incr_atomico():
+        return _recontar(cochera_id, tipo_id)
+    v = versiones.version(VERSION_ESPACIOS, cochera_id)
+    res, faltan = {}, {}
+    for t in (tipo_id, TODOS):
+        key = _key(cochera_id, v, t)
+        try:
+            res[t] = cache.incr(key, delta)
+        except ValueError:
+            faltan[(cochera_id, t)] = key
+    if faltan:
+        res.update({t: n for (_, t), n in _sembrar(faltan).items()})
+    return res
+
+
+def ocupados(cochera_ids, tipo_id=TODOS):
+    """{cochera_id: ocupados del tipo} de varias cocheras: dos get_many (versiones y contadores)."""
+    vers = versiones.versiones(VERSION_ESPACIOS, cochera_ids)
+    keys = {c: _key(c, vers[c], tipo_id) for c in cochera_ids}
+    hit = cache.get_many(keys.values())
+    res, faltan = {}, {}
+    for c, key in keys.items():
+        if key in hit:
+            res[c] = hit[key]
+        else:
+            faltan[(c, tipo_id)] = key
+    if faltan:
+        res.update({c: n for (c, _), n in _sembrar(faltan).items()})
+    return res
+
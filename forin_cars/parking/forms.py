@@ -1,12 +1,12 @@
 from django import forms
 from django.core.validators import validate_email
-from .models import Cochera
+from .models import Cochera, TipoEspacio
 
 
 class CocheraForm(forms.ModelForm):
     class Meta:
         model = Cochera
-        fields = ["nombre", "direccion"]
+        fields = ["nombre", "direccion", "latitud", "longitud", "estrategia_asignacion", "horas_abandono"]
 
 
 class CapacidadForm(forms.Form):
@@ -74,3 +74,20 @@ class EmpleadosForm(forms.Form):
 
         cleaned["emails_list"] = emails_list
         return cleaned
+
+
+class ReservaForm(forms.Form):
+    tipo = forms.ModelChoiceField(queryset=TipoEspacio.objects.order_by("nombre"), label="Tipo de vehículo")
+    desde = forms.DateTimeField(label="Desde", widget=forms.DateTimeInput(attrs={"type": "datetime-local"}))
+    hasta = forms.DateTimeField(label="Hasta", widget=forms.DateTimeInput(attrs={"type": "datetime-local"}))
+    nombre = forms.CharField(max_length=80, required=False)
+    apellido = forms.CharField(max_length=80, required=False)
+    telefono = forms.CharField(max_length=30, required=False)
+    email = forms.EmailField(required=False)
+
+    def clean(self):
+        cleaned = super().clean()
+        desde, hasta = cleaned.get("desde"), cleaned.get("hasta")
+        if desde and hasta and hasta <= desde:
+            raise forms.ValidationError("El horario de salida tiene que ser posterior al de entrada.")
+        return cleaned
@@ -0,0 +1,64 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, Max, Min, Q
+
+from parking.models import Movimiento
+from parking.services_intervalos import EPOCH, UN_MS, _ids, a_ms
+
+
+class Command(BaseCommand):
+    help = (
+        "Consulta 'quién estaba adentro' en instantes al azar de la historia de una "
+        "cochera con el índice de intervalos y con el barrido directo sobre Movimiento, "
+        "compara los resultados y mide los dos."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--cochera", type=int, help="Por defecto la de más movimientos.")
+        parser.add_argument("--n", type=int, default=50, help="Instantes a probar.")
+        parser.add_argument("--rango-min", type=int, default=0, help="Además, rangos de estos minutos.")
+        parser.add_argument("--seed", type=int, default=1)
+
+    def handle(self, *args, **opts):
+        cochera_id = opts["cochera"] or (
+            Movimiento.objects.values("cochera_id").annotate(n=Count("id")).order_by("-n").values_list("cochera_id", flat=True).first()
+        )
+        if cochera_id is None:
+            raise CommandError("No hay movimientos.")
+        limites = Movimiento.objects.filter(cochera_id=cochera_id).aggregate(a=Min("ingreso_at"), b=Max("ingreso_at"))
+        lo, hi = a_ms(limites["a"]), a_ms(limites["b"])
+        rng = random.Random(opts["seed"])
+        largo = opts["rango_min"] * 60_000
+
+        t_indice, t_barrido, total = [], [], 0
+        for _ in range(opts["n"]):
+            a = rng.randrange(lo, hi)
+            b = a + max(largo - 1, 0)
+
+            t0 = time.perf_counter()
+            ids = _ids(cochera_id, a, b)
+            t_indice.append(time.perf_counter() - t0)
+
+            desde, hasta = EPOCH + a * UN_MS, EPOCH + (b + 1) * UN_MS
+            t0 = time.perf_counter()
+            esperado = set(
+                Movimiento.objects.filter(cochera_id=cochera_id, ingreso_at__lt=hasta)
+                .filter(Q(estado=Movimiento.ABIERTO) | Q(egreso_at__gt=desde))
+                .values_list("id", flat=True)
+            )
+            t_barrido.append(time.perf_counter() - t0)
+
+            # duraciones por debajo del ms no entran al índice
+            if ids != esperado:
+                raise CommandError(f"Difiere en t={a}: sobran {sorted(ids - esperado)[:5]} faltan {sorted(esperado - ids)[:5]}")
+            total += len(ids)
+
+        def p(ts, q):
+            ts = sorted(ts)
+            return ts[min(len(ts) - 1, int(len(ts) * q))] * 1000
+
+        self.stdout.write(f"cochera {cochera_id}: {opts['n']} consultas, {total / opts['n']:.1f} adentro en promedio, todo coincide")
+        self.stdout.write(f"índice   p50={p(t_indice, .5):7.2f}ms p95={p(t_indice, .95):7.2f}ms")
+        self.stdout.write(f"barrido  p50={p(t_barrido, .5):7.2f}ms p95={p(t_barrido, .95):7.2f}ms")
@@ -0,0 +1,67 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, Max
+
+from parking import services_analitica
+from parking.models import EventoMovimiento
+
+
+class Command(BaseCommand):
+    help = (
+        "Corre los reportes de analítica (sin cache) sobre una cochera y falla si "
+        "alguno pasa el presupuesto. Sin --cochera usa la de más eventos."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--cochera", type=int)
+        parser.add_argument("--dias", type=int, default=30, help="Días hacia atrás desde el último evento de la cochera.")
+        parser.add_argument("--presupuesto-ms", type=float, default=1000.0)
+        parser.add_argument("--repeticiones", type=int, default=3, help="Se toma la mejor.")
+
+    def handle(self, *args, **opts):
+        cochera_id = opts["cochera"]
+        if cochera_id is None:
+            fila = (
+                EventoMovimiento.objects.values("cochera_id").annotate(n=Count("id")).order_by("-n").first()
+            )
+            if fila is None:
+                raise CommandError("No hay eventos (generar_datos --eventos).")
+            cochera_id = fila["cochera_id"]
+
+        # el último evento y no hoy: los datos de generar_datos terminan en su --hasta
+        ultimo = EventoMovimiento.objects.filter(cochera_id=cochera_id).aggregate(m=Max("ocurrido_at"))["m"]
+        if ultimo is None:
+            raise CommandError(f"La cochera {cochera_id} no tiene eventos.")
+        hasta = ultimo + timedelta(seconds=1)
+        desde = hasta - timedelta(days=opts["dias"])
+        filas = EventoMovimiento.objects.filter(
+            cochera_id=cochera_id, ocurrido_at__gte=desde, ocurrido_at__lt=hasta
+        ).count()
+        self.stdout.write(f"cochera {cochera_id}, {opts['dias']} días, {filas:,} eventos")
+
+        reportes = {
+            "operadores": lambda: services_analitica.rendimiento_operadores(desde, hasta, cochera_id),
+            "puestos": lambda: services_analitica.tiempos_entre_operaciones(desde, hasta, cochera_id),
+            "estadias_tipo": lambda: services_analitica.distribucion_estadias(desde, hasta, cochera_id, por="tipo"),
+            "estadias_dia": lambda: services_analitica.distribucion_estadias(desde, hasta, cochera_id, por="dia_semana"),
+        }
+        pasados = []
+        total = 0.0
+        for nombre, correr in reportes.items():
+            mejor = None
+            for _ in range(max(1, opts["repeticiones"])):
+                t0 = time.perf_counter()
+                res = correr()
+                ms = (time.perf_counter() - t0) * 1000
+                mejor = ms if mejor is None else min(mejor, ms)
+            total += mejor
+            marca = "" if mejor <= opts["presupuesto_ms"] else "  << pasado"
+            self.stdout.write(f"{nombre:<14} {mejor:8.1f}ms  grupos={len(res)}{marca}")
+            if marca:
+                pasados.append(nombre)
+
+        self.stdout.write(f"{'total':<14} {total:8.1f}ms")
+        if pasados:
+            raise CommandError(f"Pasan el presupuesto de {opts['presupuesto_ms']:.0f}ms: {', '.join(pasados)}")
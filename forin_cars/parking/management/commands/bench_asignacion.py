@@ -0,0 +1,58 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from parking.models import Cochera
+from parking.services_asignacion import Pool
+
+
+class Command(BaseCommand):
+    help = "Benchmark en memoria de las estrategias de asignación (bitmap vs. recorrer la lista)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--espacios", type=int, default=2000)
+        parser.add_argument("--niveles", type=int, default=4)
+        parser.add_argument("--ocupacion", type=float, default=0.9, help="Ocupación de régimen (0-1).")
+        parser.add_argument("--ops", type=int, default=200_000)
+        parser.add_argument("--seed", type=int, default=1)
+
+    def handle(self, *args, **opts):
+        n = opts["espacios"]
+        filas = [(i + 1, i // opts["niveles"] + 1, i % opts["niveles"], False) for i in range(n)]
+        objetivo = int(n * opts["ocupacion"])
+
+        for estrategia, nombre in Cochera.ESTRATEGIAS:
+            rnd = random.Random(opts["seed"])
+            pool = Pool(filas)
+            ocupados = []
+            t0 = time.perf_counter()
+            for _ in range(opts["ops"]):
+                if len(ocupados) < objetivo or rnd.random() < 0.5:
+                    eid = pool.tomar(estrategia)
+                    if eid is not None:
+                        ocupados.append(eid)
+                        continue
+                j = rnd.randrange(len(ocupados))
+                ocupados[j], ocupados[-1] = ocupados[-1], ocupados[j]
+                pool.liberar(ocupados.pop())
+            dt = time.perf_counter() - t0
+            self.stdout.write(f"{nombre:<28} {opts['ops'] / dt:>12,.0f} ops/s  ({dt * 1e6 / opts['ops']:.2f} µs/op)")
+
+        # referencia: lo que hacía el ingreso, primer libre recorriendo la lista
+        rnd = random.Random(opts["seed"])
+        libres = [True] * n
+        ocupados = []
+        t0 = time.perf_counter()
+        for _ in range(opts["ops"]):
+            if len(ocupados) < objetivo or rnd.random() < 0.5:
+                i = next((k for k, libre in enumerate(libres) if libre), None)
+                if i is not None:
+                    libres[i] = False
+                    ocupados.append(i)
+                    continue
+            j = rnd.randrange(len(ocupados))
+            ocupados[j], ocupados[-1] = ocupados[-1], ocupados[j]
+            libres[ocupados.pop()] = True
+        dt = time.perf_counter() - t0
+        self.stdout.write(f"{'(scan lineal)':<28} {opts['ops'] / dt:>12,.0f} ops/s  ({dt * 1e6 / opts['ops']:.2f} µs/op)")
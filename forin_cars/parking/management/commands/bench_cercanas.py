@@ -0,0 +1,91 @@
+import random
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+
+from parking import services_catalogo, services_cercanas, tenancy
+from parking.models import Cochera
+
+
+# centro para --sembrar (Obelisco)
+CENTRO = (-34.6037, -58.3816)
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide services_cercanas.cercanas() (grilla en memoria + contadores de la cache) con las cocheras "
+        "de un dueño, y la búsqueda en la grilla sola con N cocheras sintéticas. --sembrar les pone "
+        "coordenadas al azar a las del dueño que no tienen (escribe en la base)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--owner", type=int, help="Id del dueño (por defecto el de la primera cochera).")
+        parser.add_argument("--n", type=int, default=2000, help="Consultas por medición.")
+        parser.add_argument("--sembrar", action="store_true")
+        parser.add_argument("--radio-km", type=float, default=services_cercanas.RADIO_KM)
+        parser.add_argument("--sinteticas", type=int, default=5000, help="Cocheras de la grilla sintética.")
+        parser.add_argument("--presupuesto-us", type=float, help="Falla si el p99 con cache caliente pasa esto.")
+
+    def handle(self, *args, **opts):
+        owner_id = opts["owner"] or Cochera.objects.order_by("id").values_list("owner_id", flat=True).first()
+        if owner_id is None:
+            raise CommandError("No hay cocheras.")
+        if opts["sembrar"]:
+            for c in Cochera.objects.filter(owner_id=owner_id, latitud__isnull=True):
+                lat, lng = self._punto(3)
+                Cochera.objects.filter(id=c.id).update(latitud=round(lat, 6), longitud=round(lng, 6))
+            services_cercanas.invalidar_cercanas(owner_id)
+
+        cocheras = list(Cochera.objects.filter(owner_id=owner_id, activa=True, latitud__isnull=False))
+        if not cocheras:
+            raise CommandError(f"Las cocheras del dueño {owner_id} no tienen coordenadas (probar con --sembrar).")
+        tipos = [t.id for t in services_catalogo.tipos()]
+        consultas = [(random.choice(cocheras), random.choice(tipos)) for _ in range(opts["n"])]
+
+        # la primera vuelta compila la grilla y siembra contadores
+        for c, t in consultas[:50]:
+            services_cercanas.cercanas(c, t, radio_km=opts["radio_km"])
+        lat, encontradas = [], 0
+        with CaptureQueriesContext(connections[tenancy.alias_actual()]) as ctx:
+            for c, t in consultas:
+                t0 = time.perf_counter()
+                encontradas += len(services_cercanas.cercanas(c, t, radio_km=opts["radio_km"]))
+                lat.append(time.perf_counter() - t0)
+        p50, p99 = self._reportar(
+            f"cercanas(): {len(cocheras)} cocheras del dueño {owner_id}, "
+            f"{encontradas / len(consultas):.1f} sugeridas por consulta, {len(ctx)} queries", lat,
+        )
+
+        # la grilla sola, con muchas cocheras en ~30 km
+        filas = [(i, f"c{i}", "", *self._punto(15)) for i in range(opts["sinteticas"])]
+        t0 = time.perf_counter()
+        grilla = services_cercanas.Grilla(filas)
+        armado_ms = (time.perf_counter() - t0) * 1000
+        lat, vistas = [], 0
+        for _ in range(opts["n"]):
+            plat, plng = self._punto(15)
+            t0 = time.perf_counter()
+            vistas += len(grilla.candidatas(plat, plng, opts["radio_km"]))
+            lat.append(time.perf_counter() - t0)
+        self._reportar(
+            f"grilla sola: {opts['sinteticas']:,} cocheras (armado {armado_ms:.1f}ms), "
+            f"{vistas / opts['n']:.0f} candidatas en {opts['radio_km']}km por consulta", lat,
+        )
+
+        if opts["presupuesto_us"] and p99 > opts["presupuesto_us"]:
+            raise CommandError(f"p99 {p99:.0f}us > presupuesto {opts['presupuesto_us']:.0f}us")
+
+    def _punto(self, km):
+        return (
+            CENTRO[0] + random.uniform(-km, km) / services_cercanas.KM_POR_GRADO,
+            CENTRO[1] + random.uniform(-km, km) / (services_cercanas.KM_POR_GRADO * 0.82),
+        )
+
+    def _reportar(self, titulo, lat):
+        us = np.array(lat) * 1e6
+        p50, p99 = np.percentile(us, [50, 99])
+        self.stdout.write(f"{titulo}\n  p50={p50:7.1f}us p99={p99:7.1f}us max={us.max():8.1f}us")
+        return p50, p99
@@ -0,0 +1,150 @@
+import hmac
+import json
+import os
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test.utils import override_settings
+
+from parking import services_outbox, tenancy
+from parking.models import EventoMovimiento, MensajeOutbox
+
+
+SECRETO = "bench"
+
+
+class _Receptor(ThreadingHTTPServer):
+    """Endpoint de mentira: verifica la firma, tarda `latencia` y falla una fracción con 503."""
+    daemon_threads = True
+
+    def __init__(self, latencia, fallas):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.latencia, self.fallas = latencia, fallas
+        self.lock = threading.Lock()
+        self.recibidos = Counter()
+        self.posts = self.rechazados = self.mal_firmados = 0
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        srv = self.server
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        t, _, firma = self.headers.get("X-Parking-Firma", "t=,v1=").partition(",")
+        bien_firmado = hmac.compare_digest(firma[3:], services_outbox.firmar(SECRETO, t[2:], body))
+        if srv.latencia:
+            time.sleep(srv.latencia)
+        falla = random.random() < srv.fallas
+        with srv.lock:
+            srv.posts += 1
+            if not bien_firmado:
+                srv.mal_firmados += 1
+            elif falla:
+                srv.rechazados += 1
+            else:
+                datos = json.loads(body)
+                for c in datos if isinstance(datos, list) else [datos]:
+                    srv.recibidos[c["id"]] += 1
+        self.send_response(503 if falla or not bien_firmado else 204)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Throughput del outbox de webhooks contra un endpoint local de mentira: encola N "
+        "mensajes (los primeros por el camino de la puerta, uno por transacción), los "
+        "despacha y verifica que lleguen todos, firmados. Borra lo que creó."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--n", type=int, default=5000)
+        parser.add_argument("--hilos", type=int, default=8)
+        parser.add_argument("--lote", type=int, default=200, help="Mensajes por pasada del despachador.")
+        parser.add_argument("--por-post", type=int, default=1, help="Eventos por POST (lote del endpoint).")
+        parser.add_argument("--latencia-ms", type=float, default=0, help="Lo que tarda el receptor por POST.")
+        parser.add_argument("--fallas", type=float, default=0.0, help="Fracción de POSTs que contestan 503.")
+        parser.add_argument("--minimo", type=float, help="Falla si entrega menos de estos mensajes por segundo.")
+
+    def handle(self, *args, **opts):
+        n = opts["n"]
+        eventos = list(
+            EventoMovimiento.objects.filter(tipo__in=services_outbox.EVENTOS).order_by("-id")[:min(n, 1000)]
+        )
+        if not eventos:
+            raise CommandError("No hay eventos de ingreso/egreso para armar los mensajes (correr generar_datos).")
+
+        receptor = _Receptor(opts["latencia_ms"] / 1000, opts["fallas"])
+        threading.Thread(target=receptor.serve_forever, daemon=True).start()
+        destino = f"bench-{os.getpid()}"
+        webhook = {
+            "nombre": destino,
+            "url": f"http://127.0.0.1:{receptor.server_address[1]}/webhook",
+            "secreto": SECRETO,
+            "lote": opts["por_post"],
+            "max_intentos": 50,
+        }
+        try:
+            with override_settings(PARKING_WEBHOOKS=[webhook]):
+                self._correr(opts, n, eventos, destino, receptor)
+        finally:
+            receptor.shutdown()
+            MensajeOutbox.objects.filter(destino=destino).delete()
+
+    def _correr(self, opts, n, eventos, destino, receptor):
+        alias = tenancy.alias_actual()
+        # costo en la puerta: encolar dentro de una transacción, como registrar()
+        en_puerta = min(n, 500)
+        t0 = time.perf_counter()
+        for i in range(en_puerta):
+            with transaction.atomic(using=alias):
+                services_outbox.encolar(eventos[i % len(eventos)])
+        puerta_ms = (time.perf_counter() - t0) * 1000 / en_puerta
+        resto = [
+            MensajeOutbox(destino=destino, evento_id=ev.id, cochera_id=ev.cochera_id, cuerpo=services_outbox.cuerpo_de(ev))
+            for ev in (eventos[i % len(eventos)] for i in range(en_puerta, n))
+        ]
+        MensajeOutbox.objects.bulk_create(resto, batch_size=1000)
+        # el mismo evento se repite si hay pocos: cada mensaje con su id para contar llegadas
+        mensajes = list(MensajeOutbox.objects.filter(destino=destino).order_by("id").only("id", "cuerpo"))
+        for i, m in enumerate(mensajes):
+            m.cuerpo["id"] = f"bench-{i}"
+        MensajeOutbox.objects.bulk_update(mensajes, ["cuerpo"], batch_size=1000)
+
+        pasadas = 0
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=opts["hilos"]) as pool:
+            while MensajeOutbox.objects.filter(destino=destino).exclude(estado=MensajeOutbox.ENTREGADO).exists():
+                e, f = services_outbox.despachar("bench", pool, opts["lote"], backoff_base=0.01)
+                pasadas += 1
+                if not e and not f:
+                    time.sleep(0.01)
+                if time.perf_counter() - t0 > 300:
+                    raise CommandError("El outbox no se vació en 5 minutos.")
+        s = time.perf_counter() - t0
+
+        estados = Counter(MensajeOutbox.objects.filter(destino=destino).values_list("estado", flat=True))
+        llegaron = len(receptor.recibidos)
+        repetidos = sum(c - 1 for c in receptor.recibidos.values())
+        self.stdout.write(
+            f"{n:,} mensajes en {s:.2f}s = {n / s:,.0f}/s ({receptor.posts:,} POSTs, {receptor.posts / s:,.0f}/s, "
+            f"{pasadas} pasadas) | encolar en la puerta: {puerta_ms:.3f}ms por transacción"
+        )
+        self.stdout.write(
+            f"llegaron={llegaron:,} repetidos={repetidos} rechazados(503)={receptor.rechazados} "
+            f"mal_firmados={receptor.mal_firmados} estados={dict(estados)}"
+        )
+        if llegaron != n or receptor.mal_firmados or estados.get(MensajeOutbox.ENTREGADO) != n:
+            raise CommandError("No llegaron todos los mensajes (o llegaron mal firmados).")
+        if opts["minimo"] and n / s < opts["minimo"]:
+            raise CommandError(f"Por debajo del mínimo: {n / s:,.0f}/s < {opts['minimo']:,.0f}/s")
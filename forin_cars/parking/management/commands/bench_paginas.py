@@ -0,0 +1,72 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, reset_queries
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from parking import tenancy
+from parking.models import Cochera
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide tiempo, queries y bytes de dashboard (esqueleto y fragmentos, también revalidando "
+        "con ETag) e ingreso y egreso para un usuario."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("usuario")
+        parser.add_argument("--n", type=int, default=50, help="Requests por página.")
+        parser.add_argument("--host", default="localhost")
+
+    def handle(self, *args, **opts):
+        user = get_user_model().objects.filter(username=opts["usuario"]).first()
+        if user is None:
+            raise CommandError("No existe ese usuario.")
+
+        with tenancy.tenant(tenancy.alias_para_usuario(user)):
+            cochera = Cochera.objects.filter(owner=user).order_by("id").first()
+        if cochera is None:
+            raise CommandError("El usuario no tiene cocheras.")
+
+        client = Client(SERVER_NAME=opts["host"])
+        client.force_login(user)
+        paginas = {
+            "dashboard": reverse("dashboard"),
+            "cocheras": reverse("dashboard_cocheras"),
+            "tarjeta": reverse("dashboard_tarjeta", args=[cochera.id]),
+            "totales": reverse("dashboard_totales"),
+            "ultimos": reverse("dashboard_ultimos"),
+            "ingreso": reverse("ingreso_cochera", args=[cochera.id]),
+            "egreso": reverse("egreso_cochera", args=[cochera.id]),
+        }
+
+        alias = tenancy.alias_para_usuario(user)
+        for nombre, url in paginas.items():
+            resp = client.get(url)  # calienta caches y templates
+            variantes = [(nombre, {}, 200)]
+            if resp.has_header("ETag"):
+                # lo que cuesta una tarjeta que no cambió
+                variantes.append((f"{nombre}/304", {"HTTP_IF_NONE_MATCH": resp["ETag"]}, 304))
+            for etiqueta, headers, esperado in variantes:
+                self._medir(client, alias, etiqueta, url, headers, esperado, opts["n"])
+        reset_queries()
+
+    def _medir(self, client, alias, nombre, url, headers, esperado, n):
+        tiempos = []
+        with CaptureQueriesContext(connections[alias]) as ctx:
+            for _ in range(n):
+                t0 = time.perf_counter()
+                resp = client.get(url, **headers)
+                tiempos.append(time.perf_counter() - t0)
+        if resp.status_code != esperado:
+            raise CommandError(f"{nombre}: status {resp.status_code}")
+        tiempos.sort()
+        self.stdout.write(
+            f"{nombre:<12} p50={tiempos[len(tiempos) // 2] * 1000:7.2f}ms "
+            f"p95={tiempos[int(len(tiempos) * 0.95)] * 1000:7.2f}ms "
+            f"queries={len(ctx.captured_queries) / n:.1f} bytes={len(resp.content):,}"
+        )
@@ -0,0 +1,155 @@
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from parking import services_catalogo, services_porton
+from parking.models import Cochera, Dispositivo
+
+
+def _puerto_libre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class Command(BaseCommand):
+    help = (
+        "Prueba de carga del portón con dispositivos simulados: abre N conexiones a la vez, "
+        "cada una se autentica y hace ciclos ENTRY/QUERY/EXIT, y mide latencias por comando. "
+        "Sin --port levanta servidor_porton en otro proceso. Los movimientos que hace quedan en "
+        "la base (usar una de prueba); los dispositivos se borran al final."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--cochera", type=int, help="Por defecto la primera del tenant.")
+        parser.add_argument("--dispositivos", type=int, default=200, help="Conexiones simultáneas.")
+        parser.add_argument("--ciclos", type=int, default=10, help="ENTRY+EXIT por dispositivo.")
+        parser.add_argument("--pausa", type=float, default=0,
+                            help="Segundos promedio entre lecturas de un dispositivo (0 = lo más rápido posible).")
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, help="Servidor ya levantado (si no, se levanta uno).")
+        parser.add_argument("--hilos", type=int, default=8, help="Hilos del servidor que se levanta.")
+        parser.add_argument("--presupuesto-ms", type=float, help="Falla si el p99 de ENTRY o EXIT pasa esto.")
+
+    def handle(self, *args, **opts):
+        cochera = Cochera.objects.filter(id=opts["cochera"]) if opts["cochera"] else Cochera.objects.order_by("id")
+        cochera = cochera.first()
+        if cochera is None:
+            raise CommandError("No hay cocheras.")
+        libres = services_porton.libres(cochera.id)
+        if not libres:
+            raise CommandError(f"La cochera {cochera.id} no tiene espacios libres.")
+        tipo_id = max(libres, key=libres.get)
+        tipo = services_catalogo.tipo(tipo_id).nombre.replace(" ", "_")
+        n = opts["dispositivos"]
+        if libres[tipo_id] < n:
+            self.stdout.write(f"ojo: {libres[tipo_id]} libres de {tipo} para {n} dispositivos, va a haber DENY")
+
+        tokens = [services_porton.nuevo_token() for _ in range(n)]
+        creados = Dispositivo.objects.bulk_create([
+            Dispositivo(cochera=cochera, nombre=f"bench-{os.getpid()}-{i}", operador_id=cochera.owner_id,
+                        token_hash=services_porton.hash_token(t))
+            for i, t in enumerate(tokens)
+        ])
+        servidor = None
+        try:
+            port = opts["port"]
+            if port is None:
+                port = _puerto_libre()
+                servidor = subprocess.Popen(
+                    [sys.executable, os.path.abspath(sys.argv[0]), "servidor_porton", "--host", "127.0.0.1",
+                     "--port", str(port), "--hilos", str(opts["hilos"])],
+                    stdout=subprocess.DEVNULL,
+                )
+            lat, cuenta, total_s, conectados = asyncio.run(
+                self._carga(opts["host"], port, tokens, tipo, opts["ciclos"], opts["pausa"])
+            )
+        finally:
+            if servidor is not None:
+                servidor.terminate()
+                servidor.wait(timeout=30)
+            Dispositivo.objects.filter(id__in=[d.id for d in creados]).delete()
+
+        ops = len(lat["ENTRY"]) + len(lat["EXIT"])
+        self.stdout.write(
+            f"{conectados} dispositivos conectados a la vez, {ops:,} ENTRY/EXIT en {total_s:.2f}s "
+            f"({ops / total_s:,.0f}/s) | respuestas: {dict(cuenta)}"
+        )
+        peor = 0.0
+        for comando in ("AUTH", "ENTRY", "QUERY", "EXIT"):
+            if not lat[comando]:
+                continue
+            ms = np.array(lat[comando]) * 1000
+            p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+            if comando in ("ENTRY", "EXIT"):
+                peor = max(peor, p99)
+            self.stdout.write(f"{comando:<6} n={len(ms):>6,} p50={p50:7.2f}ms p95={p95:7.2f}ms p99={p99:7.2f}ms max={ms.max():7.2f}ms")
+        if cuenta["ERR"]:
+            raise CommandError(f"{cuenta['ERR']} respuestas ERR.")
+        if opts["presupuesto_ms"] and peor > opts["presupuesto_ms"]:
+            raise CommandError(f"p99 {peor:.1f}ms > presupuesto {opts['presupuesto_ms']:.1f}ms")
+
+    async def _carga(self, host, port, tokens, tipo, ciclos, pausa):
+        lat, cuenta = defaultdict(list), Counter()
+        # hasta que el servidor atienda
+        limite = time.monotonic() + 30
+        while True:
+            try:
+                _, w = await asyncio.open_connection(host, port)
+                w.close()
+                break
+            except OSError:
+                if time.monotonic() > limite:
+                    raise CommandError(f"No hay servidor en {host}:{port}.")
+                await asyncio.sleep(0.2)
+
+        largada = asyncio.Event()
+        conectados = []
+
+        async def dispositivo(token):
+            reader, writer = await asyncio.open_connection(host, port)
+
+            async def cmd(nombre, linea):
+                t0 = time.perf_counter()
+                writer.write(linea.encode() + b"\n")
+                await writer.drain()
+                resp = (await reader.readline()).decode().strip()
+                lat[nombre].append(time.perf_counter() - t0)
+                cuenta[resp.split(" ", 1)[0] or "cortada"] += 1
+                return resp
+
+            try:
+                if not (await cmd("AUTH", f"AUTH {token}")).startswith("OK"):
+                    return
+                conectados.append(token)
+                # todos conectados antes de arrancar: la carga es con N conexiones abiertas
+                await largada.wait()
+                for _ in range(ciclos):
+                    if pausa:
+                        await asyncio.sleep(random.expovariate(1 / pausa))
+                    resp = await cmd("ENTRY", f"ENTRY {tipo}")
+                    if not resp.startswith("OPEN"):
+                        continue
+                    await cmd("QUERY", "QUERY")
+                    if pausa:
+                        await asyncio.sleep(random.expovariate(1 / pausa))
+                    await cmd("EXIT", f"EXIT {resp.split()[1]}")
+                await cmd("QUIT", "QUIT")
+            finally:
+                writer.close()
+
+        tareas = [asyncio.create_task(dispositivo(t)) for t in tokens]
+        while len(conectados) < len(tokens) and not any(t.done() for t in tareas):
+            await asyncio.sleep(0.05)
+        t0 = time.perf_counter()
+        largada.set()
+        await asyncio.gather(*tareas)
+        return lat, cuenta, time.perf_counter() - t0, len(conectados)
@@ -0,0 +1,115 @@
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from parking import secuenciador, services_catalogo, services_porton, services_tickets, tenancy
+from parking.models import Cochera
+from parking.services_movimientos import egresar_vehiculo, ingresar_vehiculo
+
+
+class Command(BaseCommand):
+    help = (
+        "Compara ingresos/egresos concurrentes sobre las mismas cocheras: cada hilo cliente escribe "
+        "por su cuenta (locks, como hoy) contra el secuenciador por cochera (parking.secuenciador) "
+        "con y sin group commit. Los movimientos quedan en la base (usar una de prueba)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--cocheras", type=int, default=1, help="Cuántas cocheras (las primeras con lugar).")
+        parser.add_argument("--clientes", type=int, default=16, help="Hilos cliente (se reparten entre las cocheras).")
+        parser.add_argument("--ciclos", type=int, default=50, help="ENTRY+EXIT por cliente y por modo.")
+        parser.add_argument("--hilos", type=int, default=4, help="Hilos del secuenciador.")
+        parser.add_argument("--lote", type=int, default=secuenciador.LOTE)
+
+    def handle(self, *args, **opts):
+        alias = tenancy.alias_actual()
+        cocheras = []
+        for c in Cochera.objects.filter(activa=True).order_by("id"):
+            libres = services_porton.libres(c.id)
+            por_cochera = -(-opts["clientes"] // opts["cocheras"])
+            if libres and max(libres.values()) >= por_cochera:
+                cocheras.append((c, services_catalogo.tipo(max(libres, key=libres.get))))
+            if len(cocheras) == opts["cocheras"]:
+                break
+        if len(cocheras) < opts["cocheras"]:
+            raise CommandError(f"No hay {opts['cocheras']} cocheras con lugar para los clientes.")
+        # el ingreso del cliente i es siempre en cocheras[i % n]
+        clientes = [cocheras[i % len(cocheras)] for i in range(opts["clientes"])]
+
+        modos = [
+            ("locks", None),
+            ("secuenciador lote=1", secuenciador.Secuenciador(opts["hilos"], lote=1)),
+            (f"secuenciador lote={opts['lote']}", secuenciador.Secuenciador(opts["hilos"], lote=opts["lote"])),
+        ]
+        self.stdout.write(
+            f"{len(cocheras)} cocheras ({', '.join(str(c.id) for c, _ in cocheras)}), "
+            f"{opts['clientes']} clientes x {opts['ciclos']} ciclos"
+        )
+        for nombre, sec in modos:
+            # tickets emitidos antes, así se mide solo el movimiento
+            tickets = [
+                [services_tickets.emitir_ticket(cochera.id) for _ in range(opts["ciclos"])] for cochera, _ in clientes
+            ]
+            lat, cuenta, por_cochera, total_s = self._correr(alias, clientes, tickets, sec)
+            if sec is not None:
+                sec.parar()
+            ops = len(lat)
+            ms = np.array(lat) * 1000
+            p50, p99 = np.percentile(ms, [50, 99])
+            extra = f" | {sec.stats['comandos'] / max(sec.stats['lotes'], 1):.1f} comandos/lote" if sec else ""
+            self.stdout.write(
+                f"{nombre:<22} {ops / total_s:8,.0f} ops/s  p50={p50:6.2f}ms p99={p99:7.2f}ms "
+                f"| por cochera: {', '.join(f'{n / total_s:,.0f}' for n in por_cochera.values())} ops/s"
+                f" | {dict(cuenta)}{extra}"
+            )
+
+    def _correr(self, alias, clientes, tickets, sec):
+        lat, cuenta, por_cochera = [], Counter(), Counter()
+        lock = threading.Lock()
+        largada = threading.Barrier(len(clientes) + 1)
+
+        def mover(func, cochera, **kwargs):
+            if sec is None:
+                return func(cochera=cochera, **kwargs)
+            return sec.ejecutar(cochera.id, func, cochera=cochera, **kwargs)
+
+        def cliente(i):
+            cochera, tipo = clientes[i]
+            operador = cochera.owner
+            mias, res = [], Counter()
+            with tenancy.tenant(alias):
+                try:
+                    largada.wait()
+                    for ticket in tickets[i]:
+                        for func, kwargs in (
+                            (ingresar_vehiculo, {"operador": operador, "tipo": tipo, "ticket": ticket}),
+                            (egresar_vehiculo, {"operador": operador, "ticket": ticket}),
+                        ):
+                            t0 = time.perf_counter()
+                            try:
+                                mover(func, cochera, **kwargs)
+                                res["ok"] += 1
+                            except ValueError:
+                                res["rechazado"] += 1
+                            except Exception as e:
+                                res[type(e).__name__] += 1
+                            mias.append(time.perf_counter() - t0)
+                finally:
+                    connections.close_all()
+            with lock:
+                lat.extend(mias)
+                cuenta.update(res)
+                por_cochera[cochera.id] += len(mias)
+
+        hilos = [threading.Thread(target=cliente, args=(i,)) for i in range(len(clientes))]
+        for h in hilos:
+            h.start()
+        largada.wait()
+        t0 = time.perf_counter()
+        for h in hilos:
+            h.join()
+        return lat, cuenta, por_cochera, time.perf_counter() - t0
@@ -0,0 +1,85 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Count, Sum
+from django.db.models.functions import ExtractYear, TruncMonth
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from parking import services_analitica, services_snapshot, tenancy
+from parking.models import Movimiento
+
+
+class Command(BaseCommand):
+    help = (
+        "Compara reportes sobre el snapshot columnar (services_snapshot) contra la base: recaudación "
+        "anual por tipo de toda la historia y estadías por tipo de los últimos --dias. Necesita un "
+        "snapshot armado (snapshot_movimientos)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dias", type=int, default=90)
+        parser.add_argument("--repeticiones", type=int, default=3, help="Se toma la mejor.")
+        parser.add_argument("--presupuesto-ms", type=float, help="Falla si algún reporte del snapshot pasa esto.")
+
+    def handle(self, *args, **opts):
+        alias = tenancy.alias_actual()
+        try:
+            snap = services_snapshot.abrir()
+        except ValueError as e:
+            raise CommandError(str(e))
+        hasta = snap.marca
+        desde = hasta - timedelta(days=opts["dias"])
+        self.stdout.write(f"{snap.filas:,} movimientos en {len(snap.particiones)} particiones, marca {timezone.localtime(hasta):%Y-%m-%d %H:%M}")
+
+        cerrados = Movimiento.objects.filter(estado=Movimiento.CERRADO, egreso_at__lte=hasta)
+        reportes = [
+            (
+                "anio x tipo",
+                lambda: snap.agregar(("anio", "tipo"), hasta=hasta),
+                lambda: list(
+                    cerrados.annotate(anio=ExtractYear("egreso_at")).values("anio", "espacio__tipo_id")
+                    .annotate(n=Count("id"), monto=Sum("monto")).order_by()
+                ),
+            ),
+            (
+                f"estadias {opts['dias']}d",
+                lambda: snap.agregar(("tipo", "estadia"), desde, hasta),
+                lambda: services_analitica.distribucion_estadias(desde, hasta, por="tipo"),
+            ),
+            (
+                f"mes x cochera {opts['dias']}d",
+                lambda: snap.agregar(("mes", "cochera"), desde, hasta),
+                lambda: list(
+                    cerrados.filter(egreso_at__gte=desde)
+                    .annotate(mes=TruncMonth("egreso_at")).values("mes", "cochera_id")
+                    .annotate(n=Count("id"), monto=Sum("monto")).order_by()
+                ),
+            ),
+        ]
+        pasados = []
+        for nombre, columnar, base in reportes:
+            with CaptureQueriesContext(connections[alias]) as ctx:
+                ms_snap, grupos = self._medir(columnar, opts["repeticiones"])
+            ms_base, _ = self._medir(base, 1)
+            marca = ""
+            if opts["presupuesto_ms"] and ms_snap > opts["presupuesto_ms"]:
+                marca = "  << pasado"
+                pasados.append(nombre)
+            self.stdout.write(
+                f"{nombre:<20} snapshot {ms_snap:8.1f}ms ({len(ctx)} queries, {grupos} grupos)  "
+                f"base {ms_base:9.1f}ms  x{ms_base / ms_snap:,.0f}{marca}"
+            )
+        if pasados:
+            raise CommandError(f"Pasados de presupuesto: {', '.join(pasados)}")
+
+    def _medir(self, correr, repeticiones):
+        mejor, res = None, None
+        for _ in range(max(1, repeticiones)):
+            t0 = time.perf_counter()
+            res = correr()
+            ms = (time.perf_counter() - t0) * 1000
+            mejor = ms if mejor is None else min(mejor, ms)
+        return mejor, len(res)
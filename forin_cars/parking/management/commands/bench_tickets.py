@@ -0,0 +1,84 @@
+import multiprocessing
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from parking import services_tickets, tenancy
+from parking.models import Cochera, SecuenciaTicket
+
+
+def _emitir(alias, cochera_id, n, hilos, cola):
+    """Corre en un proceso hijo: emite n tickets con `hilos` hilos y manda la lista."""
+    def lote(k):
+        with tenancy.tenant(alias):
+            try:
+                return [services_tickets.emitir_ticket(cochera_id) for _ in range(k)]
+            finally:
+                connections.close_all()
+
+    por_hilo = [n // hilos + (1 if i < n % hilos else 0) for i in range(hilos)]
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=hilos) as pool:
+        codigos = [c for parte in pool.map(lote, por_hilo) for c in parte]
+    cola.put((codigos, time.perf_counter() - t0))
+
+
+def _valido(codigo):
+    try:
+        return services_tickets.leer(codigo) is not None
+    except ValueError:
+        return False
+
+
+class Command(BaseCommand):
+    help = (
+        "Emite tickets desde varios procesos (y hilos) a la vez sobre una cochera y "
+        "verifica que no se repita ninguno y que todos tengan el dígito bien."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--cochera", type=int, help="Por defecto la primera del tenant.")
+        parser.add_argument("--procesos", type=int, default=4)
+        parser.add_argument("--hilos", type=int, default=4, help="Hilos por proceso.")
+        parser.add_argument("--n", type=int, default=5000, help="Tickets por proceso.")
+
+    def handle(self, *args, **opts):
+        alias = tenancy.alias_actual()
+        cochera = Cochera.objects.filter(id=opts["cochera"]) if opts["cochera"] else Cochera.objects.order_by("id")
+        cochera = cochera.first()
+        if cochera is None:
+            raise CommandError("No hay cocheras.")
+
+        antes = SecuenciaTicket.objects.filter(cochera=cochera).values_list("siguiente", flat=True).first() or 1
+        connections.close_all()
+        ctx = multiprocessing.get_context("fork")
+        cola = ctx.Queue()
+        hijos = [
+            ctx.Process(target=_emitir, args=(alias, cochera.id, opts["n"], opts["hilos"], cola))
+            for _ in range(opts["procesos"])
+        ]
+        t0 = time.perf_counter()
+        for p in hijos:
+            p.start()
+        resultados = [cola.get() for _ in hijos]
+        for p in hijos:
+            p.join()
+        total_s = time.perf_counter() - t0
+
+        codigos = [c for parte, _ in resultados for c in parte]
+        repetidos = len(codigos) - len(set(codigos))
+        invalidos = [c for c in codigos if not _valido(c)]
+        despues = SecuenciaTicket.objects.filter(cochera=cochera).values_list("siguiente", flat=True).get()
+        bloques = (despues - antes) // services_tickets.TAMANO_BLOQUE
+
+        self.stdout.write(
+            f"cochera {cochera.id}: {len(codigos):,} tickets en {total_s:.2f}s "
+            f"({len(codigos) / total_s:,.0f}/s), {bloques} bloques de {services_tickets.TAMANO_BLOQUE} "
+            f"({bloques} idas a la base), repetidos={repetidos} inválidos={len(invalidos)}"
+        )
+        por_proceso = ", ".join(f"{len(parte) / s:,.0f}/s" for parte, s in resultados)
+        self.stdout.write(f"por proceso: {por_proceso}")
+        if repetidos or invalidos:
+            raise CommandError("Hay tickets repetidos o inválidos.")
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from parking.services_movimientos import LOTE_ABANDONADOS, PAUSA_ABANDONADOS, cerrar_abandonados
+
+
+class Command(BaseCommand):
+    help = (
+        "Cierra los movimientos ABIERTOS más viejos que el umbral de su cochera "
+        "(Cochera.horas_abandono), en lotes chicos con su propia transacción."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--cochera", type=int, help="Solo esta cochera (id).")
+        parser.add_argument("--lote", type=int, default=LOTE_ABANDONADOS, help="Movimientos por transacción.")
+        parser.add_argument("--pausa", type=float, default=PAUSA_ABANDONADOS,
+                            help="Segundos entre lotes (para no acaparar la base frente a la puerta).")
+        parser.add_argument("--dry-run", action="store_true", help="Solo cuenta.")
+
+    def handle(self, *args, **opts):
+        t0 = time.perf_counter()
+        res = cerrar_abandonados(
+            cochera_id=opts["cochera"], lote=opts["lote"], aplicar=not opts["dry_run"], pausa=opts["pausa"]
+        )
+        if not res:
+            if opts["verbosity"] > 1:
+                self.stdout.write("Sin abandonados.")
+            return
+
+        for coch, n in sorted(res.items()):
+            self.stdout.write(f"cochera {coch}: {n}")
+        total = sum(res.values())
+        if opts["dry_run"]:
+            self.stdout.write(self.style.WARNING(f"dry-run: {total:,} abandonados, no se cerró nada."))
+            return
+        self.stdout.write(self.style.SUCCESS(f"{total:,} cerrados en {time.perf_counter() - t0:.1f}s"))
@@ -0,0 +1,82 @@
+import os
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from parking import services_outbox, tenancy, versiones
+
+
+# cada cuánto se rescatan colgados y se purgan viejos
+MANTENIMIENTO_S = 60
+
+
+class Command(BaseCommand):
+    help = (
+        "Entrega el outbox de webhooks (MensajeOutbox) a los endpoints de PARKING_WEBHOOKS: "
+        "lotes en paralelo, reintentos con backoff. Recorre todos los shards; pueden "
+        "correr varios a la vez."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--hilos", type=int, default=8, help="POSTs en paralelo.")
+        parser.add_argument("--lote", type=int, default=200, help="Mensajes reclamados por pasada y shard.")
+        parser.add_argument("--intervalo", type=float, default=1.0, help="Segundos entre consultas con el outbox vacío.")
+        parser.add_argument("--una-vez", action="store_true", help="Entrega lo que esté listo y termina (cron, deploy).")
+        parser.add_argument("--vencimiento", type=int, default=300,
+                            help="Segundos tras los que un mensaje ENVIANDO se da por colgado.")
+        parser.add_argument("--purgar-dias", type=int, default=7, help="Días que se guardan los ENTREGADOS.")
+        parser.add_argument("--reintentar-fallidos", action="store_true",
+                            help="Antes de arrancar, los FALLIDOS vuelven a PENDIENTE con los intentos en 0.")
+
+    def handle(self, *args, **opts):
+        if versiones.cache_local():
+            raise CommandError(versiones.SOLO_UN_PROCESO)
+        if not services_outbox.destinos():
+            raise CommandError("No hay endpoints en PARKING_WEBHOOKS.")
+        worker = f"{socket.gethostname()}:{os.getpid()}"
+        parar = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *a: parar.set())
+        signal.signal(signal.SIGINT, lambda *a: parar.set())
+
+        if opts["reintentar_fallidos"]:
+            for alias in tenancy.shards():
+                with tenancy.tenant(alias):
+                    n = services_outbox.reintentar_fallidos()
+                if n and opts["verbosity"]:
+                    self.stdout.write(f"{alias}: {n} fallidos vuelven a PENDIENTE")
+
+        entregados = con_error = 0
+        mantenimiento = 0.0
+        t0 = time.perf_counter()
+        if opts["verbosity"]:
+            self.stdout.write(f"outbox {worker}: {opts['hilos']} hilos, endpoints: {', '.join(services_outbox.destinos())}")
+
+        with ThreadPoolExecutor(max_workers=opts["hilos"], thread_name_prefix="webhook") as pool:
+            while not parar.is_set():
+                if time.monotonic() - mantenimiento > MANTENIMIENTO_S:
+                    for alias in tenancy.shards():
+                        with tenancy.tenant(alias):
+                            rescatados = services_outbox.rescatar_colgados(timedelta(seconds=opts["vencimiento"]))
+                            purgados = services_outbox.purgar(opts["purgar_dias"])
+                        if opts["verbosity"] > 1 and (rescatados or purgados):
+                            self.stdout.write(f"{alias}: rescatados={rescatados} purgados={purgados}")
+                    mantenimiento = time.monotonic()
+
+                e, f = services_outbox.despachar(worker, pool, opts["lote"])
+                entregados += e
+                con_error += f
+                if opts["verbosity"] > 1 and (e or f):
+                    self.stdout.write(f"entregados={e} con_error={f}")
+                if not e and not f:
+                    if opts["una_vez"]:
+                        break
+                    parar.wait(opts["intervalo"])
+
+        if opts["verbosity"]:
+            s = time.perf_counter() - t0
+            self.stdout.write(f"outbox {worker}: {entregados} entregados, {con_error} con error en {s:.1f}s")
@@ -0,0 +1,60 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from parking import services_porton, tenancy
+from parking.models import Cochera, Dispositivo
+
+
+class Command(BaseCommand):
+    help = (
+        "Dispositivos del portón (servidor_porton). alta: crea uno y muestra su token (una sola vez). "
+        "baja <id>: lo desactiva (las sesiones abiertas se cortan al recargar el directorio). "
+        "lista: los de la base del tenant."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("accion", choices=["alta", "baja", "lista"])
+        parser.add_argument("id", nargs="?", type=int, help="Para baja: id del dispositivo.")
+        parser.add_argument("--cochera", type=int)
+        parser.add_argument("--nombre", help="Para alta, ej. 'Barrera entrada 1'.")
+        parser.add_argument("--operador", help="Usuario a cuyo nombre quedan los movimientos (por defecto el dueño).")
+        parser.add_argument("--shard", help="Alias de la base de la cochera (por defecto el tenant actual).")
+
+    def handle(self, *args, **opts):
+        with tenancy.tenant(opts["shard"] or tenancy.alias_actual()):
+            getattr(self, f"_{opts['accion']}")(opts)
+
+    def _alta(self, opts):
+        if not opts["cochera"] or not opts["nombre"]:
+            raise CommandError("alta necesita --cochera y --nombre.")
+        cochera = Cochera.objects.filter(id=opts["cochera"]).first()
+        if cochera is None:
+            raise CommandError(f"No existe la cochera {opts['cochera']} en {tenancy.alias_actual()}.")
+        operador_id = cochera.owner_id
+        if opts["operador"]:
+            operador_id = get_user_model().objects.filter(username=opts["operador"]).values_list("id", flat=True).first()
+            if operador_id is None:
+                raise CommandError(f"No existe el usuario {opts['operador']}.")
+
+        token = services_porton.nuevo_token()
+        d = Dispositivo.objects.create(
+            cochera=cochera, nombre=opts["nombre"], operador_id=operador_id, token_hash=services_porton.hash_token(token)
+        )
+        self.stdout.write(f"dispositivo {d.id} ({d.nombre}) en cochera {cochera.id}")
+        self.stdout.write(f"token: {token}")
+        self.stdout.write("Guardalo ahora: no se puede volver a ver.")
+
+    def _baja(self, opts):
+        if not opts["id"]:
+            raise CommandError("baja necesita el id del dispositivo.")
+        if not Dispositivo.objects.filter(id=opts["id"]).update(activo=False):
+            raise CommandError(f"No existe el dispositivo {opts['id']}.")
+        self.stdout.write(f"dispositivo {opts['id']} dado de baja")
+
+    def _lista(self, opts):
+        qs = Dispositivo.objects.order_by("cochera_id", "id")
+        if opts["cochera"]:
+            qs = qs.filter(cochera_id=opts["cochera"])
+        for d in qs:
+            estado = "activo" if d.activo else "baja"
+            self.stdout.write(f"{d.id:>5} cochera={d.cochera_id} operador={d.operador_id} {estado:<6} {d.nombre}")
@@ -0,0 +1,392 @@
+import heapq
+import time
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+from itertools import islice
+
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from parking import tenancy
+from parking.models import (
+    Cochera, CocheraEmpleado, ConfigCapacidad, TarifaHora, TipoEspacio, Espacio,
+    Cliente, Vehiculo, Movimiento, EventoMovimiento, RecaudacionDiaria, IntervaloOcupacion,
+)
+from parking.services import ensure_default_tipos
+from parking.services_intervalos import nodos
+from parking.services_tarifas import cotizar_lote
+from users.models import EmpleadoAsignacion
+
+
+User = get_user_model()
+
+# datasets estándar para benchmarks y tests de presupuesto de queries
+PERFILES = {
+    "chico": {"duenos": 3, "cocheras": 2, "movimientos": 100_000, "dias": 365},
+    "mediano": {"duenos": 10, "cocheras": 3, "movimientos": 1_000_000, "dias": 730},
+    "grande": {"duenos": 50, "cocheras": 4, "movimientos": 10_000_000, "dias": 1095},
+}
+
+# llegadas por hora (día hábil / fin de semana) y peso por día de la semana (lun..dom)
+HORAS_HABIL = np.array([
+    0.2, 0.1, 0.1, 0.1, 0.2, 0.5, 1.5, 4.0, 7.0, 6.5, 5.0, 4.5,
+    5.0, 5.0, 4.5, 4.5, 5.0, 5.5, 5.0, 4.0, 3.0, 2.0, 1.2, 0.6,
+])
+HORAS_FINDE = np.array([
+    0.6, 0.4, 0.3, 0.2, 0.2, 0.3, 0.5, 1.0, 2.0, 3.0, 4.5, 5.5,
+    6.0, 6.0, 5.5, 5.0, 5.0, 5.0, 5.5, 6.0, 5.5, 4.0, 2.5, 1.2,
+])
+DIA_SEMANA = np.array([1.0, 1.0, 1.02, 1.05, 1.15, 0.8, 0.55])
+
+# reparto de la capacidad y precio base por hora
+MEZCLA_TIPOS = {"Auto": (0.65, 1000), "Moto": (0.15, 500), "Camioneta": (0.15, 1400), "Bicicleta": (0.05, 200)}
+
+# fin de la historia por defecto: fijo, así el mismo --seed da los mismos datos
+HASTA = "2026-01-01"
+
+MIN_ESTADIA = 5 * 60
+MAX_ESTADIA = 72 * 3600
+
+
+def _fechas_db(epochs):
+    """Epoch (UTC) -> 'YYYY-MM-DD HH:MM:SS', como guarda Django en cualquier backend."""
+    return np.char.replace(np.datetime_as_string(epochs.astype("datetime64[s]"), unit="s"), "T", " ").astype(object)
+
+
+class Command(BaseCommand):
+    help = (
+        "Genera datos sintéticos a escala: dueños, cocheras con capacidades/tarifas/espacios, "
+        "empleados, clientes, vehículos e historial de movimientos con curvas de llegada "
+        "diarias y semanales. Determinístico por --seed y --hasta."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--perfil", choices=sorted(PERFILES), default="chico")
+        parser.add_argument("--duenos", type=int, help="Cantidad de dueños.")
+        parser.add_argument("--cocheras", type=int, help="Cocheras por dueño.")
+        parser.add_argument("--movimientos", type=int, help="Movimientos aproximados en total.")
+        parser.add_argument("--dias", type=int, help="Días de historia hasta --hasta.")
+        parser.add_argument("--hasta", default=HASTA,
+                            help="Fin de la historia, fecha local (YYYY-MM-DD, a las 00:00) o 'ahora'. "
+                                 "Lo que sigue adentro a esa hora queda ABIERTO.")
+        parser.add_argument("--empleados", type=int, default=2, help="Empleados por cochera.")
+        parser.add_argument("--espacios", type=int, nargs=2, default=[40, 400], metavar=("MIN", "MAX"))
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--chunk", type=int, default=20_000)
+        parser.add_argument("--prefijo", default="gen", help="Prefijo de usuarios y tickets.")
+        parser.add_argument("--eventos", action="store_true", help="Escribir también la bitácora de eventos.")
+
+    def handle(self, *args, **opts):
+        cfg = dict(PERFILES[opts["perfil"]])
+        for k in cfg:
+            if opts[k] is not None:
+                cfg[k] = opts[k]
+        self.opts = opts
+        self.prefijo = opts["prefijo"]
+        self.chunk = opts["chunk"]
+        self.rng = np.random.default_rng(opts["seed"])
+        self.clave = make_password(self.prefijo)
+        self.secuencias = set()
+
+        if User.objects.filter(username__startswith=f"{self.prefijo}_").exists():
+            raise CommandError(f"Ya hay datos con prefijo '{self.prefijo}'. Usá otro --prefijo.")
+
+        t0 = time.perf_counter()
+        self.ahora = self._hasta(opts["hasta"])
+        self.ini = self.ahora - cfg["dias"] * 86400
+
+        duenos = self._usuarios([f"{self.prefijo}_d{i}" for i in range(cfg["duenos"])], "ADMIN_DUENO")
+
+        # tamaño de cada cochera primero, para repartir los movimientos según capacidad
+        lo, hi = opts["espacios"]
+        tamanios = self.rng.integers(lo, hi + 1, size=(cfg["duenos"], cfg["cocheras"]))
+        por_espacio = cfg["movimientos"] / max(int(tamanios.sum()), 1)
+
+        total = 0
+        for i, dueno in enumerate(duenos):
+            with tenancy.tenant(tenancy.alias_para_owner(dueno.id)):
+                # los tipos viven en cada shard
+                ensure_default_tipos()
+                self.tipos = {t.nombre: t for t in TipoEspacio.objects.filter(nombre__in=MEZCLA_TIPOS)}
+                for j in range(cfg["cocheras"]):
+                    total += self._cochera(dueno, i, j, int(tamanios[i, j]), por_espacio, cfg["dias"])
+                self._reset_secuencias()
+                self.secuencias.clear()
+
+        dt = time.perf_counter() - t0
+        self.stdout.write(self.style.SUCCESS(
+            f"{total:,} movimientos en {dt:.1f}s ({total / max(dt, 0.001):,.0f}/s)"
+        ))
+
+    def _hasta(self, valor):
+        if valor == "ahora":
+            return int(timezone.now().timestamp())
+        try:
+            fecha = datetime.fromisoformat(valor)
+        except ValueError:
+            raise CommandError("--hasta va como YYYY-MM-DD o 'ahora'.")
+        return int(timezone.make_aware(fecha).timestamp())
+
+    # ------------------------------------------------------------------
+    # estructura
+    # ------------------------------------------------------------------
+
+    def _usuarios(self, nombres, grupo):
+        usuarios = User.objects.bulk_create([
+            User(username=n, email=f"{n}@example.com", password=self.clave) for n in nombres
+        ])
+        grp, _ = Group.objects.get_or_create(name=grupo)
+        User.groups.through.objects.bulk_create([
+            User.groups.through(user_id=u.id, group_id=grp.id) for u in usuarios
+        ])
+        return usuarios
+
+    @tenancy.atomic
+    def _estructura(self, dueno, i, j, tamanio):
+        cochera = Cochera.objects.create(
+            owner=dueno,
+            nombre=f"{self.prefijo.upper()} {i}-{j}",
+            direccion=f"Calle {int(self.rng.integers(1, 5000))}",
+            estrategia_asignacion=Cochera.ESTRATEGIAS[(i + j) % len(Cochera.ESTRATEGIAS)][0],
+        )
+
+        empleados = self._usuarios(
+            [f"{self.prefijo}_e{i}_{j}_{k}" for k in range(self.opts["empleados"])], "ADMIN_EMPLEADO"
+        )
+        CocheraEmpleado.objects.bulk_create([CocheraEmpleado(cochera=cochera, empleado=e) for e in empleados])
+        if tenancy.sharding_activo():
+            EmpleadoAsignacion.objects.bulk_create([EmpleadoAsignacion(dueno=dueno, empleado=e) for e in empleados])
+
+        capacidades = {}
+        espacios = []
+        niveles = max(tamanio // 100, 1)
+        for nombre, (share, precio) in MEZCLA_TIPOS.items():
+            tipo = self.tipos[nombre]
+            cantidad = max(int(round(tamanio * share)), 1)
+            capacidades[tipo.id] = cantidad
+            ConfigCapacidad.objects.create(cochera=cochera, tipo=tipo, cantidad=cantidad)
+            factor = float(self.rng.uniform(0.8, 1.3))
+            TarifaHora.objects.create(cochera=cochera, tipo=tipo, precio_hora=Decimal(int(precio * factor / 10) * 10))
+            espacios += [
+                Espacio(cochera=cochera, tipo=tipo, etiqueta=f"{nombre[:3].upper()}-{k + 1}", orden=k + 1, nivel=k % niveles)
+                for k in range(cantidad)
+            ]
+        Espacio.objects.bulk_create(espacios, batch_size=self.chunk)
+
+        return cochera, [dueno.id] + [e.id for e in empleados], capacidades
+
+    def _vehiculos(self, tipo_id, cantidad, base):
+        clientes = Cliente.objects.bulk_create([Cliente() for _ in range(cantidad)], batch_size=self.chunk)
+        vehiculos = Vehiculo.objects.bulk_create(
+            [
+                Vehiculo(cliente=c, ticket=f"{self.prefijo.upper()}{base + k:09d}", tipo_id=tipo_id)
+                for k, c in enumerate(clientes)
+            ],
+            batch_size=self.chunk,
+        )
+        return np.array([v.id for v in vehiculos], dtype=np.int64)
+
+    # ------------------------------------------------------------------
+    # historia
+    # ------------------------------------------------------------------
+
+    def _llegadas(self, por_dia, dias):
+        """Epochs de llegada (ordenados) con curva horaria y semanal."""
+        dia0 = self.ini - self.ini % 86400
+        n_dias = dias + 1
+        inicios = dia0 + np.arange(n_dias, dtype=np.int64) * 86400
+        semana = ((inicios // 86400) + 3) % 7  # 1970-01-01 fue jueves
+        anual = 1 + 0.1 * np.sin(2 * np.pi * np.arange(n_dias) / 365)
+        cuantos = self.rng.poisson(por_dia * DIA_SEMANA[semana] / DIA_SEMANA.mean() * anual)
+
+        dia = np.repeat(np.arange(n_dias), cuantos)
+        finde = semana[dia] >= 5
+        horas = np.empty(len(dia), dtype=np.int64)
+        horas[~finde] = self.rng.choice(24, size=int((~finde).sum()), p=HORAS_HABIL / HORAS_HABIL.sum())
+        horas[finde] = self.rng.choice(24, size=int(finde.sum()), p=HORAS_FINDE / HORAS_FINDE.sum())
+
+        ts = inicios[dia] + horas * 3600 + self.rng.integers(0, 3600, size=len(dia))
+        ts = ts[(ts >= self.ini) & (ts < self.ahora)]
+        ts.sort()
+        return ts
+
+    def _estadias(self, n):
+        """Mezcla: visitas cortas (mediana 1.5h) y jornadas laborales (~8.5h)."""
+        cortas = self.rng.lognormal(np.log(90 * 60), 0.8, size=n)
+        largas = self.rng.lognormal(np.log(8.5 * 3600), 0.25, size=n)
+        seg = np.where(self.rng.random(n) < 0.8, cortas, largas)
+        return np.clip(seg, MIN_ESTADIA, MAX_ESTADIA).astype(np.int64)
+
+    def _simular(self, llegadas, estadias, espacio_ids):
+        """
+        Asigna espacios como lo haría la cochera (menor orden libre primero). Si
+        está llena la llegada se descarta. Devuelve índices aceptados y espacio de cada uno.
+        """
+        libres = list(range(len(espacio_ids)))
+        heapq.heapify(libres)
+        ocupados = []  # (egreso, slot)
+        aceptadas, slots = [], []
+        for k in range(len(llegadas)):
+            t = llegadas[k]
+            while ocupados and ocupados[0][0] <= t:
+                heapq.heappush(libres, heapq.heappop(ocupados)[1])
+            if not libres:
+                continue
+            s = heapq.heappop(libres)
+            heapq.heappush(ocupados, (t + estadias[k], s))
+            aceptadas.append(k)
+            slots.append(s)
+        return np.array(aceptadas, dtype=np.int64), np.asarray(espacio_ids, dtype=np.int64)[slots]
+
+    def _cochera(self, dueno, i, j, tamanio, por_espacio, dias):
+        cochera, operadores, capacidades = self._estructura(dueno, i, j, tamanio)
+        espacios = defaultdict(list)
+        for eid, tipo_id in Espacio.objects.filter(cochera=cochera).order_by("orden", "id").values_list("id", "tipo_id"):
+            espacios[tipo_id].append(eid)
+
+        # por tipo: llegadas, estadías y espacio, después se mezcla todo por tiempo
+        cols = defaultdict(list)
+        for tipo_id, cap in capacidades.items():
+            llegadas = self._llegadas(por_espacio * cap / dias, dias)
+            estadias = self._estadias(len(llegadas))
+            ok, espacio = self._simular(llegadas, estadias, espacios[tipo_id])
+            ingreso = llegadas[ok]
+            egreso = ingreso + estadias[ok]
+
+            # vehículos: habitués + ocasionales; los que siguen adentro, todos distintos
+            n_veh = max(cap * 4, 50)
+            vehiculos = self._vehiculos(tipo_id, n_veh, base=cochera.id * 10_000_000 + tipo_id * 1_000_000)
+            idx = (n_veh * self.rng.random(len(ok)) ** 2).astype(np.int64)
+            adentro = egreso > self.ahora
+            idx[adentro] = np.arange(int(adentro.sum())) % n_veh
+
+            cols["tipo"].append(np.full(len(ok), tipo_id, dtype=np.int64))
+            cols["ingreso"].append(ingreso)
+            cols["egreso"].append(egreso)
+            cols["espacio"].append(espacio)
+            cols["vehiculo"].append(vehiculos[idx])
+
+        c = {k: np.concatenate(v) for k, v in cols.items()}
+        orden = np.argsort(c["ingreso"], kind="stable")
+        c = {k: v[orden] for k, v in c.items()}
+        abierto = c["egreso"] > self.ahora
+        centavos = cotizar_lote(cochera.id, c["tipo"], c["ingreso"], c["egreso"])
+        operador = np.asarray(operadores, dtype=np.int64)[self.rng.integers(0, len(operadores), size=len(orden))]
+
+        self._insertar(cochera, c, abierto, centavos, operador)
+
+        Espacio.objects.filter(id__in=c["espacio"][abierto].tolist()).update(ocupado=True)
+        self._recaudacion(cochera, c["egreso"][~abierto], centavos[~abierto])
+        self.stdout.write(f"  {cochera.nombre}: {tamanio} espacios, {len(orden):,} movimientos")
+        return len(orden)
+
+    def _insertar(self, cochera, c, abierto, centavos, operador):
+        """
+        Movimientos (y eventos) en chunks con executemany e ids explícitos: a
+        millones de filas el armado de instancias y la preparación de cada
+        valor en bulk_create es el cuello de botella.
+        """
+        n = len(abierto)
+        ids = self._reservar_ids(Movimiento, n)
+        ingreso = _fechas_db(c["ingreso"])
+        egreso = _fechas_db(c["egreso"]).astype(object)
+        egreso[abierto] = None
+        monto = np.array([f"{v // 100}.{v % 100:02d}" for v in centavos.tolist()], dtype=object)
+        monto[abierto] = None
+        estado = np.where(abierto, Movimiento.ABIERTO, Movimiento.CERRADO).astype(object)
+
+        filas = zip(
+            ids.tolist(), [cochera.id] * n, c["vehiculo"].tolist(), c["espacio"].tolist(), operador.tolist(),
+            estado.tolist(), ingreso.tolist(), egreso.tolist(), monto.tolist(),
+        )
+        self._volcar(Movimiento, [
+            "id", "cochera", "vehiculo", "espacio", "operador", "estado", "ingreso_at", "egreso_at", "monto",
+        ], filas)
+        self._intervalos(cochera, ids, c, abierto)
+
+        if self.opts["eventos"]:
+            self._eventos(cochera, ids, c, abierto, ingreso, egreso, monto, operador)
+
+    def _intervalos(self, cochera, mov_ids, c, abierto):
+        # el índice de "quién estaba adentro" de los cerrados (services_intervalos)
+        cerrados = np.flatnonzero(~abierto & (c["egreso"] > c["ingreso"]))
+        desde = c["ingreso"][cerrados] * 1000
+        hasta = c["egreso"][cerrados] * 1000 - 1
+        filas = zip(
+            mov_ids[cerrados].tolist(), [cochera.id] * len(cerrados), nodos(desde, hasta).tolist(),
+            desde.tolist(), hasta.tolist(),
+        )
+        self._volcar(IntervaloOcupacion, ["movimiento", "cochera", "nodo", "desde", "hasta"], filas)
+
+    def _eventos(self, cochera, mov_ids, c, abierto, ingreso, egreso, monto, operador):
+        cerrados = np.flatnonzero(~abierto)
+        n = len(mov_ids) + len(cerrados)
+        # INGRESO y EGRESO de cada movimiento, ordenados por instante
+        tipo = np.array([EventoMovimiento.INGRESO] * len(mov_ids) + [EventoMovimiento.EGRESO] * len(cerrados), dtype=object)
+        fila = np.concatenate([np.arange(len(mov_ids)), cerrados])
+        instante = np.concatenate([c["ingreso"], c["egreso"][cerrados]])
+        orden = np.lexsort((tipo == EventoMovimiento.INGRESO, instante))
+        tipo, fila = tipo[orden], fila[orden]
+        es_egreso = tipo == EventoMovimiento.EGRESO
+
+        cuando = np.where(es_egreso, egreso[fila], ingreso[fila].astype(object))
+        montos = np.where(es_egreso, monto[fila], None)
+        payload = connections[router.db_for_write(EventoMovimiento)].ops.adapt_json_value({}, None)
+
+        filas = zip(
+            self._reservar_ids(EventoMovimiento, n).tolist(), tipo.tolist(), [cochera.id] * n,
+            mov_ids[fila].tolist(), c["espacio"][fila].tolist(), operador[fila].tolist(),
+            cuando.tolist(), montos.tolist(), [payload] * n,
+        )
+        self._volcar(EventoMovimiento, [
+            "id", "tipo", "cochera", "movimiento", "espacio", "operador", "ocurrido_at", "monto", "payload",
+        ], filas)
+
+    def _reservar_ids(self, modelo, n):
+        ultimo = modelo.objects.order_by("-id").values_list("id", flat=True).first() or 0
+        self.secuencias.add(modelo)
+        return np.arange(ultimo + 1, ultimo + 1 + n, dtype=np.int64)
+
+    def _volcar(self, modelo, campos, filas):
+        alias = router.db_for_write(modelo)
+        ops = connections[alias].ops
+        columnas = ", ".join(ops.quote_name(modelo._meta.get_field(f).column) for f in campos)
+        sql = f"INSERT INTO {ops.quote_name(modelo._meta.db_table)} ({columnas}) VALUES ({', '.join(['%s'] * len(campos))})"
+        with connections[alias].cursor() as cursor:
+            while True:
+                lote = list(islice(filas, self.chunk))
+                if not lote:
+                    return
+                with transaction.atomic(using=alias):
+                    cursor.executemany(sql, lote)
+
+    def _reset_secuencias(self):
+        # con ids explícitos, en postgres hay que correr la secuencia
+        conn = connections[router.db_for_write(Movimiento)]
+        sqls = conn.ops.sequence_reset_sql(no_style(), list(self.secuencias))
+        if sqls:
+            with conn.cursor() as cursor:
+                for sql in sqls:
+                    cursor.execute(sql)
+
+    def _recaudacion(self, cochera, egresos, centavos):
+        # fecha local por hora de egreso (pocas horas distintas, muchos egresos)
+        horas, inversa = np.unique(egresos // 3600, return_inverse=True)
+        tz = timezone.get_current_timezone()
+        fecha_hora = [datetime.fromtimestamp(int(h) * 3600, tz=tz).date() for h in horas]
+        fechas, por_hora = np.unique(np.array(fecha_hora, dtype="datetime64[D]"), return_inverse=True)
+        dia = por_hora[inversa]
+        cantidad = np.bincount(dia, minlength=len(fechas))
+        total = np.bincount(dia, weights=centavos, minlength=len(fechas))
+        RecaudacionDiaria.objects.bulk_create([
+            RecaudacionDiaria(cochera=cochera, fecha=f.item(), egresos=int(n), total=Decimal(int(t)) / 100)
+            for f, n, t in zip(fechas, cantidad, total)
+            if n
+        ], batch_size=self.chunk)
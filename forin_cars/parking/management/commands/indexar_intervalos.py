@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from parking.services_intervalos import reconstruir
+
+
+class Command(BaseCommand):
+    help = (
+        "Carga el índice de intervalos (quién estaba adentro a tal hora) con la historia "
+        "ya cerrada. Es incremental: se puede cortar y volver a correr."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--cochera", type=int, help="Solo esta cochera (id).")
+        parser.add_argument("--rehacer", action="store_true", help="Borra el índice y lo arma de cero.")
+        parser.add_argument("--lote", type=int, default=5000)
+
+    def handle(self, *args, **opts):
+        t0 = time.perf_counter()
+        n = reconstruir(cochera_id=opts["cochera"], rehacer=opts["rehacer"], lote=opts["lote"])
+        self.stdout.write(f"{n:,} movimientos cerrados recorridos en {time.perf_counter() - t0:.1f}s")
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from parking.services_reconciliacion import reconciliar
+
+
+class Command(BaseCommand):
+    help = (
+        "Detecta y repara diferencias entre Espacio.ocupado y los movimientos ABIERTOS "
+        "(pensado para correr cada minuto)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--cochera", type=int, help="Solo esta cochera (id).")
+        parser.add_argument("--dry-run", action="store_true", help="Solo informa, no repara.")
+
+    def handle(self, *args, **opts):
+        reporte = reconciliar(cochera_id=opts["cochera"], aplicar=not opts["dry_run"])
+
+        detectado = reporte["detectado"]
+        if not any(detectado.values()):
+            if opts["verbosity"] > 1:
+                self.stdout.write("Sin diferencias.")
+            return
+
+        for categoria, n in detectado.items():
+            if n:
+                muestra = ", ".join(str(i) for i in reporte["muestra"][categoria])
+                self.stdout.write(f"{categoria}: {n}  [{muestra}{', ...' if n > len(reporte['muestra'][categoria]) else ''}]")
+
+        if opts["dry_run"]:
+            self.stdout.write(self.style.WARNING("dry-run: no se reparó nada."))
+            return
+
+        rep = reporte["reparado"]
+        self.stdout.write(self.style.SUCCESS(
+            f"reubicados={rep['reubicados']} liberados={rep['liberados']} ocupados={rep['ocupados']}"
+        ))
+        if rep["sin_lugar"]:
+            self.stdout.write(self.style.WARNING(f"{rep['sin_lugar']} movimientos sin espacio libre para reubicar."))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from parking.services_eventos import CHUNK, TraficoEnVivo, reconstruir_proyecciones
+
+
+class Command(BaseCommand):
+    help = (
+        "Rehace ocupación de espacios, estado de movimientos y recaudación diaria "
+        "desde la bitácora de eventos (EventoMovimiento)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--cochera", type=int, help="Solo esta cochera (id).")
+        parser.add_argument("--chunk", type=int, default=CHUNK, help="Eventos por lectura.")
+        parser.add_argument("--dry-run", action="store_true", help="Solo informa diferencias, no escribe.")
+
+    def handle(self, *args, **opts):
+        try:
+            stats = reconstruir_proyecciones(
+                cochera_id=opts["cochera"], chunk=opts["chunk"], aplicar=not opts["dry_run"]
+            )
+        except TraficoEnVivo as e:
+            raise CommandError(str(e))
+
+        eventos = stats.get("eventos", 0)
+        seg = stats.get("plegado_s") or 0.001
+        self.stdout.write(f"eventos leídos: {eventos:,} ({eventos / seg * 60:,.0f}/min de plegado)")
+        for k in ("espacios_ocupar", "espacios_liberar", "movimientos_corregidos",
+                  "movimientos_sin_eventos", "dias_recaudacion", "dias_sin_cubrir", "dias_corregidos"):
+            self.stdout.write(f"{k}: {stats.get(k, 0)}")
+        self.stdout.write(f"tiempo total: {stats['total_s']}s")
+
+        if opts["dry_run"]:
+            self.stdout.write(self.style.WARNING("dry-run: no se escribió nada."))
+        else:
+            self.stdout.write(self.style.SUCCESS("Proyecciones reconstruidas."))
@@ -0,0 +1,153 @@
+import asyncio
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from parking import services_porton, versiones
+
+
+# una línea más larga que esto corta la conexión
+LARGO_LINEA = 1024
+# AUTH fallidos antes de cortar
+MAX_AUTH_FALLIDOS = 3
+# no hubo lugar en el pool a tiempo
+OCUPADO = object()
+
+
+class Command(BaseCommand):
+    help = (
+        "Servidor TCP (asyncio) del protocolo de línea de los portones: AUTH/ENTRY/EXIT/QUERY "
+        "(ver parking.services_porton). Lo que toca la base va a un pool de hilos acotado; "
+        "si la cola de espera se llena contesta ERR Ocupado en vez de acumular."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="0.0.0.0")
+        parser.add_argument("--port", type=int, default=7070)
+        parser.add_argument("--hilos", type=int, default=8,
+                            help="Comandos contra la base en paralelo (con SQLite, un solo escritor, rinden más pocos).")
+        parser.add_argument("--cola", type=int, default=256,
+                            help="Comandos esperando un hilo; más que esto se rechaza.")
+        parser.add_argument("--espera", type=float, default=2.0,
+                            help="Segundos que un comando espera lugar en la cola antes del ERR Ocupado.")
+        parser.add_argument("--max-conexiones", type=int, default=2000)
+        parser.add_argument("--inactividad", type=float, default=600,
+                            help="Segundos sin comandos tras los que se corta una conexión.")
+        parser.add_argument("--timeout-auth", type=float, default=10, help="Segundos para mandar AUTH.")
+
+    def handle(self, *args, **opts):
+        if versiones.cache_local():
+            raise CommandError(versiones.SOLO_UN_PROCESO)
+        self.opts = opts
+        self.stats = {"conexiones": 0, "abiertas": 0, "comandos": 0, "ocupado": 0}
+        asyncio.run(self._servir())
+
+    async def _servir(self):
+        opts = self.opts
+        self.pool = ThreadPoolExecutor(max_workers=opts["hilos"], thread_name_prefix="porton")
+        # hilos ocupados + los que esperan: acota la cola del executor
+        self.cupo = asyncio.Semaphore(opts["hilos"] + opts["cola"])
+        loop = asyncio.get_running_loop()
+        parar = asyncio.Event()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, parar.set)
+
+        server = await asyncio.start_server(
+            self._atender, opts["host"], opts["port"], limit=LARGO_LINEA, backlog=1024
+        )
+        direcciones = ", ".join(f"{s.getsockname()[0]}:{s.getsockname()[1]}" for s in server.sockets)
+        self.stdout.write(f"portón escuchando en {direcciones} ({opts['hilos']} hilos)")
+        self.stdout.flush()
+
+        async with server:
+            t0 = time.monotonic()
+            while not parar.is_set():
+                try:
+                    await asyncio.wait_for(parar.wait(), timeout=60)
+                except asyncio.TimeoutError:
+                    if opts["verbosity"] > 1:
+                        self.stdout.write(f"{self.stats} en {time.monotonic() - t0:.0f}s")
+
+        # deja terminar lo que ya está en los hilos
+        self.pool.shutdown(wait=True)
+        self.stdout.write(f"portón: {self.stats['conexiones']} conexiones, {self.stats['comandos']} comandos")
+
+    async def _en_hilo(self, func, *args):
+        """Corre `func` en el pool si hay cupo; OCUPADO si no lo hubo a tiempo."""
+        try:
+            await asyncio.wait_for(self.cupo.acquire(), timeout=self.opts["espera"])
+        except asyncio.TimeoutError:
+            self.stats["ocupado"] += 1
+            return OCUPADO
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.pool, func, *args)
+        finally:
+            self.cupo.release()
+
+    async def _responder(self, writer, linea):
+        writer.write(linea.encode() + b"\n")
+        await writer.drain()
+
+    async def _atender(self, reader, writer):
+        opts, stats = self.opts, self.stats
+        stats["conexiones"] += 1
+        if stats["abiertas"] >= opts["max_conexiones"]:
+            writer.write(b"ERR Demasiadas conexiones.\n")
+            writer.close()
+            return
+        stats["abiertas"] += 1
+        sesion, fallidos = None, 0
+        try:
+            while True:
+                try:
+                    linea = await asyncio.wait_for(
+                        reader.readline(), timeout=opts["inactividad"] if sesion else opts["timeout_auth"]
+                    )
+                except asyncio.TimeoutError:
+                    break
+                except ValueError:
+                    # pasó el límite de largo sin \n
+                    await self._responder(writer, "ERR Línea demasiado larga.")
+                    break
+                if not linea:
+                    break
+
+                comando, *argumentos = linea.decode("utf-8", "replace").split() or [""]
+                comando = comando.upper()
+                stats["comandos"] += 1
+                if comando == "PING":
+                    respuesta = "PONG"
+                elif comando == "QUIT":
+                    await self._responder(writer, "BYE")
+                    break
+                elif comando == "AUTH":
+                    nueva = await self._en_hilo(services_porton.autenticar, argumentos[0] if argumentos else "")
+                    if nueva is OCUPADO:
+                        respuesta = "ERR Ocupado."
+                    elif nueva is None:
+                        fallidos += 1
+                        if fallidos >= MAX_AUTH_FALLIDOS:
+                            await self._responder(writer, "ERR Token inválido.")
+                            break
+                        respuesta = "ERR Token inválido."
+                    else:
+                        sesion = nueva
+                        respuesta = services_porton.bienvenida(sesion)
+                elif sesion is None:
+                    respuesta = "ERR Falta AUTH."
+                else:
+                    respuesta = await self._en_hilo(services_porton.ejecutar, sesion, comando, argumentos)
+                    if respuesta is OCUPADO:
+                        respuesta = "ERR Ocupado."
+                await self._responder(writer, respuesta)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            stats["abiertas"] -= 1
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
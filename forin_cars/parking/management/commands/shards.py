@@ -0,0 +1,79 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from parking import tenancy
+from parking.models import Cochera, ShardOperador
+
+
+class Command(BaseCommand):
+    help = (
+        "Operaciones sobre todos los shards de parking. "
+        "migrate: migra default y cada shard. "
+        "run <comando> [args]: corre un comando en cada shard. "
+        "resumen: totales por shard. "
+        "fijar: guarda en ShardOperador el shard de cada dueño que tiene cocheras y no tiene fila "
+        "(correrlo antes de agregar shards a PARKING_SHARDS)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("accion", choices=["migrate", "run", "resumen", "fijar"])
+        parser.add_argument("resto", nargs="*", help="Para run: comando y sus argumentos.")
+        parser.add_argument("--shard", action="append", help="Limitar a estos aliases (repetible).")
+
+    def _aliases(self, opts):
+        aliases = tenancy.shards()
+        if opts["shard"]:
+            faltan = set(opts["shard"]) - set(aliases)
+            if faltan:
+                raise CommandError(f"Shards desconocidos: {', '.join(sorted(faltan))}")
+            aliases = [a for a in aliases if a in opts["shard"]]
+        return aliases
+
+    def handle(self, *args, **opts):
+        accion = opts["accion"]
+
+        if accion == "migrate":
+            aliases = self._aliases(opts)
+            if "default" not in aliases:
+                aliases = ["default", *aliases]
+            for alias in aliases:
+                self.stdout.write(self.style.MIGRATE_HEADING(f"== {alias}"))
+                call_command("migrate", *opts["resto"], database=alias, verbosity=opts["verbosity"])
+            return
+
+        if accion == "run":
+            if not opts["resto"]:
+                raise CommandError("Falta el comando a correr. Ej: shards run reconciliar_ocupacion")
+            comando, *resto = opts["resto"]
+            for alias in self._aliases(opts):
+                self.stdout.write(self.style.MIGRATE_HEADING(f"== {alias}"))
+                with tenancy.tenant(alias):
+                    call_command(comando, *resto)
+            return
+
+        if accion == "fijar":
+            if not tenancy.sharding_activo():
+                raise CommandError("Sin PARKING_SHARDS no hay nada que fijar.")
+            ya = set(ShardOperador.objects.values_list("owner_id", flat=True))
+            for alias in self._aliases(opts):
+                with tenancy.tenant(alias):
+                    owners = set(Cochera.objects.values_list("owner_id", flat=True).distinct()) - ya
+                # el shard donde están sus cocheras, no el del módulo
+                otro = []
+                for owner_id in sorted(owners):
+                    if tenancy.asignar(owner_id, alias) != alias:
+                        otro.append(owner_id)
+                ya |= owners
+                self.stdout.write(f"{alias}: {len(owners) - len(otro)} dueños fijados")
+                if otro:
+                    self.stderr.write(f"{alias}: con cocheras acá pero ya asignados a otro shard: {otro}")
+            return
+
+        for fila in tenancy.resumen_por_shard():
+            if opts["shard"] and fila["alias"] not in opts["shard"]:
+                continue
+            self.stdout.write(
+                f"{fila['alias']:<12} cocheras={fila['cocheras']} operadores={fila['operadores']} "
+                f"espacios={fila['espacios']} ocupados={fila['ocupados']} "
+                f"movimientos={fila['movimientos']} abiertos={fila['abiertos']} facturado={fila['facturado']}"
+            )
@@ -0,0 +1,36 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from parking import services_snapshot, tenancy
+
+
+class Command(BaseCommand):
+    help = (
+        "Agrega al snapshot columnar (parking.services_snapshot, en PARKING_SNAPSHOTS) los movimientos "
+        "cerrados desde la corrida anterior. Pensado para cron; recorre todos los shards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--shard", action="append", help="Limitar a estos aliases (repetible).")
+        parser.add_argument("--rehacer", action="store_true", help="Borra el snapshot y lo arma de cero.")
+        parser.add_argument("--compactar", action="store_true", help="Después, junta las particiones chicas.")
+        parser.add_argument("--margen", type=int, default=int(services_snapshot.MARGEN.total_seconds()),
+                            help="Segundos: lo cerrado hace menos queda para la próxima.")
+        parser.add_argument("--reescaneo", type=int, default=int(services_snapshot.REESCANEO.total_seconds()),
+                            help="Segundos antes de la marca anterior que se vuelven a mirar (commits tardíos).")
+
+    def handle(self, *args, **opts):
+        for alias in opts["shard"] or tenancy.shards():
+            with tenancy.tenant(alias):
+                t0 = time.perf_counter()
+                filas, particiones = services_snapshot.actualizar(
+                    rehacer=opts["rehacer"], margen=timedelta(seconds=opts["margen"]),
+                    reescaneo=timedelta(seconds=opts["reescaneo"]),
+                )
+                linea = f"{alias}: {filas:,} movimientos en {particiones} particiones nuevas"
+                if opts["compactar"]:
+                    linea += f", {services_snapshot.compactar()} después de compactar"
+                if opts["verbosity"]:
+                    self.stdout.write(f"{linea} ({time.perf_counter() - t0:.1f}s)")
@@ -0,0 +1,124 @@
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from parking import cola, versiones
+
+
+# cada cuánto se rescatan colgadas y se purgan viejas
+MANTENIMIENTO_S = 60
+# cada cuánto se renueva el latido de las que están corriendo (bastante menos que --vencimiento)
+LATIDO_S = 30
+
+
+class Command(BaseCommand):
+    help = (
+        "Worker de la cola de tareas (parking.cola): toma tareas de la base y las corre "
+        "en un pool de hilos, con reintentos y backoff. Con --procesos levanta varios "
+        "procesos, cada uno con su pool."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--hilos", type=int, default=4, help="Tareas en paralelo por proceso.")
+        parser.add_argument("--procesos", type=int, default=1)
+        parser.add_argument("--intervalo", type=float, default=1.0, help="Segundos entre consultas con la cola vacía.")
+        parser.add_argument("--una-vez", action="store_true", help="Vacía la cola y termina (cron, deploy).")
+        parser.add_argument("--vencimiento", type=int, default=600,
+                            help="Segundos sin latido tras los que una tarea CORRIENDO se da por colgada.")
+        parser.add_argument("--purgar-dias", type=int, default=7, help="Días que se guardan las tareas HECHAS.")
+
+    def handle(self, *args, **opts):
+        if versiones.cache_local():
+            raise CommandError(versiones.SOLO_UN_PROCESO)
+        if opts["procesos"] <= 1:
+            self._bucle(opts)
+            return
+
+        # cada hijo abre sus conexiones: no se heredan sockets a la base
+        connections.close_all()
+        ctx = multiprocessing.get_context("fork")
+        hijos = [ctx.Process(target=self._bucle, args=(opts,), daemon=False) for _ in range(opts["procesos"])]
+        for p in hijos:
+            p.start()
+
+        def _reenviar(signum, frame):
+            for p in hijos:
+                if p.is_alive():
+                    os.kill(p.pid, signum)
+
+        signal.signal(signal.SIGTERM, _reenviar)
+        signal.signal(signal.SIGINT, _reenviar)
+        for p in hijos:
+            p.join()
+
+    def _bucle(self, opts):
+        worker = f"{socket.gethostname()}:{os.getpid()}"
+        hilos = opts["hilos"]
+        parar = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *a: parar.set())
+        signal.signal(signal.SIGINT, lambda *a: parar.set())
+
+        hechas = fallidas = 0
+        mantenimiento = latido = 0.0
+        # future -> id de la tarea
+        en_curso = {}
+        if opts["verbosity"]:
+            self.stdout.write(f"worker {worker}: {hilos} hilos, tareas: {', '.join(cola.registradas())}")
+
+        with ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="tarea") as pool:
+            while not parar.is_set():
+                if time.monotonic() - mantenimiento > MANTENIMIENTO_S:
+                    rescatadas = cola.rescatar_colgadas(timedelta(seconds=opts["vencimiento"]))
+                    purgadas = cola.purgar(opts["purgar_dias"])
+                    if opts["verbosity"] > 1 and (rescatadas or purgadas):
+                        self.stdout.write(f"rescatadas={rescatadas} purgadas={purgadas}")
+                    mantenimiento = time.monotonic()
+                if en_curso and time.monotonic() - latido > LATIDO_S:
+                    cola.latir(worker, en_curso.values())
+                    latido = time.monotonic()
+
+                libres = hilos - len(en_curso)
+                ids = cola.reclamar(worker, libres) if libres else []
+                for tarea_id in ids:
+                    en_curso[pool.submit(cola.ejecutar, tarea_id)] = tarea_id
+
+                if not ids and not en_curso:
+                    if opts["una_vez"]:
+                        break
+                    parar.wait(opts["intervalo"])
+                    continue
+
+                # con el pool lleno (o la cola vacía) se espera a que se libere un hilo
+                if not libres or not ids:
+                    listas, _ = wait(en_curso, timeout=opts["intervalo"], return_when=FIRST_COMPLETED)
+                else:
+                    listas = {f for f in en_curso if f.done()}
+                for f in listas:
+                    del en_curso[f]
+                    if f.result():
+                        hechas += 1
+                    else:
+                        fallidas += 1
+
+            # al parar se esperan las que están corriendo, sin dejar de latir
+            while en_curso:
+                listas, _ = wait(en_curso, timeout=LATIDO_S, return_when=FIRST_COMPLETED)
+                for f in listas:
+                    del en_curso[f]
+                    if f.result():
+                        hechas += 1
+                    else:
+                        fallidas += 1
+                cola.latir(worker, en_curso.values())
+
+        connections.close_all()
+        if opts["verbosity"]:
+            self.stdout.write(f"worker {worker}: {hechas} hechas, {fallidas} con error")
@@ -0,0 +1,35 @@
+from django.shortcuts import redirect
+
+from . import tenancy
+
+
+class TenantMiddleware:
+    """
+    Fija el shard del request según el usuario. El superuser elige shard con
+    ?shard=<alias> (queda en sesión) para navegar el admin de cada operador.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not tenancy.sharding_activo():
+            return self.get_response(request)
+
+        user = request.user
+        if user.is_authenticated and user.is_superuser:
+            if "shard" in request.GET:
+                pedido = request.GET["shard"]
+                if pedido in tenancy.shards():
+                    request.session["shard"] = pedido
+                # se saca el parámetro (el admin rechaza filtros desconocidos)
+                params = request.GET.copy()
+                del params["shard"]
+                return redirect(f"{request.path}?{params.urlencode()}" if params else request.path)
+            alias = request.session.get("shard") or tenancy.shards()[0]
+        else:
+            alias = tenancy.alias_para_usuario(user)
+
+        request.shard = alias
+        with tenancy.tenant(alias):
+            return self.get_response(request)
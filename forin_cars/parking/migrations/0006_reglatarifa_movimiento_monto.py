@@ -0,0 +1,39 @@
+# Generated by Django 6.0 on 2026-10-19 00:37
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0005_invitacionempleado_tarifahora'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movimiento',
+            name='monto',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.CreateModel(
+            name='ReglaTarifa',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('vigente_desde', models.DateTimeField(default=django.utils.timezone.now)),
+                ('precio_primera_hora', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('minutos_fraccion', models.PositiveSmallIntegerField(choices=[(5, '5 min'), (10, '10 min'), (15, '15 min'), (20, '20 min'), (30, '30 min'), (60, '60 min')], default=15)),
+                ('precio_fraccion', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('precio_fraccion_noche', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('noche_desde', models.PositiveSmallIntegerField(default=22)),
+                ('noche_hasta', models.PositiveSmallIntegerField(default=6)),
+                ('tope_diario', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('cochera', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reglas_tarifa', to='parking.cochera')),
+                ('tipo', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='parking.tipoespacio')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('cochera', 'tipo', 'vigente_desde'), name='uq_regla_tarifa_vigencia')],
+            },
+        ),
+    ]
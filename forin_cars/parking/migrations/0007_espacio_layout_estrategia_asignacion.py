@@ -0,0 +1,46 @@
+# Generated by Django 6.0 on 2026-10-19 00:38
+
+from django.db import migrations, models
+
+
+def numerar_espacios(apps, schema_editor):
+    # los espacios existentes quedan numerados por id dentro de (cochera, tipo)
+    Espacio = apps.get_model("parking", "Espacio")
+    actual, n, cambios = None, 0, []
+    for e in Espacio.objects.order_by("cochera_id", "tipo_id", "id").only("id", "cochera_id", "tipo_id"):
+        if (e.cochera_id, e.tipo_id) != actual:
+            actual, n = (e.cochera_id, e.tipo_id), 0
+        n += 1
+        e.orden = n
+        cambios.append(e)
+    Espacio.objects.bulk_update(cambios, ["orden"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0006_reglatarifa_movimiento_monto'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cochera',
+            name='estrategia_asignacion',
+            field=models.CharField(choices=[('MENOR_ETIQUETA', 'Menor etiqueta'), ('ROUND_ROBIN', 'Rotativa'), ('CERCA_SALIDA', 'Más cerca de la salida'), ('REPARTIR', 'Repartir entre niveles')], default='MENOR_ETIQUETA', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='espacio',
+            name='nivel',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='espacio',
+            name='orden',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='espacio',
+            index=models.Index(fields=['cochera', 'tipo', 'ocupado'], name='parking_esp_cochera_e295dc_idx'),
+        ),
+        migrations.RunPython(numerar_espacios, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 6.0 on 2026-10-19 00:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0007_espacio_layout_estrategia_asignacion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Reserva',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('codigo', models.CharField(max_length=12, unique=True)),
+                ('desde', models.DateTimeField()),
+                ('hasta', models.DateTimeField()),
+                ('estado', models.CharField(choices=[('ACTIVA', 'ACTIVA'), ('CUMPLIDA', 'CUMPLIDA'), ('CANCELADA', 'CANCELADA')], default='ACTIVA', max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('cliente', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reservas', to='parking.cliente')),
+                ('cochera', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservas', to='parking.cochera')),
+                ('movimiento', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reservas', to='parking.movimiento')),
+                ('tipo', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='parking.tipoespacio')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['cochera', 'estado', 'desde'], name='parking_res_cochera_319bcc_idx')],
+                'constraints': [models.CheckConstraint(condition=models.Q(('hasta__gt', models.F('desde'))), name='ck_reserva_rango')],
+            },
+        ),
+    ]
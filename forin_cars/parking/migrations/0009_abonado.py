@@ -0,0 +1,42 @@
+# Generated by Django 6.0 on 2026-10-19 00:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0008_reserva'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Abonado',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('valido_desde', models.DateField()),
+                ('valido_hasta', models.DateField()),
+                ('activo', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('cliente', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='abonos', to='parking.cliente')),
+                ('cochera', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='abonados', to='parking.cochera')),
+                ('espacio', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='abonados', to='parking.espacio')),
+                ('tipo', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='parking.tipoespacio')),
+                ('vehiculo', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='abonos', to='parking.vehiculo')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='movimiento',
+            name='abonado',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='movimientos', to='parking.abonado'),
+        ),
+        migrations.AddIndex(
+            model_name='abonado',
+            index=models.Index(fields=['cochera', 'activo'], name='parking_abo_cochera_e9aa49_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='abonado',
+            constraint=models.CheckConstraint(condition=models.Q(('valido_hasta__gte', models.F('valido_desde'))), name='ck_abonado_vigencia'),
+        ),
+    ]
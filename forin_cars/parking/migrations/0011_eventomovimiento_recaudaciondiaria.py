@@ -0,0 +1,91 @@
+# Generated by Django 6.0 on 2026-10-19 00:46
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_eventos(apps, schema_editor):
+    """
+    Genera INGRESO/EGRESO para los movimientos existentes (en orden de ingreso,
+    cada egreso pegado a su ingreso) y la recaudación diaria, para que el replay
+    arranque de una bitácora completa.
+    """
+    from collections import defaultdict
+    from decimal import Decimal
+
+    from django.utils import timezone
+
+    db = schema_editor.connection.alias
+    Movimiento = apps.get_model("parking", "Movimiento")
+    EventoMovimiento = apps.get_model("parking", "EventoMovimiento")
+    RecaudacionDiaria = apps.get_model("parking", "RecaudacionDiaria")
+
+    recaudacion = defaultdict(lambda: [0, Decimal(0)])
+    lote = []
+    filas = (
+        Movimiento.objects.using(db)
+        .order_by("ingreso_at", "id")
+        .values_list("id", "cochera_id", "espacio_id", "operador_id", "ingreso_at", "egreso_at", "monto", "estado")
+        .iterator(chunk_size=5000)
+    )
+    for mov_id, coch, esp, op, ingreso_at, egreso_at, monto, estado in filas:
+        comun = dict(cochera_id=coch, movimiento_id=mov_id, espacio_id=esp, operador_id=op)
+        lote.append(EventoMovimiento(tipo="INGRESO", ocurrido_at=ingreso_at, payload={"backfill": True}, **comun))
+        if estado == "CERRADO" and egreso_at:
+            lote.append(EventoMovimiento(tipo="EGRESO", ocurrido_at=egreso_at, monto=monto, payload={"backfill": True}, **comun))
+            r = recaudacion[(coch, timezone.localtime(egreso_at).date())]
+            r[0] += 1
+            r[1] += monto or 0
+        if len(lote) >= 5000:
+            EventoMovimiento.objects.using(db).bulk_create(lote)
+            lote = []
+    EventoMovimiento.objects.using(db).bulk_create(lote)
+
+    RecaudacionDiaria.objects.using(db).bulk_create(
+        [RecaudacionDiaria(cochera_id=c, fecha=f, egresos=n, total=t) for (c, f), (n, t) in recaudacion.items()],
+        batch_size=2000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0010_shardoperador_fks_usuario_sin_constraint'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventoMovimiento',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('INGRESO', 'INGRESO'), ('EGRESO', 'EGRESO'), ('REASIGNACION', 'REASIGNACION'), ('AJUSTE', 'AJUSTE')], max_length=12)),
+                ('ocurrido_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('monto', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('payload', models.JSONField(blank=True, default=dict)),
+                ('cochera', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='parking.cochera')),
+                ('espacio', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='parking.espacio')),
+                ('movimiento', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='parking.movimiento')),
+                ('operador', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['cochera', 'id'], name='parking_eve_cochera_f22475_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='RecaudacionDiaria',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('egresos', models.PositiveIntegerField(default=0)),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('cochera', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recaudacion', to='parking.cochera')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('cochera', 'fecha'), name='uq_recaudacion_dia')],
+            },
+        ),
+        migrations.RunPython(backfill_eventos, migrations.RunPython.noop),
+    ]
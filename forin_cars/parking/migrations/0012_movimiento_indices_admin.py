@@ -0,0 +1,27 @@
+# Generated by Django 6.0 on 2026-10-19 01:01
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0011_eventomovimiento_recaudaciondiaria'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='movimiento',
+            index=models.Index(fields=['ingreso_at'], name='parking_mov_ingreso_c8f8e3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movimiento',
+            index=models.Index(fields=['estado', 'ingreso_at'], name='parking_mov_estado_9e9e11_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movimiento',
+            index=models.Index(fields=['cochera', 'ingreso_at'], name='parking_mov_cochera_493315_idx'),
+        ),
+    ]
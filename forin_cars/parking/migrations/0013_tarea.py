@@ -0,0 +1,38 @@
+# Generated by Django 6.0 on 2026-10-19 01:08
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0012_movimiento_indices_admin'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tarea',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=80)),
+                ('kwargs', models.JSONField(blank=True, default=dict)),
+                ('alias', models.CharField(default='default', max_length=40)),
+                ('prioridad', models.SmallIntegerField(default=0)),
+                ('clave', models.CharField(blank=True, max_length=200, null=True)),
+                ('estado', models.CharField(choices=[('PENDIENTE', 'PENDIENTE'), ('CORRIENDO', 'CORRIENDO'), ('HECHA', 'HECHA'), ('FALLIDA', 'FALLIDA')], default='PENDIENTE', max_length=10)),
+                ('intentos', models.PositiveSmallIntegerField(default=0)),
+                ('max_intentos', models.PositiveSmallIntegerField(default=3)),
+                ('disponible_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('tomada_por', models.CharField(blank=True, max_length=80)),
+                ('iniciada_at', models.DateTimeField(blank=True, null=True)),
+                ('terminada_at', models.DateTimeField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['estado', 'prioridad', 'disponible_at'], name='parking_tar_estado_c099a7_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('estado__in', ['PENDIENTE', 'CORRIENDO'])), fields=('clave',), name='uq_tarea_clave_activa')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-19 01:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0013_tarea'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cochera',
+            name='horas_abandono',
+            field=models.PositiveIntegerField(default=72, help_text='Horas tras las que un vehículo adentro se da por abandonado (0 = nunca).'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 6.0 on 2026-10-19 01:20
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0014_cochera_horas_abandono'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='movimiento',
+            index=models.Index(fields=['cochera', 'egreso_at'], name='parking_mov_cochera_4e6dcb_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 6.0 on 2026-10-19 01:23
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0015_movimiento_cochera_egreso'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='eventomovimiento',
+            index=models.Index(fields=['cochera', 'ocurrido_at'], name='parking_eve_cochera_36f0bd_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 6.0 on 2026-10-19 01:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0016_eventomovimiento_cochera_ocurrido'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SecuenciaTicket',
+            fields=[
+                ('cochera', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='secuencia_ticket', serialize=False, to='parking.cochera')),
+                ('siguiente', models.PositiveBigIntegerField(default=1)),
+            ],
+        ),
+    ]
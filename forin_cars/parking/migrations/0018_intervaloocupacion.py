@@ -0,0 +1,27 @@
+# Generated by Django 6.0 on 2026-10-19 01:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0017_secuenciaticket'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IntervaloOcupacion',
+            fields=[
+                ('movimiento', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='+', serialize=False, to='parking.movimiento')),
+                ('nodo', models.BigIntegerField()),
+                ('desde', models.BigIntegerField()),
+                ('hasta', models.BigIntegerField()),
+                ('cochera', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='parking.cochera')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['cochera', 'nodo', 'desde'], name='parking_int_cochera_971dc1_idx'), models.Index(fields=['cochera', 'nodo', 'hasta'], name='parking_int_cochera_cca08c_idx')],
+            },
+        ),
+    ]
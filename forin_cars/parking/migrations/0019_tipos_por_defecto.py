@@ -0,0 +1,27 @@
+# Generated by Django 6.0 on 2026-10-19 01:31
+
+from django.db import migrations
+
+
+TIPOS_POR_DEFECTO = ["Auto", "Moto", "Camioneta", "Bicicleta"]
+
+
+def crear_tipos(apps, schema_editor):
+    # antes lo hacía ensure_default_tipos() en cada alta/edición de cochera
+    TipoEspacio = apps.get_model("parking", "TipoEspacio")
+    db = schema_editor.connection.alias
+    existentes = set(TipoEspacio.objects.using(db).values_list("nombre", flat=True))
+    TipoEspacio.objects.using(db).bulk_create(
+        [TipoEspacio(nombre=n) for n in TIPOS_POR_DEFECTO if n not in existentes]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0018_intervaloocupacion'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_tipos, migrations.RunPython.noop, hints={"model_name": "tipoespacio"}),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 6.0 on 2026-10-19 01:37
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0019_tipos_por_defecto'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MensajeOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('destino', models.CharField(max_length=40)),
+                ('cuerpo', models.JSONField(default=dict)),
+                ('estado', models.CharField(choices=[('PENDIENTE', 'PENDIENTE'), ('ENVIANDO', 'ENVIANDO'), ('ENTREGADO', 'ENTREGADO'), ('FALLIDO', 'FALLIDO')], default='PENDIENTE', max_length=10)),
+                ('intentos', models.PositiveSmallIntegerField(default=0)),
+                ('disponible_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('tomado_por', models.CharField(blank=True, max_length=80)),
+                ('tomado_at', models.DateTimeField(blank=True, null=True)),
+                ('entregado_at', models.DateTimeField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('cochera', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='parking.cochera')),
+                ('evento', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='parking.eventomovimiento')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['estado', 'disponible_at'], name='parking_men_estado_e3fb0c_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 6.0 on 2026-10-19 01:51
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0021_dispositivo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UmbralAlerta',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('porcentaje', models.PositiveSmallIntegerField(default=90, validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(100)])),
+                ('histeresis', models.PositiveSmallIntegerField(default=5, validators=[django.core.validators.MaxValueValidator(100)])),
+                ('activo', models.BooleanField(default=True)),
+                ('disparado', models.BooleanField(default=False)),
+                ('disparado_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('cochera', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='umbrales', to='parking.cochera')),
+                ('tipo', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='parking.tipoespacio')),
+            ],
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 6.0 on 2026-10-19 03:10
+
+from django.db import migrations
+from django.db.models import Max
+
+
+def numerar_espacios(apps, schema_editor):
+    # la 0007 numeraba sin .using(): con shards leía y escribía en la base del
+    # router y no en la que se estaba migrando. Acá se numeran, en la base que
+    # se migra, los (cochera, tipo) que quedaron sin numerar (todos en 0).
+    Espacio = apps.get_model("parking", "Espacio")
+    db = schema_editor.connection.alias
+    sin_numerar = set(
+        Espacio.objects.using(db).values_list("cochera_id", "tipo_id")
+        .annotate(maximo=Max("orden")).filter(maximo=0).values_list("cochera_id", "tipo_id")
+    )
+    if not sin_numerar:
+        return
+    actual, n, cambios = None, 0, []
+    for e in Espacio.objects.using(db).order_by("cochera_id", "tipo_id", "id").only("id", "cochera_id", "tipo_id"):
+        if (e.cochera_id, e.tipo_id) not in sin_numerar:
+            continue
+        if (e.cochera_id, e.tipo_id) != actual:
+            actual, n = (e.cochera_id, e.tipo_id), 0
+        n += 1
+        e.orden = n
+        cambios.append(e)
+    Espacio.objects.using(db).bulk_update(cambios, ["orden"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0023_cochera_coordenadas'),
+    ]
+
+    operations = [
+        migrations.RunPython(numerar_espacios, migrations.RunPython.noop, hints={"model_name": "espacio"}),
+    ]
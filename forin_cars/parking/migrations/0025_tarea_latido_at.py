@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-19 02:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0024_numerar_espacios_por_base'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tarea',
+            name='latido_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
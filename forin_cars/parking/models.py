@@ -1,17 +1,101 @@
 from django.conf import settings
+from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
 from django.utils import timezone
 
 
+class ShardOperador(models.Model):
+    """Asignación manual de un dueño a un shard (vive siempre en default)."""
+    owner = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="shard")
+    alias = models.CharField(max_length=40)
+
+    def __str__(self):
+        return f"{self.owner.username} -> {self.alias}"
+
+
+class Tarea(models.Model):
+    """
+    Trabajo en segundo plano (cola en la base, sin broker). Vive en default y
+    guarda el alias del tenant en el que se encoló; la corre `worker_tareas`.
+    """
+    PENDIENTE = "PENDIENTE"
+    CORRIENDO = "CORRIENDO"
+    HECHA = "HECHA"
+    FALLIDA = "FALLIDA"
+    ESTADOS = [(PENDIENTE, "PENDIENTE"), (CORRIENDO, "CORRIENDO"), (HECHA, "HECHA"), (FALLIDA, "FALLIDA")]
+
+    nombre = models.CharField(max_length=80)
+    kwargs = models.JSONField(default=dict, blank=True)
+    alias = models.CharField(max_length=40, default="default")
+    # mayor prioridad sale primero
+    prioridad = models.SmallIntegerField(default=0)
+    # evita encolar dos veces lo mismo mientras la primera no terminó
+    clave = models.CharField(max_length=200, null=True, blank=True)
+
+    estado = models.CharField(max_length=10, choices=ESTADOS, default=PENDIENTE)
+    intentos = models.PositiveSmallIntegerField(default=0)
+    max_intentos = models.PositiveSmallIntegerField(default=3)
+    disponible_at = models.DateTimeField(default=timezone.now)
+    tomada_por = models.CharField(max_length=80, blank=True)
+    iniciada_at = models.DateTimeField(null=True, blank=True)
+    # el worker lo renueva mientras la corre: sin latido reciente, el worker murió
+    latido_at = models.DateTimeField(null=True, blank=True)
+    terminada_at = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["estado", "prioridad", "disponible_at"]),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["clave"],
+                condition=models.Q(estado__in=["PENDIENTE", "CORRIENDO"]),
+                name="uq_tarea_clave_activa",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.nombre}#{self.pk} ({self.estado})"
+
+
 class Cochera(models.Model):
+    MENOR_ETIQUETA = "MENOR_ETIQUETA"
+    ROUND_ROBIN = "ROUND_ROBIN"
+    CERCA_SALIDA = "CERCA_SALIDA"
+    REPARTIR = "REPARTIR"
+    ESTRATEGIAS = [
+        (MENOR_ETIQUETA, "Menor etiqueta"),
+        (ROUND_ROBIN, "Rotativa"),
+        (CERCA_SALIDA, "Más cerca de la salida"),
+        (REPARTIR, "Repartir entre niveles"),
+    ]
+
+    # las FKs a usuarios no llevan constraint: con shards el usuario vive en default
     owner = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
         related_name="cocheras",
+        db_constraint=False,
     )
     nombre = models.CharField(max_length=120)
     direccion = models.CharField(max_length=200, blank=True)
+    # para ofrecer cocheras cercanas cuando esta se llena (services_cercanas)
+    latitud = models.DecimalField(
+        max_digits=9, decimal_places=6, null=True, blank=True,
+        validators=[MinValueValidator(-90), MaxValueValidator(90)],
+    )
+    longitud = models.DecimalField(
+        max_digits=9, decimal_places=6, null=True, blank=True,
+        validators=[MinValueValidator(-180), MaxValueValidator(180)],
+    )
     activa = models.BooleanField(default=True)
+    estrategia_asignacion = models.CharField(max_length=20, choices=ESTRATEGIAS, default=MENOR_ETIQUETA)
+    # un ABIERTO más viejo que esto se da por abandonado y se cierra (0 = nunca)
+    horas_abandono = models.PositiveIntegerField(
+        default=72, help_text="Horas tras las que un vehículo adentro se da por abandonado (0 = nunca)."
+    )
     created_at = models.DateTimeField(auto_now_add=True)
 
     empleados = models.ManyToManyField(
@@ -31,7 +115,7 @@ class Cochera(models.Model):
 
 class CocheraEmpleado(models.Model):
     cochera = models.ForeignKey(Cochera, on_delete=models.CASCADE)
-    empleado = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    empleado = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, db_constraint=False)
     activo = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -66,6 +150,7 @@ class InvitacionEmpleado(models.Model):
         blank=True,
         on_delete=models.SET_NULL,
         related_name="invitaciones_aceptadas",
+        db_constraint=False,
     )
 
     class Meta:
@@ -116,11 +201,48 @@ class TarifaHora(models.Model):
         return f"{self.cochera.nombre} - {self.tipo.nombre}: ${self.precio_hora}/h"
 
 
+class ReglaTarifa(models.Model):
+    """
+    Tarifa por fracción con vigencia: primera hora fija, después cada fracción
+    iniciada se cobra según la franja (día/noche) en la que arranca, con tope
+    opcional por cada 24 h de estadía. Se aplica la regla vigente al ingreso.
+    """
+    FRACCIONES = [(m, f"{m} min") for m in (5, 10, 15, 20, 30, 60)]
+
+    cochera = models.ForeignKey(Cochera, on_delete=models.CASCADE, related_name="reglas_tarifa")
+    tipo = models.ForeignKey(TipoEspacio, on_delete=models.PROTECT)
+    vigente_desde = models.DateTimeField(default=timezone.now)
+
+    precio_primera_hora = models.DecimalField(max_digits=10, decimal_places=2)
+    minutos_fraccion = models.PositiveSmallIntegerField(choices=FRACCIONES, default=15)
+    precio_fraccion = models.DecimalField(max_digits=10, decimal_places=2)
+    precio_fraccion_noche = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    noche_desde = models.PositiveSmallIntegerField(default=22)
+    noche_hasta = models.PositiveSmallIntegerField(default=6)
+    tope_diario = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["cochera", "tipo", "vigente_desde"], name="uq_regla_tarifa_vigencia")
+        ]
+
+    def __str__(self):
+        return f"{self.cochera.nombre} - {self.tipo.nombre} desde {self.vigente_desde:%Y-%m-%d %H:%M}"
+
+
 class Espacio(models.Model):
     cochera = models.ForeignKey(Cochera, on_delete=models.CASCADE, related_name="espacios")
     tipo = models.ForeignKey(TipoEspacio, on_delete=models.PROTECT)
     ocupado = models.BooleanField(default=False)
     etiqueta = models.CharField(max_length=30, blank=True)
+    # layout: orden dentro del nivel (1 = más cerca de la salida) y nivel/piso
+    orden = models.PositiveIntegerField(default=0)
+    nivel = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["cochera", "tipo", "ocupado"]),
+        ]
 
     def __str__(self):
         return f"{self.cochera.nombre} - {self.tipo.nombre} - {'OCUPADO' if self.ocupado else 'LIBRE'}"
@@ -154,6 +276,20 @@ class Vehiculo(models.Model):
         return f"{self.ticket} - {self.tipo.nombre} - {p}"
 
 
+class SecuenciaTicket(models.Model):
+    """
+    Contador de tickets emitidos por cochera. Se reserva de a bloques
+    (services_tickets): cada worker numera su bloque en memoria y solo vuelve a
+    esta fila cuando lo termina.
+    """
+    cochera = models.OneToOneField(Cochera, on_delete=models.CASCADE, primary_key=True, related_name="secuencia_ticket")
+    # primer número que todavía no se entregó a ningún bloque
+    siguiente = models.PositiveBigIntegerField(default=1)
+
+    def __str__(self):
+        return f"{self.cochera_id}: {self.siguiente}"
+
+
 class Movimiento(models.Model):
     ABIERTO = "ABIERTO"
     CERRADO = "CERRADO"
@@ -162,18 +298,259 @@ class Movimiento(models.Model):
     cochera = models.ForeignKey(Cochera, on_delete=models.CASCADE, related_name="movimientos")
     vehiculo = models.ForeignKey(Vehiculo, on_delete=models.PROTECT, related_name="movimientos")
     espacio = models.ForeignKey(Espacio, on_delete=models.PROTECT, related_name="movimientos")
-    operador = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.PROTECT, related_name="movimientos")
+    operador = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.PROTECT, related_name="movimientos", db_constraint=False
+    )
 
     estado = models.CharField(max_length=10, choices=ESTADOS, default=ABIERTO)
     ingreso_at = models.DateTimeField(default=timezone.now)
     egreso_at = models.DateTimeField(null=True, blank=True)
+    monto = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    abonado = models.ForeignKey(
+        "Abonado", on_delete=models.SET_NULL, null=True, blank=True, related_name="movimientos"
+    )
 
     class Meta:
         indexes = [
             models.Index(fields=["cochera", "estado"]),
             models.Index(fields=["vehiculo", "estado"]),
             models.Index(fields=["espacio", "estado"]),
+            # changelist del admin: orden por ingreso, con y sin filtro
+            models.Index(fields=["ingreso_at"]),
+            models.Index(fields=["estado", "ingreso_at"]),
+            models.Index(fields=["cochera", "ingreso_at"]),
+            # serie de ocupación: lo que sigue adentro a partir de un instante
+            models.Index(fields=["cochera", "egreso_at"]),
         ]
 
     def __str__(self):
         return f"{self.vehiculo.ticket} - {self.cochera.nombre} - {self.estado}"
+
+
+class Reserva(models.Model):
+    ACTIVA = "ACTIVA"
+    CUMPLIDA = "CUMPLIDA"
+    CANCELADA = "CANCELADA"
+    ESTADOS = [(ACTIVA, "ACTIVA"), (CUMPLIDA, "CUMPLIDA"), (CANCELADA, "CANCELADA")]
+
+    cochera = models.ForeignKey(Cochera, on_delete=models.CASCADE, related_name="reservas")
+    tipo = models.ForeignKey(TipoEspacio, on_delete=models.PROTECT)
+    cliente = models.ForeignKey(Cliente, on_delete=models.SET_NULL, null=True, blank=True, related_name="reservas")
+    codigo = models.CharField(max_length=12, unique=True)
+
+    desde = models.DateTimeField()
+    hasta = models.DateTimeField()
+    estado = models.CharField(max_length=10, choices=ESTADOS, default=ACTIVA)
+    movimiento = models.ForeignKey(
+        Movimiento, on_delete=models.SET_NULL, null=True, blank=True, related_name="reservas"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["cochera", "estado", "desde"]),
+        ]
+        constraints = [
+            models.CheckConstraint(condition=models.Q(hasta__gt=models.F("desde")), name="ck_reserva_rango"),
+        ]
+
+    def __str__(self):
+        return f"{self.codigo} - {self.cochera.nombre} - {self.tipo.nombre} ({self.estado})"
+
+
+class Abonado(models.Model):
+    """
+    Abono mensual: el vehículo (ticket/patente) entra sin facturar por hora.
+    Con espacio = lugar fijo reservado; sin espacio = flotante.
+    """
+    cliente = models.ForeignKey(Cliente, on_delete=models.PROTECT, related_name="abonos")
+    vehiculo = models.ForeignKey(Vehiculo, on_delete=models.PROTECT, related_name="abonos")
+    cochera = models.ForeignKey(Cochera, on_delete=models.CASCADE, related_name="abonados")
+    tipo = models.ForeignKey(TipoEspacio, on_delete=models.PROTECT)
+    espacio = models.ForeignKey(
+        Espacio, on_delete=models.SET_NULL, null=True, blank=True, related_name="abonados"
+    )
+
+    valido_desde = models.DateField()
+    valido_hasta = models.DateField()
+    activo = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["cochera", "activo"]),
+        ]
+        constraints = [
+            models.CheckConstraint(condition=models.Q(valido_hasta__gte=models.F("valido_desde")), name="ck_abonado_vigencia"),
+        ]
+
+    def __str__(self):
+        return f"{self.vehiculo.ticket} - {self.cochera.nombre} ({self.valido_desde} a {self.valido_hasta})"
+
+
+class IntervaloOcupacion(models.Model):
+    """
+    Índice de intervalos para "quién estaba adentro a tal hora"
+    (services_intervalos): cada movimiento CERRADO una vez, colgado de su nodo
+    en un árbol de intervalos virtual sobre milisegundos epoch.
+    """
+    movimiento = models.OneToOneField(Movimiento, on_delete=models.CASCADE, primary_key=True, related_name="+")
+    cochera = models.ForeignKey(Cochera, on_delete=models.DO_NOTHING, db_constraint=False, related_name="+")
+    nodo = models.BigIntegerField()
+    # [desde, hasta] en ms, cerrado: hasta = egreso - 1
+    desde = models.BigIntegerField()
+    hasta = models.BigIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["cochera", "nodo", "desde"]),
+            models.Index(fields=["cochera", "nodo", "hasta"]),
+        ]
+
+    def __str__(self):
+        return f"mov {self.movimiento_id} - cochera {self.cochera_id} [{self.desde}, {self.hasta}]"
+
+
+class EventoMovimiento(models.Model):
+    """
+    Bitácora append-only de lo que pasa con los movimientos. Nunca se edita ni
+    se borra: Espacio.ocupado, Movimiento y RecaudacionDiaria se pueden rehacer
+    desde acá (`manage.py replay_eventos`). Las FKs no tienen constraint para
+    que el log sobreviva aunque se borren filas.
+    """
+    INGRESO = "INGRESO"
+    EGRESO = "EGRESO"
+    REASIGNACION = "REASIGNACION"
+    AJUSTE = "AJUSTE"
+    TIPOS = [(INGRESO, "INGRESO"), (EGRESO, "EGRESO"), (REASIGNACION, "REASIGNACION"), (AJUSTE, "AJUSTE")]
+
+    tipo = models.CharField(max_length=12, choices=TIPOS)
+    cochera = models.ForeignKey(
+        Cochera, on_delete=models.DO_NOTHING, db_constraint=False, related_name="+"
+    )
+    movimiento = models.ForeignKey(
+        Movimiento, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True, related_name="+"
+    )
+    espacio = models.ForeignKey(
+        Espacio, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True, related_name="+"
+    )
+    operador = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True,
+        related_name="+",
+    )
+    ocurrido_at = models.DateTimeField(default=timezone.now)
+    monto = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    # detalle según tipo: ticket/tipo_id en INGRESO, espacio_anterior en
+    # REASIGNACION, ocupado/cerrar/motivo en AJUSTE
+    payload = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["cochera", "id"]),
+            # analítica por rango de fechas (services_analitica)
+            models.Index(fields=["cochera", "ocurrido_at"]),
+        ]
+
+    def __str__(self):
+        return f"#{self.pk} {self.tipo} - cochera {self.cochera_id} - mov {self.movimiento_id}"
+
+
+class MensajeOutbox(models.Model):
+    """
+    Aviso pendiente a un sistema externo (settings.PARKING_WEBHOOKS). Se escribe
+    en la misma transacción que el evento, así no se pierde ni se manda uno de
+    una operación que hizo rollback; `despachar_outbox` lo entrega después.
+    """
+    PENDIENTE = "PENDIENTE"
+    ENVIANDO = "ENVIANDO"
+    ENTREGADO = "ENTREGADO"
+    FALLIDO = "FALLIDO"
+    ESTADOS = [(PENDIENTE, "PENDIENTE"), (ENVIANDO, "ENVIANDO"), (ENTREGADO, "ENTREGADO"), (FALLIDO, "FALLIDO")]
+
+    # nombre del endpoint en PARKING_WEBHOOKS
+    destino = models.CharField(max_length=40)
+    evento = models.ForeignKey(
+        EventoMovimiento, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True, related_name="+"
+    )
+    cochera = models.ForeignKey(
+        Cochera, on_delete=models.DO_NOTHING, db_constraint=False, related_name="+"
+    )
+    # el cuerpo ya armado: se manda tal cual aunque después cambien los datos
+    cuerpo = models.JSONField(default=dict)
+
+    estado = models.CharField(max_length=10, choices=ESTADOS, default=PENDIENTE)
+    intentos = models.PositiveSmallIntegerField(default=0)
+    disponible_at = models.DateTimeField(default=timezone.now)
+    # marca del despachador que lo tomó (un UPDATE reclama el lote entero)
+    tomado_por = models.CharField(max_length=80, blank=True)
+    tomado_at = models.DateTimeField(null=True, blank=True)
+    entregado_at = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["estado", "disponible_at"]),
+        ]
+
+    def __str__(self):
+        return f"{self.destino}#{self.pk} ({self.estado})"
+
+
+class Dispositivo(models.Model):
+    """
+    Barrera o lector que habla el protocolo TCP del portón (`servidor_porton`).
+    Se autentica con un token que solo se muestra al darlo de alta: acá queda
+    el sha256.
+    """
+    cochera = models.ForeignKey(Cochera, on_delete=models.CASCADE, related_name="dispositivos")
+    nombre = models.CharField(max_length=80)
+    token_hash = models.CharField(max_length=64, unique=True)
+    # a nombre de quién quedan los movimientos que hace
+    operador = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.PROTECT, related_name="+", db_constraint=False
+    )
+    activo = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.nombre} ({self.cochera_id})"
+
+
+class UmbralAlerta(models.Model):
+    """
+    Aviso cuando la ocupación de una cochera (o de un tipo) llega a
+    `porcentaje` (100 = sin lugar). Se rearma recién cuando baja `histeresis`
+    puntos, así no avisa en cada ingreso/egreso alrededor del límite. Lo evalúa
+    services_alertas y el aviso sale por el outbox (evento UMBRAL).
+    """
+    cochera = models.ForeignKey(Cochera, on_delete=models.CASCADE, related_name="umbrales")
+    # vacío = toda la cochera
+    tipo = models.ForeignKey(TipoEspacio, on_delete=models.CASCADE, null=True, blank=True)
+    porcentaje = models.PositiveSmallIntegerField(
+        default=90, validators=[MinValueValidator(1), MaxValueValidator(100)]
+    )
+    histeresis = models.PositiveSmallIntegerField(default=5, validators=[MaxValueValidator(100)])
+    activo = models.BooleanField(default=True)
+    disparado = models.BooleanField(default=False)
+    disparado_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.cochera.nombre} - {self.tipo.nombre if self.tipo_id else 'total'} al {self.porcentaje}%"
+
+
+class RecaudacionDiaria(models.Model):
+    """Proyección: egresos y total cobrado por cochera y día (fecha local del egreso)."""
+    cochera = models.ForeignKey(Cochera, on_delete=models.CASCADE, related_name="recaudacion")
+    fecha = models.DateField()
+    egresos = models.PositiveIntegerField(default=0)
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["cochera", "fecha"], name="uq_recaudacion_dia"),
+        ]
+
+    def __str__(self):
+        return f"{self.cochera.nombre} {self.fecha}: {self.total} ({self.egresos})"
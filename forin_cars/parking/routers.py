@@ -0,0 +1,43 @@
+from django.conf import settings
+
+from . import tenancy
+
+
+# modelos de parking que viven siempre en "default" (directorio de tenants, cola de tareas)
+GLOBALES = {"shardoperador", "tarea"}
+
+
+def _es_de_tenant(model):
+    return model._meta.app_label == "parking" and model._meta.model_name not in GLOBALES
+
+
+class TenantRouter:
+    """Manda los modelos de parking al shard del tenant actual."""
+
+    def db_for_read(self, model, **hints):
+        if not tenancy.sharding_activo():
+            return None
+        if not _es_de_tenant(model):
+            return "default"
+        # ojo: al asignar una FK el hint es el objeto relacionado (ej. el User)
+        instance = hints.get("instance")
+        if instance is not None and _es_de_tenant(instance.__class__) and instance._state.db:
+            return instance._state.db
+        return tenancy.alias_actual()
+
+    db_for_write = db_for_read
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if not tenancy.sharding_activo():
+            return None
+        # parking -> usuarios (default) es una referencia lógica, sin constraint
+        if _es_de_tenant(obj1.__class__) != _es_de_tenant(obj2.__class__):
+            return True
+        return obj1._state.db == obj2._state.db
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if not tenancy.sharding_activo():
+            return None
+        if app_label == "parking" and model_name not in GLOBALES:
+            return db in settings.PARKING_SHARDS
+        return db == "default"
@@ -0,0 +1,157 @@
+"""
+Secuenciador de movimientos por cochera (opcional: settings.PARKING_SECUENCIADOR).
+
+Con varios hilos metiendo ingresos y egresos en la misma cochera, todos se
+pelean por las mismas filas (Espacio, Movimiento) y por el lock de escritura.
+Con el secuenciador prendido cada cochera tiene dueño: los comandos van a una
+cola y los corre siempre el mismo hilo (cochera_id % hilos), uno atrás del
+otro. Dentro del proceso no hay dos escritores en una cochera, así que nadie
+espera un lock de otro ni falla el claim del bitmap de espacios.
+
+Group commit: el hilo toma lo que haya en su cola (hasta `lote`, sin esperar
+a que se junte más) y lo corre en una sola transacción, cada comando en su
+savepoint: un ValueError deshace solo ese y el resto commitea junto. Los
+on_commit de los comandos (pool, versiones, alertas) corren al commitear el
+lote, y recién ahí se contesta.
+
+Es por proceso: rinde cuando la puerta de una cochera pasa por un solo proceso
+(servidor_porton, un worker). Lo que no pasa por acá (admin, cierres en bloque,
+otros procesos) se sigue cuidando con select_for_update y los UPDATE
+condicionales de siempre, que sin competencia no esperan nada. No llamar desde
+adentro de una transacción: el comando commitea aparte.
+"""
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from . import tenancy
+from .services_asignacion import devolver_si_falla
+
+
+log = logging.getLogger(__name__)
+
+# comandos por transacción
+LOTE = 32
+# comandos esperando por hilo; con la cola llena se rechaza en vez de acumular
+LARGO_COLA = 1000
+# segundos que se espera lugar en la cola
+ESPERA_COLA = 2
+
+_PARAR = object()
+
+
+class Secuenciador:
+    """`hilos` hilos dueños de las cocheras, cada uno con su cola."""
+
+    def __init__(self, hilos, *, lote=LOTE, largo_cola=LARGO_COLA):
+        self.lote = lote
+        self.colas = [queue.Queue(maxsize=largo_cola) for _ in range(hilos)]
+        self.stats = {"comandos": 0, "lotes": 0}
+        self.hilos = [
+            threading.Thread(target=self._correr, args=(cola,), name=f"secuenciador-{i}", daemon=True)
+            for i, cola in enumerate(self.colas)
+        ]
+        for h in self.hilos:
+            h.start()
+
+    def enviar(self, cochera_id, func, *args, **kwargs):
+        """Encola func(*args, **kwargs) en el hilo de la cochera (con el tenant actual). Devuelve un Future."""
+        fut = Future()
+        try:
+            self.colas[cochera_id % len(self.colas)].put(
+                (tenancy.alias_actual(), func, args, kwargs, fut), timeout=ESPERA_COLA
+            )
+        except queue.Full:
+            raise ValueError("La cochera tiene demasiados movimientos en espera, probá de nuevo.")
+        return fut
+
+    def ejecutar(self, cochera_id, func, *args, **kwargs):
+        return self.enviar(cochera_id, func, *args, **kwargs).result()
+
+    def parar(self):
+        """Termina lo encolado y frena los hilos."""
+        for cola in self.colas:
+            cola.put(_PARAR)
+        for h in self.hilos:
+            h.join()
+
+    def _correr(self, cola):
+        while True:
+            lote = [cola.get()]
+            while len(lote) < self.lote and lote[-1] is not _PARAR:
+                try:
+                    lote.append(cola.get_nowait())
+                except queue.Empty:
+                    break
+            fin = lote[-1] is _PARAR
+            if fin:
+                lote.pop()
+
+            por_alias = {}
+            for item in lote:
+                por_alias.setdefault(item[0], []).append(item[1:])
+            for alias, comandos in por_alias.items():
+                self._lote(alias, comandos)
+            if fin:
+                close_old_connections()
+                return
+
+    def _lote(self, alias, comandos):
+        resultados = []
+        try:
+            # devolver_si_falla: los espacios que tomó un comando (o el lote) que no commiteó
+            with tenancy.tenant(alias), devolver_si_falla(), transaction.atomic(using=alias):
+                for func, args, kwargs, _ in comandos:
+                    try:
+                        with devolver_si_falla(), transaction.atomic(using=alias):
+                            resultados.append((func(*args, **kwargs), None))
+                    except Exception as e:
+                        resultados.append((None, e))
+        except Exception as e:
+            # no commiteó: no quedó ninguno (y la conexión puede haber quedado mal)
+            log.exception("secuenciador: falló el commit de un lote de %s comandos en %s", len(comandos), alias)
+            close_old_connections()
+            for *_, fut in comandos:
+                fut.set_exception(e)
+            return
+
+        self.stats["comandos"] += len(comandos)
+        self.stats["lotes"] += 1
+        for (valor, error), (*_, fut) in zip(resultados, comandos):
+            if error is None:
+                fut.set_result(valor)
+            else:
+                fut.set_exception(error)
+
+
+_instancia = None
+_lock = threading.Lock()
+
+
+def activo():
+    return bool(getattr(settings, "PARKING_SECUENCIADOR", 0))
+
+
+def secuenciador():
+    """El del proceso (se arranca con el primer comando)."""
+    global _instancia
+    if _instancia is None:
+        with _lock:
+            if _instancia is None:
+                _instancia = Secuenciador(settings.PARKING_SECUENCIADOR)
+    return _instancia
+
+
+def ejecutar(cochera_id, func, *args, **kwargs):
+    """
+    func(*args, **kwargs) en el hilo dueño de la cochera y devuelve lo que
+    devuelve (o levanta lo que levanta). Con el secuenciador apagado, acá
+    mismo.
+    """
+    if not activo():
+        return func(*args, **kwargs)
+    return secuenciador().ejecutar(cochera_id, func, *args, **kwargs)
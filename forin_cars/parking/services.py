@@ -11,17 +11,23 @@ from .models import (
     CocheraEmpleado,
     Espacio
 )
+from .services_asignacion import invalidar_espacios
+from . import tenancy
+from users.models import EmpleadoAsignacion
 
 User = get_user_model()
 
 
 def ensure_default_tipos():
+    """Los tipos por defecto ya los crea la migración 0019; esto queda para scripts sobre bases viejas."""
     defaults = ["Auto", "Moto", "Camioneta", "Bicicleta"]
+    existentes = set(TipoEspacio.objects.filter(nombre__in=defaults).values_list("nombre", flat=True))
     for n in defaults:
-        TipoEspacio.objects.get_or_create(nombre=n)
+        if n not in existentes:
+            TipoEspacio.objects.get_or_create(nombre=n)
 
 
-@transaction.atomic
+@tenancy.atomic
 def upsert_capacidades(cochera, tipos, cap_cleaned):
     ConfigCapacidad.objects.filter(cochera=cochera).delete()
     for tipo in tipos:
@@ -29,7 +35,7 @@ def upsert_capacidades(cochera, tipos, cap_cleaned):
         ConfigCapacidad.objects.create(cochera=cochera, tipo=tipo, cantidad=cantidad)
 
 
-@transaction.atomic
+@tenancy.atomic
 def upsert_tarifas(cochera, tipos, tarifa_cleaned):
     for tipo in tipos:
         precio = tarifa_cleaned.get(f"precio_{tipo.id}", 0)
@@ -40,7 +46,7 @@ def upsert_tarifas(cochera, tipos, tarifa_cleaned):
         )
 
 
-@transaction.atomic
+@tenancy.atomic
 def invitar_empleados(cochera, emails_list):
     # crea invitaciones y si el usuario ya existe, lo asigna al toque
     for email in emails_list:
@@ -55,9 +61,12 @@ def invitar_empleados(cochera, emails_list):
             CocheraEmpleado.objects.get_or_create(cochera=cochera, empleado=user)
             grp, _ = Group.objects.get_or_create(name="ADMIN_EMPLEADO")
             user.groups.add(grp)
+            if tenancy.sharding_activo():
+                # con shards el empleado opera en el tenant de su dueño
+                EmpleadoAsignacion.objects.get_or_create(empleado=user, defaults={"dueno_id": cochera.owner_id})
 
 
-@transaction.atomic
+@tenancy.atomic
 def apply_pending_invites(user):
     email = (user.email or "").strip().lower()
     if not email:
@@ -85,7 +94,7 @@ def apply_pending_invites(user):
 
     return count
 
-@transaction.atomic
+@tenancy.atomic
 def regenerar_espacios(cochera):
     """
     Genera espacios lógicos según ConfigCapacidad.
@@ -106,5 +115,7 @@ def regenerar_espacios(cochera):
     for cap in capacidades:
         for i in range(cap.cantidad):
             # etiqueta opcional por si querés verlos mejor en admin
-            bulk.append(Espacio(cochera=cochera, tipo=cap.tipo, ocupado=False, etiqueta=f"{cap.tipo.nombre[:3].upper()}-{i+1}"))
+            bulk.append(Espacio(cochera=cochera, tipo=cap.tipo, ocupado=False, etiqueta=f"{cap.tipo.nombre[:3].upper()}-{i+1}", orden=i + 1))
     Espacio.objects.bulk_create(bulk)
+
+    transaction.on_commit(lambda: invalidar_espacios(cochera.id), using=tenancy.alias_actual())
@@ -0,0 +1,87 @@
+"""
+Abonados mensuales.
+
+El chequeo en el ingreso se hace contra un diccionario en memoria por cochera
+(ticket -> abonos activos), reconstruido solo cuando cambia la versión de
+abonados (signals sobre Abonado). Un abonado entra con un lookup y el único
+insert es el Movimiento.
+
+Un ticket puede tener varios abonos activos (una renovación que se pisa con el
+período anterior, uno vencido y uno vigente): vale el vigente hoy.
+"""
+from collections import defaultdict, namedtuple
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Abonado, Cliente, Espacio, Vehiculo
+from . import tenancy, versiones
+
+
+VERSION = "abonados"
+
+Abono = namedtuple("Abono", "id vehiculo_id tipo_id espacio_id desde hasta")
+
+
+def _cargar(cochera_id):
+    filas = (
+        Abonado.objects.filter(cochera_id=cochera_id, activo=True)
+        .order_by("valido_desde", "id")
+        .values_list("vehiculo__ticket", "id", "vehiculo_id", "tipo_id", "espacio_id", "valido_desde", "valido_hasta")
+    )
+    por_ticket = defaultdict(list)
+    for f in filas:
+        por_ticket[f[0]].append(Abono(*f[1:]))
+    return dict(por_ticket)
+
+
+def abonos_cochera(cochera_id):
+    return versiones.memo(VERSION, cochera_id, lambda: _cargar(cochera_id))
+
+
+def invalidar_abonados(cochera_id):
+    versiones.bump(VERSION, cochera_id)
+
+
+def abono_vigente(cochera_id, ticket, fecha=None):
+    abonos = abonos_cochera(cochera_id).get(ticket)
+    if not abonos:
+        return None
+    fecha = fecha or timezone.localdate()
+    # si dos se pisan, el más nuevo (la renovación)
+    for abono in reversed(abonos):
+        if abono.desde <= fecha <= abono.hasta:
+            return abono
+    return None
+
+
+def ocupar_espacio_fijo(espacio_id):
+    """Claim atómico del lugar fijo del abonado."""
+    return Espacio.objects.filter(id=espacio_id, ocupado=False).update(ocupado=True) == 1
+
+
+@tenancy.atomic
+def crear_abonado(*, cochera, tipo, ticket, valido_desde, valido_hasta, patente_ult3="", espacio=None, cliente_data=None):
+    ticket = (ticket or "").strip().upper()
+    if not ticket:
+        raise ValueError("El TICKET es obligatorio para el abono.")
+    if espacio is not None and (espacio.cochera_id != cochera.id or espacio.tipo_id != tipo.id):
+        raise ValueError("El espacio fijo tiene que ser de la misma cochera y tipo.")
+
+    vehiculo = Vehiculo.objects.filter(ticket=ticket).select_related("cliente").first()
+    if vehiculo is None:
+        datos = {k: ((cliente_data or {}).get(k) or "").strip() for k in ["nombre", "apellido", "telefono", "email"]}
+        cliente = Cliente.objects.create(**datos)
+        vehiculo = Vehiculo.objects.create(
+            cliente=cliente, ticket=ticket, tipo=tipo, patente_ult3=(patente_ult3 or "").strip().upper() or None
+        )
+
+    return Abonado.objects.create(
+        cliente=vehiculo.cliente,
+        vehiculo=vehiculo,
+        cochera=cochera,
+        tipo=tipo,
+        espacio=espacio,
+        valido_desde=valido_desde,
+        valido_hasta=valido_hasta,
+    )
@@ -0,0 +1,138 @@
+"""
+Alertas de capacidad: avisar cuando una cochera (o un tipo) pasa un porcentaje
+de ocupación o se queda sin lugar, sin que nadie tenga que estar refrescando
+el dashboard.
+
+- Cada ingreso/egreso suma a los ocupados de la cache compartida
+  (parking.contadores) cuando commitea, y con esos números se evalúan las
+  reglas: no se cuenta nada en la base.
+- Las reglas activas (UmbralAlerta) se compilan por cochera con
+  versiones.memo, con los límites ya pasados a cantidad de espacios. Sin
+  reglas para la cochera no se hace nada más.
+- Histéresis: dispara al llegar al límite y se rearma recién al bajar
+  `histeresis` puntos. El cambio de estado es un UPDATE condicional, así con
+  varios procesos avisa uno solo; el aviso va al outbox (evento UMBRAL) en la
+  misma transacción que el cambio.
+
+Si no se cruza ningún límite, la puerta no hace ninguna query de más: unos
+get/incr de cache después del commit. Eso con Redis o Memcached; con la cache
+en la base los ocupados se recuentan en la base después de cada commit (ver
+parking.contadores), que es exacto y cuesta menos que el incr en esa tabla.
+"""
+import logging
+import math
+from collections import namedtuple
+
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import Espacio, UmbralAlerta
+from .services_asignacion import VERSION as VERSION_ESPACIOS
+from .contadores import TODOS
+from . import contadores, services_outbox, tenancy, versiones
+
+
+log = logging.getLogger(__name__)
+
+VERSION_UMBRALES = "umbrales"
+ALCANZADO = "ALCANZADO"
+NORMAL = "NORMAL"
+
+
+# dispara con ocupados >= alto y se rearma con ocupados <= bajo
+Regla = namedtuple("Regla", "id tipo_id porcentaje total alto bajo disparado")
+
+
+def _compilar(cochera_id):
+    umbrales = list(
+        UmbralAlerta.objects.filter(cochera_id=cochera_id, activo=True)
+        .values_list("id", "tipo_id", "porcentaje", "histeresis", "disparado")
+    )
+    if not umbrales:
+        return ()
+    totales = dict(
+        Espacio.objects.filter(cochera_id=cochera_id).values_list("tipo_id").annotate(n=Count("id")).order_by()
+    )
+    totales[TODOS] = sum(totales.values())
+
+    reglas = []
+    for umbral_id, tipo_id, porcentaje, histeresis, disparado in umbrales:
+        tipo_id = tipo_id or TODOS
+        total = totales.get(tipo_id, 0)
+        if not total:
+            continue
+        alto = max(1, math.ceil(total * porcentaje / 100))
+        bajo = min(math.floor(total * max(porcentaje - histeresis, 0) / 100), alto - 1)
+        reglas.append(Regla(umbral_id, tipo_id, porcentaje, total, alto, bajo, disparado))
+    return tuple(reglas)
+
+
+def reglas(cochera_id, version_espacios=None):
+    """Las reglas activas compiladas de la cochera (se recompilan si cambian ellas o el layout)."""
+    if version_espacios is None:
+        version_espacios = versiones.version(VERSION_ESPACIOS, cochera_id)
+    hit = versiones.memo(VERSION_UMBRALES, cochera_id, lambda: (version_espacios, _compilar(cochera_id)))
+    if hit[0] != version_espacios:
+        versiones.olvidar(VERSION_UMBRALES, cochera_id)
+        hit = versiones.memo(VERSION_UMBRALES, cochera_id, lambda: (version_espacios, _compilar(cochera_id)))
+    return hit[1]
+
+
+def invalidar_umbrales(cochera_id):
+    versiones.bump(VERSION_UMBRALES, cochera_id)
+
+
+def evaluar(cochera_id, tipo_id, ocupados):
+    """Avisa si con `ocupados` ({tipo_id: n, TODOS: n}, ya commiteados) se cruzó algún límite."""
+    aplican = [r for r in reglas(cochera_id) if r.tipo_id in (TODOS, tipo_id)]
+    for r in aplican:
+        n = ocupados[r.tipo_id]
+        if not r.disparado and n >= r.alto:
+            _cambiar(cochera_id, r, True, n)
+        elif r.disparado and n <= r.bajo:
+            _cambiar(cochera_id, r, False, n)
+
+
+def _cambiar(cochera_id, regla, disparado, ocupados):
+    ahora = timezone.now()
+    cambios = {"disparado": disparado}
+    if disparado:
+        cambios["disparado_at"] = ahora
+    with transaction.atomic(using=tenancy.alias_actual()):
+        if not UmbralAlerta.objects.filter(id=regla.id, disparado=not disparado).update(**cambios):
+            # otro proceso lo cambió primero (y avisó él)
+            return
+        services_outbox.encolar_aviso({
+            "id": f"{tenancy.alias_actual()}-umbral-{regla.id}-{int(ahora.timestamp() * 1000)}",
+            "tipo": services_outbox.UMBRAL,
+            "cochera_id": cochera_id,
+            "ocurrido_at": ahora.isoformat(),
+            "detalle": {
+                "umbral_id": regla.id,
+                "estado": ALCANZADO if disparado else NORMAL,
+                "tipo_id": regla.tipo_id or None,
+                "porcentaje": regla.porcentaje,
+                "ocupados": ocupados,
+                "total": regla.total,
+                "libres": max(regla.total - ocupados, 0),
+            },
+        })
+    invalidar_umbrales(cochera_id)
+    log.info("umbral %s de cochera %s: %s (%s/%s)", regla.id, cochera_id,
+             ALCANZADO if disparado else NORMAL, ocupados, regla.total)
+
+
+def ocupacion(cochera_id, tipo_id, delta):
+    """
+    Para llamar dentro de la transacción del ingreso/egreso (delta +1/-1):
+    cuando commitea suma a los contadores y evalúa los umbrales (con rollback
+    no cuenta). Un error acá se loguea y no le llega a la puerta.
+    """
+    alias = tenancy.alias_actual()
+
+    def _cb():
+        with tenancy.tenant(alias):
+            evaluar(cochera_id, tipo_id, contadores.sumar(cochera_id, tipo_id, delta))
+
+    transaction.on_commit(_cb, using=alias, robust=True)
@@ -0,0 +1,263 @@
+"""
+Analítica de operación sobre la base (agregados y funciones de ventana, sin
+traer filas a Python):
+
+- rendimiento: operaciones (ingresos + egresos de la bitácora) por operador,
+  horas activas, ops/hora, la hora pico (ROW_NUMBER sobre el agrupado) y el
+  reparto por hora del día
+- puestos: tiempo entre operaciones consecutivas de cada puesto (cochera,
+  operador) con LAG, promedio y percentiles
+- estadias: distribución de la estadía (egreso - ingreso) por tipo, cochera y
+  día de la semana; percentiles con ROW_NUMBER/COUNT por partición (portable,
+  sqlite no tiene percentile_cont)
+
+Los egresos no guardan operador en Movimiento: el rendimiento sale de
+EventoMovimiento, que tiene el operador de cada operación.
+"""
+import math
+from datetime import datetime
+
+from django.core.cache import cache
+from django.db import connections, router
+from django.db.models import (
+    Avg, Count, F, FloatField, Func, IntegerField, Max, Min, Q, Window,
+)
+from django.db.models.functions import Ceil, RowNumber
+from django.utils import timezone
+
+from .models import EventoMovimiento, Movimiento
+from . import tenancy
+
+
+PERCENTILES = (0.5, 0.9, 0.95)
+CACHE_TTL = 60 * 10
+
+
+def _operaciones(desde, hasta, cochera_id=None):
+    qs = EventoMovimiento.objects.filter(
+        tipo__in=[EventoMovimiento.INGRESO, EventoMovimiento.EGRESO],
+        ocurrido_at__gte=desde,
+        ocurrido_at__lt=hasta,
+        operador_id__isnull=False,
+    )
+    return qs.filter(cochera_id=cochera_id) if cochera_id else qs
+
+
+class _Cubo(Func):
+    """
+    Número de cubo de `segundos` desde epoch (corrido `desfase` segundos, y
+    módulo `modulo` si se pasa), entero y nativo en cada motor. Trunc*/Extract*
+    en sqlite son funciones Python fila por fila y en rangos grandes son lo que
+    más tarda.
+    """
+    output_field = IntegerField()
+
+    def __init__(self, expresion, segundos, desfase=0, modulo=None):
+        super().__init__(expresion)
+        self.segundos, self.desfase, self.modulo = int(segundos), int(desfase), modulo
+
+    def _armar(self, epoch, div):
+        sql = f"(({epoch} + {self.desfase}) {div} {self.segundos})"
+        return f"({sql} %% {int(self.modulo)})" if self.modulo else sql
+
+    def as_sql(self, compiler, connection, **extra):
+        sql, params = compiler.compile(self.source_expressions[0])
+        return f"CAST({self._armar(f'FLOOR(EXTRACT(EPOCH FROM {sql}))', '/')} AS BIGINT)", params
+
+    def as_mysql(self, compiler, connection, **extra):
+        sql, params = compiler.compile(self.source_expressions[0])
+        return self._armar(f"UNIX_TIMESTAMP({sql})", "DIV"), params
+
+    def as_sqlite(self, compiler, connection, **extra):
+        sql, params = compiler.compile(self.source_expressions[0])
+        # el formato va como parámetro: un '%s' literal se confunde con un placeholder
+        return self._armar(f"CAST(strftime(%s, {sql}) AS INTEGER)", "/"), ["%s", *params]
+
+
+def _desfase(fecha):
+    """Segundos de la zona local respecto de UTC al comienzo del rango."""
+    return int(timezone.localtime(fecha).utcoffset().total_seconds())
+
+
+def rendimiento_operadores(desde, hasta, cochera_id=None):
+    ops = _operaciones(desde, hasta, cochera_id)
+
+    filas = {
+        f["operador_id"]: {**f, "horas_activas": 0, "pico": None, "por_hora_del_dia": [0] * 24}
+        for f in ops.values("operador_id").annotate(
+            ops=Count("id"),
+            ingresos=Count("id", filter=Q(tipo=EventoMovimiento.INGRESO)),
+            egresos=Count("id", filter=Q(tipo=EventoMovimiento.EGRESO)),
+        ).order_by()
+    }
+
+    # ops por (operador, hora) agrupadas en la base, con el ranking de horas de
+    # cada operador: rk=1 es su hora pico
+    horas = (
+        ops.annotate(hora=_Cubo("ocurrido_at", 3600))
+        .values("operador_id", "hora")
+        .annotate(n=Count("id"))
+        .annotate(rk=Window(RowNumber(), partition_by=[F("operador_id")], order_by=[F("n").desc(), F("hora").asc()]))
+        .values_list("operador_id", "hora", "n", "rk")
+    )
+    tz = timezone.get_current_timezone()
+    for op_id, hora, n, rk in horas:
+        f = filas[op_id]
+        inicio = datetime.fromtimestamp(hora * 3600, tz=tz)
+        f["horas_activas"] += 1
+        f["por_hora_del_dia"][inicio.hour] += n
+        if rk == 1:
+            f["pico"] = {"hora": inicio.isoformat(), "ops": n}
+
+    res = []
+    for f in filas.values():
+        f["ops_por_hora"] = round(f["ops"] / f["horas_activas"], 2) if f["horas_activas"] else 0
+        res.append(f)
+    return sorted(res, key=lambda f: -f["ops"])
+
+
+def _segundos_entre(conn, a, b):
+    if conn.vendor == "postgresql":
+        return f"EXTRACT(EPOCH FROM ({a} - {b}))"
+    if conn.vendor == "mysql":
+        return f"TIMESTAMPDIFF(MICROSECOND, {b}, {a}) / 1000000.0"
+    return f"(julianday({a}) - julianday({b})) * 86400.0"
+
+
+class _Segundos(Func):
+    """Segundos de b a a en SQL nativo (la resta de DateTimeField en sqlite también es una función Python)."""
+    arity = 2
+    output_field = FloatField()
+
+    def as_sql(self, compiler, connection, **extra):
+        (a, pa), (b, pb) = (compiler.compile(e) for e in self.source_expressions)
+        return f"({_segundos_entre(connection, a, b)})", [*pa, *pb]
+
+
+def tiempos_entre_operaciones(desde, hasta, cochera_id=None):
+    """
+    Por puesto (cochera, operador): cantidad de huecos y segundos promedio, p50,
+    p90 y máximo entre una operación y la siguiente. Son dos niveles de ventana
+    (LAG y después ROW_NUMBER sobre el hueco), que el ORM no anida: va en SQL
+    armado sobre la query del ORM.
+    """
+    ops = _operaciones(desde, hasta, cochera_id).values("cochera_id", "operador_id", "ocurrido_at")
+    conn = connections[router.db_for_read(EventoMovimiento)]
+    base_sql, params = ops.query.get_compiler(connection=conn).as_sql()
+    hueco = _segundos_entre(conn, "ocurrido_at", "anterior")
+
+    sql = f"""
+        WITH ops AS ({base_sql}),
+        huecos AS (
+            SELECT cochera_id, operador_id, ocurrido_at,
+                   LAG(ocurrido_at) OVER (PARTITION BY cochera_id, operador_id ORDER BY ocurrido_at) AS anterior
+            FROM ops
+        ),
+        medidos AS (
+            SELECT cochera_id, operador_id, {hueco} AS seg
+            FROM huecos WHERE anterior IS NOT NULL
+        ),
+        rankeados AS (
+            SELECT cochera_id, operador_id, seg,
+                   ROW_NUMBER() OVER (PARTITION BY cochera_id, operador_id ORDER BY seg) AS rn,
+                   COUNT(*) OVER (PARTITION BY cochera_id, operador_id) AS n
+            FROM medidos
+        )
+        SELECT cochera_id, operador_id, MAX(n), AVG(seg),
+               MAX(CASE WHEN rn = CAST((n + 1) / 2 AS INTEGER) THEN seg END),
+               MAX(CASE WHEN rn * 10 >= n * 9 AND (rn - 1) * 10 < n * 9 THEN seg END),
+               MAX(seg)
+        FROM rankeados
+        GROUP BY cochera_id, operador_id
+        ORDER BY cochera_id, operador_id
+    """
+    with conn.cursor() as cur:
+        cur.execute(sql, params)
+        filas = cur.fetchall()
+
+    redondear = lambda v: round(float(v), 1) if v is not None else None
+    return [
+        {
+            "cochera_id": coch,
+            "operador_id": op,
+            "huecos": n,
+            "promedio_s": redondear(prom),
+            "p50_s": redondear(p50),
+            "p90_s": redondear(p90),
+            "max_s": redondear(mx),
+        }
+        for coch, op, n, prom, p50, p90, mx in filas
+    ]
+
+
+def _estadias(desde, hasta, cochera_id=None):
+    qs = Movimiento.objects.filter(
+        estado=Movimiento.CERRADO, ingreso_at__gte=desde, ingreso_at__lt=hasta, egreso_at__isnull=False
+    )
+    if cochera_id:
+        qs = qs.filter(cochera_id=cochera_id)
+    return qs.annotate(seg=_Segundos("egreso_at", "ingreso_at"))
+
+
+def _dimension(por, desde):
+    if por == "tipo":
+        return F("espacio__tipo_id")
+    if por == "cochera":
+        return F("cochera_id")
+    if por == "dia_semana":
+        # 1 = domingo ... 7 = sábado, como ExtractWeekDay. El 1/1/1970 fue
+        # jueves: se corre 4 días para que el módulo 7 arranque en domingo.
+        # La zona se toma al comienzo del rango (exacto en zonas sin horario
+        # de verano, como la nuestra).
+        return _Cubo("ingreso_at", 86400, desfase=_desfase(desde) + 4 * 86400, modulo=7) + 1
+    raise ValueError("Dimensión inválida (tipo, cochera o dia_semana).")
+
+
+def distribucion_estadias(desde, hasta, cochera_id=None, por="tipo"):
+    """
+    Estadía por grupo: cantidad, promedio, mínimo, máximo y percentiles
+    (PERCENTILES, método nearest-rank), en minutos.
+    """
+    grupo = _dimension(por, desde)
+    base = _estadias(desde, hasta, cochera_id).annotate(grupo=grupo)
+
+    res = {
+        f["grupo"]: {
+            "n": f["n"],
+            "promedio_min": round(f["prom"] / 60, 1),
+            "min_min": round(f["minimo"] / 60, 1),
+            "max_min": round(f["maximo"] / 60, 1),
+        }
+        for f in base.values("grupo").annotate(n=Count("id"), prom=Avg("seg"), minimo=Min("seg"), maximo=Max("seg")).order_by()
+    }
+
+    rankeado = base.annotate(
+        rn=Window(RowNumber(), partition_by=[grupo], order_by=[F("seg").asc(), F("id").asc()]),
+        total=Window(Count("id"), partition_by=[grupo]),
+    )
+    cortes = Q()
+    for p in PERCENTILES:
+        cortes |= Q(rn=Ceil(F("total") * p))
+    for grupo_id, rn, total, seg in rankeado.filter(cortes).values_list("grupo", "rn", "total", "seg"):
+        for p in PERCENTILES:
+            if rn == math.ceil(total * p):
+                res[grupo_id][f"p{int(p * 100)}_min"] = round(seg / 60, 1)
+
+    return [{por: k, **v} for k, v in sorted(res.items())]
+
+
+def resumen(cochera_id, desde, hasta):
+    """Todo junto para el endpoint, cacheado por (cochera, rango)."""
+    key = f"analitica:{tenancy.clave(cochera_id, int(desde.timestamp()), int(hasta.timestamp()))}"
+    res = cache.get(key)
+    if res is None:
+        res = {
+            "operadores": rendimiento_operadores(desde, hasta, cochera_id),
+            "puestos": tiempos_entre_operaciones(desde, hasta, cochera_id),
+            "estadias": {
+                "tipo": distribucion_estadias(desde, hasta, cochera_id, por="tipo"),
+                "dia_semana": distribucion_estadias(desde, hasta, cochera_id, por="dia_semana"),
+            },
+        }
+        cache.set(key, res, CACHE_TTL)
+    return res
@@ -0,0 +1,248 @@
+"""
+Asignación de espacios con bitmap de libres por (cochera, tipo).
+
+Cada proceso carga una vez los espacios del pool y guarda los libres como un
+entero usado de bitset (bit i = slot i libre). Elegir espacio es buscar el bit
+más bajo de una máscara, sin recorrer la tabla. La base sigue siendo la fuente
+de verdad: el claim final es un UPDATE ... WHERE ocupado = false, y si el bitmap
+estaba viejo (otro proceso ocupó/liberó) se corrige solo o se recarga.
+
+El bit se apaga al tomar, antes del commit (si no, otro hilo elige el mismo).
+Si la transacción hace rollback hay que devolverlo: lo que escribe y puede
+fallar después de asignar va dentro de `devolver_si_falla()`.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+from django.db import transaction
+
+from .models import Cochera, Espacio
+from . import tenancy, versiones
+
+
+VERSION = "espacios"
+# cambia con cada ingreso/egreso: la usan las caches de lo que se muestra
+VERSION_OCUPACION = "ocupacion"
+TTL_POOL = 300
+MAX_FALLOS = 8
+
+
+def _bit_bajo(x):
+    return (x & -x).bit_length() - 1
+
+
+class Pool:
+    """Libres de un (cochera, tipo). `filas` = (id, orden, nivel, ocupado)."""
+
+    def __init__(self, filas):
+        filas = sorted(filas, key=lambda f: (f[1], f[0]))
+        self.ids = [f[0] for f in filas]
+        self.slot = {eid: i for i, eid in enumerate(self.ids)}
+        self.libres = 0
+        for i, f in enumerate(filas):
+            if not f[3]:
+                self.libres |= 1 << i
+
+        # orden alternativo por distancia a la salida: (nivel, orden)
+        por_salida = sorted(range(len(filas)), key=lambda i: (filas[i][2], filas[i][1], filas[i][0]))
+        self.salida_a_slot = por_salida
+        self.slot_a_salida = [0] * len(filas)
+        for pos, i in enumerate(por_salida):
+            self.slot_a_salida[i] = pos
+        self.libres_salida = 0
+        for pos, i in enumerate(por_salida):
+            if self.libres >> i & 1:
+                self.libres_salida |= 1 << pos
+
+        # máscaras por nivel para repartir la carga
+        self.nivel_de = [f[2] for f in filas]
+        self.mascara_nivel = {}
+        self.libres_nivel = {}
+        for i, n in enumerate(self.nivel_de):
+            self.mascara_nivel[n] = self.mascara_nivel.get(n, 0) | (1 << i)
+            self.libres_nivel[n] = self.libres_nivel.get(n, 0) + (self.libres >> i & 1)
+
+        self.cursor = 0
+        self.cargado = time.monotonic()
+        self.lock = threading.Lock()
+
+    @property
+    def total(self):
+        return len(self.ids)
+
+    @property
+    def cantidad_libres(self):
+        return sum(self.libres_nivel.values())
+
+    def _elegir(self, estrategia):
+        if not self.libres:
+            return None
+
+        if estrategia == Cochera.ROUND_ROBIN:
+            resto = self.libres >> self.cursor
+            i = self.cursor + _bit_bajo(resto) if resto else _bit_bajo(self.libres)
+            self.cursor = i + 1
+            return i
+
+        if estrategia == Cochera.CERCA_SALIDA:
+            return self.salida_a_slot[_bit_bajo(self.libres_salida)]
+
+        if estrategia == Cochera.REPARTIR:
+            nivel = max(self.libres_nivel, key=lambda n: (self.libres_nivel[n], -n))
+            return _bit_bajo(self.libres & self.mascara_nivel[nivel])
+
+        return _bit_bajo(self.libres)
+
+    def _ocupar(self, i):
+        if self.libres >> i & 1:
+            self.libres &= ~(1 << i)
+            self.libres_salida &= ~(1 << self.slot_a_salida[i])
+            self.libres_nivel[self.nivel_de[i]] -= 1
+
+    def _liberar(self, i):
+        if not self.libres >> i & 1:
+            self.libres |= 1 << i
+            self.libres_salida |= 1 << self.slot_a_salida[i]
+            self.libres_nivel[self.nivel_de[i]] += 1
+
+    def tomar(self, estrategia):
+        with self.lock:
+            i = self._elegir(estrategia)
+            if i is None:
+                return None
+            self._ocupar(i)
+            return self.ids[i]
+
+    def marcar_ocupado(self, espacio_id):
+        with self.lock:
+            i = self.slot.get(espacio_id)
+            if i is not None:
+                self._ocupar(i)
+
+    def liberar(self, espacio_id):
+        with self.lock:
+            i = self.slot.get(espacio_id)
+            if i is not None:
+                self._liberar(i)
+
+
+# (alias, cochera_id, tipo_id) -> (version, Pool)
+_pools = {}
+_pools_lock = threading.Lock()
+# por hilo: (key del pool, espacio_id) tomados que todavía no commitearon
+_local = threading.local()
+
+
+def _cargar(cochera_id, tipo_id):
+    # los lugares fijos de abonados no entran en la asignación general
+    filas = (
+        Espacio.objects.filter(cochera_id=cochera_id, tipo_id=tipo_id)
+        .exclude(abonados__activo=True)
+        .values_list("id", "orden", "nivel", "ocupado")
+    )
+    return Pool(list(filas))
+
+
+def obtener_pool(cochera_id, tipo_id, recargar=False):
+    v = versiones.version(VERSION, cochera_id)
+    key = (tenancy.alias_actual(), cochera_id, tipo_id)
+    hit = _pools.get(key)
+    if hit is not None and hit[0] == v and not recargar and time.monotonic() - hit[1].cargado < TTL_POOL:
+        return hit[1]
+
+    pool = _cargar(cochera_id, tipo_id)
+    with _pools_lock:
+        _pools[key] = (v, pool)
+    return pool
+
+
+def invalidar_espacios(cochera_id):
+    versiones.bump(VERSION, cochera_id)
+    versiones.bump(VERSION_OCUPACION, cochera_id)
+
+
+def ocupacion_cambio(cochera_id):
+    """Bump de la versión de ocupación cuando commitea (antes alguien podría cachear lo viejo)."""
+    alias = tenancy.alias_actual()
+
+    def _cb():
+        with tenancy.tenant(alias):
+            versiones.bump(VERSION_OCUPACION, cochera_id)
+
+    transaction.on_commit(_cb, using=alias)
+
+
+def asignar_espacio(cochera, tipo_id):
+    """
+    Devuelve el id del espacio tomado (ya marcado ocupado en la base) o None si
+    no hay libres. Tiene que llamarse dentro de la transacción del ingreso.
+    """
+    pool = obtener_pool(cochera.id, tipo_id)
+
+    for recargado in (False, True):
+        fallos = 0
+        while fallos < MAX_FALLOS:
+            espacio_id = pool.tomar(cochera.estrategia_asignacion)
+            if espacio_id is None:
+                break
+            if Espacio.objects.filter(id=espacio_id, ocupado=False).update(ocupado=True):
+                _anotar((tenancy.alias_actual(), cochera.id, tipo_id), espacio_id)
+                return espacio_id
+            # el bitmap estaba viejo: ese espacio ya estaba ocupado
+            fallos += 1
+
+        if recargado:
+            break
+        # puede haber libres que este proceso no vio (egresos de otro worker)
+        pool = obtener_pool(cochera.id, tipo_id, recargar=True)
+
+    return None
+
+
+def _pendientes():
+    return _local.__dict__.setdefault("pendientes", [])
+
+
+def _anotar(key, espacio_id):
+    pendientes = _pendientes()
+    tomado = (key, espacio_id)
+    pendientes.append(tomado)
+
+    def _confirmado():
+        if tomado in pendientes:
+            pendientes.remove(tomado)
+
+    transaction.on_commit(_confirmado, using=key[0])
+
+
+@contextmanager
+def devolver_si_falla():
+    """
+    Para la transacción (o savepoint) que asigna: si sale con una excepción,
+    los espacios que tomó adentro vuelven a estar libres en el pool de este
+    proceso (en la base ya los liberó el rollback). Sirve como decorator.
+    """
+    pendientes = _pendientes()
+    desde = len(pendientes)
+    try:
+        yield
+    except BaseException:
+        for key, espacio_id in pendientes[desde:]:
+            hit = _pools.get(key)
+            if hit is not None:
+                hit[1].liberar(espacio_id)
+        del pendientes[desde:]
+        raise
+
+
+def liberar_espacio(cochera_id, tipo_id, espacio_id):
+    """Marca libre en el pool local cuando commitea el egreso."""
+    key = (tenancy.alias_actual(), cochera_id, tipo_id)
+
+    def _cb():
+        hit = _pools.get(key)
+        if hit is not None:
+            hit[1].liberar(espacio_id)
+
+    transaction.on_commit(_cb, using=tenancy.alias_actual())
@@ -0,0 +1,67 @@
+"""
+Catálogo por proceso de lo que casi nunca cambia: los tipos de espacio y, por
+cochera, capacidades y tarifas por hora. Va con `versiones` (memo local +
+versión compartida) y se invalida por signals, así las pantallas de portón y
+los cálculos no releen estas tablas en cada request.
+
+Con una cache compartida (la tabla de la base, Redis) la versión se da por
+buena FRESCO segundos (versiones.memo): un hit no hace ninguna query. Un cambio
+hecho en otro proceso se ve a lo sumo FRESCO segundos tarde.
+
+Lo que devuelve se comparte entre requests: no modificarlo.
+"""
+from .models import ConfigCapacidad, TarifaHora, TipoEspacio
+from . import versiones
+
+
+VERSION_TIPOS = "catalogo_tipos"
+VERSION_COCHERA = "catalogo_cochera"
+FRESCO = 5
+
+
+def _cargar_tipos():
+    lista = tuple(TipoEspacio.objects.order_by("nombre"))
+    return {"lista": lista, "por_id": {t.id: t for t in lista}}
+
+
+def tipos():
+    """Todos los TipoEspacio, por nombre."""
+    return versiones.memo(VERSION_TIPOS, 0, _cargar_tipos, fresco=FRESCO)["lista"]
+
+
+def tipo(tipo_id):
+    """El TipoEspacio con ese id (acepta el string de un POST) o None."""
+    try:
+        tipo_id = int(tipo_id)
+    except (TypeError, ValueError):
+        return None
+    return versiones.memo(VERSION_TIPOS, 0, _cargar_tipos, fresco=FRESCO)["por_id"].get(tipo_id)
+
+
+def _cargar_cochera(cochera_id):
+    return {
+        "capacidades": dict(ConfigCapacidad.objects.filter(cochera_id=cochera_id).values_list("tipo_id", "cantidad")),
+        "tarifas": dict(TarifaHora.objects.filter(cochera_id=cochera_id).values_list("tipo_id", "precio_hora")),
+    }
+
+
+def config_cochera(cochera_id):
+    return versiones.memo(VERSION_COCHERA, cochera_id, lambda: _cargar_cochera(cochera_id), fresco=FRESCO)
+
+
+def capacidades(cochera_id):
+    """{tipo_id: cantidad} según ConfigCapacidad."""
+    return config_cochera(cochera_id)["capacidades"]
+
+
+def tarifas(cochera_id):
+    """{tipo_id: precio_hora} según TarifaHora."""
+    return config_cochera(cochera_id)["tarifas"]
+
+
+def invalidar_tipos():
+    versiones.bump(VERSION_TIPOS, 0)
+
+
+def invalidar_cochera(cochera_id):
+    versiones.bump(VERSION_COCHERA, cochera_id)
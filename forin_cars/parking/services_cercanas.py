@@ -0,0 +1,108 @@
+"""
+Cocheras cercanas con lugar, para ofrecerle algo al conductor cuando la
+cochera está llena.
+
+Por dueño se arma en memoria una grilla de sus cocheras activas con
+coordenadas (celdas de CELDA grados): buscar es mirar las celdas que tocan el
+radio y medir la distancia a las que caen ahí, sin tocar la base. Se compila
+con versiones.memo y la invalida la signal de Cochera.
+
+Los libres son la capacidad del tipo (services_catalogo) menos los ocupados de
+la cache compartida (parking.contadores): dos get_many por tanda de
+candidatas, de la más cercana a la más lejana, hasta juntar las pedidas. Es
+una sugerencia: no cuenta reservas ni lugares fijos de abonados. Con la
+cache en la base los contadores son recuentos de hace segundos (ver
+parking.contadores).
+"""
+import math
+from collections import defaultdict, namedtuple
+
+from .models import Cochera
+from . import contadores, services_catalogo, versiones
+
+
+VERSION = "cercanas"
+# ~1,1 km de latitud
+CELDA = 0.01
+RADIO_KM = 5
+MAXIMO = 3
+# candidatas por ida a la cache
+TANDA = 8
+KM_POR_GRADO = 111.32
+
+Cercana = namedtuple("Cercana", "id nombre direccion distancia_km libres")
+
+
+def _celda(lat, lng):
+    return math.floor(lat / CELDA), math.floor(lng / CELDA)
+
+
+class Grilla:
+    """Cocheras por celda. `filas` = (id, nombre, direccion, lat, lng)."""
+
+    def __init__(self, filas):
+        self.celdas = defaultdict(list)
+        for f in filas:
+            self.celdas[_celda(f[3], f[4])].append(f)
+
+    def candidatas(self, lat, lng, radio_km):
+        """
+        [(distancia_km, fila)] de las que están a menos de radio_km, de la más
+        cercana a la más lejana. A estas distancias alcanza con la proyección
+        plana (equirectangular): el error contra haversine es mucho menor a 0,1%.
+        """
+        km_lng = KM_POR_GRADO * max(math.cos(math.radians(lat)), 0.01)
+        dlat, dlng = radio_km / KM_POR_GRADO, radio_km / km_lng
+        i0, j0 = _celda(lat - dlat, lng - dlng)
+        i1, j1 = _celda(lat + dlat, lng + dlng)
+        tope = radio_km * radio_km
+        res = []
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                for f in self.celdas.get((i, j), ()):
+                    d2 = ((f[3] - lat) * KM_POR_GRADO) ** 2 + ((f[4] - lng) * km_lng) ** 2
+                    if d2 <= tope:
+                        res.append((d2, f))
+        res.sort(key=lambda x: x[0])
+        return [(math.sqrt(d2), f) for d2, f in res]
+
+
+def _cargar(owner_id):
+    filas = (
+        Cochera.objects.filter(owner_id=owner_id, activa=True, latitud__isnull=False, longitud__isnull=False)
+        .values_list("id", "nombre", "direccion", "latitud", "longitud")
+    )
+    return Grilla([(i, nombre, direccion, float(lat), float(lng)) for i, nombre, direccion, lat, lng in filas])
+
+
+def grilla(owner_id):
+    return versiones.memo(VERSION, owner_id, lambda: _cargar(owner_id))
+
+
+def invalidar_cercanas(owner_id):
+    versiones.bump(VERSION, owner_id)
+
+
+def cercanas(cochera, tipo_id, *, n=MAXIMO, radio_km=RADIO_KM):
+    """
+    Hasta `n` cocheras del mismo dueño a menos de `radio_km` con lugar para el
+    tipo, de la más cercana a la más lejana (sin la propia). Sin coordenadas, [].
+    """
+    if cochera.latitud is None or cochera.longitud is None:
+        return []
+    candidatas = [
+        (d, f)
+        for d, f in grilla(cochera.owner_id).candidatas(float(cochera.latitud), float(cochera.longitud), radio_km)
+        if f[0] != cochera.id
+    ]
+    res = []
+    for i in range(0, len(candidatas), TANDA):
+        tanda = candidatas[i:i + TANDA]
+        ocupados = contadores.ocupados([f[0] for _, f in tanda], tipo_id)
+        for d, (cochera_id, nombre, direccion, _, _) in tanda:
+            libres = services_catalogo.capacidades(cochera_id).get(tipo_id, 0) - ocupados[cochera_id]
+            if libres > 0:
+                res.append(Cercana(cochera_id, nombre, direccion, round(d, 2), libres))
+                if len(res) >= n:
+                    return res
+    return res
@@ -0,0 +1,256 @@
+"""
+Bitácora de movimientos (EventoMovimiento) y proyecciones reconstruibles.
+
+Los services de movimientos escriben un evento en la misma transacción en la
+que tocan Espacio.ocupado / Movimiento, y suman la recaudación del día. Si el
+estado queda mal (bug, edición a mano), `reconstruir_proyecciones` lo rehace:
+recorre la bitácora por id en chunks (keyset, tuplas sin instanciar modelos),
+pliega todo en memoria y escribe solo las diferencias, en lotes.
+"""
+import time
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Cochera, EventoMovimiento, Espacio, Movimiento, RecaudacionDiaria
+from .services_asignacion import invalidar_espacios
+from . import services_intervalos, services_outbox, tenancy
+
+
+CHUNK = 50000
+# lote de ids por UPDATE ... WHERE id IN (...) (sqlite tiene tope de variables)
+LOTE_IDS = 900
+
+
+def registrar(tipo, *, cochera_id, movimiento_id=None, espacio_id=None, operador_id=None,
+              monto=None, ocurrido_at=None, **payload):
+    evento = EventoMovimiento.objects.create(
+        tipo=tipo,
+        cochera_id=cochera_id,
+        movimiento_id=movimiento_id,
+        espacio_id=espacio_id,
+        operador_id=operador_id,
+        monto=monto,
+        ocurrido_at=ocurrido_at or timezone.now(),
+        payload=payload,
+    )
+    # los webhooks salen de la misma transacción (outbox)
+    services_outbox.encolar(evento)
+    return evento
+
+
+def sumar_recaudacion(cochera_id, egreso_at, monto, egresos=1):
+    """Suma egresos al día de la cochera (upsert con F(), sin leer la fila)."""
+    fecha = timezone.localdate(egreso_at)
+    monto = monto or 0
+    qs = RecaudacionDiaria.objects.filter(cochera_id=cochera_id, fecha=fecha)
+    if qs.update(egresos=F("egresos") + egresos, total=F("total") + monto):
+        return
+    try:
+        with transaction.atomic(using=tenancy.alias_actual()):
+            RecaudacionDiaria.objects.create(cochera_id=cochera_id, fecha=fecha, egresos=egresos, total=monto)
+    except IntegrityError:
+        # otro egreso creó la fila del día entre el update y el create
+        qs.update(egresos=F("egresos") + egresos, total=F("total") + monto)
+
+
+# --------------------------------------------------------------------------
+# replay
+# --------------------------------------------------------------------------
+
+def _por_chunks(qs, campos, chunk):
+    """values_list por keyset sobre id (el primer campo tiene que ser "id")."""
+    ultimo = 0
+    while True:
+        filas = list(qs.filter(id__gt=ultimo).order_by("id").values_list(*campos)[:chunk])
+        if not filas:
+            return
+        yield filas
+        ultimo = filas[-1][0]
+
+
+def _en_lotes(ids, n=LOTE_IDS):
+    ids = list(ids)
+    for i in range(0, len(ids), n):
+        yield ids[i:i + n]
+
+
+def _plegar(eventos_qs, chunk, stats):
+    """
+    Aplica los eventos en orden y devuelve el estado final:
+    movs[id] = [estado, espacio_id, egreso_at, monto], ocupados[espacio_id] = bool
+    y recaudacion[(cochera_id, fecha)] = [egresos, total].
+    """
+    movs = {}
+    ocupados = {}
+    recaudacion = defaultdict(lambda: [0, Decimal(0)])
+    tz = timezone.get_current_timezone()
+
+    def _cerrar(mov_id, espacio_id, cochera_id, at, monto, cobra):
+        m = movs.get(mov_id)
+        if m is None:
+            m = movs[mov_id] = [Movimiento.ABIERTO, espacio_id, None, None]
+        m[0], m[2], m[3] = Movimiento.CERRADO, at, monto
+        esp = espacio_id or m[1]
+        if esp:
+            ocupados[esp] = False
+        if cobra:
+            r = recaudacion[(cochera_id, at.astimezone(tz).date())]
+            r[0] += 1
+            r[1] += monto or 0
+
+    campos = ("id", "tipo", "movimiento_id", "espacio_id", "cochera_id", "ocurrido_at", "monto", "payload")
+    for filas in _por_chunks(eventos_qs, campos, chunk):
+        stats["eventos"] += len(filas)
+        for _, tipo, mov_id, espacio_id, cochera_id, at, monto, payload in filas:
+            if tipo == EventoMovimiento.INGRESO:
+                movs[mov_id] = [Movimiento.ABIERTO, espacio_id, None, None]
+                ocupados[espacio_id] = True
+
+            elif tipo == EventoMovimiento.EGRESO:
+                _cerrar(mov_id, espacio_id, cochera_id, at, monto, True)
+
+            elif tipo == EventoMovimiento.REASIGNACION:
+                anterior = payload.get("espacio_anterior")
+                if anterior and payload.get("liberar_anterior", True):
+                    ocupados[anterior] = False
+                ocupados[espacio_id] = True
+                if mov_id in movs:
+                    movs[mov_id][1] = espacio_id
+
+            elif tipo == EventoMovimiento.AJUSTE:
+                if mov_id and payload.get("cerrar"):
+                    _cerrar(mov_id, espacio_id, cochera_id, at, monto, monto is not None)
+                elif espacio_id and "ocupado" in payload:
+                    ocupados[espacio_id] = bool(payload["ocupado"])
+
+    return movs, ocupados, recaudacion
+
+
+class TraficoEnVivo(ValueError):
+    """Entraron eventos mientras se plegaba: el replay pisaría ese estado."""
+
+
+def reconstruir_proyecciones(*, cochera_id=None, chunk=CHUNK, aplicar=True):
+    """
+    Rehace ocupación de espacios, movimientos abiertos/cerrados y recaudación
+    diaria desde la bitácora. Con aplicar=False solo cuenta diferencias.
+    Devuelve un dict con los contadores.
+
+    Solo toca lo que la bitácora cubre: espacios que aparecen en algún evento,
+    movimientos con eventos y días de recaudación sin egresos anteriores a la
+    bitácora (filas cargadas sin eventos, `generar_datos` sin --eventos). Si
+    entran eventos de la cochera mientras se lee, no escribe y levanta
+    TraficoEnVivo (en sqlite el chequeo y las escrituras van bajo el lock de
+    escritura, así que no se cuela ninguno en el medio).
+    """
+    stats = defaultdict(int)
+    t0 = time.perf_counter()
+
+    eventos = EventoMovimiento.objects.all()
+    espacios = Espacio.objects.all()
+    movimientos = Movimiento.objects.all()
+    recaudaciones = RecaudacionDiaria.objects.all()
+    if cochera_id:
+        eventos = eventos.filter(cochera_id=cochera_id)
+        espacios = espacios.filter(cochera_id=cochera_id)
+        movimientos = movimientos.filter(cochera_id=cochera_id)
+        recaudaciones = recaudaciones.filter(cochera_id=cochera_id)
+
+    tope = eventos.order_by("-id").values_list("id", flat=True).first() or 0
+    movs, ocupados, recaudacion = _plegar(eventos.filter(id__lte=tope), chunk, stats)
+    con_eventos = set(eventos.filter(id__lte=tope).values_list("cochera_id", flat=True).distinct())
+    stats["plegado_s"] = round(time.perf_counter() - t0, 2)
+
+    estado_espacios = {}
+    for filas in _por_chunks(espacios, ("id", "ocupado", "cochera_id"), chunk):
+        for espacio_id, ocupado, coch in filas:
+            estado_espacios[espacio_id] = (ocupado, coch)
+
+    # movimientos: solo los que aparecen en la bitácora. Los que no tienen
+    # eventos son anteriores a la bitácora: su espacio y su día quedan como están.
+    cambios, cocheras = [], set()
+    retenidos, sin_cubrir = set(), set()
+    campos = ("id", "estado", "espacio_id", "egreso_at", "monto", "cochera_id")
+    for filas in _por_chunks(movimientos, campos, chunk):
+        for mov_id, estado, espacio_id, egreso_at, monto, coch in filas:
+            m = movs.get(mov_id)
+            if m is None:
+                stats["movimientos_sin_eventos"] += 1
+                if estado == Movimiento.ABIERTO:
+                    retenidos.add(espacio_id)
+                elif egreso_at is not None:
+                    sin_cubrir.add((coch, timezone.localdate(egreso_at)))
+                continue
+            if m[1] not in estado_espacios:
+                # el espacio del log ya no existe (se regeneró el layout)
+                m[1] = espacio_id
+            if (estado, espacio_id, egreso_at, monto) != tuple(m):
+                cambios.append(Movimiento(id=mov_id, estado=m[0], espacio_id=m[1], egreso_at=m[2], monto=m[3]))
+                cocheras.add(coch)
+    stats["movimientos_corregidos"] = len(cambios)
+
+    # ocupación: solo espacios con eventos y que no ocupa un movimiento sin eventos
+    a_ocupar, a_liberar = [], []
+    for espacio_id, debe in ocupados.items():
+        actual = estado_espacios.get(espacio_id)
+        if actual is None or espacio_id in retenidos or actual[0] == debe:
+            continue
+        (a_ocupar if debe else a_liberar).append(espacio_id)
+        cocheras.add(actual[1])
+    stats["espacios_ocupar"] = len(a_ocupar)
+    stats["espacios_liberar"] = len(a_liberar)
+
+    # recaudación: se rehacen los días de cocheras con eventos, salvo los que
+    # tienen egresos sin eventos (ahí vale lo que ya estaba sumado). Eventos de
+    # cocheras borradas no generan recaudación.
+    vivas = set(Cochera.objects.filter(id__in=con_eventos).values_list("id", flat=True))
+    recaudacion = {k: v for k, v in recaudacion.items() if k[0] in vivas and k not in sin_cubrir}
+    guardadas = {
+        (coch, fecha): [n, total]
+        for coch, fecha, n, total in recaudaciones.filter(cochera_id__in=vivas)
+        .values_list("cochera_id", "fecha", "egresos", "total")
+    }
+    a_borrar = [k for k, v in guardadas.items() if k not in sin_cubrir and recaudacion.get(k) != v]
+    a_crear = [k for k, v in recaudacion.items() if guardadas.get(k) != v]
+    stats["dias_recaudacion"] = len(recaudacion)
+    stats["dias_sin_cubrir"] = len(sin_cubrir)
+    stats["dias_corregidos"] = len(set(a_borrar) | set(a_crear))
+
+    if aplicar:
+        with transaction.atomic(using=tenancy.alias_actual()):
+            if eventos.filter(id__gt=tope).exists():
+                raise TraficoEnVivo(
+                    "Entraron movimientos mientras se leía la bitácora; "
+                    "correr el replay con los portones parados o cuando no haya tráfico."
+                )
+            for lote in _en_lotes(a_ocupar):
+                Espacio.objects.filter(id__in=lote).update(ocupado=True)
+            for lote in _en_lotes(a_liberar):
+                Espacio.objects.filter(id__in=lote).update(ocupado=False)
+            Movimiento.objects.bulk_update(cambios, ["estado", "espacio", "egreso_at", "monto"], batch_size=500)
+            services_intervalos.reindexar(m.id for m in cambios)
+
+            por_cochera = defaultdict(list)
+            for coch, fecha in a_borrar:
+                por_cochera[coch].append(fecha)
+            for coch, fechas in por_cochera.items():
+                for lote in _en_lotes(fechas):
+                    RecaudacionDiaria.objects.filter(cochera_id=coch, fecha__in=lote).delete()
+            RecaudacionDiaria.objects.bulk_create(
+                [
+                    RecaudacionDiaria(cochera_id=coch, fecha=fecha, egresos=recaudacion[(coch, fecha)][0],
+                                      total=recaudacion[(coch, fecha)][1])
+                    for coch, fecha in a_crear
+                ],
+                batch_size=2000,
+            )
+
+            for coch in cocheras:
+                transaction.on_commit(lambda c=coch: invalidar_espacios(c), using=tenancy.alias_actual())
+
+    stats["total_s"] = round(time.perf_counter() - t0, 2)
+    return dict(stats)
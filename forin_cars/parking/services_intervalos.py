@@ -0,0 +1,184 @@
+"""
+"Quién estaba adentro" en un instante o en un rango, sin recorrer la historia.
+
+Comparar ingreso_at/egreso_at contra T obliga a leer todo lo que entró antes
+de T (o todo lo que salió después): en años de historia son millones de filas
+para devolver unas decenas. IntervaloOcupacion guarda cada movimiento CERRADO
+una sola vez, en su "nodo de corte" de un árbol binario virtual sobre los
+milisegundos epoch (árbol de intervalos relacional): el nodo más alto que cae
+dentro de [ingreso, egreso). Para un instante t solo pueden contenerlo los
+intervalos colgados de los ~40 nodos del camino de la raíz a t, y en cada nodo
+alcanza con un rango del índice:
+
+- nodos a la izquierda de t (n < t): los que terminan después, hasta >= t
+- nodos a la derecha (n > t): los que empezaron antes, desde <= t
+- el nodo t: todos
+
+Cada movimiento ocupa una fila (sin importar cuánto dure) y la consulta
+devuelve exactamente los que estaban, sin falsos positivos. Los ABIERTOS no
+están en el índice: salen de Movimiento (son pocos) y entran al índice cuando
+se cierran.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+
+from .models import IntervaloOcupacion, Movimiento
+
+
+# 2**42 ms alcanza hasta el año 2109
+RAIZ = 2 ** 41
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+UN_MS = timedelta(milliseconds=1)
+LOTE = 5000
+
+
+def a_ms(dt):
+    return (dt - EPOCH) // UN_MS
+
+
+def nodos(desde, hasta):
+    """Nodo de corte de cada intervalo [desde, hasta] (arrays de ms)."""
+    desde, hasta = np.asarray(desde, dtype=np.int64), np.asarray(hasta, dtype=np.int64)
+    n = np.full(len(desde), RAIZ, dtype=np.int64)
+    paso = RAIZ // 2
+    bajando = np.ones(len(desde), dtype=bool)
+    while paso and bajando.any():
+        izq = bajando & (hasta < n)
+        der = bajando & (n < desde)
+        n[izq] -= paso
+        n[der] += paso
+        bajando = izq | der
+        paso //= 2
+    return n
+
+
+def _camino(t):
+    """Nodos del camino de la raíz a t, sin t: (los menores que t, los mayores)."""
+    izq, der = [], []
+    n, paso = RAIZ, RAIZ // 2
+    while n != t:
+        (izq if n < t else der).append(n)
+        if not paso:
+            break
+        n = n + paso if n < t else n - paso
+        paso //= 2
+    return izq, der
+
+
+def _filas(movs):
+    """IntervaloOcupacion de (id, cochera_id, ingreso_at, egreso_at); los de duración < 1ms no ocupan."""
+    movs = [(m, c, a_ms(i), a_ms(e) - 1) for m, c, i, e in movs]
+    movs = [f for f in movs if f[3] >= f[2]]
+    if not movs:
+        return []
+    ns = nodos([f[2] for f in movs], [f[3] for f in movs])
+    return [
+        IntervaloOcupacion(movimiento_id=m, cochera_id=c, nodo=int(n), desde=d, hasta=h)
+        for (m, c, d, h), n in zip(movs, ns.tolist())
+    ]
+
+
+def registrar(movimientos):
+    """Indexa movimientos recién cerrados: iterable de (id, cochera_id, ingreso_at, egreso_at)."""
+    IntervaloOcupacion.objects.bulk_create(_filas(movimientos), batch_size=1000)
+
+
+def reindexar(movimiento_ids):
+    """Rehace el índice de estos movimientos (p. ej. si replay_eventos les cambió el egreso o el estado)."""
+    ids = list(movimiento_ids)
+    for i in range(0, len(ids), LOTE):
+        lote = ids[i:i + LOTE]
+        IntervaloOcupacion.objects.filter(movimiento_id__in=lote).delete()
+        registrar(
+            Movimiento.objects.filter(id__in=lote, estado=Movimiento.CERRADO, egreso_at__isnull=False)
+            .values_list("id", "cochera_id", "ingreso_at", "egreso_at")
+        )
+
+
+def reconstruir(*, cochera_id=None, rehacer=False, lote=LOTE):
+    """
+    Carga el índice de la historia ya cerrada, por id (keyset) y en lotes. Sin
+    `rehacer` solo agrega lo que falta: se puede cortar y volver a correr.
+    Devuelve cuántos movimientos recorrió.
+    """
+    movs = Movimiento.objects.filter(estado=Movimiento.CERRADO, egreso_at__isnull=False)
+    if cochera_id:
+        movs = movs.filter(cochera_id=cochera_id)
+        if rehacer:
+            IntervaloOcupacion.objects.filter(cochera_id=cochera_id).delete()
+    elif rehacer:
+        IntervaloOcupacion.objects.all().delete()
+
+    ultimo, total = 0, 0
+    while True:
+        filas = list(
+            movs.filter(id__gt=ultimo).order_by("id").values_list("id", "cochera_id", "ingreso_at", "egreso_at")[:lote]
+        )
+        if not filas:
+            return total
+        IntervaloOcupacion.objects.bulk_create(_filas(filas), batch_size=1000, ignore_conflicts=True)
+        ultimo = filas[-1][0]
+        total += len(filas)
+
+
+def _ids(cochera_id, a, b):
+    """Ids de los movimientos de la cochera que estuvieron adentro en algún ms de [a, b]."""
+    izq, _ = _camino(a)
+    _, der = _camino(b)
+
+    base = IntervaloOcupacion.objects.filter(cochera_id=cochera_id).values_list("movimiento_id", flat=True)
+    partes = [base.filter(nodo__gte=a, nodo__lte=b)]
+    if izq:
+        partes.append(base.filter(nodo__in=izq, hasta__gte=a))
+    if der:
+        partes.append(base.filter(nodo__in=der, desde__lte=b))
+    cerrados = partes[0].union(*partes[1:], all=True) if len(partes) > 1 else partes[0]
+
+    # los que están adentro ahora son pocos: con egreso_at NULL como única
+    # condición va por el índice (cochera, egreso_at) y el ingreso se mira acá
+    tope = EPOCH + (b + 1) * UN_MS
+    abiertos = [
+        mov_id
+        for mov_id, ingreso in Movimiento.objects.filter(
+            cochera_id=cochera_id, egreso_at__isnull=True, estado=Movimiento.ABIERTO
+        ).values_list("id", "ingreso_at")
+        if ingreso < tope
+    ]
+    return set(cerrados) | set(abiertos)
+
+
+def _detalle(ids):
+    movs = (
+        Movimiento.objects.filter(id__in=ids)
+        .select_related("vehiculo__tipo", "espacio")
+        .order_by("ingreso_at", "id")
+    )
+    return [
+        {
+            "movimiento_id": m.id,
+            "ticket": m.vehiculo.ticket,
+            "patente_ult3": m.vehiculo.patente_ult3,
+            "tipo": m.vehiculo.tipo.nombre,
+            # el espacio final: si lo reasignaron, el anterior está en la bitácora
+            "espacio_id": m.espacio_id,
+            "espacio": m.espacio.etiqueta,
+            "ingreso_at": m.ingreso_at,
+            "egreso_at": m.egreso_at,
+        }
+        for m in movs
+    ]
+
+
+def adentro_en(cochera_id, instante):
+    """Vehículos y espacios ocupados en la cochera en `instante` (aware, resolución ms)."""
+    t = a_ms(instante)
+    return _detalle(_ids(cochera_id, t, t))
+
+
+def adentro_entre(cochera_id, desde, hasta):
+    """Los que estuvieron adentro en algún momento de [desde, hasta)."""
+    a, b = a_ms(desde), a_ms(hasta) - 1
+    if b < a:
+        raise ValueError("El rango está vacío.")
+    return _detalle(_ids(cochera_id, a, b))
@@ -1,6 +1,28 @@
+import time
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
 from django.db import transaction
+from django.db.models import Exists, OuterRef
 from django.utils import timezone
-from .models import Vehiculo, Cliente, Movimiento, Espacio
+from .models import Vehiculo, Cliente, Movimiento, Reserva, Espacio, EventoMovimiento, Cochera
+from .services_tarifas import cotizar, cotizar_lote, a_epoch
+from .services_asignacion import asignar_espacio, devolver_si_falla, liberar_espacio, invalidar_espacios
+from .services_reservas import tomar_reserva, hay_lugar_sin_reserva
+from .services_abonados import abono_vigente, ocupar_espacio_fijo
+from .services_eventos import registrar, sumar_recaudacion
+from .services_tickets import leer as leer_ticket
+from . import services_alertas, services_intervalos, services_outbox, tenancy
+
+
+class SinLugar(ValueError):
+    """No hay espacio libre del tipo: el que lo atrapa puede ofrecer cocheras cercanas (services_cercanas)."""
+
+    def __init__(self, mensaje, *, cochera_id, tipo_id):
+        super().__init__(mensaje)
+        self.cochera_id = cochera_id
+        self.tipo_id = tipo_id
 
 
 def _normalize_ult3(value: str) -> str:
@@ -18,11 +40,25 @@ def _has_cliente_data(cliente_data: dict) -> bool:
     return any((cliente_data.get(k) or "").strip() for k in ["nombre", "apellido", "telefono", "email"])
 
 
-@transaction.atomic
-def ingresar_vehiculo(*, cochera, operador, tipo, ticket, patente_ult3=None, cliente_data=None):
+def _leer_ticket_de(cochera, ticket):
+    """Valida el dígito verificador y que un ticket emitido por el sistema sea de esta cochera."""
+    leido = leer_ticket(ticket)
+    if leido is not None and leido[0] != cochera.id:
+        raise ValueError("El ticket es de otra cochera.")
+
+
+@devolver_si_falla()
+@tenancy.atomic
+def ingresar_vehiculo(*, cochera, operador, tipo, ticket, patente_ult3=None, cliente_data=None, codigo_reserva=None):
     ticket = (ticket or "").strip().upper()
     if not ticket:
         raise ValueError("El TICKET es obligatorio para identificar el vehículo.")
+    _leer_ticket_de(cochera, ticket)
+
+    # abonado: un lookup en memoria, sin tocar Cliente/Vehiculo
+    abono = abono_vigente(cochera.id, ticket)
+    if abono is not None:
+        return _ingresar_abonado(cochera=cochera, operador=operador, abono=abono)
 
     ult3 = _normalize_ult3(patente_ult3)
 
@@ -61,29 +97,92 @@ def ingresar_vehiculo(*, cochera, operador, tipo, ticket, patente_ult3=None, cli
     if Movimiento.objects.filter(cochera=cochera, vehiculo=vehiculo, estado="ABIERTO").exists():
         raise ValueError("Ese vehículo ya está dentro (movimiento ABIERTO).")
 
-    # asignar espacio libre del tipo
-    espacio = Espacio.objects.select_for_update().filter(
-        cochera=cochera, tipo=tipo, ocupado=False
-    ).first()
+    # con reserva usa su lugar retenido; sin reserva no puede comerse lo retenido
+    reserva = None
+    if (codigo_reserva or "").strip():
+        reserva = tomar_reserva(cochera=cochera, tipo=tipo, codigo=codigo_reserva)
+    elif not hay_lugar_sin_reserva(cochera, tipo.id):
+        raise SinLugar(
+            f"Los espacios libres de tipo '{tipo.nombre}' están reservados.", cochera_id=cochera.id, tipo_id=tipo.id
+        )
 
-    if not espacio:
-        raise ValueError(f"No hay espacios libres disponibles para tipo '{tipo.nombre}'.")
+    # asignar espacio libre del tipo (bitmap en memoria + claim atómico en la base)
+    espacio_id = asignar_espacio(cochera, tipo.id)
 
-    espacio.ocupado = True
-    espacio.save(update_fields=["ocupado"])
+    if not espacio_id:
+        raise SinLugar(
+            f"No hay espacios libres disponibles para tipo '{tipo.nombre}'.", cochera_id=cochera.id, tipo_id=tipo.id
+        )
 
     mov = Movimiento.objects.create(
         cochera=cochera,
         vehiculo=vehiculo,
-        espacio=espacio,
+        espacio_id=espacio_id,
         operador=operador,
         estado="ABIERTO",
         ingreso_at=timezone.now(),
     )
+    registrar(
+        EventoMovimiento.INGRESO,
+        cochera_id=cochera.id,
+        movimiento_id=mov.id,
+        espacio_id=espacio_id,
+        operador_id=operador.id,
+        ocurrido_at=mov.ingreso_at,
+        ticket=ticket,
+        tipo_id=tipo.id,
+        reserva_id=reserva.id if reserva else None,
+    )
+    services_alertas.ocupacion(cochera.id, tipo.id, +1)
+
+    if reserva:
+        reserva.estado = Reserva.CUMPLIDA
+        reserva.movimiento = mov
+        reserva.save(update_fields=["estado", "movimiento"])
+
     return mov
 
 
-@transaction.atomic
+def _ingresar_abonado(*, cochera, operador, abono):
+    if Movimiento.objects.filter(cochera=cochera, vehiculo_id=abono.vehiculo_id, estado="ABIERTO").exists():
+        raise ValueError("Ese vehículo ya está dentro (movimiento ABIERTO).")
+
+    if abono.espacio_id:
+        if not ocupar_espacio_fijo(abono.espacio_id):
+            raise ValueError("El lugar fijo del abonado está ocupado.")
+        espacio_id = abono.espacio_id
+    else:
+        # el flotante no se puede comer un lugar retenido por una reserva
+        if not hay_lugar_sin_reserva(cochera, abono.tipo_id):
+            raise ValueError("Los espacios libres para el abonado están reservados.")
+        espacio_id = asignar_espacio(cochera, abono.tipo_id)
+        if not espacio_id:
+            raise ValueError("No hay espacios libres disponibles para el abonado.")
+
+    mov = Movimiento.objects.create(
+        cochera=cochera,
+        vehiculo_id=abono.vehiculo_id,
+        espacio_id=espacio_id,
+        operador=operador,
+        abonado_id=abono.id,
+        estado="ABIERTO",
+        ingreso_at=timezone.now(),
+    )
+    registrar(
+        EventoMovimiento.INGRESO,
+        cochera_id=cochera.id,
+        movimiento_id=mov.id,
+        espacio_id=espacio_id,
+        operador_id=operador.id,
+        ocurrido_at=mov.ingreso_at,
+        tipo_id=abono.tipo_id,
+        abonado_id=abono.id,
+    )
+    services_alertas.ocupacion(cochera.id, abono.tipo_id, +1)
+    return mov
+
+
+@tenancy.atomic
 def egresar_vehiculo(*, cochera, operador, ticket):
     ticket = (ticket or "").strip().upper()
 
@@ -94,6 +193,8 @@ def egresar_vehiculo(*, cochera, operador, ticket):
     ).select_related("espacio").first()
 
     if not mov:
+        # un ticket nuestro mal escaneado (o de otra cochera) da un error más útil que "no existe"
+        _leer_ticket_de(cochera, ticket)
         raise ValueError("No existe un movimiento ABIERTO para ese ticket en esta cochera.")
 
     espacio = mov.espacio
@@ -102,6 +203,173 @@ def egresar_vehiculo(*, cochera, operador, ticket):
 
     mov.estado = "CERRADO"
     mov.egreso_at = timezone.now()
-    mov.save(update_fields=["estado", "egreso_at"])
+    # los abonados no pagan por hora
+    if mov.abonado_id:
+        mov.monto = 0
+    else:
+        mov.monto = cotizar(cochera.id, espacio.tipo_id, mov.ingreso_at, mov.egreso_at)
+    mov.save(update_fields=["estado", "egreso_at", "monto"])
+    services_intervalos.registrar([(mov.id, cochera.id, mov.ingreso_at, mov.egreso_at)])
+
+    registrar(
+        EventoMovimiento.EGRESO,
+        cochera_id=cochera.id,
+        movimiento_id=mov.id,
+        espacio_id=espacio.id,
+        operador_id=operador.id,
+        monto=mov.monto,
+        ocurrido_at=mov.egreso_at,
+    )
+    sumar_recaudacion(cochera.id, mov.egreso_at, mov.monto)
+
+    liberar_espacio(cochera.id, espacio.tipo_id, espacio.id)
+    services_alertas.ocupacion(cochera.id, espacio.tipo_id, -1)
+
+    return mov
 
+
+@tenancy.atomic
+def reasignar_espacio(*, cochera, operador, ticket, espacio_destino):
+    """Mueve un vehículo que está adentro a otro espacio libre de la misma cochera."""
+    ticket = (ticket or "").strip().upper()
+
+    mov = Movimiento.objects.select_for_update().filter(
+        cochera=cochera,
+        vehiculo__ticket=ticket,
+        estado="ABIERTO"
+    ).select_related("espacio").first()
+
+    if not mov:
+        raise ValueError("No existe un movimiento ABIERTO para ese ticket en esta cochera.")
+    if espacio_destino.cochera_id != cochera.id:
+        raise ValueError("El espacio destino es de otra cochera.")
+    if espacio_destino.id == mov.espacio_id:
+        raise ValueError("El vehículo ya está en ese espacio.")
+
+    if not Espacio.objects.filter(id=espacio_destino.id, ocupado=False).update(ocupado=True):
+        raise ValueError("El espacio destino está ocupado.")
+
+    anterior = mov.espacio
+    anterior.ocupado = False
+    anterior.save(update_fields=["ocupado"])
+
+    mov.espacio = espacio_destino
+    mov.save(update_fields=["espacio"])
+
+    registrar(
+        EventoMovimiento.REASIGNACION,
+        cochera_id=cochera.id,
+        movimiento_id=mov.id,
+        espacio_id=espacio_destino.id,
+        operador_id=operador.id,
+        espacio_anterior=anterior.id,
+    )
+
+    # el destino se tomó por fuera del pool: mejor recargarlo
+    transaction.on_commit(lambda: invalidar_espacios(cochera.id), using=tenancy.alias_actual())
     return mov
+
+
+def cerrar_movimientos(movimiento_ids, *, operador_id=None, motivo="manual", ahora=None):
+    """
+    Cierra en bloque movimientos ABIERTOS (acción del admin, abandonados).
+    Cobra con la tarifa vigente hasta `ahora` (abonados en 0), libera los
+    espacios que no tengan otro ABIERTO y deja un AJUSTE de cierre por
+    movimiento (con su aviso en el outbox). Conviene pasar lotes chicos: todo va en una transacción.
+    Devuelve la cantidad cerrada.
+    """
+    ahora = ahora or timezone.now()
+    alias = tenancy.alias_actual()
+    with transaction.atomic(using=alias):
+        filas = list(
+            Movimiento.objects.select_for_update(of=("self",))
+            .filter(id__in=list(movimiento_ids), estado=Movimiento.ABIERTO)
+            .values_list("id", "cochera_id", "espacio_id", "espacio__tipo_id", "ingreso_at", "abonado_id")
+        )
+        if not filas:
+            return 0
+
+        por_cochera = defaultdict(list)
+        for f in filas:
+            por_cochera[f[1]].append(f)
+
+        egreso_s = int(ahora.timestamp())
+        # estado y egreso son iguales para todos y los montos se repiten mucho:
+        # un UPDATE por monto distinto sale mucho más barato que un bulk_update
+        # (CASE WHEN por fila) y el lock de escritura dura menos
+        por_monto, eventos = defaultdict(list), []
+        for coch, lista in por_cochera.items():
+            centavos = cotizar_lote(coch, [f[3] for f in lista], a_epoch([f[4] for f in lista]), [egreso_s] * len(lista))
+            total = Decimal(0)
+            for (mov_id, _, espacio_id, _, _, abonado_id), c in zip(lista, centavos.tolist()):
+                monto = Decimal(0) if abonado_id else Decimal(int(c)) / 100
+                total += monto
+                por_monto[monto].append(mov_id)
+                eventos.append(EventoMovimiento(
+                    tipo=EventoMovimiento.AJUSTE,
+                    cochera_id=coch,
+                    movimiento_id=mov_id,
+                    espacio_id=espacio_id,
+                    operador_id=operador_id,
+                    monto=monto,
+                    ocurrido_at=ahora,
+                    payload={"cerrar": True, "motivo": motivo},
+                ))
+            sumar_recaudacion(coch, ahora, total, egresos=len(lista))
+
+        for monto, ids in por_monto.items():
+            Movimiento.objects.filter(id__in=ids).update(estado=Movimiento.CERRADO, egreso_at=ahora, monto=monto)
+        EventoMovimiento.objects.bulk_create(eventos, batch_size=1000)
+        services_outbox.encolar_lote(eventos)
+        services_intervalos.registrar((f[0], f[1], f[4], ahora) for f in filas)
+
+        otro_abierto = Movimiento.objects.filter(espacio_id=OuterRef("pk"), estado=Movimiento.ABIERTO)
+        Espacio.objects.filter(id__in={f[2] for f in filas}, ocupado=True).exclude(Exists(otro_abierto)).update(ocupado=False)
+
+        for coch in por_cochera:
+            transaction.on_commit(lambda c=coch: invalidar_espacios(c), using=alias)
+
+    return len(filas)
+
+
+LOTE_ABANDONADOS = 500
+# respiro entre lotes: sin esto el lock de escritura se vuelve a tomar al toque
+# y un ingreso que espera turno puede quedar segundos colgado
+PAUSA_ABANDONADOS = 0.05
+
+
+def cerrar_abandonados(*, cochera_id=None, lote=LOTE_ABANDONADOS, aplicar=True, ahora=None, pausa=PAUSA_ABANDONADOS):
+    """
+    Cierra los ABIERTOS más viejos que Cochera.horas_abandono, de a `lote` por
+    transacción (cada una bloquea solo sus filas un instante, así los ingresos
+    y egresos siguen pasando). Recorre por id (keyset) sin cargar todo.
+    Devuelve {cochera_id: cerrados} (con aplicar=False, los que cerraría).
+    """
+    ahora = ahora or timezone.now()
+    cocheras = Cochera.objects.filter(horas_abandono__gt=0)
+    if cochera_id:
+        cocheras = cocheras.filter(id=cochera_id)
+
+    res = {}
+    for coch, horas in cocheras.values_list("id", "horas_abandono"):
+        viejos = Movimiento.objects.filter(
+            cochera_id=coch, estado=Movimiento.ABIERTO, ingreso_at__lt=ahora - timedelta(hours=horas)
+        )
+        if not aplicar:
+            n = viejos.count()
+            if n:
+                res[coch] = n
+            continue
+
+        total, ultimo = 0, 0
+        while True:
+            ids = list(viejos.filter(id__gt=ultimo).order_by("id").values_list("id", flat=True)[:lote])
+            if not ids:
+                break
+            total += cerrar_movimientos(ids, motivo="abandonado", ahora=ahora)
+            ultimo = ids[-1]
+            if pausa:
+                time.sleep(pausa)
+        if total:
+            res[coch] = total
+    return res
@@ -0,0 +1,156 @@
+"""
+Serie de ocupación de una cochera en el tiempo, para gráficos.
+
+Se trae solo lo que se superpone con el rango (cerrados con egreso >= desde
+por el índice (cochera, egreso_at) + los ABIERTOS) y se hace un barrido
+vectorizado: +1 en cada ingreso, -1 en cada egreso, cumsum sobre los eventos
+ordenados. Los bordes de los cubos entran como eventos de delta 0, así cada
+tramo entre eventos cae en un solo cubo y salen exactos el máximo y el
+promedio (ponderado por tiempo) de cada uno.
+
+Modos:
+- "max": por cubo el máximo y el promedio (el máximo nunca esconde un pico)
+- "lttb": la serie escalonada completa reducida con Largest-Triangle-Three-Buckets
+
+Se cachea por (cochera, tipo, rango, puntos, modo): los rangos ya cerrados un
+día, los que llegan a "ahora" un minuto.
+"""
+import math
+from datetime import datetime, timezone as dt_timezone
+
+import numpy as np
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import Movimiento
+from .services_tarifas import a_epoch
+from . import services_catalogo, tenancy
+
+
+MAX_PUNTOS = 2000
+CACHE_TTL = 60 * 60 * 24
+CACHE_TTL_VIVO = 60
+
+
+def _intervalos(cochera_id, tipo_id, t0, t1):
+    """(ingresos, egresos) en epoch de los movimientos que pisan [t0, t1); abiertos con egreso inf."""
+    desde = datetime.fromtimestamp(t0, tz=dt_timezone.utc)
+    hasta = datetime.fromtimestamp(t1, tz=dt_timezone.utc)
+    qs = Movimiento.objects.filter(cochera_id=cochera_id, ingreso_at__lt=hasta)
+    if tipo_id:
+        qs = qs.filter(espacio__tipo_id=tipo_id)
+
+    cerrados = list(qs.filter(egreso_at__gte=desde).values_list("ingreso_at", "egreso_at"))
+    abiertos = list(qs.filter(estado=Movimiento.ABIERTO, egreso_at__isnull=True).values_list("ingreso_at", flat=True))
+
+    ing = np.concatenate([a_epoch([f[0] for f in cerrados]), a_epoch(abiertos)]).astype(np.float64)
+    egr = np.concatenate([a_epoch([f[1] for f in cerrados]).astype(np.float64), np.full(len(abiertos), np.inf)])
+    return ing, egr
+
+
+def _barrido(ing, egr, t0, paso, n, fin):
+    """
+    Máximo y promedio de n cubos de `paso` segundos desde t0. Lo posterior a
+    `fin` (ahora) no cuenta: el último cubo promedia solo lo transcurrido.
+    """
+    bordes = t0 + paso * np.arange(n)
+    salen = egr[egr < fin]
+
+    tiempos = np.concatenate([np.maximum(ing, t0), salen, bordes])
+    deltas = np.concatenate([np.ones(len(ing)), -np.ones(len(salen)), np.zeros(n)])
+    # a igual instante: primero salen, después el borde, después entran
+    orden = np.lexsort((deltas, tiempos))
+    tiempos, ocupacion = tiempos[orden], np.cumsum(deltas[orden])
+
+    cubo = np.minimum(((tiempos - t0) // paso).astype(np.int64), n - 1)
+    # cada cubo tiene al menos su borde: reduceat sobre el primer evento de cada uno
+    inicios = np.searchsorted(cubo, np.arange(n))
+    maximo = np.maximum.reduceat(ocupacion, inicios)
+    duracion = np.diff(np.append(tiempos, fin))
+    promedio = np.add.reduceat(ocupacion * duracion, inicios) / np.minimum(paso, fin - bordes)
+    return bordes, maximo, promedio
+
+
+def _escalones(ing, egr, t0, t1):
+    """La serie exacta: (instante, ocupación) después de cada evento dentro del rango."""
+    salen = egr[egr < t1]
+    tiempos = np.concatenate([[t0], np.maximum(ing, t0), salen])
+    deltas = np.concatenate([[0.0], np.ones(len(ing)), -np.ones(len(salen))])
+    orden = np.lexsort((deltas, tiempos))
+    return tiempos[orden], np.cumsum(deltas[orden])
+
+
+def lttb(x, y, n):
+    """Largest-Triangle-Three-Buckets: se queda con n puntos que conservan la forma."""
+    if n < 3 or len(x) <= n:
+        return x, y
+    bordes = np.linspace(1, len(x) - 1, n - 1).astype(np.int64)
+    elegidos = np.empty(n, dtype=np.int64)
+    elegidos[0], elegidos[-1] = 0, len(x) - 1
+
+    a = 0
+    for i in range(n - 2):
+        ini, fin = bordes[i], bordes[i + 1]
+        if i + 2 < len(bordes):
+            s_ini, s_fin = bordes[i + 1], bordes[i + 2]
+        else:
+            s_ini, s_fin = len(x) - 1, len(x)
+        cx, cy = x[s_ini:s_fin].mean(), y[s_ini:s_fin].mean()
+        area = np.abs((x[a] - cx) * (y[ini:fin] - y[a]) - (x[a] - x[ini:fin]) * (cy - y[a]))
+        a = ini + int(area.argmax())
+        elegidos[i + 1] = a
+    return x[elegidos], y[elegidos]
+
+
+def _capacidad(cochera_id, tipo_id):
+    caps = services_catalogo.capacidades(cochera_id)
+    return caps.get(tipo_id, 0) if tipo_id else sum(caps.values())
+
+
+def _calcular(cochera_id, tipo_id, t0, t1, puntos, modo):
+    ahora = timezone.now().timestamp()
+    # lo que todavía no pasó queda sin dato
+    fin = min(t1, ahora)
+    res = {"desde": int(t0), "hasta": int(t1), "modo": modo, "capacidad": _capacidad(cochera_id, tipo_id)}
+    if fin <= t0:
+        res.update({"t": [], "max": [], "promedio": []} if modo == "max" else {"t": [], "v": []})
+        return res
+
+    ing, egr = _intervalos(cochera_id, tipo_id, t0, fin)
+
+    if modo == "lttb":
+        x, y = lttb(*_escalones(ing, egr, t0, fin), puntos)
+        res.update({"t": x.astype(np.int64).tolist(), "v": y.astype(np.int64).tolist()})
+        return res
+
+    paso = (t1 - t0) / puntos
+    # solo los cubos que ya empezaron
+    n = min(puntos, math.ceil((fin - t0) / paso))
+    bordes, maximo, promedio = _barrido(ing, egr, t0, paso, n, fin)
+    res.update({
+        "paso_s": round(paso, 3),
+        "t": bordes.astype(np.int64).tolist(),
+        "max": maximo.astype(np.int64).tolist(),
+        "promedio": np.round(promedio, 2).tolist(),
+    })
+    return res
+
+
+def serie_ocupacion(cochera_id, desde, hasta, *, puntos=300, modo="max", tipo_id=None):
+    """
+    Ocupación de la cochera (o de un tipo) entre desde y hasta (aware), reducida
+    a `puntos`. Devuelve un dict listo para JSON con epochs en segundos.
+    """
+    if modo not in ("max", "lttb"):
+        raise ValueError("Modo inválido (max o lttb).")
+    if hasta <= desde:
+        raise ValueError("El rango está vacío.")
+    puntos = max(2, min(int(puntos), MAX_PUNTOS))
+    t0, t1 = desde.timestamp(), hasta.timestamp()
+
+    key = f"ocupacion:serie:{tenancy.clave(cochera_id, tipo_id or 0, int(t0), int(t1), puntos, modo)}"
+    res = cache.get(key)
+    if res is None:
+        res = _calcular(cochera_id, tipo_id, t0, t1, puntos, modo)
+        cache.set(key, res, CACHE_TTL if t1 <= timezone.now().timestamp() else CACHE_TTL_VIVO)
+    return res
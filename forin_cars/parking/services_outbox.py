@@ -0,0 +1,322 @@
+"""
+Outbox de webhooks: avisar a sistemas externos (contabilidad, barreras,
+cartelería) de cada ingreso/egreso sin frenar la puerta y sin perder avisos si
+el receptor está caído.
+
+- `services_eventos.registrar` deja un MensajeOutbox por endpoint suscripto en
+  la misma transacción del evento: un INSERT más, y si hay rollback no sale
+  nada. Lo que escribe eventos en bloque (cierres de abandonados,
+  reconciliación) usa `encolar_lote`. Sin PARKING_WEBHOOKS no se escribe nada.
+- `despachar_outbox` reclama lotes con un solo UPDATE (pueden correr varios),
+  manda en paralelo reusando conexiones (keep-alive por hilo) y guarda los
+  resultados en bloque. Lo que falla vuelve a PENDIENTE con backoff
+  exponencial (con jitter, para que no vuelvan todos juntos cuando el receptor
+  se levanta); después de `max_intentos` respuestas de error queda FALLIDO
+  para mirarlo.
+- Si un endpoint no contesta (conexión caída, timeout), el resto de su lote no
+  se intenta: va directo al backoff en vez de esperar un timeout por mensaje.
+  Eso no gasta intentos ni tiene tope: cada mensaje espera más o menos lo que
+  ya lleva en la cola (hasta BACKOFF_MAX), así un receptor caído por horas no
+  manda nada a FALLIDO.
+
+Entrega al menos una vez y sin orden garantizado: el receptor deduplica por
+`id` del evento (también en la cabecera X-Parking-Evento) y ordena por
+`ocurrido_at`. Con secreto, cada POST lleva
+`X-Parking-Firma: t=<epoch>,v1=<hex>` = HMAC-SHA256 de "<t>.<cuerpo>".
+"""
+import hashlib
+import hmac
+import http.client
+import json
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from .models import EventoMovimiento, MensajeOutbox
+from . import tenancy
+
+
+# AJUSTE: cierres en bloque (cobran, como un egreso) y correcciones de la reconciliación
+EVENTOS = (EventoMovimiento.INGRESO, EventoMovimiento.EGRESO, EventoMovimiento.AJUSTE)
+# avisos de services_alertas: solo les llegan a los endpoints que lo piden en "eventos"
+UMBRAL = "UMBRAL"
+TIMEOUT = 5
+# respuestas de error (no cuenta cuando el endpoint no contesta)
+MAX_INTENTOS = 12
+# segundos antes del reintento n: BACKOFF_BASE * 2**(n-1), con tope
+BACKOFF_BASE = 5
+BACKOFF_MAX = 60 * 60
+LARGO_ERROR = 500
+# ids por UPDATE ... WHERE id IN (...) (sqlite tiene tope de variables)
+LOTE_IDS = 900
+
+_config = (None, {})
+_local = threading.local()
+
+
+def destinos():
+    """PARKING_WEBHOOKS normalizado: {nombre: config}. Se rearma solo si cambia el setting."""
+    global _config
+    crudo = getattr(settings, "PARKING_WEBHOOKS", None) or []
+    if _config[0] is not crudo:
+        config = {}
+        for d in crudo:
+            config[d["nombre"]] = {
+                "nombre": d["nombre"],
+                "url": d["url"],
+                "secreto": d.get("secreto", ""),
+                "eventos": frozenset(d.get("eventos") or EVENTOS),
+                "cocheras": frozenset(d.get("cocheras") or ()),
+                "lote": max(1, int(d.get("lote", 1))),
+                "timeout": float(d.get("timeout", TIMEOUT)),
+                "max_intentos": int(d.get("max_intentos", MAX_INTENTOS)),
+            }
+        _config = (crudo, config)
+    return _config[1]
+
+
+def cuerpo_de(evento):
+    """Lo que recibe el endpoint por cada evento."""
+    return {
+        "id": f"{tenancy.alias_actual()}-{evento.id}",
+        "tipo": evento.tipo,
+        "cochera_id": evento.cochera_id,
+        "movimiento_id": evento.movimiento_id,
+        "espacio_id": evento.espacio_id,
+        "operador_id": evento.operador_id,
+        "monto": None if evento.monto is None else str(evento.monto),
+        "ocurrido_at": evento.ocurrido_at.isoformat(),
+        "detalle": evento.payload,
+    }
+
+
+def _suscriptos(tipo, cochera_id):
+    return [
+        d["nombre"]
+        for d in destinos().values()
+        if tipo in d["eventos"] and (not d["cocheras"] or cochera_id in d["cocheras"])
+    ]
+
+
+def encolar(evento):
+    """Deja el evento para cada endpoint suscripto. Va dentro de la transacción del evento."""
+    encolar_lote([evento])
+
+
+def encolar_lote(eventos):
+    """encolar() de varios eventos ya guardados (con id) en un solo bulk_create."""
+    if not destinos():
+        return
+    mensajes = []
+    for evento in eventos:
+        para = _suscriptos(evento.tipo, evento.cochera_id)
+        if para:
+            cuerpo = cuerpo_de(evento)
+            mensajes += [
+                MensajeOutbox(destino=nombre, evento_id=evento.id, cochera_id=evento.cochera_id, cuerpo=cuerpo)
+                for nombre in para
+            ]
+    MensajeOutbox.objects.bulk_create(mensajes, batch_size=1000)
+
+
+def encolar_aviso(cuerpo):
+    """
+    Como encolar() para avisos que no son un EventoMovimiento (UMBRAL): el
+    cuerpo ya viene armado con su id, tipo y cochera_id. Devuelve a cuántos
+    endpoints va.
+    """
+    para = _suscriptos(cuerpo["tipo"], cuerpo["cochera_id"])
+    MensajeOutbox.objects.bulk_create([
+        MensajeOutbox(destino=nombre, cochera_id=cuerpo["cochera_id"], cuerpo=cuerpo) for nombre in para
+    ])
+    return len(para)
+
+
+# --------------------------------------------------------------------------
+# despacho
+# --------------------------------------------------------------------------
+
+def reclamar(worker, n):
+    """
+    Toma hasta n mensajes listos, por antigüedad. Un solo UPDATE los marca con
+    una clave de este lote (exige PENDIENTE: dos despachadores nunca se llevan
+    el mismo) y después se leen por esa clave.
+    """
+    ahora = timezone.now()
+    ids = list(
+        MensajeOutbox.objects.filter(estado=MensajeOutbox.PENDIENTE, disponible_at__lte=ahora)
+        .order_by("disponible_at", "id")
+        .values_list("id", flat=True)[:n]
+    )
+    if not ids:
+        return []
+    marca = f"{worker[:70]}:{uuid.uuid4().hex[:8]}"
+    MensajeOutbox.objects.filter(id__in=ids, estado=MensajeOutbox.PENDIENTE).update(
+        estado=MensajeOutbox.ENVIANDO, tomado_por=marca, tomado_at=ahora, intentos=F("intentos") + 1
+    )
+    return list(
+        MensajeOutbox.objects.filter(id__in=ids, tomado_por=marca, estado=MensajeOutbox.ENVIANDO)
+        .only("id", "destino", "cuerpo", "intentos", "created_at")
+        .order_by("id")
+    )
+
+
+def firmar(secreto, t, cuerpo):
+    return hmac.new(secreto.encode(), f"{t}.".encode() + cuerpo, hashlib.sha256).hexdigest()
+
+
+class _Caido(Exception):
+    """El endpoint no contestó (no es un HTTP de error)."""
+
+
+def _conexion(url, timeout):
+    """Conexión keep-alive de este hilo al host de `url` y la ruta a pedir."""
+    partes = urlsplit(url)
+    conexiones = _local.__dict__.setdefault("conexiones", {})
+    clave = (partes.scheme, partes.netloc, timeout)
+    conn = conexiones.get(clave)
+    reusada = conn is not None
+    if conn is None:
+        clase = http.client.HTTPSConnection if partes.scheme == "https" else http.client.HTTPConnection
+        conn = conexiones[clave] = clase(partes.netloc, timeout=timeout)
+    ruta = (partes.path or "/") + (f"?{partes.query}" if partes.query else "")
+    return conn, ruta, reusada, lambda: conexiones.pop(clave, None)
+
+
+def _post(destino, cuerpos):
+    """Manda uno o varios eventos en un POST. None si el endpoint dijo 2xx, si no el error."""
+    datos = cuerpos[0] if destino["lote"] == 1 else cuerpos
+    body = json.dumps(datos, separators=(",", ":"), ensure_ascii=False).encode()
+    headers = {
+        "Content-Type": "application/json",
+        "User-Agent": "forin-cars-outbox",
+        "X-Parking-Evento": ",".join(c["id"] for c in cuerpos),
+    }
+    if destino["secreto"]:
+        t = str(int(time.time()))
+        headers["X-Parking-Firma"] = f"t={t},v1={firmar(destino['secreto'], t, body)}"
+
+    while True:
+        conn, ruta, reusada, descartar = _conexion(destino["url"], destino["timeout"])
+        try:
+            conn.request("POST", ruta, body=body, headers=headers)
+            resp = conn.getresponse()
+            resp.read()
+        except (OSError, http.client.HTTPException) as e:
+            conn.close()
+            descartar()
+            # una conexión vieja que el servidor ya cerró: se reintenta una vez con una nueva
+            if reusada:
+                continue
+            raise _Caido(f"{type(e).__name__}: {e}"[:LARGO_ERROR]) from e
+        if resp.will_close:
+            conn.close()
+            descartar()
+        if 200 <= resp.status < 300:
+            return None
+        return f"HTTP {resp.status} {resp.reason}"[:LARGO_ERROR]
+
+
+def _en_lotes(ids, n=LOTE_IDS):
+    for i in range(0, len(ids), n):
+        yield ids[i:i + n]
+
+
+def entregar(mensajes, pool, *, backoff_base=BACKOFF_BASE):
+    """Manda un lote ya reclamado (en `pool`) y guarda cómo salió. Devuelve (entregados, con_error)."""
+    config = destinos()
+    grupos, huerfanos = [], []
+    por_destino = defaultdict(list)
+    for m in mensajes:
+        por_destino[m.destino].append(m)
+    for nombre, lista in por_destino.items():
+        d = config.get(nombre)
+        if d is None:
+            huerfanos.extend(lista)
+            continue
+        grupos.extend((d, lista[i:i + d["lote"]]) for i in range(0, len(lista), d["lote"]))
+
+    caidos = {}
+
+    def enviar(grupo):
+        """(destino, mensajes, error o None, si el endpoint no contestó o ni se probó)."""
+        d, lista = grupo
+        if d["nombre"] in caidos:
+            return d, lista, f"No se intentó: {caidos[d['nombre']]}", True
+        try:
+            return d, lista, _post(d, [m.cuerpo for m in lista]), False
+        except _Caido as e:
+            caidos[d["nombre"]] = str(e)
+            return d, lista, str(e), True
+
+    ahora = timezone.now()
+    ok, fallas = [], defaultdict(list)
+    for d, lista, error, caido in pool.map(enviar, grupos):
+        if error is None:
+            ok.extend(m.id for m in lista)
+            continue
+        for m in lista:
+            if caido:
+                # devuelve el intento que sumó reclamar(); el nivel de backoff
+                # sale de lo que lleva en la cola: espera más o menos eso
+                edad = (ahora - m.created_at).total_seconds()
+                fallas[(False, max(1, int(edad / backoff_base).bit_length()), error, True)].append(m.id)
+            else:
+                fallas[(m.intentos >= d["max_intentos"], m.intentos, error, False)].append(m.id)
+    for m in huerfanos:
+        fallas[(True, m.intentos, f"El endpoint {m.destino} no está en PARKING_WEBHOOKS.", False)].append(m.id)
+
+    for ids in _en_lotes(ok):
+        MensajeOutbox.objects.filter(id__in=ids).update(estado=MensajeOutbox.ENTREGADO, entregado_at=ahora, error="")
+    for (agotado, nivel, error, caido), ids in fallas.items():
+        if agotado:
+            cambios = {"estado": MensajeOutbox.FALLIDO}
+        else:
+            espera = min(backoff_base * 2 ** (nivel - 1), BACKOFF_MAX) * random.uniform(1, 1.25)
+            cambios = {"estado": MensajeOutbox.PENDIENTE, "disponible_at": ahora + timedelta(seconds=espera)}
+        if caido:
+            cambios["intentos"] = F("intentos") - 1
+        for lote in _en_lotes(ids):
+            MensajeOutbox.objects.filter(id__in=lote).update(error=error, **cambios)
+    return len(ok), sum(len(ids) for ids in fallas.values())
+
+
+def despachar(worker, pool, lote, *, backoff_base=BACKOFF_BASE):
+    """Una pasada por cada shard: reclama hasta `lote` mensajes y los entrega. Devuelve (entregados, con_error)."""
+    entregados = con_error = 0
+    for alias in tenancy.shards():
+        with tenancy.tenant(alias):
+            mensajes = reclamar(worker, lote)
+            if mensajes:
+                e, f = entregar(mensajes, pool, backoff_base=backoff_base)
+                entregados += e
+                con_error += f
+    return entregados, con_error
+
+
+def rescatar_colgados(vencimiento):
+    """Los ENVIANDO hace más de `vencimiento` son de un despachador que murió: vuelven a PENDIENTE."""
+    limite = timezone.now() - vencimiento
+    return MensajeOutbox.objects.filter(estado=MensajeOutbox.ENVIANDO, tomado_at__lt=limite).update(
+        estado=MensajeOutbox.PENDIENTE, disponible_at=timezone.now()
+    )
+
+
+def reintentar_fallidos():
+    return MensajeOutbox.objects.filter(estado=MensajeOutbox.FALLIDO).update(
+        estado=MensajeOutbox.PENDIENTE, intentos=0, disponible_at=timezone.now(), error=""
+    )
+
+
+def purgar(dias):
+    """Borra los ENTREGADOS más viejos que `dias` (los FALLIDOS quedan para mirarlos)."""
+    limite = timezone.now() - timedelta(days=dias)
+    return MensajeOutbox.objects.filter(estado=MensajeOutbox.ENTREGADO, entregado_at__lt=limite).delete()[0]
@@ -0,0 +1,201 @@
+"""
+Protocolo de línea de los portones (barreras, lectores de ticket, carteles).
+
+Sin HTTP, sesión, CSRF ni templates: el dispositivo abre una conexión TCP con
+`servidor_porton`, se autentica una vez y después manda una línea por lectura.
+Cada comando es una línea UTF-8 terminada en \\n y cada respuesta también:
+
+    AUTH <token>                   -> OK <cochera_id> <dispositivo>     | ERR <motivo>
+    ENTRY <tipo> [ticket|-] [ult3] -> OPEN <ticket> <espacio> <libres>  | DENY <libres> <motivo>
+    EXIT <ticket>                  -> OPEN <monto> <libres>             | DENY <libres> <motivo>
+    QUERY                          -> FREE <libres> <Tipo>=<n> ...
+    PING                           -> PONG
+    QUIT                           -> BYE
+
+`tipo` es el id o el nombre del TipoEspacio; sin ticket (o con "-") se emite
+uno. `libres` son los espacios libres de la cochera después de la operación.
+Si un ENTRY se rechaza por falta de lugar, el motivo termina con las cocheras
+cercanas con lugar (services_cercanas): `... | CERCA <id>:<libres>:<km> ...`.
+
+Acá está la parte sincrónica (la que toca la base): el servidor la corre en un
+pool de hilos acotado. Los dispositivos se buscan por el sha256 del token en un
+directorio en memoria de todos los shards, que se recarga cada DIRECTORIO_TTL
+(así una baja corta las sesiones abiertas) o ante un token desconocido.
+"""
+import hashlib
+import logging
+import secrets
+import threading
+import time
+
+from django.contrib.auth import get_user_model
+from django.db.models import Count
+
+from .models import Dispositivo, Espacio
+from .services_movimientos import SinLugar, egresar_vehiculo, ingresar_vehiculo
+from .services_tickets import emitir_ticket
+from . import secuenciador, services_catalogo, services_cercanas, tenancy
+
+
+log = logging.getLogger(__name__)
+
+DIRECTORIO_TTL = 60
+# un token desconocido recarga el directorio como mucho cada tanto (no es un
+# atajo para pegarle a la base)
+RECARGA_MIN = 5
+LARGO_MOTIVO = 200
+
+_cache = {"por_hash": {}, "cargado": float("-inf")}
+_lock = threading.Lock()
+
+
+class Sesion:
+    """Un dispositivo autenticado, con la cochera y el operador ya cargados."""
+    __slots__ = ("alias", "dispositivo_id", "nombre", "token_hash", "cochera", "operador")
+
+    def __init__(self, alias, dispositivo, operador):
+        self.alias = alias
+        self.dispositivo_id = dispositivo.id
+        self.nombre = dispositivo.nombre
+        self.token_hash = dispositivo.token_hash
+        self.cochera = dispositivo.cochera
+        self.operador = operador
+
+
+def nuevo_token():
+    return secrets.token_urlsafe(24)
+
+
+def hash_token(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def _cargar():
+    por_hash = {}
+    for alias in tenancy.shards():
+        with tenancy.tenant(alias):
+            dispositivos = list(
+                Dispositivo.objects.filter(activo=True, cochera__activa=True).select_related("cochera")
+            )
+        operadores = get_user_model().objects.in_bulk({d.operador_id for d in dispositivos})
+        for d in dispositivos:
+            if d.operador_id in operadores:
+                por_hash[d.token_hash] = Sesion(alias, d, operadores[d.operador_id])
+    return por_hash
+
+
+def _directorio(edad_max):
+    """{sha256 del token: Sesion}, recargado si tiene más de `edad_max` segundos (recarga uno solo)."""
+    if time.monotonic() - _cache["cargado"] > edad_max:
+        with _lock:
+            if time.monotonic() - _cache["cargado"] > edad_max:
+                _cache["por_hash"] = _cargar()
+                _cache["cargado"] = time.monotonic()
+    return _cache["por_hash"]
+
+
+def autenticar(token):
+    """La Sesion del dispositivo con ese token, o None."""
+    h = hash_token(token.strip())
+    sesion = _directorio(DIRECTORIO_TTL).get(h)
+    if sesion is None:
+        sesion = _directorio(RECARGA_MIN).get(h)
+    return sesion
+
+
+def bienvenida(sesion):
+    return f"OK {sesion.cochera.id} {_campo(sesion.nombre)}"
+
+
+def _vigente(sesion):
+    actual = _directorio(DIRECTORIO_TTL).get(sesion.token_hash)
+    return actual is not None and actual.dispositivo_id == sesion.dispositivo_id
+
+
+def libres(cochera_id):
+    """{tipo_id: espacios libres} (cuenta por el índice cochera, tipo, ocupado)."""
+    return dict(
+        Espacio.objects.filter(cochera_id=cochera_id, ocupado=False)
+        .values_list("tipo_id")
+        .annotate(n=Count("id"))
+        .order_by()
+    )
+
+
+def _campo(valor):
+    """Un campo de la respuesta: sin espacios (se separa por espacios)."""
+    return str(valor).strip().replace(" ", "_") or "-"
+
+
+def _tipo(valor):
+    tipo = services_catalogo.tipo(valor)
+    if tipo is None:
+        tipo = next((t for t in services_catalogo.tipos() if t.nombre.upper() == valor.upper()), None)
+    if tipo is None:
+        raise ValueError(f"Tipo de vehículo inválido: {valor}")
+    return tipo
+
+
+def _entrada(sesion, argumentos):
+    if not argumentos:
+        raise ValueError("Falta el tipo de vehículo.")
+    tipo = _tipo(argumentos[0])
+    ticket = argumentos[1] if len(argumentos) > 1 and argumentos[1] != "-" else ""
+    # como en la pantalla de ingreso: el ticket se emite antes de abrir la transacción
+    if not ticket:
+        ticket = emitir_ticket(sesion.cochera.id)
+    mov = secuenciador.ejecutar(
+        sesion.cochera.id,
+        ingresar_vehiculo,
+        cochera=sesion.cochera,
+        operador=sesion.operador,
+        tipo=tipo,
+        ticket=ticket,
+        patente_ult3=argumentos[2] if len(argumentos) > 2 else "",
+    )
+    total = sum(libres(sesion.cochera.id).values())
+    return f"OPEN {_campo(mov.vehiculo.ticket)} {_campo(mov.espacio.etiqueta)} {total}"
+
+
+def _salida(sesion, argumentos):
+    if not argumentos:
+        raise ValueError("Falta el ticket.")
+    mov = secuenciador.ejecutar(
+        sesion.cochera.id, egresar_vehiculo, cochera=sesion.cochera, operador=sesion.operador, ticket=argumentos[0]
+    )
+    total = sum(libres(sesion.cochera.id).values())
+    return f"OPEN {mov.monto} {total}"
+
+
+def _consulta(sesion, argumentos):
+    por_tipo = libres(sesion.cochera.id)
+    nombres = {t.id: t.nombre for t in services_catalogo.tipos()}
+    # los tipos con capacidad aparecen aunque estén en 0
+    tipos = sorted(set(services_catalogo.capacidades(sesion.cochera.id)) | set(por_tipo), key=lambda t: nombres.get(t, ""))
+    detalle = " ".join(f"{_campo(nombres.get(t, t))}={por_tipo.get(t, 0)}" for t in tipos)
+    return f"FREE {sum(por_tipo.values())} {detalle}".rstrip()
+
+
+COMANDOS = {"ENTRY": _entrada, "EXIT": _salida, "QUERY": _consulta}
+
+
+def ejecutar(sesion, comando, argumentos):
+    """Corre un comando de un dispositivo autenticado y devuelve la línea de respuesta (sin \\n)."""
+    func = COMANDOS.get(comando)
+    if func is None:
+        return f"ERR Comando desconocido: {_campo(comando)[:20]}"
+    if not _vigente(sesion):
+        return "ERR Dispositivo dado de baja."
+    with tenancy.tenant(sesion.alias):
+        try:
+            return func(sesion, argumentos)
+        except ValueError as e:
+            motivo = " ".join(str(e).split())[:LARGO_MOTIVO]
+            if isinstance(e, SinLugar):
+                cerca = services_cercanas.cercanas(sesion.cochera, e.tipo_id)
+                if cerca:
+                    motivo += " | CERCA " + " ".join(f"{c.id}:{c.libres}:{c.distancia_km}" for c in cerca)
+            return f"DENY {sum(libres(sesion.cochera.id).values())} {motivo}"
+        except Exception:
+            log.exception("portón: %s %s de %s falló", comando, argumentos, sesion.nombre)
+            return "ERR Error interno."
@@ -0,0 +1,198 @@
+"""
+Pronóstico de ocupación por (cochera, tipo) a partir del histórico de Movimiento.
+
+Se arma un perfil semanal (168 horas) con:
+- llegadas: cantidad de ingresos por hora-de-la-semana
+- estadias: histograma de duración de estadías en horas (truncado a MAX_ESTADIA_H)
+
+La ocupación esperada en la hora t es la convolución circular de la tasa de
+llegadas con la curva de supervivencia de las estadías. El perfil se guarda en
+cache y se refresca incrementalmente (solo movimientos cerrados después de la
+última marca), así que un pedido normal no vuelve a escanear el histórico.
+"""
+from itertools import islice
+
+import numpy as np
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import Movimiento
+from . import services_catalogo, tenancy
+
+
+HORAS_SEMANA = 168
+MAX_ESTADIA_H = 72
+REFRESCO_SEG = 300
+CHUNK = 100_000
+CACHE_TTL = 60 * 60 * 24
+
+# 1970-01-01 fue jueves (weekday() == 3)
+_DIA_EPOCH = 3
+
+
+def _cache_key(cochera_id):
+    return f"pronostico:v1:{tenancy.clave(cochera_id)}"
+
+
+def _offset_local():
+    # sin DST: alcanza para armar perfiles horarios
+    return int(timezone.localtime().utcoffset().total_seconds())
+
+
+def _horas_locales(fechas, offset):
+    seg = np.fromiter((f.timestamp() for f in fechas), dtype=np.float64, count=len(fechas))
+    return ((seg + offset) // 3600).astype(np.int64)
+
+
+def _hora_semana(horas):
+    return ((horas // 24 + _DIA_EPOCH) % 7) * 24 + horas % 24
+
+
+def _perfil_vacio():
+    return {
+        "tipos": {},          # tipo_id -> {"llegadas": ndarray(168), "estadias": ndarray(MAX+1)}
+        "primera_hora": None,  # hora epoch (local) del primer ingreso visto
+        "marca": None,         # egreso_at más alto procesado
+        "ids_marca": set(),    # ids con egreso_at == marca (para no contarlos dos veces)
+        "actualizado": 0.0,
+    }
+
+
+def _acumular(perfil, filas, offset):
+    ids, tipos, ingresos, egresos = zip(*filas)
+
+    h_ing = _horas_locales(ingresos, offset)
+    dur = np.fromiter(
+        ((e - i).total_seconds() for i, e in zip(ingresos, egresos)),
+        dtype=np.float64,
+        count=len(ingresos),
+    )
+    bins_estadia = np.clip(dur // 3600, 0, MAX_ESTADIA_H).astype(np.int64)
+    hs = _hora_semana(h_ing)
+
+    tipos_arr = np.asarray(tipos, dtype=np.int64)
+    uniq, codigos = np.unique(tipos_arr, return_inverse=True)
+
+    llegadas = np.bincount(codigos * HORAS_SEMANA + hs, minlength=len(uniq) * HORAS_SEMANA)
+    estadias = np.bincount(codigos * (MAX_ESTADIA_H + 1) + bins_estadia, minlength=len(uniq) * (MAX_ESTADIA_H + 1))
+    llegadas = llegadas.reshape(len(uniq), HORAS_SEMANA)
+    estadias = estadias.reshape(len(uniq), MAX_ESTADIA_H + 1)
+
+    for i, tipo_id in enumerate(uniq.tolist()):
+        t = perfil["tipos"].setdefault(tipo_id, {
+            "llegadas": np.zeros(HORAS_SEMANA, dtype=np.int64),
+            "estadias": np.zeros(MAX_ESTADIA_H + 1, dtype=np.int64),
+        })
+        t["llegadas"] += llegadas[i]
+        t["estadias"] += estadias[i]
+
+    primera = int(h_ing.min())
+    if perfil["primera_hora"] is None or primera < perfil["primera_hora"]:
+        perfil["primera_hora"] = primera
+
+    ultima = max(egresos)
+    if perfil["marca"] is None or ultima > perfil["marca"]:
+        perfil["marca"] = ultima
+        perfil["ids_marca"] = set()
+    perfil["ids_marca"].update(i for i, e in zip(ids, egresos) if e == perfil["marca"])
+
+
+def _refrescar(perfil, cochera_id):
+    qs = Movimiento.objects.filter(cochera_id=cochera_id, estado=Movimiento.CERRADO, egreso_at__isnull=False)
+    if perfil["marca"] is not None:
+        qs = qs.filter(egreso_at__gte=perfil["marca"])
+
+    it = qs.order_by().values_list("id", "espacio__tipo_id", "ingreso_at", "egreso_at").iterator(chunk_size=CHUNK)
+    offset = _offset_local()
+    vistos = set(perfil["ids_marca"])
+
+    while True:
+        chunk = list(islice(it, CHUNK))
+        if not chunk:
+            break
+        filas = [f for f in chunk if f[0] not in vistos]
+        if filas:
+            _acumular(perfil, filas, offset)
+
+    perfil["actualizado"] = timezone.now().timestamp()
+    return perfil
+
+
+def obtener_perfil(cochera_id, forzar=False):
+    """
+    Devuelve el perfil ajustado de la cochera. Si está en cache y es reciente no
+    toca la base; si está viejo, solo lee lo cerrado desde la última marca.
+    """
+    key = _cache_key(cochera_id)
+    perfil = cache.get(key)
+    ahora = timezone.now().timestamp()
+
+    if perfil is None:
+        perfil = _refrescar(_perfil_vacio(), cochera_id)
+        cache.set(key, perfil, CACHE_TTL)
+    elif forzar or ahora - perfil["actualizado"] > REFRESCO_SEG:
+        perfil = _refrescar(perfil, cochera_id)
+        cache.set(key, perfil, CACHE_TTL)
+
+    return perfil
+
+
+def invalidar_perfil(cochera_id):
+    cache.delete(_cache_key(cochera_id))
+
+
+def _semanas_observadas(perfil):
+    if perfil["primera_hora"] is None or perfil["marca"] is None:
+        return 1.0
+    ultima = int((perfil["marca"].timestamp() + _offset_local()) // 3600)
+    return max((ultima - perfil["primera_hora"] + 1) / HORAS_SEMANA, 1.0)
+
+
+def _curva_semanal(t, semanas):
+    tasa = t["llegadas"] / semanas
+    total = t["estadias"].sum()
+    if total == 0:
+        return np.zeros(HORAS_SEMANA)
+
+    # supervivencia[k] = P(estadía >= k horas), el bin 0 siempre cuenta
+    supervivencia = 1.0 - np.concatenate(([0], np.cumsum(t["estadias"])[:-1])) / total
+
+    k = np.arange(MAX_ESTADIA_H + 1)
+    idx = (np.arange(HORAS_SEMANA)[:, None] - k[None, :]) % HORAS_SEMANA
+    return (tasa[idx] * supervivencia[None, :]).sum(axis=1)
+
+
+def pronosticar(cochera, fecha=None):
+    """
+    Curva horaria (24 valores) de ocupación esperada por tipo para el día
+    `fecha` (date). Si no viene, se usa hoy.
+    """
+    if fecha is None:
+        fecha = timezone.localdate()
+
+    perfil = obtener_perfil(cochera.id)
+    semanas = _semanas_observadas(perfil)
+    desde = fecha.weekday() * 24
+
+    capacidades = {
+        tipo_id: (services_catalogo.tipo(tipo_id).nombre, cantidad)
+        for tipo_id, cantidad in services_catalogo.capacidades(cochera.id).items()
+    }
+
+    res = {}
+    for tipo_id, (nombre, cantidad) in capacidades.items():
+        t = perfil["tipos"].get(tipo_id)
+        if t is None:
+            curva = np.zeros(24)
+        else:
+            curva = _curva_semanal(t, semanas)[desde:desde + 24]
+        if cantidad:
+            curva = np.minimum(curva, cantidad)
+
+        res[tipo_id] = {
+            "tipo": nombre,
+            "capacidad": cantidad,
+            "ocupacion": [round(float(v), 2) for v in curva],
+            "pct": [round(float(v) / cantidad * 100, 1) if cantidad else 0.0 for v in curva],
+        }
+    return res
@@ -0,0 +1,197 @@
+"""
+Reconciliación de Espacio.ocupado contra los movimientos ABIERTOS.
+
+Todo se detecta con pocas queries por conjunto (sin recorrer espacios en
+Python) y se repara en bloque, con un evento AJUSTE/REASIGNACION por fila
+tocada para que el replay de la bitácora llegue al mismo estado:
+
+1. movimientos en espacios de otra cochera -> se reubican en su cochera
+2. dos o más ABIERTOS en un espacio -> queda el más viejo, el resto se reubica
+3. espacios ocupados sin movimiento ABIERTO -> se liberan
+4. ABIERTOS en espacios libres -> el espacio se marca ocupado
+
+Los pasos 3 y 4 llevan la condición dentro del UPDATE, así no pisan un
+ingreso/egreso que commitee en el medio.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, Exists, F, OuterRef
+
+from .models import Espacio, EventoMovimiento, Movimiento
+from .services_asignacion import invalidar_espacios
+from .services_eventos import _en_lotes
+from . import services_outbox, tenancy
+
+
+MUESTRA = 20
+
+
+def _abierto_en(espacio_ref="pk"):
+    return Exists(Movimiento.objects.filter(espacio_id=OuterRef(espacio_ref), estado=Movimiento.ABIERTO))
+
+
+def _scope(qs, cochera_id, campo="cochera_id"):
+    return qs.filter(**{campo: cochera_id}) if cochera_id else qs
+
+
+def detectar(cochera_id=None):
+    """Devuelve los ids en falta por categoría (una query por categoría)."""
+    abiertos = _scope(Movimiento.objects.filter(estado=Movimiento.ABIERTO), cochera_id)
+
+    otra_cochera = list(
+        abiertos.exclude(espacio__cochera_id=F("cochera_id"))
+        .values_list("id", "cochera_id", "espacio__tipo_id", "espacio_id")
+    )
+
+    espacios_dobles = (
+        abiertos.values("espacio_id").annotate(n=Count("id")).filter(n__gt=1).values("espacio_id")
+    )
+    # de cada espacio doble queda el más viejo (menor ingreso_at, después id)
+    dobles = []
+    ultimo = None
+    for fila in (
+        abiertos.filter(espacio_id__in=espacios_dobles)
+        .order_by("espacio_id", "ingreso_at", "id")
+        .values_list("id", "cochera_id", "espacio__tipo_id", "espacio_id")
+    ):
+        if fila[3] == ultimo:
+            dobles.append(fila)
+        ultimo = fila[3]
+
+    ocupados_sin_mov = list(
+        _scope(Espacio.objects.filter(ocupado=True), cochera_id)
+        .exclude(_abierto_en())
+        .values_list("id", "cochera_id")
+    )
+
+    libres_con_mov = list(
+        abiertos.filter(espacio__ocupado=False).values_list("espacio_id", "espacio__cochera_id").distinct()
+    )
+
+    return {
+        "otra_cochera": otra_cochera,
+        "dobles": dobles,
+        "ocupados_sin_movimiento": ocupados_sin_mov,
+        "libres_con_movimiento": libres_con_mov,
+    }
+
+
+def _reubicar(filas, motivo, cocheras):
+    """
+    filas = (mov_id, cochera_id, tipo_id, espacio_id). Cada movimiento pasa a un
+    espacio libre de su cochera y tipo. Devuelve cuántos no tuvieron lugar.
+    """
+    por_grupo = defaultdict(list)
+    for fila in filas:
+        por_grupo[(fila[1], fila[2])].append(fila)
+
+    sin_lugar = 0
+    cambios, eventos = [], []
+    for (coch, tipo_id), lista in por_grupo.items():
+        candidatos = list(
+            Espacio.objects.filter(cochera_id=coch, tipo_id=tipo_id, ocupado=False)
+            .exclude(abonados__activo=True)
+            .exclude(_abierto_en())
+            .order_by("orden", "id")
+            .values_list("id", flat=True)[:len(lista)]
+        )
+        for lote in _en_lotes(candidatos):
+            Espacio.objects.filter(id__in=lote, ocupado=False).update(ocupado=True)
+        sin_lugar += len(lista) - len(candidatos)
+
+        for (mov_id, _, _, anterior), nuevo in zip(lista, candidatos):
+            cambios.append(Movimiento(id=mov_id, espacio_id=nuevo))
+            eventos.append(EventoMovimiento(
+                tipo=EventoMovimiento.REASIGNACION,
+                cochera_id=coch,
+                movimiento_id=mov_id,
+                espacio_id=nuevo,
+                # el anterior lo libera (o no) el AJUSTE del paso 3
+                payload={"espacio_anterior": anterior, "liberar_anterior": False, "motivo": motivo},
+            ))
+        cocheras.add(coch)
+
+    Movimiento.objects.bulk_update(cambios, ["espacio"], batch_size=500)
+    EventoMovimiento.objects.bulk_create(eventos, batch_size=1000)
+    services_outbox.encolar_lote(eventos)
+    return sin_lugar
+
+
+def _ajustar_ocupacion(filas, ocupado, motivo, cocheras):
+    """Marca los espacios (id, cochera_id) re-chequeando la condición en el UPDATE."""
+    ids = [f[0] for f in filas]
+    if not ids:
+        return 0
+
+    # de a LOTE_IDS: en una cochera grande no entran todos en un IN (tope de variables de sqlite)
+    tocados = []
+    for lote in _en_lotes(ids):
+        qs = Espacio.objects.filter(id__in=lote, ocupado=not ocupado)
+        qs = qs.filter(_abierto_en()) if ocupado else qs.exclude(_abierto_en())
+        del_lote = list(qs.values_list("id", "cochera_id"))
+        Espacio.objects.filter(id__in=[t[0] for t in del_lote]).update(ocupado=ocupado)
+        tocados += del_lote
+
+    eventos = EventoMovimiento.objects.bulk_create(
+        [
+            EventoMovimiento(
+                tipo=EventoMovimiento.AJUSTE,
+                cochera_id=coch,
+                espacio_id=eid,
+                payload={"ocupado": ocupado, "motivo": motivo},
+            )
+            for eid, coch in tocados
+        ],
+        batch_size=1000,
+    )
+    services_outbox.encolar_lote(eventos)
+    cocheras.update(coch for _, coch in tocados)
+    return len(tocados)
+
+
+def reconciliar(*, cochera_id=None, aplicar=True):
+    """
+    Detecta y (si aplicar) repara. Devuelve {"detectado": {...}, "reparado": {...}}
+    con las cantidades y una muestra de ids por categoría.
+    """
+    hallado = detectar(cochera_id)
+    reporte = {
+        "detectado": {k: len(v) for k, v in hallado.items()},
+        "muestra": {k: [f[0] for f in v[:MUESTRA]] for k, v in hallado.items() if v},
+        "reparado": {},
+    }
+    if not aplicar or not any(hallado.values()):
+        return reporte
+
+    cocheras = set()
+    with transaction.atomic(using=tenancy.alias_actual()):
+        rep = reporte["reparado"]
+        rep["sin_lugar"] = _reubicar(hallado["otra_cochera"], "otra_cochera", cocheras)
+        rep["sin_lugar"] += _reubicar(hallado["dobles"], "espacio_doble", cocheras)
+        rep["reubicados"] = len(hallado["otra_cochera"]) + len(hallado["dobles"]) - rep["sin_lugar"]
+
+        # las reubicaciones cambian qué espacios quedan con/sin movimiento
+        if rep["reubicados"]:
+            hallado = detectar(cochera_id)
+        rep["liberados"] = _ajustar_ocupacion(
+            hallado["ocupados_sin_movimiento"], False, "ocupado_sin_movimiento", cocheras
+        )
+        rep["ocupados"] = _ajustar_ocupacion(
+            hallado["libres_con_movimiento"], True, "libre_con_movimiento", cocheras
+        )
+
+        for coch in cocheras:
+            transaction.on_commit(lambda c=coch: invalidar_espacios(c), using=tenancy.alias_actual())
+
+    return reporte
+
+
+def liberar_espacios(espacio_ids, motivo="manual"):
+    """Libera los espacios marcados ocupados que no tienen un ABIERTO. Devuelve cuántos."""
+    cocheras = set()
+    with transaction.atomic(using=tenancy.alias_actual()):
+        n = _ajustar_ocupacion([(i, None) for i in espacio_ids], False, motivo, cocheras)
+        for coch in cocheras:
+            transaction.on_commit(lambda c=coch: invalidar_espacios(c), using=tenancy.alias_actual())
+    return n
@@ -0,0 +1,241 @@
+"""
+Reservas y disponibilidad.
+
+Por cada (cochera, día) se arma un índice de intervalos con un barrido ordenado
+de las reservas ACTIVAS: por tipo, una lista de cortes (epoch) y la cantidad de
+lugares retenidos a partir de cada corte. Consultar "cuántos están retenidos a
+las 18:00" o "el máximo entre 9 y 13" es un bisect sobre esa lista. El índice
+vive en cache y se invalida con la versión de reservas de la cochera (signals).
+"""
+import secrets
+from bisect import bisect_left, bisect_right
+from datetime import datetime, time, timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import Reserva, Movimiento, Cliente, Cochera
+from .services_asignacion import obtener_pool
+from . import services_catalogo, tenancy, versiones
+
+
+VERSION = "reservas"
+CACHE_TTL = 60 * 60 * 24
+# se acepta la reserva un rato antes del horario pactado
+TOLERANCIA_INGRESO = timedelta(minutes=15)
+
+
+def _limites_dia(fecha):
+    ini = timezone.make_aware(datetime.combine(fecha, time.min))
+    return ini, ini + timedelta(days=1)
+
+
+def _ts(dt):
+    return int(dt.timestamp())
+
+
+def _construir_indice(cochera_id, fecha):
+    ini, fin = _limites_dia(fecha)
+    filas = Reserva.objects.filter(
+        cochera_id=cochera_id,
+        estado=Reserva.ACTIVA,
+        desde__lt=fin,
+        hasta__gt=ini,
+    ).values_list("tipo_id", "desde", "hasta")
+
+    eventos = {}
+    for tipo_id, desde, hasta in filas:
+        ev = eventos.setdefault(tipo_id, [])
+        ev.append((_ts(max(desde, ini)), 1))
+        ev.append((_ts(min(hasta, fin)), -1))
+
+    tipos = {}
+    for tipo_id, ev in eventos.items():
+        # a igual instante primero salen y después entran (intervalos semiabiertos)
+        ev.sort()
+        cortes, cantidades, actual = [_ts(ini)], [0], 0
+        for ts, delta in ev:
+            actual += delta
+            if ts == cortes[-1]:
+                cantidades[-1] = actual
+            else:
+                cortes.append(ts)
+                cantidades.append(actual)
+        tipos[tipo_id] = (cortes, cantidades)
+
+    return {"ini": _ts(ini), "fin": _ts(fin), "tipos": tipos}
+
+
+def indice_dia(cochera_id, fecha):
+    v = versiones.version(VERSION, cochera_id)
+    key = f"reservas:idx:{tenancy.clave(cochera_id, v, fecha.isoformat())}"
+    idx = cache.get(key)
+    if idx is None:
+        idx = _construir_indice(cochera_id, fecha)
+        cache.set(key, idx, CACHE_TTL)
+    return idx
+
+
+def invalidar_reservas(cochera_id):
+    versiones.bump(VERSION, cochera_id)
+
+
+def retenidas(cochera_id, tipo_id, instante):
+    """Lugares retenidos por reservas activas en un instante."""
+    idx = indice_dia(cochera_id, timezone.localtime(instante).date())
+    t = idx["tipos"].get(tipo_id)
+    if t is None:
+        return 0
+    cortes, cantidades = t
+    return cantidades[bisect_right(cortes, _ts(instante)) - 1]
+
+
+def max_retenidas(cochera_id, tipo_id, desde, hasta):
+    """Máximo de lugares retenidos en [desde, hasta)."""
+    res = 0
+    dia = timezone.localtime(desde).date()
+    ultimo = timezone.localtime(hasta - timedelta(microseconds=1)).date()
+    a, b = _ts(desde), _ts(hasta)
+
+    while dia <= ultimo:
+        t = indice_dia(cochera_id, dia)["tipos"].get(tipo_id)
+        if t is not None:
+            cortes, cantidades = t
+            i0 = max(bisect_right(cortes, a) - 1, 0)
+            i1 = max(bisect_left(cortes, b), i0 + 1)
+            res = max(res, max(cantidades[i0:i1]))
+        dia += timedelta(days=1)
+    return res
+
+
+def _capacidades(cochera_id):
+    return {
+        tipo_id: (services_catalogo.tipo(tipo_id), cantidad)
+        for tipo_id, cantidad in services_catalogo.capacidades(cochera_id).items()
+    }
+
+
+def _ocupados_por_tipo(cochera_id):
+    return dict(
+        Movimiento.objects.filter(cochera_id=cochera_id, estado=Movimiento.ABIERTO)
+        .values_list("espacio__tipo_id")
+        .annotate(n=Count("id"))
+        .order_by()
+    )
+
+
+def disponibilidad_dia(cochera, fecha):
+    """
+    Por tipo: tramos del día con lugares reservados y libres. La ocupación
+    actual solo descuenta en el tramo que contiene "ahora" (de los autos que
+    están adentro no sabemos cuándo salen).
+    """
+    idx = indice_dia(cochera.id, fecha)
+    ahora = _ts(timezone.now())
+    ocupados = _ocupados_por_tipo(cochera.id) if idx["ini"] <= ahora < idx["fin"] else {}
+
+    res = {}
+    for tipo_id, (tipo, capacidad) in _capacidades(cochera.id).items():
+        cortes, cantidades = idx["tipos"].get(tipo_id, ([idx["ini"]], [0]))
+        tramos = []
+        for i, (corte, reservadas) in enumerate(zip(cortes, cantidades)):
+            hasta = cortes[i + 1] if i + 1 < len(cortes) else idx["fin"]
+            adentro = ocupados.get(tipo_id, 0) if corte <= ahora < hasta else 0
+            tramos.append({
+                "desde": datetime.fromtimestamp(corte, tz=timezone.get_current_timezone()).isoformat(),
+                "hasta": datetime.fromtimestamp(hasta, tz=timezone.get_current_timezone()).isoformat(),
+                "reservadas": reservadas,
+                "libres": max(capacidad - reservadas - adentro, 0),
+            })
+        res[tipo_id] = {"tipo": tipo.nombre, "capacidad": capacidad, "tramos": tramos}
+    return res
+
+
+def _max_superpuestas(cochera_id, tipo_id, desde, hasta):
+    """Como max_retenidas, pero leyendo las reservas de la base y no del índice en cache."""
+    filas = Reserva.objects.filter(
+        cochera_id=cochera_id, tipo_id=tipo_id, estado=Reserva.ACTIVA, desde__lt=hasta, hasta__gt=desde
+    ).values_list("desde", "hasta")
+
+    eventos = []
+    for d, h in filas:
+        eventos.append((max(d, desde), 1))
+        eventos.append((min(h, hasta), -1))
+    # a igual instante primero salen
+    eventos.sort()
+    res = actual = 0
+    for _, delta in eventos:
+        actual += delta
+        res = max(res, actual)
+    return res
+
+
+def _nuevo_codigo():
+    return secrets.token_hex(4).upper()
+
+
+@tenancy.atomic
+def crear_reserva(*, cochera, tipo, desde, hasta, cliente_data=None):
+    if hasta <= desde:
+        raise ValueError("El horario de salida tiene que ser posterior al de entrada.")
+    if hasta <= timezone.now():
+        raise ValueError("No se puede reservar en el pasado.")
+
+    # una reserva a la vez por cochera (en sqlite ya lo serializa el BEGIN
+    # IMMEDIATE). El chequeo va contra la base: el índice en cache se invalida
+    # recién en el commit del otro y en ese hueco todavía no la cuenta.
+    Cochera.objects.select_for_update().filter(id=cochera.id).first()
+    capacidad = _capacidades(cochera.id).get(tipo.id, (tipo, 0))[1]
+    ocupadas = _max_superpuestas(cochera.id, tipo.id, desde, hasta)
+    if desde <= timezone.now():
+        ocupadas += _ocupados_por_tipo(cochera.id).get(tipo.id, 0)
+
+    if ocupadas >= capacidad:
+        raise ValueError(f"No hay lugar para reservar tipo '{tipo.nombre}' en ese horario.")
+
+    datos = {k: ((cliente_data or {}).get(k) or "").strip() for k in ["nombre", "apellido", "telefono", "email"]}
+    cliente = Cliente.objects.create(**datos) if any(datos.values()) else None
+
+    return Reserva.objects.create(
+        cochera=cochera,
+        tipo=tipo,
+        cliente=cliente,
+        codigo=_nuevo_codigo(),
+        desde=desde,
+        hasta=hasta,
+    )
+
+
+def tomar_reserva(*, cochera, tipo, codigo):
+    """Valida y bloquea la reserva que se presenta en el ingreso."""
+    codigo = (codigo or "").strip().upper()
+    reserva = Reserva.objects.select_for_update().filter(
+        cochera=cochera, codigo=codigo, estado=Reserva.ACTIVA
+    ).first()
+
+    if not reserva:
+        raise ValueError("No existe una reserva ACTIVA con ese código en esta cochera.")
+    if reserva.tipo_id != tipo.id:
+        raise ValueError(f"La reserva es para tipo '{reserva.tipo.nombre}'.")
+
+    ahora = timezone.now()
+    if not (reserva.desde - TOLERANCIA_INGRESO <= ahora < reserva.hasta):
+        raise ValueError("La reserva no está vigente en este horario.")
+    return reserva
+
+
+def hay_lugar_sin_reserva(cochera, tipo_id):
+    """
+    Un ingreso sin reserva (incluidos los abonados flotantes) solo entra si
+    quedan libres por encima de lo retenido ahora. Sin reservas vigentes no
+    cuesta ninguna query.
+    """
+    retenido = retenidas(cochera.id, tipo_id, timezone.now())
+    if not retenido:
+        return True
+    if obtener_pool(cochera.id, tipo_id).cantidad_libres > retenido:
+        return True
+    # antes de rechazar, se confirma contra la base
+    return obtener_pool(cochera.id, tipo_id, recargar=True).cantidad_libres > retenido
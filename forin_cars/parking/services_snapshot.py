@@ -0,0 +1,468 @@
+"""
+Snapshot columnar de los movimientos cerrados, para reportes pesados (años de
+recaudación por tipo, histogramas de estadía) sin tocar la base de la puerta.
+
+`manage.py snapshot_movimientos` baja los CERRADOS a archivos .npy, una
+carpeta por partición y un archivo por columna:
+
+    <PARKING_SNAPSHOTS>/<alias>/movimientos/
+        manifiesto.json   particiones, marca, dimensiones
+        000001/id.npy cochera.npy tipo.npy operador.npy ingreso.npy egreso.npy monto.npy abonado.npy
+
+cochera/tipo/operador van como códigos enteros chicos (posición en la lista
+de esa dimensión en el manifiesto: los nuevos se agregan al final, un código
+no cambia nunca), ingreso/egreso en segundos epoch y el monto en centavos.
+
+Es incremental: cada corrida lee lo que se cerró entre la marca anterior y
+ahora - MARGEN (por cochera, con el índice (cochera, egreso_at)) y lo agrega
+como particiones nuevas, de a VENTANA de egresos y hasta FILAS_PARTICION filas
+cada una. La partición se escribe aparte y entra al manifiesto recién al
+final (os.replace): quien lee ve la versión anterior entera o la nueva.
+
+egreso_at no sale en orden de commit: el cierre encolado del admin
+(tareas.cerrar_movimientos) pone la hora del click y puede commitear mucho
+después (cola atrasada, reintentos). Por eso cada corrida vuelve a mirar
+desde REESCANEO antes de la marca, o desde el `ahora` del cierre encolado más
+viejo que seguía sin terminar al arrancar la corrida anterior (queda en el
+manifiesto), y saltea los ids que ya están. Lo que se corrija de un
+movimiento ya exportado (replay de eventos, arreglos a mano) no vuelve a
+bajar solo: para eso está --rehacer.
+
+Las consultas (`Snapshot.agregar`) leen solo archivos: las columnas se mapean
+en memoria (np.load mmap_mode="r"), las particiones fuera del rango se saltean
+por su egreso mínimo/máximo y cada grupo sale de un bincount.
+"""
+import json
+import os
+import shutil
+from datetime import datetime, timedelta, timezone as dt_timezone
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import Min
+from django.utils import timezone
+
+from .models import Cochera, Movimiento, Tarea
+from . import services_catalogo, tenancy
+
+
+FORMATO = 1
+# lo que se cerró hace menos que esto queda para la próxima (transacciones en vuelo)
+MARGEN = timedelta(minutes=1)
+VENTANA = timedelta(days=30)
+# lo ya exportado se vuelve a mirar esto para atrás (commits que llegan tarde)
+REESCANEO = timedelta(hours=1)
+FILAS_PARTICION = 1_000_000
+CHUNK = 20_000
+# compactar junta particiones seguidas hasta este tamaño
+FILAS_COMPACTA = FILAS_PARTICION
+
+COLUMNAS = {
+    "id": np.int64,
+    "cochera": np.int32,
+    "tipo": np.int16,
+    "operador": np.int32,
+    "ingreso": np.int64,
+    "egreso": np.int64,
+    "monto": np.int64,
+    "abonado": np.bool_,
+}
+DIMENSIONES = ("cochera", "tipo", "operador")
+# estadía, en minutos (el último grupo es "más de 24h")
+BORDES_MIN = (15, 30, 60, 120, 240, 480, 720, 1440)
+# tope de grupos de una consulta (el bincount es denso)
+MAX_GRUPOS = 1 << 22
+
+
+def directorio(alias=None):
+    return Path(settings.PARKING_SNAPSHOTS) / (alias or tenancy.alias_actual()) / "movimientos"
+
+
+def _manifiesto_vacio():
+    return {
+        "formato": FORMATO,
+        "marca": None,
+        # `ahora` del cierre encolado más viejo sin terminar en la última corrida
+        "pendiente": None,
+        "particiones": [],
+        # [[id, nombre], ...]: la posición es el código
+        "dimensiones": {d: [] for d in DIMENSIONES},
+    }
+
+
+def _leer_manifiesto(base):
+    try:
+        with open(base / "manifiesto.json") as f:
+            man = json.load(f)
+    except FileNotFoundError:
+        return _manifiesto_vacio()
+    if man.get("formato") != FORMATO:
+        raise ValueError(f"El snapshot de {base} es de otro formato: rehacerlo (--rehacer).")
+    return man
+
+
+def _guardar_manifiesto(base, man):
+    tmp = base / "manifiesto.json.tmp"
+    with open(tmp, "w") as f:
+        json.dump(man, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, base / "manifiesto.json")
+
+
+def _segundos(dt):
+    return int(dt.timestamp())
+
+
+# --- escritura ------------------------------------------------------------
+
+class _Codigos:
+    """Ids de la base -> código de la dimensión, agregando los nuevos al final del manifiesto."""
+
+    def __init__(self, lista):
+        self.lista = lista
+        self.codigos = {i: c for c, (i, _) in enumerate(lista)}
+
+    def __call__(self, id_):
+        c = self.codigos.get(id_)
+        if c is None:
+            c = self.codigos[id_] = len(self.lista)
+            self.lista.append([id_, str(id_)])
+        return c
+
+    def nombrar(self, nombres):
+        for fila in self.lista:
+            fila[1] = nombres.get(fila[0], fila[1])
+
+
+class _Escritor:
+    """Junta filas y las baja como particiones al llegar a FILAS_PARTICION o al cerrar una ventana."""
+
+    def __init__(self, base, man, ya=()):
+        self.base, self.man = base, man
+        self.codigos = {d: _Codigos(man["dimensiones"][d]) for d in DIMENSIONES}
+        # ids ya exportados de la parte que se vuelve a mirar
+        self.ya = ya
+        self.filas = []
+        self.nuevas = []
+        self.total = 0
+
+    def agregar(self, filas):
+        cod_c, cod_t, cod_o = (self.codigos[d] for d in DIMENSIONES)
+        for mov_id, cochera_id, tipo_id, operador_id, ingreso, egreso, monto, abonado_id in filas:
+            if mov_id in self.ya:
+                continue
+            self.filas.append((
+                mov_id, cod_c(cochera_id), cod_t(tipo_id), cod_o(operador_id),
+                _segundos(ingreso), _segundos(egreso),
+                int(round(monto * 100)) if monto is not None else 0,
+                abonado_id is not None,
+            ))
+            self.total += 1
+            if len(self.filas) >= FILAS_PARTICION:
+                self.bajar()
+
+    def bajar(self):
+        if not self.filas:
+            return
+        columnas = list(zip(*self.filas))
+        self.filas = []
+        datos = {c: np.array(v, dtype=dtype) for (c, dtype), v in zip(COLUMNAS.items(), columnas)}
+        self.nuevas.append(_escribir_particion(self.base, _siguiente(self.man) + len(self.nuevas), datos))
+
+
+def _siguiente(man):
+    """Número para la próxima partición: después de la más alta (compactar deja huecos)."""
+    return max((int(p["nombre"]) for p in man["particiones"]), default=0) + 1
+
+
+def _escribir_particion(base, numero, datos):
+    nombre = f"{numero:06d}"
+    tmp = base / f"{nombre}.tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    for col, arr in datos.items():
+        np.save(tmp / f"{col}.npy", arr)
+    # una corrida que murió antes del manifiesto puede haber dejado la carpeta
+    shutil.rmtree(base / nombre, ignore_errors=True)
+    os.rename(tmp, base / nombre)
+    egreso = datos["egreso"]
+    return {
+        "nombre": nombre,
+        "filas": len(egreso),
+        "egreso_min": int(egreso.min()),
+        "egreso_max": int(egreso.max()),
+    }
+
+
+def _cierres_pendientes():
+    """El `ahora` más viejo de los cierres encolados del tenant que todavía no terminaron (o None)."""
+    pendientes = Tarea.objects.filter(
+        nombre="cerrar_movimientos", alias=tenancy.alias_actual(), estado__in=[Tarea.PENDIENTE, Tarea.CORRIENDO],
+    ).values_list("kwargs", flat=True)
+    fechas = [k["ahora"] for k in pendientes if k.get("ahora")]
+    return min(fechas, key=datetime.fromisoformat) if fechas else None
+
+
+def _exportados_desde(base, man, desde):
+    """Ids ya exportados con egreso >= desde (solo se abren las particiones que llegan hasta ahí)."""
+    t = _segundos(desde)
+    ids = set()
+    for p in man["particiones"]:
+        if p["egreso_max"] >= t:
+            carpeta = base / p["nombre"]
+            egreso = np.load(carpeta / "egreso.npy", mmap_mode="r")
+            ids.update(np.load(carpeta / "id.npy", mmap_mode="r")[egreso >= t].tolist())
+    return ids
+
+
+def actualizar(*, rehacer=False, margen=MARGEN, reescaneo=REESCANEO):
+    """
+    Agrega al snapshot del tenant actual lo cerrado desde la última marca
+    (menos el reescaneo) hasta ahora - margen. Devuelve (filas nuevas,
+    particiones nuevas).
+    """
+    base = directorio()
+    if rehacer:
+        shutil.rmtree(base, ignore_errors=True)
+    base.mkdir(parents=True, exist_ok=True)
+    man = _leer_manifiesto(base)
+
+    # antes de leer nada: lo que siga pendiente lo vuelve a mirar la próxima
+    pendiente = _cierres_pendientes()
+    corte = timezone.now() - margen
+    marca = datetime.fromisoformat(man["marca"]) if man["marca"] else None
+    cerrados = Movimiento.objects.filter(estado=Movimiento.CERRADO, egreso_at__isnull=False)
+    cocheras = dict(Cochera.objects.values_list("id", "nombre"))
+    ya = set()
+    if marca is None:
+        # por cochera, con el índice (un Min sobre toda la tabla la recorre)
+        primeros = [
+            cerrados.filter(cochera_id=c).aggregate(m=Min("egreso_at"))["m"] for c in cocheras
+        ]
+        primeros = [p for p in primeros if p is not None]
+        if not primeros:
+            return 0, 0
+        desde = min(primeros) - timedelta(microseconds=1)
+    else:
+        desde = marca - reescaneo
+        if man.get("pendiente"):
+            desde = min(desde, datetime.fromisoformat(man["pendiente"]) - timedelta(microseconds=1))
+        ya = _exportados_desde(base, man, desde)
+    if desde >= corte:
+        return 0, 0
+
+    escritor = _Escritor(base, man, ya)
+    while desde < corte:
+        hasta = min(desde + VENTANA, corte)
+        for cochera_id in cocheras:
+            filas = (
+                cerrados.filter(cochera_id=cochera_id, egreso_at__gt=desde, egreso_at__lte=hasta)
+                .order_by()
+                .values_list(
+                    "id", "cochera_id", "espacio__tipo_id", "operador_id", "ingreso_at", "egreso_at", "monto", "abonado_id",
+                )
+                .iterator(chunk_size=CHUNK)
+            )
+            escritor.agregar(filas)
+        escritor.bajar()
+        desde = hasta
+
+    # los nombres se refrescan en cada corrida (los códigos no cambian)
+    dims = escritor.codigos
+    dims["cochera"].nombrar(cocheras)
+    dims["tipo"].nombrar({t.id: t.nombre for t in services_catalogo.tipos()})
+    ids_op = [i for i, _ in man["dimensiones"]["operador"]]
+    dims["operador"].nombrar(dict(get_user_model().objects.filter(id__in=ids_op).values_list("id", "username")))
+
+    man["particiones"].extend(escritor.nuevas)
+    man["marca"] = corte.isoformat()
+    man["pendiente"] = pendiente
+    _guardar_manifiesto(base, man)
+    return escritor.total, len(escritor.nuevas)
+
+
+def compactar(filas=FILAS_COMPACTA):
+    """Junta particiones seguidas (las corridas frecuentes dejan muchas chicas). Devuelve cuántas quedaron."""
+    base = directorio()
+    man = _leer_manifiesto(base)
+    grupos, actual = [], []
+    for p in man["particiones"]:
+        if actual and sum(q["filas"] for q in actual) + p["filas"] > filas:
+            grupos.append(actual)
+            actual = []
+        actual.append(p)
+    if actual:
+        grupos.append(actual)
+    if len(grupos) == len(man["particiones"]):
+        return len(grupos)
+
+    siguiente = _siguiente(man)
+    nuevas, viejas = [], []
+    for grupo in grupos:
+        if len(grupo) == 1:
+            nuevas.append(grupo[0])
+            continue
+        datos = {
+            col: np.concatenate([np.load(base / p["nombre"] / f"{col}.npy", mmap_mode="r") for p in grupo])
+            for col in COLUMNAS
+        }
+        nuevas.append(_escribir_particion(base, siguiente, datos))
+        siguiente += 1
+        viejas.extend(p["nombre"] for p in grupo)
+
+    man["particiones"] = nuevas
+    _guardar_manifiesto(base, man)
+    # en Linux quien las tenga mapeadas las sigue leyendo hasta soltarlas
+    for nombre in viejas:
+        shutil.rmtree(base / nombre, ignore_errors=True)
+    return len(nuevas)
+
+
+# --- lectura --------------------------------------------------------------
+
+class Snapshot:
+    """
+    El snapshot de un alias, solo lectura. Se abre con `abrir()`; las
+    columnas se mapean la primera vez que se usan.
+    """
+
+    def __init__(self, base):
+        self.base = base
+        self.man = _leer_manifiesto(base)
+        self.particiones = self.man["particiones"]
+        self.dimensiones = {d: [i for i, _ in self.man["dimensiones"][d]] for d in DIMENSIONES}
+        self.nombres = {d: dict(map(tuple, self.man["dimensiones"][d])) for d in DIMENSIONES}
+        self._columnas = {}
+
+    @property
+    def marca(self):
+        return datetime.fromisoformat(self.man["marca"]) if self.man["marca"] else None
+
+    @property
+    def filas(self):
+        return sum(p["filas"] for p in self.particiones)
+
+    def columna(self, particion, col):
+        key = (particion["nombre"], col)
+        arr = self._columnas.get(key)
+        if arr is None:
+            arr = self._columnas[key] = np.load(self.base / particion["nombre"] / f"{col}.npy", mmap_mode="r")
+        return arr
+
+    def _codigos(self, dim, ids):
+        codigos = {i: c for c, i in enumerate(self.dimensiones[dim])}
+        return np.array([codigos[i] for i in ids if i in codigos], dtype=np.int64)
+
+    def _grupo(self, dim, p, mask, desfase, rango, bordes):
+        """(código de grupo de cada fila que pasa el filtro, cantidad de grupos, etiqueta de cada código)."""
+        if dim in DIMENSIONES:
+            ids = self.dimensiones[dim]
+            return self.columna(p, dim)[mask].astype(np.int64), len(ids), ids.__getitem__
+        if dim == "estadia":
+            seg = self.columna(p, "egreso")[mask] - self.columna(p, "ingreso")[mask]
+            etiquetas = [f"<{b}" for b in bordes] + [f">={bordes[-1]}"]
+            return np.searchsorted(np.asarray(bordes) * 60, seg, side="right"), len(etiquetas), etiquetas.__getitem__
+
+        local = self.columna(p, "egreso")[mask] + desfase
+        if dim == "hora":
+            return (local // 3600) % 24, 24, int
+        if dim == "dia_semana":
+            # 1 = domingo ... 7 = sábado, como en services_analitica
+            return (local // 86400 + 4) % 7, 7, lambda c: c + 1
+        meses = local.astype("datetime64[s]").astype("datetime64[M]").astype(np.int64)
+        m0, m1 = rango
+        if dim == "mes":
+            return meses - m0, m1 - m0 + 1, lambda c: f"{1970 + (m0 + c) // 12}-{(m0 + c) % 12 + 1:02d}"
+        if dim == "anio":
+            return meses // 12 - m0 // 12, m1 // 12 - m0 // 12 + 1, lambda c: 1970 + m0 // 12 + c
+        raise ValueError("Dimensión inválida (cochera, tipo, operador, anio, mes, dia_semana, hora o estadia).")
+
+    def agregar(self, por=("tipo",), desde=None, hasta=None, *, cocheras=None, tipos=None, bordes_min=BORDES_MIN):
+        """
+        Movimientos cerrados con egreso en [desde, hasta), agrupados por `por`
+        (cochera, tipo, operador, anio, mes, dia_semana, hora, estadia). Por
+        grupo: n, monto (recaudación) y estadía promedio en minutos. Las
+        fechas de los grupos son locales, con la zona del comienzo del rango
+        (exacto sin horario de verano). Ej.:
+
+            abrir().agregar(("anio", "tipo"))           recaudación anual por tipo
+            abrir().agregar(("tipo", "estadia"), desde)  histograma de estadías
+        """
+        por = tuple(por)
+        parts = [
+            p for p in self.particiones
+            if (desde is None or p["egreso_max"] >= _segundos(desde)) and (hasta is None or p["egreso_min"] < _segundos(hasta))
+        ]
+        if not parts:
+            return []
+        t0 = _segundos(desde) if desde else min(p["egreso_min"] for p in parts)
+        t1 = _segundos(hasta) - 1 if hasta else max(p["egreso_max"] for p in parts)
+        desfase = int(timezone.localtime(datetime.fromtimestamp(t0, dt_timezone.utc)).utcoffset().total_seconds())
+        rango = tuple(
+            int(np.datetime64(t + desfase, "s").astype("datetime64[M]").astype(np.int64)) for t in (t0, t1)
+        )
+        filtros = {
+            "cochera": self._codigos("cochera", cocheras) if cocheras is not None else None,
+            "tipo": self._codigos("tipo", tipos) if tipos is not None else None,
+        }
+
+        n = monto = estadia = None
+        for p in parts:
+            egreso = self.columna(p, "egreso")
+            mask = (egreso >= t0) & (egreso <= t1)
+            for dim, codigos in filtros.items():
+                if codigos is not None:
+                    mask &= np.isin(self.columna(p, dim), codigos)
+            if not mask.any():
+                continue
+
+            clave, total, etiquetas = 0, 1, []
+            for dim in por:
+                codigo, cuantos, etiqueta = self._grupo(dim, p, mask, desfase, rango, bordes_min)
+                clave = clave * cuantos + codigo
+                total *= cuantos
+                etiquetas.append((cuantos, etiqueta))
+            if total > MAX_GRUPOS:
+                raise ValueError("Demasiados grupos: acotar el rango o agrupar por menos dimensiones.")
+            clave = np.broadcast_to(np.asarray(clave, dtype=np.int64), (int(mask.sum()),))
+            seg = (egreso[mask] - self.columna(p, "ingreso")[mask]).astype(np.float64)
+            cents = self.columna(p, "monto")[mask].astype(np.float64)
+            if n is None:
+                n, monto, estadia = (np.zeros(total, dtype=np.float64) for _ in range(3))
+            n += np.bincount(clave, minlength=total)
+            monto += np.bincount(clave, weights=cents, minlength=total)
+            estadia += np.bincount(clave, weights=seg, minlength=total)
+        if n is None:
+            return []
+
+        res = []
+        for k in np.flatnonzero(n).tolist():
+            fila, resto = {}, k
+            for dim, (cuantos, etiqueta) in zip(reversed(por), reversed(etiquetas)):
+                resto, codigo = divmod(resto, cuantos)
+                fila[dim] = etiqueta(codigo)
+            fila = {dim: fila[dim] for dim in por}
+            fila["n"] = int(n[k])
+            fila["monto"] = round(float(monto[k]) / 100, 2)
+            fila["estadia_prom_min"] = round(float(estadia[k] / n[k]) / 60, 1)
+            res.append(fila)
+        return res
+
+
+_abiertos = {}
+
+
+def abrir(alias=None):
+    """El snapshot del alias (por defecto el del tenant actual); se vuelve a abrir si cambió el manifiesto."""
+    base = directorio(alias)
+    try:
+        mtime = (base / "manifiesto.json").stat().st_mtime_ns
+    except FileNotFoundError:
+        raise ValueError(f"No hay snapshot en {base} (correr manage.py snapshot_movimientos).")
+    snap = _abiertos.get(base)
+    if snap is None or snap[0] != mtime:
+        snap = _abiertos[base] = (mtime, Snapshot(base))
+    return snap[1]
@@ -0,0 +1,230 @@
+"""
+Motor tarifario compilado.
+
+Las reglas de cada cochera (ReglaTarifa, o TarifaHora como fallback) se compilan
+en tablas de sumas acumuladas por minuto de inicio, en centavos enteros:
+
+- cotizar una estadía = bisect de la regla vigente + aritmética O(1)
+- cotizar_lote = lo mismo con NumPy sobre miles de estadías
+
+Tanto el egreso como el lote usan exactamente la misma cuenta, así que lo
+cotizado coincide con lo persistido en Movimiento.monto.
+"""
+import math
+from bisect import bisect_right
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+
+import numpy as np
+from django.utils import timezone
+
+from .models import ReglaTarifa, TarifaHora
+from . import versiones
+
+
+MIN_DIA = 1440
+VERSION = "tarifas"
+
+
+def _centavos(valor):
+    return int((Decimal(valor or 0) * 100).to_integral_value())
+
+
+def _a_decimal(centavos):
+    return (Decimal(int(centavos)) / 100).quantize(Decimal("0.01"))
+
+
+def _epoch(dt):
+    return math.floor(dt.timestamp())
+
+
+def _offset(epoch_s):
+    # se toma al inicio de la hora, igual que en el lote
+    instante = datetime.fromtimestamp((epoch_s // 3600) * 3600, tz=dt_timezone.utc)
+    return int(timezone.localtime(instante).utcoffset().total_seconds())
+
+
+def _offsets(epochs):
+    # el offset solo puede cambiar de hora en hora: se calcula por hora única
+    horas, inversa = np.unique(epochs // 3600, return_inverse=True)
+    por_hora = np.fromiter((_offset(int(h) * 3600) for h in horas), dtype=np.int64, count=len(horas))
+    return por_hora[inversa]
+
+
+def _es_noche(hora, desde, hasta):
+    if desde == hasta:
+        return False
+    if desde < hasta:
+        return desde <= hora < hasta
+    return hora >= desde or hora < hasta
+
+
+class TablaTarifa:
+    """Una regla compilada. Todo en centavos."""
+
+    __slots__ = ("fraccion", "por_dia", "primera_h", "primera", "tope", "acum", "total")
+
+    def __init__(self, *, primera, fraccion, precio, precio_noche, noche_desde, noche_hasta, tope):
+        self.fraccion = fraccion
+        self.por_dia = MIN_DIA // fraccion
+        self.primera_h = 60 // fraccion
+        self.primera = primera
+        self.tope = tope
+
+        # precio de la fracción según el minuto del día en que arranca
+        precio_min = np.array(
+            [precio_noche if _es_noche(m // 60, noche_desde, noche_hasta) else precio for m in range(MIN_DIA)],
+            dtype=np.int64,
+        )
+        # acum[r, j] = suma de las primeras j fracciones de la grilla que arranca en el minuto r
+        grilla = precio_min.reshape(self.por_dia, fraccion).T
+        self.acum = np.zeros((fraccion, self.por_dia + 1), dtype=np.int64)
+        np.cumsum(grilla, axis=1, out=self.acum[:, 1:])
+        self.total = self.acum[:, -1].copy()
+
+    @classmethod
+    def desde_regla(cls, r):
+        precio = _centavos(r.precio_fraccion)
+        return cls(
+            primera=_centavos(r.precio_primera_hora),
+            fraccion=r.minutos_fraccion,
+            precio=precio,
+            precio_noche=precio if r.precio_fraccion_noche is None else _centavos(r.precio_fraccion_noche),
+            noche_desde=r.noche_desde,
+            noche_hasta=r.noche_hasta,
+            tope=None if r.tope_diario is None else _centavos(r.tope_diario),
+        )
+
+    @classmethod
+    def desde_tarifa_hora(cls, t):
+        precio = _centavos(t.precio_hora)
+        return cls(primera=precio, fraccion=60, precio=precio, precio_noche=precio,
+                   noche_desde=0, noche_hasta=0, tope=None)
+
+    def _acumulado(self, r, x):
+        return (x // self.por_dia) * self.total[r] + self.acum[r, x % self.por_dia]
+
+    def cotizar(self, minuto_dia, segundos):
+        """Centavos para una estadía que arranca en `minuto_dia` y dura `segundos`."""
+        paso = self.fraccion * 60
+        n = 0 if segundos <= 3600 else (segundos - 3600 + paso - 1) // paso
+        fin = self.primera_h + n
+        r, j0 = minuto_dia % self.fraccion, minuto_dia // self.fraccion
+
+        def suma(g0, g1):
+            return int(self._acumulado(r, j0 + g1) - self._acumulado(r, j0 + g0))
+
+        def tope(x):
+            return x if self.tope is None else min(x, self.tope)
+
+        total = tope(self.primera + suma(self.primera_h, min(fin, self.por_dia)))
+        dias = fin // self.por_dia
+        if dias > 1:
+            total += (dias - 1) * tope(int(self.total[r]))
+        if dias >= 1 and fin % self.por_dia:
+            total += tope(suma(dias * self.por_dia, fin))
+        return total
+
+    def cotizar_vector(self, minuto_dia, segundos):
+        paso = self.fraccion * 60
+        n = np.where(segundos <= 3600, 0, (segundos - 3600 + paso - 1) // paso)
+        fin = self.primera_h + n
+        r, j0 = minuto_dia % self.fraccion, minuto_dia // self.fraccion
+        tope = np.iinfo(np.int64).max if self.tope is None else self.tope
+
+        def suma(g0, g1):
+            return self._acumulado(r, j0 + g1) - self._acumulado(r, j0 + g0)
+
+        total = np.minimum(self.primera + suma(self.primera_h, np.minimum(fin, self.por_dia)), tope)
+        dias = fin // self.por_dia
+        total += np.maximum(dias - 1, 0) * np.minimum(self.total[r], tope)
+        parcial = (dias >= 1) & (fin % self.por_dia != 0)
+        total += np.where(parcial, np.minimum(suma(dias * self.por_dia, fin), tope), 0)
+        return total
+
+
+class Motor:
+    """Reglas compiladas de una cochera, indexadas por tipo y vigencia."""
+
+    def __init__(self, por_tipo):
+        # tipo_id -> (lista de vigente_desde en epoch ordenada, lista de TablaTarifa)
+        self.por_tipo = por_tipo
+
+    def _indice(self, tipo_id, ingreso_s):
+        desdes, _ = self.por_tipo[tipo_id]
+        # si el ingreso es anterior a la primera vigencia, se usa la primera
+        return max(bisect_right(desdes, ingreso_s) - 1, 0)
+
+    def cotizar_centavos(self, tipo_id, ingreso_s, egreso_s):
+        if tipo_id not in self.por_tipo:
+            return 0
+        tabla = self.por_tipo[tipo_id][1][self._indice(tipo_id, ingreso_s)]
+        minuto = ((ingreso_s + _offset(ingreso_s)) // 60) % MIN_DIA
+        return tabla.cotizar(minuto, max(egreso_s - ingreso_s, 0))
+
+    def cotizar_lote(self, tipo_ids, ingresos_s, egresos_s):
+        tipo_ids = np.asarray(tipo_ids, dtype=np.int64)
+        ingresos_s = np.asarray(ingresos_s, dtype=np.int64)
+        egresos_s = np.asarray(egresos_s, dtype=np.int64)
+
+        res = np.zeros(len(tipo_ids), dtype=np.int64)
+        if not len(tipo_ids):
+            return res
+
+        minutos = ((ingresos_s + _offsets(ingresos_s)) // 60) % MIN_DIA
+        segundos = np.maximum(egresos_s - ingresos_s, 0)
+
+        for tipo_id, (desdes, tablas) in self.por_tipo.items():
+            filas = np.flatnonzero(tipo_ids == tipo_id)
+            if not len(filas):
+                continue
+            idx = np.maximum(np.searchsorted(desdes, ingresos_s[filas], side="right") - 1, 0)
+            for i, tabla in enumerate(tablas):
+                sel = filas[idx == i]
+                if len(sel):
+                    res[sel] = tabla.cotizar_vector(minutos[sel], segundos[sel])
+        return res
+
+
+def _compilar(cochera_id):
+    por_tipo = {}
+
+    for t in TarifaHora.objects.filter(cochera_id=cochera_id):
+        # fallback: la tarifa plana vale "desde siempre"
+        por_tipo[t.tipo_id] = [(-(2 ** 62), TablaTarifa.desde_tarifa_hora(t))]
+
+    reglas = ReglaTarifa.objects.filter(cochera_id=cochera_id).order_by("tipo_id", "vigente_desde")
+    for r in reglas:
+        por_tipo.setdefault(r.tipo_id, []).append((_epoch(r.vigente_desde), TablaTarifa.desde_regla(r)))
+
+    return Motor({
+        tipo_id: ([d for d, _ in items], [t for _, t in items])
+        for tipo_id, items in por_tipo.items()
+    })
+
+
+def motor_tarifario(cochera_id):
+    return versiones.memo(VERSION, cochera_id, lambda: _compilar(cochera_id))
+
+
+def invalidar_tarifas(cochera_id):
+    versiones.bump(VERSION, cochera_id)
+
+
+def cotizar(cochera_id, tipo_id, ingreso_at, egreso_at=None):
+    """Monto (Decimal) de una estadía. Sin egreso, cotiza hasta ahora."""
+    egreso_at = egreso_at or timezone.now()
+    cent = motor_tarifario(cochera_id).cotizar_centavos(tipo_id, _epoch(ingreso_at), _epoch(egreso_at))
+    return _a_decimal(cent)
+
+
+def cotizar_lote(cochera_id, tipo_ids, ingresos_s, egresos_s):
+    """
+    Cotiza en lote. Recibe arrays de tipo_id y epoch en segundos (enteros) y
+    devuelve un array de centavos (int64).
+    """
+    return motor_tarifario(cochera_id).cotizar_lote(tipo_ids, ingresos_s, egresos_s)
+
+
+def a_epoch(fechas):
+    return np.fromiter((_epoch(f) for f in fechas), dtype=np.int64, count=len(fechas))
@@ -0,0 +1,159 @@
+"""
+Emisión de tickets del lado del servidor.
+
+El código es `T<cochera>-<número>-<dv>` (ej. T12-000457-7): correlativo por
+cochera, único en la base porque lleva la cochera adelante, y con un dígito
+verificador (Luhn) para que un ticket mal tipeado o mal leído no se confunda
+con otro.
+
+Los números salen de bloques (hi/lo): un UPDATE sobre SecuenciaTicket reserva
+TAMANO_BLOQUE números para este proceso y el resto se numera en memoria, sin
+ir a la base. Dos procesos nunca comparten bloque; los números que quedan sin
+usar cuando se reinicia un worker se pierden (hay huecos, no repetidos).
+"""
+import os
+import re
+import threading
+from xml.sax.saxutils import escape
+
+from django.db import transaction
+from django.db.models import F
+
+from .models import SecuenciaTicket
+from . import tenancy
+
+
+TAMANO_BLOQUE = 100
+PATRON = re.compile(r"^T(\d+)-(\d{6,})-(\d)$")
+
+# (alias, cochera_id) -> [siguiente, fin) del bloque de este proceso
+_bloques = {}
+_lock = threading.Lock()
+
+
+def _despues_de_fork():
+    # el hijo no puede seguir numerando el bloque del padre
+    global _lock
+    _bloques.clear()
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_despues_de_fork)
+
+
+def digito_verificador(digitos):
+    """Luhn sobre un string de dígitos."""
+    total = 0
+    for i, c in enumerate(reversed(digitos)):
+        d = int(c)
+        if i % 2 == 0:
+            d *= 2
+            if d > 9:
+                d -= 9
+        total += d
+    return str((10 - total % 10) % 10)
+
+
+def formatear(cochera_id, numero):
+    cuerpo = f"{cochera_id}{numero:06d}"
+    return f"T{cochera_id}-{numero:06d}-{digito_verificador(cuerpo)}"
+
+
+def leer(codigo):
+    """
+    (cochera_id, número) si `codigo` es un ticket emitido por el sistema, None
+    si es un ticket/alias cargado a mano. ValueError si tiene nuestro formato
+    pero el dígito verificador no cierra.
+    """
+    m = PATRON.match((codigo or "").strip().upper())
+    if m is None:
+        return None
+    cochera, numero, dv = m.groups()
+    if digito_verificador(cochera + numero) != dv:
+        raise ValueError("El ticket está mal leído o mal tipeado (no coincide el dígito verificador).")
+    return int(cochera), int(numero)
+
+
+def _reservar_bloque(alias, cochera_id, n):
+    """Reserva [ini, ini + n) en su propia transacción. Devuelve ini."""
+    with transaction.atomic(using=alias):
+        tocadas = SecuenciaTicket.objects.using(alias).filter(cochera_id=cochera_id).update(siguiente=F("siguiente") + n)
+        if not tocadas:
+            SecuenciaTicket.objects.using(alias).get_or_create(cochera_id=cochera_id)
+            SecuenciaTicket.objects.using(alias).filter(cochera_id=cochera_id).update(siguiente=F("siguiente") + n)
+        fin = SecuenciaTicket.objects.using(alias).values_list("siguiente", flat=True).get(cochera_id=cochera_id)
+    return fin - n
+
+
+def emitir_ticket(cochera_id):
+    """
+    Próximo código de ticket de la cochera. Va fuera de transacción: si el
+    bloque se reservara adentro y después hubiera rollback, otro proceso podría
+    recibir los mismos números.
+    """
+    alias = tenancy.alias_actual()
+    key = (alias, cochera_id)
+    with _lock:
+        bloque = _bloques.get(key)
+        if bloque is None or bloque[0] >= bloque[1]:
+            if transaction.get_connection(alias).in_atomic_block:
+                raise RuntimeError("emitir_ticket no puede reservar un bloque dentro de una transacción.")
+            ini = _reservar_bloque(alias, cochera_id, TAMANO_BLOQUE)
+            bloque = _bloques[key] = [ini, ini + TAMANO_BLOQUE]
+        numero = bloque[0]
+        bloque[0] += 1
+    return formatear(cochera_id, numero)
+
+
+# --------------------------------------------------------------------------
+# impresión: Code 39 en SVG (lo lee cualquier lector de mano como teclado)
+# --------------------------------------------------------------------------
+
+# barras anchas de 1..9,0; cada serie repite las barras y cambia el espacio ancho
+_BARRAS = ["10001", "01001", "11000", "00101", "10100", "01100", "00011", "10010", "01010", "00110"]
+_SERIES = [("1234567890", 1), ("ABCDEFGHIJ", 2), ("KLMNOPQRST", 3), ("UVWXYZ-. *", 0)]
+CODE39 = {
+    c: "".join(b + (("1" if i == espacio else "0") if i < 4 else "") for i, b in enumerate(_BARRAS[j]))
+    for chars, espacio in _SERIES
+    for j, c in enumerate(chars)
+}
+
+
+def code39_svg(texto, *, angosta=2, ancha=5, alto=60):
+    texto = texto.upper()
+    faltan = set(texto) - set(CODE39) | ({"*"} & set(texto))
+    if faltan:
+        raise ValueError(f"Code 39 no admite: {''.join(sorted(faltan))}")
+
+    x, barras = angosta * 10, []
+    for c in f"*{texto}*":
+        for i, ancho in enumerate(CODE39[c]):
+            w = ancha if ancho == "1" else angosta
+            if i % 2 == 0:
+                barras.append(f'<rect x="{x}" y="0" width="{w}" height="{alto}"/>')
+            x += w
+        x += angosta
+    largo = x + angosta * 9
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{largo}" height="{alto}" '
+        f'viewBox="0 0 {largo} {alto}" role="img" aria-label="{escape(texto)}">'
+        f'<rect width="{largo}" height="{alto}" fill="#fff"/><g fill="#000">{"".join(barras)}</g></svg>'
+    )
+
+
+def payload_ticket(mov):
+    """Lo que va impreso en el ticket de un movimiento."""
+    codigo = mov.vehiculo.ticket
+    try:
+        barras = code39_svg(codigo)
+    except ValueError:
+        # alias con caracteres que Code 39 no tiene: sale solo el texto
+        barras = ""
+    return {
+        "codigo": codigo,
+        "cochera": mov.cochera.nombre,
+        "espacio": mov.espacio.etiqueta,
+        "tipo": mov.vehiculo.tipo.nombre,
+        "ingreso_at": mov.ingreso_at,
+        "code39_svg": barras,
+    }
@@ -0,0 +1,86 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import (
+    ReglaTarifa, TarifaHora, Reserva, Abonado, ShardOperador, Cochera, Espacio, Movimiento, TipoEspacio,
+    ConfigCapacidad, UmbralAlerta,
+)
+from .services_catalogo import invalidar_cochera, invalidar_tipos
+from .services_tarifas import invalidar_tarifas
+from .services_reservas import invalidar_reservas
+from .services_abonados import invalidar_abonados
+from .services_asignacion import invalidar_espacios, ocupacion_cambio
+from .services_alertas import invalidar_umbrales
+from .services_cercanas import invalidar_cercanas
+from . import tenancy
+
+
+# las versiones se cuentan por shard: se invalida en la base donde se escribió
+
+
+def _al_commit(using, *invalidaciones):
+    """
+    Corre las invalidaciones cuando commitea la transacción del que escribió
+    (como ocupacion_cambio). Antes, otro proceso podía ver la versión nueva,
+    recompilar con las filas viejas y guardar eso bajo la versión nueva.
+    """
+    def _cb():
+        with tenancy.tenant(using):
+            for func, *args in invalidaciones:
+                func(*args)
+
+    transaction.on_commit(_cb, using=using)
+
+
+@receiver([post_save, post_delete], sender=ReglaTarifa)
+@receiver([post_save, post_delete], sender=TarifaHora)
+def _tarifas_cambiaron(sender, instance, using, **kwargs):
+    _al_commit(using, (invalidar_tarifas, instance.cochera_id))
+
+
+@receiver([post_save, post_delete], sender=TipoEspacio)
+def _tipos_cambiaron(sender, instance, using, **kwargs):
+    _al_commit(using, (invalidar_tipos,))
+
+
+@receiver([post_save, post_delete], sender=ConfigCapacidad)
+@receiver([post_save, post_delete], sender=TarifaHora)
+def _config_cochera_cambio(sender, instance, using, **kwargs):
+    _al_commit(using, (invalidar_cochera, instance.cochera_id))
+
+
+@receiver([post_save, post_delete], sender=Reserva)
+def _reservas_cambiaron(sender, instance, using, **kwargs):
+    _al_commit(using, (invalidar_reservas, instance.cochera_id))
+
+
+@receiver([post_save, post_delete], sender=Abonado)
+def _abonados_cambiaron(sender, instance, using, **kwargs):
+    # un lugar fijo entra o sale de la asignación general
+    _al_commit(using, (invalidar_abonados, instance.cochera_id), (invalidar_espacios, instance.cochera_id))
+
+
+@receiver([post_save, post_delete], sender=UmbralAlerta)
+def _umbrales_cambiaron(sender, instance, using, **kwargs):
+    _al_commit(using, (invalidar_umbrales, instance.cochera_id))
+
+
+@receiver([post_save, post_delete], sender=Movimiento)
+@receiver([post_save, post_delete], sender=Espacio)
+def _ocupacion_cambio(sender, instance, using, **kwargs):
+    with tenancy.tenant(using):
+        ocupacion_cambio(instance.cochera_id)
+
+
+@receiver([post_save, post_delete], sender=Cochera)
+def _cochera_cambio(sender, instance, using, **kwargs):
+    # nombre/dirección/activa salen en las tarjetas del dashboard
+    with tenancy.tenant(using):
+        ocupacion_cambio(instance.id)
+    _al_commit(using, (invalidar_cercanas, instance.owner_id))
+
+
+@receiver([post_save, post_delete], sender=ShardOperador)
+def _shards_cambiaron(sender, instance, using, **kwargs):
+    _al_commit(using, (tenancy.invalidar_asignaciones,))
@@ -0,0 +1,38 @@
+"""
+Tareas de parking para la cola (parking.cola). Reciben ids y datos planos:
+el worker las corre dentro del tenant en el que se encolaron.
+"""
+from datetime import datetime
+
+from .cola import tarea
+from .models import Cochera
+from . import services, services_movimientos, services_reconciliacion
+
+
+@tarea("invitar_empleados", prioridad=5)
+def invitar_empleados(cochera_id, emails):
+    cochera = Cochera.objects.filter(id=cochera_id).first()
+    if cochera is None:
+        # la borraron antes de que corriera
+        return
+    services.invitar_empleados(cochera, emails)
+
+
+@tarea("cerrar_movimientos")
+def cerrar_movimientos(movimiento_ids, operador_id=None, motivo="manual", ahora=None):
+    services_movimientos.cerrar_movimientos(
+        movimiento_ids,
+        operador_id=operador_id,
+        motivo=motivo,
+        ahora=datetime.fromisoformat(ahora) if ahora else None,
+    )
+
+
+@tarea("reconciliar_ocupacion", prioridad=-5, max_intentos=1)
+def reconciliar_ocupacion(cochera_id=None):
+    services_reconciliacion.reconciliar(cochera_id=cochera_id)
+
+
+@tarea("cerrar_abandonados", max_intentos=1)
+def cerrar_abandonados(cochera_id=None):
+    services_movimientos.cerrar_abandonados(cochera_id=cochera_id)
@@ -0,0 +1,168 @@
+"""
+Ruteo por operador (tenant): cada dueño de cocheras vive en un alias de base.
+
+- settings.PARKING_SHARDS vacío: todo en "default", nada cambia.
+- Con shards: los modelos de parking van al alias del tenant actual
+  (contextvar seteado por TenantMiddleware o por `tenant(alias)`); usuarios,
+  auth y el mapa ShardOperador quedan en "default".
+
+El tenant de un usuario es el de su dueño (EmpleadoAsignacion) o el propio; el
+alias sale de ShardOperador. La primera vez que se rutea un dueño sin fila se
+elige por módulo y se guarda: agregar un shard después no muda a nadie a una
+base vacía (`shards fijar` guarda la de los dueños que ya tienen cocheras).
+"""
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+
+
+_actual = ContextVar("parking_tenant", default=None)
+
+CACHE_TTL = 300
+
+
+def sharding_activo():
+    return bool(getattr(settings, "PARKING_SHARDS", None))
+
+
+def shards():
+    """Aliases que tienen datos de parking."""
+    return list(settings.PARKING_SHARDS) if sharding_activo() else ["default"]
+
+
+def alias_actual():
+    return _actual.get() or "default"
+
+
+@contextmanager
+def tenant(alias):
+    token = _actual.set(alias)
+    try:
+        yield alias
+    finally:
+        _actual.reset(token)
+
+
+def atomic(func):
+    """
+    transaction.atomic sobre la base del tenant actual. El alias se resuelve en
+    cada llamada: con @transaction.atomic a secas la transacción se abre en
+    "default" mientras los writes de parking van al shard.
+    """
+    @functools.wraps(func)
+    def inner(*args, **kwargs):
+        with transaction.atomic(using=alias_actual()):
+            return func(*args, **kwargs)
+    return inner
+
+
+def _asignaciones():
+    from .models import ShardOperador
+
+    mapa = cache.get("tenancy:asignaciones")
+    if mapa is None:
+        mapa = dict(ShardOperador.objects.using("default").values_list("owner_id", "alias"))
+        cache.set("tenancy:asignaciones", mapa, CACHE_TTL)
+    return mapa
+
+
+def invalidar_asignaciones():
+    cache.delete("tenancy:asignaciones")
+
+
+def _por_defecto(owner_id):
+    return settings.PARKING_SHARDS[owner_id % len(settings.PARKING_SHARDS)]
+
+
+def asignar(owner_id, alias=None):
+    """
+    Guarda el shard del dueño si todavía no tiene (por defecto, el del módulo)
+    y devuelve el que quedó: si otro proceso lo asignó antes, gana ese.
+    """
+    from .models import ShardOperador
+
+    if alias is None:
+        alias = _por_defecto(owner_id)
+    fila, _ = ShardOperador.objects.using("default").get_or_create(owner_id=owner_id, defaults={"alias": alias})
+    return fila.alias
+
+
+def alias_para_owner(owner_id, *, guardar=True):
+    """
+    Shard del dueño. Con guardar=False, si no tiene fila devuelve el de por
+    defecto sin escribirla (usuarios que no son dueños de nada).
+    """
+    if not sharding_activo():
+        return "default"
+    alias = _asignaciones().get(owner_id)
+    if alias is None:
+        alias = asignar(owner_id) if guardar else _por_defecto(owner_id)
+    if alias not in settings.PARKING_SHARDS:
+        # sus datos están en un shard que ya no está configurado: mejor fallar que mandarlo a otra base
+        raise ImproperlyConfigured(f"El dueño {owner_id} está en el shard '{alias}', que no está en PARKING_SHARDS.")
+    return alias
+
+
+def owner_de(user):
+    """Id del dueño cuyo tenant usa el usuario (él mismo si no es empleado)."""
+    from users.models import EmpleadoAsignacion
+
+    key = f"tenancy:owner:{user.pk}"
+    owner_id = cache.get(key)
+    if owner_id is None:
+        owner_id = (
+            EmpleadoAsignacion.objects.using("default")
+            .filter(empleado_id=user.pk, activo=True)
+            .values_list("dueno_id", flat=True)
+            .first()
+        ) or user.pk
+        cache.set(key, owner_id, CACHE_TTL)
+    return owner_id
+
+
+def alias_para_usuario(user):
+    from users.permissions import is_dueno
+
+    if not sharding_activo() or not user.is_authenticated:
+        return "default"
+    owner_id = owner_de(user)
+    # la fila en ShardOperador es para dueños (o el dueño del empleado): un
+    # usuario cualquiera logueado no escribe en default en cada request
+    return alias_para_owner(owner_id, guardar=owner_id != user.pk or is_dueno(user))
+
+
+def clave(*partes):
+    """Prefija claves de cache/memo con el alias actual (ids de distintos shards chocan)."""
+    return ":".join(str(p) for p in (alias_actual(), *partes))
+
+
+def resumen_por_shard():
+    """Totales por shard para el admin (una pasada de queries agregadas por alias)."""
+    from django.db.models import Count, Q, Sum
+    from .models import Cochera, Espacio, Movimiento
+
+    filas = []
+    for alias in shards():
+        with tenant(alias):
+            espacios = Espacio.objects.aggregate(total=Count("id"), ocupados=Count("id", filter=Q(ocupado=True)))
+            movs = Movimiento.objects.aggregate(
+                total=Count("id"),
+                abiertos=Count("id", filter=Q(estado=Movimiento.ABIERTO)),
+                facturado=Sum("monto"),
+            )
+            filas.append({
+                "alias": alias,
+                "cocheras": Cochera.objects.count(),
+                "operadores": Cochera.objects.values("owner_id").distinct().count(),
+                "espacios": espacios["total"],
+                "ocupados": espacios["ocupados"],
+                "movimientos": movs["total"],
+                "abiertos": movs["abiertos"],
+                "facturado": movs["facturado"] or 0,
+            })
+    return filas
@@ -1,3 +1,1901 @@
-from django.test import TestCase
+import asyncio
+import hmac
+import io
+import json
+import multiprocessing
+import random
+import re
+import socket
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import IntegrityError, connections, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import (
+    admin as parking_admin, cola, contadores, secuenciador, services_alertas, services_analitica, services_movimientos,
+    services_asignacion, services_catalogo, services_eventos, services_outbox, services_pronostico,
+    services_intervalos, services_porton, services_ocupacion, services_reconciliacion, services_snapshot,
+    services_tickets, tenancy, versiones,
+)
+from .models import (
+    Cliente, Cochera, ConfigCapacidad, Dispositivo, Espacio, EventoMovimiento, IntervaloOcupacion, MensajeOutbox,
+    Movimiento, RecaudacionDiaria, ReglaTarifa, Reserva, SecuenciaTicket, ShardOperador, Tarea, TarifaHora,
+    TipoEspacio, UmbralAlerta, Vehiculo,
+)
+from .services import ensure_default_tipos
+from .services_abonados import abono_vigente, crear_abonado
+from .services_movimientos import cerrar_movimientos, egresar_vehiculo, ingresar_vehiculo, reasignar_espacio
+from .services_reservas import crear_reserva, disponibilidad_dia, max_retenidas, retenidas
+from .services_tarifas import a_epoch, cotizar, cotizar_lote
+
+
+class DigitoVerificadorTests(SimpleTestCase):
+    def test_luhn_conocidos(self):
+        # ejemplos de referencia de Luhn: número -> dígito verificador
+        for digitos, dv in [("7992739871", "3"), ("0", "0"), ("1", "8"), ("12345", "5"), ("000000", "0")]:
+            with self.subTest(digitos=digitos):
+                self.assertEqual(services_tickets.digito_verificador(digitos), dv)
+
+    def test_detecta_un_digito_cambiado(self):
+        cuerpo = "12000457"
+        dv = services_tickets.digito_verificador(cuerpo)
+        for i in range(len(cuerpo)):
+            for otro in "0123456789":
+                if otro == cuerpo[i]:
+                    continue
+                cambiado = cuerpo[:i] + otro + cuerpo[i + 1:]
+                self.assertNotEqual(services_tickets.digito_verificador(cambiado), dv, cambiado)
+
+    def test_detecta_vecinos_invertidos(self):
+        cuerpo = "12000457"
+        dv = services_tickets.digito_verificador(cuerpo)
+        for i in range(len(cuerpo) - 1):
+            a, b = cuerpo[i], cuerpo[i + 1]
+            # Luhn no ve 09 <-> 90
+            if a == b or {a, b} == {"0", "9"}:
+                continue
+            invertido = cuerpo[:i] + b + a + cuerpo[i + 2:]
+            self.assertNotEqual(services_tickets.digito_verificador(invertido), dv, invertido)
+
+
+class LeerTicketTests(SimpleTestCase):
+    def test_formatear_y_leer(self):
+        codigo = services_tickets.formatear(12, 457)
+        self.assertEqual(codigo, "T12-000457-7")
+        self.assertEqual(services_tickets.leer(codigo), (12, 457))
+
+    def test_leer_normaliza(self):
+        self.assertEqual(services_tickets.leer("  t12-000457-7 "), (12, 457))
+
+    def test_numeros_de_mas_de_seis_digitos(self):
+        codigo = services_tickets.formatear(3, 1234567)
+        self.assertEqual(services_tickets.leer(codigo), (3, 1234567))
+
+    def test_digito_que_no_cierra(self):
+        with self.assertRaises(ValueError):
+            services_tickets.leer("T12-000457-4")
+        with self.assertRaises(ValueError):
+            services_tickets.leer("T12-000475-7")
+
+    def test_tickets_cargados_a_mano(self):
+        for codigo in ["", None, "ABC123", "T12-457-3", "T12-000457", "X12-000457-3"]:
+            with self.subTest(codigo=codigo):
+                self.assertIsNone(services_tickets.leer(codigo))
+
+
+def _emitir_en_proceso(cochera_id, hilos, por_hilo, salida):
+    """Hijo del fork: emite con varios hilos y manda los códigos al padre."""
+    codigos, lock = [], threading.Lock()
+
+    def emitir():
+        mios = [services_tickets.emitir_ticket(cochera_id) for _ in range(por_hilo)]
+        with lock:
+            codigos.extend(mios)
+
+    try:
+        ts = [threading.Thread(target=emitir) for _ in range(hilos)]
+        for t in ts:
+            t.start()
+        for t in ts:
+            t.join()
+        salida.send(codigos)
+    except Exception as e:
+        salida.send(e)
+    finally:
+        connections.close_all()
+        salida.close()
+
+
+class EmisionConcurrenteTests(TransactionTestCase):
+    """Varios procesos (y varios hilos en cada uno) emitiendo para la misma cochera."""
+
+    PROCESOS = 4
+    HILOS = 3
+    POR_HILO = 40
+
+    def setUp(self):
+        dueno = get_user_model().objects.create_user("dueno", password="x")
+        self.cocheras = [Cochera.objects.create(owner=dueno, nombre=f"C{i}") for i in range(2)]
+        self._tamano = services_tickets.TAMANO_BLOQUE
+        # bloques chicos: cada proceso tiene que volver a reservar muchas veces
+        services_tickets.TAMANO_BLOQUE = 7
+        services_tickets._bloques.clear()
+
+    def tearDown(self):
+        services_tickets.TAMANO_BLOQUE = self._tamano
+        services_tickets._bloques.clear()
+
+    def _correr(self, cochera_id):
+        ctx = multiprocessing.get_context("fork")
+        # los hijos abren sus propias conexiones
+        connections.close_all()
+        hijos = []
+        for _ in range(self.PROCESOS):
+            leer, escribir = ctx.Pipe(duplex=False)
+            p = ctx.Process(target=_emitir_en_proceso, args=(cochera_id, self.HILOS, self.POR_HILO, escribir))
+            p.start()
+            escribir.close()
+            hijos.append((p, leer))
+        codigos = []
+        for p, leer in hijos:
+            res = leer.recv()
+            p.join(timeout=60)
+            if isinstance(res, Exception):
+                raise res
+            self.assertEqual(p.exitcode, 0)
+            codigos.extend(res)
+        return codigos
+
+    def test_codigos_unicos_entre_procesos(self):
+        cochera_id = self.cocheras[0].id
+        codigos = self._correr(cochera_id)
+        total = self.PROCESOS * self.HILOS * self.POR_HILO
+        self.assertEqual(len(codigos), total)
+        self.assertEqual(len(set(codigos)), total)
+
+        numeros = []
+        for codigo in codigos:
+            cochera, numero = services_tickets.leer(codigo)
+            self.assertEqual(cochera, cochera_id)
+            numeros.append(numero)
+        # la secuencia en la base quedó después de todo lo repartido
+        siguiente = SecuenciaTicket.objects.get(cochera_id=cochera_id).siguiente
+        self.assertLess(max(numeros), siguiente)
+
+    def test_cocheras_no_se_pisan(self):
+        uno, dos = (c.id for c in self.cocheras)
+        a = self._correr(uno)
+        b = self._correr(dos)
+        self.assertFalse(set(a) & set(b))
+        self.assertEqual({services_tickets.leer(c)[0] for c in a}, {uno})
+        self.assertEqual({services_tickets.leer(c)[0] for c in b}, {dos})
+
+
+# el cache en tabla también hace queries: para contar solo las del código va
+# LocMem (los tests corren en un proceso)
+CACHE_LOCAL = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+@override_settings(CACHES=CACHE_LOCAL)
+class DatosGeneradosTestCase(TestCase):
+    """
+    Base de los tests de presupuesto: un dataset chico de generar_datos, fijo
+    por --seed y --hasta, armado una vez por clase.
+    """
+
+    HASTA = "2026-01-01"
+    DATOS = {"duenos": 1, "cocheras": 1, "movimientos": 20_000, "dias": 60, "espacios": [150, 150]}
+
+    @classmethod
+    def setUpTestData(cls):
+        # LocMem sobrevive entre clases y los ids se repiten después del rollback
+        cache.clear()
+        cls.generar("gen")
+        cls.cochera = Cochera.objects.get(nombre="GEN 0-0")
+        cls.dueno = cls.cochera.owner
+        cls.hasta = timezone.make_aware(datetime.fromisoformat(cls.HASTA))
+
+    @classmethod
+    def generar(cls, prefijo):
+        call_command("generar_datos", prefijo=prefijo, hasta=cls.HASTA, eventos=True, stdout=io.StringIO(), **cls.DATOS)
+
+
+class GenerarDatosTests(DatosGeneradosTestCase):
+    def _historia(self, prefijo):
+        return list(
+            Movimiento.objects.filter(cochera__nombre__startswith=prefijo.upper())
+            .order_by("ingreso_at", "espacio__etiqueta")
+            .values_list("ingreso_at", "egreso_at", "monto", "estado", "espacio__etiqueta")
+        )
+
+    def test_mismo_seed_mismos_datos(self):
+        self.generar("otro")
+        gen, otro = self._historia("gen"), self._historia("otro")
+        self.assertGreater(len(gen), 10_000)
+        self.assertEqual(gen, otro)
+
+    def test_historia_termina_en_hasta(self):
+        movs = Movimiento.objects.filter(cochera=self.cochera)
+        self.assertFalse(movs.filter(ingreso_at__gte=self.hasta).exists())
+        self.assertFalse(movs.filter(egreso_at__gte=self.hasta).exists())
+        # lo que seguía adentro a esa hora quedó abierto, con su espacio ocupado
+        abiertos = movs.filter(estado=Movimiento.ABIERTO)
+        self.assertTrue(abiertos.exists())
+        self.assertEqual(abiertos.filter(espacio__ocupado=True).count(), abiertos.count())
+
+    def test_puerta_no_depende_de_la_historia(self):
+        tipo = TipoEspacio.objects.get(nombre="Auto")
+        # la primera vuelta llena los caches (tarifas, bitmap de espacios, abonos)
+        ingresar_vehiculo(cochera=self.cochera, operador=self.dueno, tipo=tipo, ticket="CALIENTA1")
+        egresar_vehiculo(cochera=self.cochera, operador=self.dueno, ticket="CALIENTA1")
+        # 20k movimientos atrás no cambian cuántas queries hace la puerta
+        with self.assertNumQueries(9):
+            ingresar_vehiculo(cochera=self.cochera, operador=self.dueno, tipo=tipo, ticket="PRESUP1")
+        with self.assertNumQueries(8):
+            egresar_vehiculo(cochera=self.cochera, operador=self.dueno, ticket="PRESUP1")
+
+
+
+class AnaliticaPresupuestoTests(DatosGeneradosTestCase):
+    """Los reportes de services_analitica: queries fijas y el resumen entero en menos de un segundo."""
+
+    PRESUPUESTO_S = 1.0
+
+    def setUp(self):
+        self.desde = self.hasta - timedelta(days=30)
+        self.rango = (self.desde, self.hasta, self.cochera.id)
+
+    def test_queries_por_reporte(self):
+        with self.assertNumQueries(2):
+            operadores = services_analitica.rendimiento_operadores(*self.rango)
+        with self.assertNumQueries(1):
+            services_analitica.tiempos_entre_operaciones(*self.rango)
+        for por in ("tipo", "dia_semana"):
+            with self.subTest(por=por), self.assertNumQueries(2):
+                services_analitica.distribucion_estadias(*self.rango, por=por)
+
+        # las cuentas salen de la base, pero tienen que cerrar con la bitácora
+        ops = EventoMovimiento.objects.filter(
+            cochera=self.cochera, ocurrido_at__gte=self.desde, ocurrido_at__lt=self.hasta,
+            tipo__in=[EventoMovimiento.INGRESO, EventoMovimiento.EGRESO],
+        ).count()
+        self.assertGreater(ops, 10_000)
+        self.assertEqual(sum(o["ops"] for o in operadores), ops)
+
+    def test_resumen_bajo_presupuesto(self):
+        with self.assertNumQueries(7):
+            t0 = time.perf_counter()
+            datos = services_analitica.resumen(self.cochera.id, self.desde, self.hasta)
+            segundos = time.perf_counter() - t0
+        self.assertLess(segundos, self.PRESUPUESTO_S)
+        self.assertEqual(len(datos["estadias"]["dia_semana"]), 7)
+        # la segunda vez sale del cache
+        with self.assertNumQueries(0):
+            services_analitica.resumen(self.cochera.id, self.desde, self.hasta)
+
+
+class _Receptor(ThreadingHTTPServer):
+    """Endpoint local de mentira: guarda lo que le llega y contesta los status de `respuestas` (después 204)."""
+    daemon_threads = True
+
+    def __init__(self, respuestas=()):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.respuestas = list(respuestas)
+        self.posts = []
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/hook"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        with self.server.lock:
+            self.server.posts.append((self.path, dict(self.headers), body))
+            status = self.server.respuestas.pop(0) if self.server.respuestas else 204
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def _puerto_cerrado():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class OutboxTests(TestCase):
+    """services_outbox contra un receptor HTTP local: entrega, firma, reintentos y backoff."""
+
+    SECRETO = "s3creto"
+
+    def setUp(self):
+        dueno = get_user_model().objects.create_user("dueno", password="x")
+        self.cochera = Cochera.objects.create(owner=dueno, nombre="C")
+        self.pool = ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(self.pool.shutdown)
+
+    def _receptor(self, respuestas=()):
+        receptor = _Receptor(respuestas)
+        threading.Thread(target=receptor.serve_forever, daemon=True).start()
+        self.addCleanup(receptor.server_close)
+        self.addCleanup(receptor.shutdown)
+        return receptor
+
+    def _webhook(self, url, **extra):
+        return override_settings(PARKING_WEBHOOKS=[{"nombre": "contable", "url": url, "secreto": self.SECRETO, **extra}])
+
+    def _mensajes(self, n):
+        return MensajeOutbox.objects.bulk_create([
+            MensajeOutbox(destino="contable", cochera=self.cochera, cuerpo={"id": f"default-{i}", "tipo": "INGRESO"})
+            for i in range(n)
+        ])
+
+    def _despachar(self):
+        return services_outbox.despachar("test", self.pool, 100)
+
+    def _listos_ya(self):
+        MensajeOutbox.objects.update(disponible_at=timezone.now())
+
+    def test_entrega_firmada(self):
+        receptor = self._receptor()
+        self._mensajes(3)
+        with self._webhook(receptor.url, lote=2):
+            self.assertEqual(self._despachar(), (3, 0))
+
+        self.assertEqual(set(MensajeOutbox.objects.values_list("estado", flat=True)), {MensajeOutbox.ENTREGADO})
+        # lote 2: un POST con dos eventos y otro con uno, cada uno firmado
+        recibidos = []
+        for ruta, headers, body in receptor.posts:
+            self.assertEqual(ruta, "/hook")
+            t, v1 = (p.split("=", 1)[1] for p in headers["X-Parking-Firma"].split(","))
+            self.assertTrue(hmac.compare_digest(v1, services_outbox.firmar(self.SECRETO, t, body)))
+            datos = json.loads(body)
+            self.assertEqual(headers["X-Parking-Evento"], ",".join(c["id"] for c in datos))
+            recibidos += [c["id"] for c in datos]
+        self.assertEqual(len(receptor.posts), 2)
+        self.assertEqual(sorted(recibidos), ["default-0", "default-1", "default-2"])
+
+    def test_error_http_reintenta_con_backoff(self):
+        receptor = self._receptor([503])
+        self._mensajes(1)
+        with self._webhook(receptor.url):
+            antes = timezone.now()
+            self.assertEqual(self._despachar(), (0, 1))
+            m = MensajeOutbox.objects.get()
+            self.assertEqual((m.estado, m.intentos, m.error), (MensajeOutbox.PENDIENTE, 1, "HTTP 503 Service Unavailable"))
+            espera = (m.disponible_at - antes).total_seconds()
+            self.assertGreaterEqual(espera, services_outbox.BACKOFF_BASE)
+            self.assertLess(espera, services_outbox.BACKOFF_BASE * 1.25 + 1)
+
+            # hasta que pase el backoff no se reclama
+            self.assertEqual(self._despachar(), (0, 0))
+            self._listos_ya()
+            self.assertEqual(self._despachar(), (1, 0))
+        m.refresh_from_db()
+        self.assertEqual((m.estado, m.intentos, m.error), (MensajeOutbox.ENTREGADO, 2, ""))
+        self.assertEqual(len(receptor.posts), 2)
+
+    def test_backoff_exponencial_y_fallido(self):
+        receptor = self._receptor([500] * 3)
+        self._mensajes(1)
+        esperas = []
+        with self._webhook(receptor.url, max_intentos=3):
+            for _ in range(3):
+                antes = timezone.now()
+                self._despachar()
+                m = MensajeOutbox.objects.get()
+                esperas.append((m.disponible_at - antes).total_seconds())
+                self._listos_ya()
+        m.refresh_from_db()
+        self.assertEqual((m.estado, m.intentos), (MensajeOutbox.FALLIDO, 3))
+        # 5s y 10s (más el jitter); el tercero ya no vuelve
+        self.assertGreaterEqual(esperas[0], services_outbox.BACKOFF_BASE)
+        self.assertGreaterEqual(esperas[1], services_outbox.BACKOFF_BASE * 2)
+        self.assertEqual(len(receptor.posts), 3)
+
+    def test_caido_no_gasta_intentos(self):
+        self._mensajes(4)
+        with self._webhook(f"http://127.0.0.1:{_puerto_cerrado()}/hook", max_intentos=1):
+            for _ in range(3):
+                self.assertEqual(self._despachar(), (0, 4))
+                self._listos_ya()
+        # ni el que se probó ni los que quedaron sin probar se agotan
+        for m in MensajeOutbox.objects.all():
+            self.assertEqual((m.estado, m.intentos), (MensajeOutbox.PENDIENTE, 0))
+            self.assertTrue(m.error)
+        self.assertTrue(MensajeOutbox.objects.filter(error__startswith="No se intentó").exists())
+
+    def test_caido_espera_segun_lo_que_lleva(self):
+        self._mensajes(2)
+        viejo, nuevo = MensajeOutbox.objects.order_by("id")
+        MensajeOutbox.objects.filter(id=viejo.id).update(created_at=timezone.now() - timedelta(minutes=20))
+        with self._webhook(f"http://127.0.0.1:{_puerto_cerrado()}/hook"):
+            antes = timezone.now()
+            self._despachar()
+        viejo.refresh_from_db()
+        nuevo.refresh_from_db()
+        # el nuevo vuelve enseguida, el que lleva 20 minutos espera del orden de eso
+        self.assertLess((nuevo.disponible_at - antes).total_seconds(), services_outbox.BACKOFF_BASE * 1.25 + 1)
+        self.assertGreater((viejo.disponible_at - antes).total_seconds(), 10 * 60)
+        self.assertLessEqual((viejo.disponible_at - antes).total_seconds(), services_outbox.BACKOFF_MAX * 1.25)
+
+
+    def test_cierre_en_bloque_pasa_por_el_outbox(self):
+        ensure_default_tipos()
+        tipo = TipoEspacio.objects.get(nombre="Auto")
+        espacios = Espacio.objects.bulk_create([
+            Espacio(cochera=self.cochera, tipo=tipo, etiqueta=f"A-{i}", orden=i) for i in range(3)
+        ])
+        vehiculo = Vehiculo.objects.create(cliente=Cliente.objects.create(), ticket="B1", tipo=tipo)
+        movs = Movimiento.objects.bulk_create([
+            Movimiento(cochera=self.cochera, vehiculo=vehiculo, espacio=e, operador=self.cochera.owner,
+                       ingreso_at=timezone.now() - timedelta(hours=5))
+            for e in espacios
+        ])
+        webhooks = [
+            {"nombre": "contable", "url": "http://127.0.0.1:1/hook"},
+            {"nombre": "barrera", "url": "http://127.0.0.1:1/hook", "eventos": ["INGRESO"]},
+        ]
+        with override_settings(PARKING_WEBHOOKS=webhooks):
+            self.assertEqual(cerrar_movimientos([m.id for m in movs[:2]], motivo="abandonado"), 2)
+        mensajes = list(MensajeOutbox.objects.order_by("id"))
+        # uno por movimiento cerrado, solo para el suscripto a AJUSTE, con el evento de la bitácora
+        self.assertEqual([m.destino for m in mensajes], ["contable", "contable"])
+        eventos = EventoMovimiento.objects.filter(tipo=EventoMovimiento.AJUSTE)
+        self.assertEqual({m.evento_id for m in mensajes}, set(eventos.values_list("id", flat=True)))
+        self.assertEqual({m.cuerpo["movimiento_id"] for m in mensajes}, {movs[0].id, movs[1].id})
+        self.assertEqual(mensajes[0].cuerpo["detalle"], {"cerrar": True, "motivo": "abandonado"})
+
+@override_settings(CACHES=CACHE_LOCAL)
+class AsignacionShardTests(TestCase):
+    """El ruteo por módulo es solo para la primera vez: después manda ShardOperador."""
+
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+        self.duenos = [User.objects.create_user(f"d{i}") for i in range(6)]
+
+    def test_agregar_un_shard_no_muda_a_nadie(self):
+        with override_settings(PARKING_SHARDS=["s1", "s2"]):
+            antes = {d.id: tenancy.alias_para_owner(d.id) for d in self.duenos}
+        self.assertEqual(dict(ShardOperador.objects.values_list("owner_id", "alias")), antes)
+        self.assertEqual(set(antes.values()), {"s1", "s2"})
+
+        with override_settings(PARKING_SHARDS=["s1", "s2", "s3"]):
+            cache.clear()
+            despues = {d.id: tenancy.alias_para_owner(d.id) for d in self.duenos}
+            nuevo = get_user_model().objects.create_user("nuevo")
+            # a los nuevos sí les puede tocar el shard nuevo
+            self.assertEqual(tenancy.alias_para_owner(nuevo.id), ["s1", "s2", "s3"][nuevo.id % 3])
+        self.assertEqual(despues, antes)
+
+    def test_gana_la_asignacion_a_mano(self):
+        dueno = self.duenos[0]
+        ShardOperador.objects.create(owner=dueno, alias="s2")
+        with override_settings(PARKING_SHARDS=["s1", "s2"]):
+            self.assertEqual(tenancy.alias_para_owner(dueno.id), "s2")
+            # otro proceso con el mapa viejo en cache termina en la misma fila
+            self.assertEqual(tenancy.asignar(dueno.id, "s1"), "s2")
+
+    def test_solo_los_duenos_quedan_asignados(self):
+        dueno, cualquiera = self.duenos[:2]
+        dueno.groups.add(Group.objects.get_or_create(name="ADMIN_DUENO")[0])
+        with override_settings(PARKING_SHARDS=["s1", "s2"]):
+            self.assertEqual(tenancy.alias_para_usuario(cualquiera), ["s1", "s2"][cualquiera.id % 2])
+            self.assertFalse(ShardOperador.objects.filter(owner=cualquiera).exists())
+            tenancy.alias_para_usuario(dueno)
+        self.assertTrue(ShardOperador.objects.filter(owner=dueno).exists())
+
+    def test_shard_que_ya_no_esta(self):
+        dueno = self.duenos[0]
+        ShardOperador.objects.create(owner=dueno, alias="viejo")
+        with override_settings(PARKING_SHARDS=["s1", "s2"]), self.assertRaises(ImproperlyConfigured):
+            tenancy.alias_para_owner(dueno.id)
+
+
+@override_settings(CACHES=CACHE_LOCAL)
+class CercanasViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        dueno = get_user_model().objects.create_user("dueno", is_superuser=True)
+        ensure_default_tipos()
+        self.tipo = TipoEspacio.objects.get(nombre="Auto")
+        # tres cocheras a unas cuadras una de otra
+        self.cocheras = []
+        for i in range(3):
+            c = Cochera.objects.create(owner=dueno, nombre=f"C{i}", latitud=f"-34.60{i}", longitud="-58.380")
+            ConfigCapacidad.objects.create(cochera=c, tipo=self.tipo, cantidad=5)
+            self.cocheras.append(c)
+        self.client.force_login(dueno)
+        self.url = reverse("cercanas_cochera", args=[self.cocheras[0].id])
+
+    def _get(self, **params):
+        return self.client.get(self.url, {"tipo": self.tipo.id, **params})
+
+    def test_cercanas(self):
+        r = self._get()
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual([c["id"] for c in r.json()["cercanas"]], [c.id for c in self.cocheras[1:]])
+
+    def test_radio_invalido(self):
+        for radio in ["nan", "inf", "-inf", "0", "-3", "abc"]:
+            with self.subTest(radio_km=radio):
+                self.assertEqual(self._get(radio_km=radio).status_code, 400)
+
+    def test_n_minimo_uno(self):
+        for n in ["0", "-5", "1"]:
+            with self.subTest(n=n):
+                r = self._get(n=n)
+                self.assertEqual(r.status_code, 200)
+                self.assertEqual(len(r.json()["cercanas"]), 1)
+
+
+@override_settings(CACHES=CACHE_LOCAL)
+class PoolRollbackTests(TestCase):
+    """Un espacio tomado por una transacción que no commiteó vuelve al bitmap del proceso."""
+
+    def setUp(self):
+        cache.clear()
+        services_asignacion._pools.clear()
+        self.dueno = get_user_model().objects.create_user("dueno")
+        ensure_default_tipos()
+        self.tipo = TipoEspacio.objects.get(nombre="Auto")
+        self.cochera = Cochera.objects.create(owner=self.dueno, nombre="C")
+        Espacio.objects.bulk_create([
+            Espacio(cochera=self.cochera, tipo=self.tipo, etiqueta=f"A-{i}", orden=i) for i in range(3)
+        ])
+
+    def _libres(self):
+        return services_asignacion.obtener_pool(self.cochera.id, self.tipo.id).cantidad_libres
+
+    def test_ingreso_que_falla_despues_de_asignar(self):
+        self.assertEqual(self._libres(), 3)
+        with mock.patch("parking.services_movimientos.registrar", side_effect=RuntimeError("se cortó")):
+            with self.assertRaises(RuntimeError):
+                ingresar_vehiculo(cochera=self.cochera, operador=self.dueno, tipo=self.tipo, ticket="X1")
+        self.assertEqual(self._libres(), 3)
+        self.assertFalse(Espacio.objects.filter(ocupado=True).exists())
+        # y el siguiente lo puede usar
+        ingresar_vehiculo(cochera=self.cochera, operador=self.dueno, tipo=self.tipo, ticket="X2")
+        self.assertEqual(self._libres(), 2)
+
+    def test_lote_que_no_commitea(self):
+        # como el secuenciador: comandos en savepoints que salen bien y el commit del lote falla
+        with self.assertRaises(RuntimeError):
+            with services_asignacion.devolver_si_falla(), transaction.atomic():
+                for _ in range(2):
+                    with services_asignacion.devolver_si_falla(), transaction.atomic():
+                        services_asignacion.asignar_espacio(self.cochera, self.tipo.id)
+                self.assertEqual(self._libres(), 1)
+                raise RuntimeError("falló el commit")
+        self.assertEqual(self._libres(), 3)
+
+    def test_savepoint_que_falla_no_devuelve_los_otros(self):
+        with services_asignacion.devolver_si_falla(), transaction.atomic():
+            bien = services_asignacion.asignar_espacio(self.cochera, self.tipo.id)
+            with self.assertRaises(RuntimeError):
+                with services_asignacion.devolver_si_falla(), transaction.atomic():
+                    services_asignacion.asignar_espacio(self.cochera, self.tipo.id)
+                    raise RuntimeError("este comando no")
+            self.assertEqual(self._libres(), 2)
+        self.assertEqual(list(Espacio.objects.filter(ocupado=True).values_list("id", flat=True)), [bien])
+
+    def test_lo_commiteado_no_se_devuelve(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                services_asignacion.asignar_espacio(self.cochera, self.tipo.id)
+        with self.assertRaises(RuntimeError):
+            with services_asignacion.devolver_si_falla():
+                raise RuntimeError("después")
+        self.assertEqual(self._libres(), 2)
+
+
+@override_settings(CACHES=CACHE_LOCAL)
+class AbonadoFlotanteReservaTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        services_asignacion._pools.clear()
+        self.dueno = get_user_model().objects.create_user("dueno")
+        ensure_default_tipos()
+        self.tipo = TipoEspacio.objects.get(nombre="Auto")
+        self.cochera = Cochera.objects.create(owner=self.dueno, nombre="C")
+        ConfigCapacidad.objects.create(cochera=self.cochera, tipo=self.tipo, cantidad=2)
+        Espacio.objects.bulk_create([
+            Espacio(cochera=self.cochera, tipo=self.tipo, etiqueta=f"A-{i}", orden=i) for i in range(2)
+        ])
+        hoy, ahora = timezone.localdate(), timezone.now()
+        # las invalidaciones de los memos van en on_commit
+        with self.captureOnCommitCallbacks(execute=True):
+            crear_abonado(
+                cochera=self.cochera, tipo=self.tipo, ticket="ABONO1",
+                valido_desde=hoy - timedelta(days=1), valido_hasta=hoy + timedelta(days=30),
+            )
+            self.reserva = crear_reserva(
+                cochera=self.cochera, tipo=self.tipo, desde=ahora, hasta=ahora + timedelta(hours=2)
+            )
+
+    def _ingresar(self, ticket, **extra):
+        return ingresar_vehiculo(cochera=self.cochera, operador=self.dueno, tipo=self.tipo, ticket=ticket, **extra)
+
+    def test_no_se_come_el_lugar_reservado(self):
+        self._ingresar("SUELTO1")
+        # queda un libre y está retenido por la reserva
+        with self.assertRaisesMessage(ValueError, "reservados"):
+            self._ingresar("ABONO1")
+        self.assertEqual(Movimiento.objects.filter(abonado__isnull=False).count(), 0)
+        # el de la reserva sí entra
+        mov = self._ingresar("RESERVA1", codigo_reserva=self.reserva.codigo)
+        self.assertEqual(mov.estado, Movimiento.ABIERTO)
+
+    def test_con_lugar_entra(self):
+        mov = self._ingresar("ABONO1")
+        self.assertIsNotNone(mov.abonado_id)
+
+
+class ReconciliacionLotesTests(TestCase):
+    def test_cochera_grande_en_lotes(self):
+        dueno = get_user_model().objects.create_user("dueno")
+        ensure_default_tipos()
+        tipo = TipoEspacio.objects.get(nombre="Auto")
+        cochera = Cochera.objects.create(owner=dueno, nombre="Grande")
+        n = services_eventos.LOTE_IDS * 2 + 100
+        # todos marcados ocupados sin ningún movimiento ABIERTO
+        Espacio.objects.bulk_create([
+            Espacio(cochera=cochera, tipo=tipo, etiqueta=f"A-{i}", orden=i, ocupado=True) for i in range(n)
+        ], batch_size=500)
+
+        with CaptureQueriesContext(connections["default"]) as ctx:
+            rep = services_reconciliacion.reconciliar(cochera_id=cochera.id)
+        self.assertEqual(rep["reparado"]["liberados"], n)
+        self.assertFalse(Espacio.objects.filter(ocupado=True).exists())
+        self.assertEqual(EventoMovimiento.objects.filter(tipo=EventoMovimiento.AJUSTE).count(), n)
+        # ningún IN (...) más largo que LOTE_IDS
+        largos = [len(m.split(",")) for q in ctx for m in re.findall(r" IN \(([^()]*)\)", q["sql"])]
+        self.assertTrue(largos)
+        self.assertLessEqual(max(largos), services_eventos.LOTE_IDS)
+
+
+@override_settings(CACHES=CACHE_LOCAL)
+class AbonoVigenteTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        services_asignacion._pools.clear()
+        self.dueno = get_user_model().objects.create_user("dueno")
+        ensure_default_tipos()
+        self.tipo = TipoEspacio.objects.get(nombre="Auto")
+        self.cochera = Cochera.objects.create(owner=self.dueno, nombre="C")
+        Espacio.objects.create(cochera=self.cochera, tipo=self.tipo, etiqueta="A-1", orden=1)
+        self.hoy = timezone.localdate()
+
+    def _abono(self, desde, hasta):
+        with self.captureOnCommitCallbacks(execute=True):
+            return crear_abonado(
+                cochera=self.cochera, tipo=self.tipo, ticket="ABONO1",
+                valido_desde=self.hoy + timedelta(days=desde), valido_hasta=self.hoy + timedelta(days=hasta),
+            )
+
+    def test_renovacion_que_se_pisa(self):
+        viejo = self._abono(-30, 2)
+        nuevo = self._abono(1, 31)
+        vigente = lambda dias: abono_vigente(self.cochera.id, "ABONO1", self.hoy + timedelta(days=dias))
+        self.assertEqual(vigente(0).id, viejo.id)
+        self.assertEqual(vigente(1).id, nuevo.id)
+        self.assertEqual(vigente(20).id, nuevo.id)
+        self.assertIsNone(vigente(40))
+
+    def test_uno_vencido_cargado_despues(self):
+        actual = self._abono(-5, 25)
+        self._abono(-60, -31)
+        mov = ingresar_vehiculo(cochera=self.cochera, operador=self.dueno, tipo=self.tipo, ticket="ABONO1")
+        self.assertEqual(mov.abonado_id, actual.id)
+
+
+@override_settings(CACHES=CACHE_LOCAL)
+class ReplayEventosTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        services_asignacion._pools.clear()
+        self.dueno = get_user_model().objects.create_user("dueno")
+        ensure_default_tipos()
+        self.tipo = TipoEspacio.objects.get(nombre="Auto")
+        self.cochera = Cochera.objects.create(owner=self.dueno, nombre="C")
+        Espacio.objects.bulk_create([
+            Espacio(cochera=self.cochera, tipo=self.tipo, etiqueta=f"A-{i}", orden=i) for i in range(6)
+        ])
+
+    def _operar(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for t in ("R1", "R2", "R3", "R4"):
+                ingresar_vehiculo(cochera=self.cochera, operador=self.dueno, tipo=self.tipo, ticket=t)
+            egresar_vehiculo(cochera=self.cochera, operador=self.dueno, ticket="R1")
+            libre = Espacio.objects.filter(cochera=self.cochera, ocupado=False).order_by("-orden").first()
+            reasignar_espacio(cochera=self.cochera, operador=self.dueno, ticket="R2", espacio_destino=libre)
+            r3 = Movimiento.objects.get(vehiculo__ticket="R3", estado=Movimiento.ABIERTO)
+            cerrar_movimientos([r3.id], operador_id=self.dueno.id)
+
+    def _foto(self):
+        return (
+            sorted(Espacio.objects.values_list("id", "ocupado")),
+            sorted(Movimiento.objects.values_list("id", "estado", "espacio_id", "egreso_at", "monto")),
+            sorted(RecaudacionDiaria.objects.values_list("cochera_id", "fecha", "egresos", "total")),
+        )
+
+    def test_replay_reproduce_las_proyecciones(self):
+        self._operar()
+        antes = self._foto()
+
+        # se rompen las tres proyecciones (los espacios que nunca se usaron no
+        # están en la bitácora: esos los arregla la reconciliación, no el replay)
+        usados = set(EventoMovimiento.objects.values_list("espacio_id", flat=True))
+        for e in Espacio.objects.filter(id__in=usados):
+            Espacio.objects.filter(id=e.id).update(ocupado=not e.ocupado)
+        Movimiento.objects.filter(vehiculo__ticket="R1").update(estado=Movimiento.ABIERTO, egreso_at=None, monto=None)
+        RecaudacionDiaria.objects.update(total=999)
+        RecaudacionDiaria.objects.create(cochera=self.cochera, fecha=timezone.localdate() - timedelta(days=3))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            stats = services_eventos.reconstruir_proyecciones()
+        self.assertEqual(self._foto(), antes)
+        self.assertEqual(stats["movimientos_corregidos"], 1)
+        # y una segunda pasada no encuentra nada
+        stats = services_eventos.reconstruir_proyecciones(aplicar=False)
+        self.assertEqual(stats["espacios_ocupar"] + stats["espacios_liberar"], 0)
+        self.assertEqual(stats["movimientos_corregidos"] + stats["dias_corregidos"], 0)
+
+    def test_datos_sin_eventos_no_se_pisan(self):
+        self._operar()
+        # un movimiento abierto y un egreso de ayer de antes de la bitácora
+        viejo = ingresar_vehiculo(cochera=self.cochera, operador=self.dueno, tipo=self.tipo, ticket="V1")
+        EventoMovimiento.objects.filter(movimiento_id=viejo.id).delete()
+        ayer = timezone.now() - timedelta(days=1)
+        Movimiento.objects.create(
+            cochera=self.cochera, vehiculo=Vehiculo.objects.get(ticket="R1"),
+            espacio=Espacio.objects.filter(cochera=self.cochera).first(), operador=self.dueno,
+            estado=Movimiento.CERRADO, ingreso_at=ayer - timedelta(hours=2), egreso_at=ayer, monto=500,
+        )
+        RecaudacionDiaria.objects.create(cochera=self.cochera, fecha=timezone.localdate(ayer), egresos=1, total=500)
+        # y una cochera entera cargada sin eventos
+        otra = Cochera.objects.create(owner=self.dueno, nombre="Vieja")
+        ocupado = Espacio.objects.create(cochera=otra, tipo=self.tipo, etiqueta="B-1", orden=1, ocupado=True)
+        RecaudacionDiaria.objects.create(cochera=otra, fecha=timezone.localdate(), egresos=3, total=1500)
+        antes = self._foto()
+
+        stats = services_eventos.reconstruir_proyecciones()
+        self.assertEqual(self._foto(), antes)
+        self.assertEqual(stats["movimientos_sin_eventos"], 2)
+        self.assertTrue(Espacio.objects.get(id=viejo.espacio_id).ocupado)
+        self.assertTrue(Espacio.objects.get(id=ocupado.id).ocupado)
+
+    def test_no_escribe_si_entran_eventos_mientras_lee(self):
+        self._operar()
+        Movimiento.objects.filter(vehiculo__ticket="R1").update(estado=Movimiento.ABIERTO, egreso_at=None, monto=None)
+        plegar = services_eventos._plegar
+
+        def _con_trafico(*args, **kwargs):
+            res = plegar(*args, **kwargs)
+            ingresar_vehiculo(cochera=self.cochera, operador=self.dueno, tipo=self.tipo, ticket="R9")
+            return res
+
+        with mock.patch("parking.services_eventos._plegar", side_effect=_con_trafico):
+            with self.assertRaises(services_eventos.TraficoEnVivo):
+                services_eventos.reconstruir_proyecciones()
+        self.assertTrue(Movimiento.objects.filter(vehiculo__ticket="R1", estado=Movimiento.ABIERTO).exists())
+
+
+@override_settings(CACHES=CACHE_LOCAL)
+class TarifasTests(TestCase):
+    """Primera hora, fracción iniciada, franja noche, tope por 24 h y vigencias."""
+
+    def setUp(self):
+        cache.clear()
+        services_asignacion._pools.clear()
+        self.dueno = get_user_model().objects.create_user("dueno")
+        ensure_default_tipos()
+        self.tipo = TipoEspacio.objects.get(nombre="Auto")
+        self.cochera = Cochera.objects.create(owner=self.dueno, nombre="C")
+        Espacio.objects.create(cochera=self.cochera, tipo=self.tipo, etiqueta="A-1", orden=1)
+        self.base = timezone.make_aware(datetime(2026, 3, 2, 10, 0))
+        with self.captureOnCommitCallbacks(execute=True):
+            ReglaTarifa.objects.create(
+                cochera=self.cochera, tipo=self.tipo, vigente_desde=self.base - timedelta(days=30),
+                precio_primera_hora=10, minutos_fraccion=15, precio_fraccion=2, precio_fraccion_noche=1,
+                noche_desde=22, noche_hasta=6, tope_diario=50,
+            )
+
+    def _monto(self, ingreso, duracion):
+        return cotizar(self.cochera.id, self.tipo.id, ingreso, ingreso + duracion)
+
+    def test_primera_hora_y_fracciones(self):
+        casos = [
+            (timedelta(seconds=1), "10.00"),
+            (timedelta(hours=1), "10.00"),
+            (timedelta(hours=1, seconds=1), "12.00"),     # fracción iniciada se cobra entera
+            (timedelta(hours=1, minutes=15), "12.00"),
+            (timedelta(hours=1, minutes=16), "14.00"),
+            (timedelta(hours=3), "26.00"),
+        ]
+        for duracion, esperado in casos:
+            with self.subTest(duracion=duracion):
+                self.assertEqual(self._monto(self.base, duracion), Decimal(esperado))
+
+    def test_fracciones_de_noche(self):
+        # 21:30 a 23:30: primera hora + 4 fracciones que arrancan después de las 22
+        ingreso = self.base.replace(hour=21, minute=30)
+        self.assertEqual(self._monto(ingreso, timedelta(hours=2)), Decimal("14.00"))
+
+    def test_tope_por_cada_24_horas(self):
+        # primeras 24 h topeadas (50), después 6 h de día = 24 fracciones (48)
+        self.assertEqual(self._monto(self.base, timedelta(hours=24)), Decimal("50.00"))
+        self.assertEqual(self._monto(self.base, timedelta(hours=30)), Decimal("98.00"))
+        self.assertEqual(self._monto(self.base, timedelta(hours=72)), Decimal("150.00"))
+
+    def test_cambio_de_precio_en_medio_de_la_estadia(self):
+        cambio = self.base + timedelta(hours=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            ReglaTarifa.objects.create(
+                cochera=self.cochera, tipo=self.tipo, vigente_desde=cambio,
+                precio_primera_hora=20, minutos_fraccion=30, precio_fraccion=5,
+            )
+        # vale la regla vigente al ingreso, aunque el egreso caiga en la nueva
+        self.assertEqual(self._monto(cambio - timedelta(minutes=1), timedelta(hours=2)), Decimal("18.00"))
+        self.assertEqual(self._monto(cambio, timedelta(hours=2)), Decimal("30.00"))
+        self.assertEqual(self._monto(cambio + timedelta(hours=5), timedelta(minutes=61)), Decimal("25.00"))
+
+    def test_tarifa_hora_como_fallback(self):
+        moto = TipoEspacio.objects.exclude(id=self.tipo.id).first()
+        with self.captureOnCommitCallbacks(execute=True):
+            TarifaHora.objects.create(cochera=self.cochera, tipo=moto, precio_hora=3)
+        self.assertEqual(cotizar(self.cochera.id, moto.id, self.base, self.base + timedelta(minutes=121)), Decimal("9.00"))
+
+    def test_lote_igual_a_cotizar(self):
+        ingresos, egresos = [], []
+        for h in range(0, 24 * 60, 37):
+            for dur in (1, 3599, 3600, 3601, 900 * 7 + 1, 86400, 86400 + 901, 3 * 86400 - 1):
+                i = self.base + timedelta(minutes=h, seconds=h % 60)
+                ingresos.append(i)
+                egresos.append(i + timedelta(seconds=dur))
+        lote = cotizar_lote(self.cochera.id, [self.tipo.id] * len(ingresos), a_epoch(ingresos), a_epoch(egresos))
+        uno_a_uno = [cotizar(self.cochera.id, self.tipo.id, i, e) for i, e in zip(ingresos, egresos)]
+        self.assertEqual([Decimal(int(c)) / 100 for c in lote], uno_a_uno)
+
+    def test_lo_cotizado_es_lo_cobrado(self):
+        for ticket, duracion in [("T1", timedelta(minutes=59)), ("T2", timedelta(hours=1, minutes=1)),
+                                 ("T3", timedelta(hours=23, minutes=40)), ("T4", timedelta(hours=26))]:
+            with self.subTest(duracion=duracion):
+                mov = ingresar_vehiculo(cochera=self.cochera, operador=self.dueno, tipo=self.tipo, ticket=ticket)
+                Movimiento.objects.filter(id=mov.id).update(ingreso_at=timezone.now() - duracion)
+                mov = egresar_vehiculo(cochera=self.cochera, operador=self.dueno, ticket=ticket)
+                mov.refresh_from_db()
+                lote = cotizar_lote(self.cochera.id, [self.tipo.id], a_epoch([mov.ingreso_at]), a_epoch([mov.egreso_at]))
+                self.assertEqual(mov.monto, Decimal(int(lote[0])) / 100)
+                self.assertEqual(mov.monto, cotizar(self.cochera.id, self.tipo.id, mov.ingreso_at, mov.egreso_at))
+
+
+@override_settings(CACHES=CACHE_LOCAL)
+class PronosticoTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.dueno = get_user_model().objects.create_user("dueno", is_superuser=True)
+        ensure_default_tipos()
+        self.tipo = TipoEspacio.objects.get(nombre="Auto")
+        self.cochera = Cochera.objects.create(owner=self.dueno, nombre="C")
+        with self.captureOnCommitCallbacks(execute=True):
+            ConfigCapacidad.objects.create(cochera=self.cochera, tipo=self.tipo, cantidad=10)
+        self.espacio = Espacio.objects.create(cochera=self.cochera, tipo=self.tipo, etiqueta="A-1", orden=1)
+        cliente = Cliente.objects.create(nombre="x")
+        self.vehiculo = Vehiculo.objects.create(cliente=cliente, ticket="P1", tipo=self.tipo)
+        self.lunes = timezone.make_aware(datetime(2026, 3, 2, 10, 0))
+
+    def _cerrados(self, ingresos, estadia):
+        Movimiento.objects.bulk_create([
+            Movimiento(cochera=self.cochera, vehiculo=self.vehiculo, espacio=self.espacio, operador=self.dueno,
+                       estado=Movimiento.CERRADO, ingreso_at=i, egreso_at=i + estadia, monto=0)
+            for i in ingresos
+        ])
+
+    def test_curva_de_lunes(self):
+        # 3 autos cada lunes 10:00 que se quedan 2 h 30, durante 4 semanas
+        ingresos = [self.lunes + timedelta(weeks=w) for w in range(4) for _ in range(3)]
+        self._cerrados(ingresos, timedelta(hours=2, minutes=30))
+
+        curva = services_pronostico.pronosticar(self.cochera, self.lunes.date())[self.tipo.id]
+        horas = (3 * 168 + 3) / 168  # de la primera llegada al último egreso
+        esperado = round(3 * 4 / horas, 2)
+        self.assertEqual(curva["ocupacion"][10:13], [esperado] * 3)
+        self.assertEqual(sum(curva["ocupacion"]), esperado * 3)
+        self.assertEqual(curva["capacidad"], 10)
+        # el martes no viene nadie
+        martes = services_pronostico.pronosticar(self.cochera, self.lunes.date() + timedelta(days=1))
+        self.assertEqual(sum(martes[self.tipo.id]["ocupacion"]), 0)
+
+    def test_refresco_incremental_igual_al_completo(self):
+        self._cerrados([self.lunes + timedelta(hours=h) for h in range(5)], timedelta(hours=1))
+        services_pronostico.obtener_perfil(self.cochera.id)
+        # más cerrados, algunos con el mismo egreso que la marca
+        self._cerrados([self.lunes + timedelta(hours=4)] * 2 + [self.lunes + timedelta(days=2)], timedelta(hours=1))
+
+        incremental = services_pronostico.obtener_perfil(self.cochera.id, forzar=True)
+        completo = services_pronostico._refrescar(services_pronostico._perfil_vacio(), self.cochera.id)
+        for clave in ("llegadas", "estadias"):
+            self.assertEqual(
+                incremental["tipos"][self.tipo.id][clave].tolist(), completo["tipos"][self.tipo.id][clave].tolist()
+            )
+        self.assertEqual(incremental["tipos"][self.tipo.id]["llegadas"].sum(), 8)
+
+    def test_perfil_en_cache_no_consulta(self):
+        self._cerrados([self.lunes], timedelta(hours=1))
+        services_pronostico.obtener_perfil(self.cochera.id)
+        with self.assertNumQueries(0):
+            services_pronostico.obtener_perfil(self.cochera.id)
+
+    def test_view(self):
+        self.client.force_login(self.dueno)
+        url = reverse("pronostico_cochera", args=[self.cochera.id])
+        r = self.client.get(url, {"fecha": "2026-03-02"})
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(len(r.json()["tipos"][str(self.tipo.id)]["ocupacion"]), 24)
+        self.assertEqual(self.client.get(url, {"fecha": "2026-13-02"}).status_code, 400)
+
+
+@override_settings(CACHES=CACHE_LOCAL)
+class ReservasTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.dueno = get_user_model().objects.create_user("dueno")
+        ensure_default_tipos()
+        self.tipo = TipoEspacio.objects.get(nombre="Auto")
+        self.cochera = Cochera.objects.create(owner=self.dueno, nombre="C")
+        with self.captureOnCommitCallbacks(execute=True):
+            ConfigCapacidad.objects.create(cochera=self.cochera, tipo=self.tipo, cantidad=2)
+        self.manana = timezone.now().replace(hour=10, minute=0, second=0, microsecond=0) + timedelta(days=1)
+
+    def _reservar(self, desde_h, hasta_h, **extra):
+        return crear_reserva(
+            cochera=self.cochera, tipo=self.tipo,
+            desde=self.manana + timedelta(hours=desde_h), hasta=self.manana + timedelta(hours=hasta_h), **extra
+        )
+
+    def test_indice_de_intervalos(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self._reservar(0, 4)
+            self._reservar(2, 6)
+        en = lambda h: retenidas(self.cochera.id, self.tipo.id, self.manana + timedelta(hours=h))
+        self.assertEqual([en(h) for h in (-1, 0, 1, 2, 3, 4, 5, 6)], [0, 1, 1, 2, 2, 1, 1, 0])
+        maximo = lambda a, b: max_retenidas(
+            self.cochera.id, self.tipo.id, self.manana + timedelta(hours=a), self.manana + timedelta(hours=b)
+        )
+        self.assertEqual(maximo(4, 6), 1)  # semiabierto: a las 4 ya salió la primera
+        self.assertEqual(maximo(0, 2), 1)
+        self.assertEqual(maximo(-2, 10), 2)
+
+    def test_sin_lugar_en_el_horario(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self._reservar(0, 4)
+            self._reservar(2, 6)
+        with self.assertRaisesMessage(ValueError, "No hay lugar"):
+            self._reservar(3, 5)
+        # pegada al final de las dos sí entra
+        self._reservar(6, 8)
+
+    def test_indice_viejo_en_cache_no_sobrevende(self):
+        # el índice queda en cache y la reserva de otro proceso commiteó pero
+        # todavía no invalidó (sin captureOnCommitCallbacks no corre el on_commit)
+        disponibilidad_dia(self.cochera, self.manana.date())
+        self._reservar(0, 4)
+        self._reservar(1, 3)
+        with self.assertRaisesMessage(ValueError, "No hay lugar"):
+            self._reservar(2, 3)
+        self.assertEqual(Reserva.objects.count(), 2)
+
+    def test_cliente_no_queda_si_falla_la_reserva(self):
+        previa = self._reservar(0, 1)
+        with mock.patch("parking.services_reservas._nuevo_codigo", return_value=previa.codigo):
+            with self.assertRaises(IntegrityError):
+                self._reservar(2, 3, cliente_data={"nombre": "Ana"})
+        self.assertFalse(Cliente.objects.filter(nombre="Ana").exists())
+
+    def test_disponibilidad_se_actualiza_al_commit(self):
+        libres = lambda: disponibilidad_dia(self.cochera, self.manana.date())[self.tipo.id]["tramos"]
+        self.assertEqual(len(libres()), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self._reservar(0, 4)
+        tramos = libres()
+        self.assertEqual([t["reservadas"] for t in tramos], [0, 1, 0])
+        self.assertEqual([t["libres"] for t in tramos], [2, 1, 2])
+
+
+@override_settings(CACHES=CACHE_LOCAL)
+class AdminTablasGrandesTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        services_asignacion._pools.clear()
+        self.admin = get_user_model().objects.create_user("admin", is_superuser=True, is_staff=True)
+        ensure_default_tipos()
+        self.tipo = TipoEspacio.objects.get(nombre="Auto")
+        self.cochera = Cochera.objects.create(owner=self.admin, nombre="C")
+        Espacio.objects.bulk_create([
+            Espacio(cochera=self.cochera, tipo=self.tipo, etiqueta=f"A-{i}", orden=i) for i in range(40)
+        ])
+        self.client.force_login(self.admin)
+        self.url = reverse("admin:parking_movimiento_changelist")
+        hoy = timezone.localdate()
+        self.mes = {"ingreso_at__year": hoy.year, "ingreso_at__month": hoy.month}
+
+    def _ingresar(self, n, desde=0):
+        return [
+            ingresar_vehiculo(cochera=self.cochera, operador=self.admin, tipo=self.tipo, ticket=f"AD{i}")
+            for i in range(desde, desde + n)
+        ]
+
+    def _listar(self, **params):
+        with CaptureQueriesContext(connections["default"]) as ctx:
+            r = self.client.get(self.url, {**self.mes, **params})
+        self.assertEqual(r.status_code, 200)
+        return r, len(ctx)
+
+    def test_sin_filtros_arranca_en_el_mes(self):
+        r = self.client.get(self.url)
+        self.assertRedirects(r, f"{self.url}?ingreso_at__year={self.mes['ingreso_at__year']}"
+                                f"&ingreso_at__month={self.mes['ingreso_at__month']}")
+
+    def test_queries_no_crecen_con_las_filas(self):
+        self._ingresar(3)
+        _, pocas = self._listar()
+        self._ingresar(30, desde=3)
+        r, muchas = self._listar()
+        self.assertEqual(len(r.context["cl"].result_list), 33)
+        self.assertEqual(pocas, muchas)
+
+    def test_busqueda_exacta_por_ticket(self):
+        self._ingresar(3)
+        r, _ = self._listar(q=" ad1 ")
+        self.assertEqual([m.vehiculo.ticket for m in r.context["cl"].result_list], ["AD1"])
+        # en un campo numérico, un término que no es número no rompe
+        r = self.client.get(reverse("admin:parking_cliente_changelist"), {"q": "abc"})
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(len(r.context["cl"].result_list), 0)
+
+    def test_conteo_acotado(self):
+        self._ingresar(6)
+        with mock.patch.object(parking_admin, "TOPE_CONTEO", 3):
+            r, _ = self._listar()
+        self.assertEqual(r.context["cl"].result_count, 4)
+
+    def test_cerrar_en_el_request_o_en_la_cola(self):
+        movs = self._ingresar(5)
+        datos = {"action": "cerrar", "_selected_action": [m.id for m in movs[:2]]}
+        self.client.post(f"{self.url}?ingreso_at__year={self.mes['ingreso_at__year']}", datos)
+        self.assertEqual(Movimiento.objects.filter(estado=Movimiento.CERRADO).count(), 2)
+
+        # más que el lote: se encola en tareas de a LOTE_ACCION
+        datos["_selected_action"] = [m.id for m in movs[2:]]
+        with mock.patch.object(parking_admin, "LOTE_ACCION", 2), self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f"{self.url}?ingreso_at__year={self.mes['ingreso_at__year']}", datos)
+        self.assertEqual(Movimiento.objects.filter(estado=Movimiento.CERRADO).count(), 2)
+        lotes = sorted(len(t.kwargs["movimiento_ids"]) for t in Tarea.objects.filter(nombre="cerrar_movimientos"))
+        self.assertEqual(lotes, [1, 2])
+
+
+_corridas = []
+
+
+@cola.tarea("test_lenta", max_intentos=1)
+def _tarea_lenta(segundos):
+    _corridas.append(segundos)
+    time.sleep(segundos)
+
+
+@cola.tarea("test_falla", max_intentos=2)
+def _tarea_que_falla():
+    raise RuntimeError("no")
+
+
+class ColaTareasTests(TestCase):
+    def setUp(self):
+        _corridas.clear()
+        # ejecutar() cierra conexiones viejas (es para los hilos del worker): acá cerraría la del TestCase
+        parche = mock.patch("parking.cola.close_old_connections")
+        parche.start()
+        self.addCleanup(parche.stop)
+
+    def _encolar(self, func, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                cola.encolar(func, **kwargs)
+
+    def test_encola_al_commit_y_sin_duplicar_por_clave(self):
+        with transaction.atomic():
+            cola.encolar(_tarea_lenta, segundos=0, clave="x")
+            self.assertFalse(Tarea.objects.exists())
+        self._encolar(_tarea_lenta, segundos=0, clave="x")
+        self._encolar(_tarea_lenta, segundos=0, clave="x")
+        self.assertEqual(Tarea.objects.count(), 1)
+        with self.assertRaises(ValueError):
+            cola.encolar("no_existe")
+
+    def test_reclamar_y_ejecutar(self):
+        self._encolar(_tarea_lenta, segundos=0)
+        ids = cola.reclamar("w1", 5)
+        self.assertEqual(len(ids), 1)
+        self.assertEqual(cola.reclamar("w2", 5), [])
+        self.assertTrue(cola.ejecutar(ids[0]))
+        t = Tarea.objects.get()
+        self.assertEqual((t.estado, t.intentos, _corridas), (Tarea.HECHA, 1, [0]))
+
+    def test_reintento_con_backoff_y_despues_fallida(self):
+        self._encolar(_tarea_que_falla)
+        [tarea_id] = cola.reclamar("w1", 1)
+        self.assertFalse(cola.ejecutar(tarea_id))
+        t = Tarea.objects.get()
+        self.assertEqual(t.estado, Tarea.PENDIENTE)
+        self.assertGreater(t.disponible_at, timezone.now() + timedelta(seconds=cola.BACKOFF_BASE - 5))
+        Tarea.objects.update(disponible_at=timezone.now())
+        [tarea_id] = cola.reclamar("w1", 1)
+        self.assertFalse(cola.ejecutar(tarea_id))
+        t = Tarea.objects.get()
+        self.assertEqual(t.estado, Tarea.FALLIDA)
+        self.assertIn("RuntimeError", t.error)
+
+    def test_rescata_solo_sin_latido(self):
+        for _ in range(3):
+            self._encolar(_tarea_lenta, segundos=0)
+        viva, muerta, vieja = cola.reclamar("w1", 3)
+        hace_rato = timezone.now() - timedelta(minutes=30)
+        Tarea.objects.update(iniciada_at=hace_rato, latido_at=hace_rato)
+        Tarea.objects.filter(id=vieja).update(latido_at=None)
+        # arrancó hace 30 minutos pero el worker sigue latiendo
+        cola.latir("w1", [viva])
+        # otro worker no late por tareas ajenas
+        cola.latir("w2", [muerta])
+
+        self.assertEqual(cola.rescatar_colgadas(timedelta(minutes=10)), 2)
+        estados = dict(Tarea.objects.values_list("id", "estado"))
+        self.assertEqual(estados[viva], Tarea.CORRIENDO)
+        # max_intentos=1: no se vuelve a correr
+        self.assertEqual(estados[muerta], Tarea.FALLIDA)
+        self.assertEqual(estados[vieja], Tarea.FALLIDA)
+
+
+class WorkerLatidoTests(TransactionTestCase):
+    """Una tarea más larga que --vencimiento no se rescata mientras el worker la corre."""
+
+    def test_tarea_larga_corre_una_sola_vez(self):
+        _corridas.clear()
+        cola.encolar(_tarea_lenta, segundos=2.5)
+        # con intentos de sobra: si se rescatara, otro hilo la volvería a correr
+        Tarea.objects.update(max_intentos=3)
+        with mock.patch("parking.management.commands.worker_tareas.MANTENIMIENTO_S", 0), \
+                mock.patch("parking.management.commands.worker_tareas.LATIDO_S", 0.2):
+            call_command("worker_tareas", "--una-vez", "--hilos=2", "--intervalo=0.1", "--vencimiento=1",
+                         verbosity=0)
+        t = Tarea.objects.get()
+        self.assertEqual(t.estado, Tarea.HECHA)
+        self.assertEqual(_corridas, [2.5])
+        self.assertGreater(t.latido_at, t.iniciada_at + timedelta(seconds=2))
+
+
+@override_settings(CACHES=CACHE_LOCAL)
+class CerrarAbandonadosTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        services_asignacion._pools.clear()
+        self.dueno = get_user_model().objects.create_user("dueno")
+        ensure_default_tipos()
+        self.tipo = TipoEspacio.objects.get(nombre="Auto")
+        self.cochera = Cochera.objects.create(owner=self.dueno, nombre="C", horas_abandono=24)
+        Espacio.objects.bulk_create([
+            Espacio(cochera=self.cochera, tipo=self.tipo, etiqueta=f"A-{i}", orden=i) for i in range(6)
+        ])
+        self.ahora = timezone.now()
+        with self.captureOnCommitCallbacks(execute=True):
+            TarifaHora.objects.create(cochera=self.cochera, tipo=self.tipo, precio_hora=100)
+            crear_abonado(cochera=self.cochera, tipo=self.tipo, ticket="AB1",
+                          valido_desde=timezone.localdate() - timedelta(days=5),
+                          valido_hasta=timezone.localdate() + timedelta(days=5))
+        for t in ("V1", "V2", "AB1", "N1"):
+            ingresar_vehiculo(cochera=self.cochera, operador=self.dueno, tipo=self.tipo, ticket=t)
+        Movimiento.objects.exclude(vehiculo__ticket="N1").update(ingreso_at=self.ahora - timedelta(hours=30))
+
+    def test_cierra_los_viejos_en_lotes(self):
+        with mock.patch("parking.services_movimientos.cerrar_movimientos",
+                        wraps=services_movimientos.cerrar_movimientos) as cerrar:
+            res = services_movimientos.cerrar_abandonados(lote=2, pausa=0, ahora=self.ahora)
+        self.assertEqual(res, {self.cochera.id: 3})
+        self.assertEqual([len(c.args[0]) for c in cerrar.call_args_list], [2, 1])
+
+        montos = dict(Movimiento.objects.filter(estado=Movimiento.CERRADO).values_list("vehiculo__ticket", "monto"))
+        self.assertEqual(montos, {"V1": Decimal("3000.00"), "V2": Decimal("3000.00"), "AB1": Decimal("0.00")})
+        self.assertTrue(Movimiento.objects.filter(vehiculo__ticket="N1", estado=Movimiento.ABIERTO).exists())
+        self.assertEqual(Espacio.objects.filter(ocupado=True).count(), 1)
+        self.assertEqual(EventoMovimiento.objects.filter(tipo=EventoMovimiento.AJUSTE).count(), 3)
+        dia = RecaudacionDiaria.objects.get(cochera=self.cochera)
+        self.assertEqual((dia.egresos, dia.total), (3, Decimal("6000.00")))
+
+    def test_dry_run_y_cocheras_sin_abandono(self):
+        self.assertEqual(services_movimientos.cerrar_abandonados(aplicar=False, ahora=self.ahora), {self.cochera.id: 3})
+        self.assertEqual(Movimiento.objects.filter(estado=Movimiento.CERRADO).count(), 0)
+        Cochera.objects.filter(id=self.cochera.id).update(horas_abandono=0)
+        self.assertEqual(services_movimientos.cerrar_abandonados(pausa=0, ahora=self.ahora), {})
+
+    def test_uno_que_salio_en_el_medio_no_se_cierra_dos_veces(self):
+        v1 = Movimiento.objects.get(vehiculo__ticket="V1")
+        egresar_vehiculo(cochera=self.cochera, operador=self.dueno, ticket="V1")
+        self.assertEqual(services_movimientos.cerrar_movimientos([v1.id], ahora=self.ahora), 0)
+        self.assertFalse(EventoMovimiento.objects.filter(tipo=EventoMovimiento.AJUSTE).exists())
+
+
+@override_settings(CACHES=CACHE_LOCAL)
+class SerieOcupacionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.dueno = get_user_model().objects.create_user("dueno", is_superuser=True)
+        ensure_default_tipos()
+        self.tipo = TipoEspacio.objects.get(nombre="Auto")
+        self.cochera = Cochera.objects.create(owner=self.dueno, nombre="C")
+        self.espacio = Espacio.objects.create(cochera=self.cochera, tipo=self.tipo, etiqueta="A-1", orden=1)
+        self.vehiculo = Vehiculo.objects.create(cliente=Cliente.objects.create(), ticket="S1", tipo=self.tipo)
+        self.dia = timezone.make_aware(datetime(2026, 3, 2))
+
+    def _movs(self, tramos):
+        """tramos en minutos desde el inicio del día; egreso None = ABIERTO."""
+        Movimiento.objects.bulk_create([
+            Movimiento(
+                cochera=self.cochera, vehiculo=self.vehiculo, espacio=self.espacio, operador=self.dueno,
+                estado=Movimiento.ABIERTO if b is None else Movimiento.CERRADO,
+                ingreso_at=self.dia + timedelta(minutes=a),
+                egreso_at=None if b is None else self.dia + timedelta(minutes=b),
+            )
+            for a, b in tramos
+        ])
+
+    def _serie(self, puntos=24, modo="max", dias=1):
+        return services_ocupacion.serie_ocupacion(
+            self.cochera.id, self.dia, self.dia + timedelta(days=dias), puntos=puntos, modo=modo
+        )
+
+    def test_maximo_y_promedio_por_cubo(self):
+        # 10-12, 11:30-11:45 y 11-13; uno de la noche anterior que sale a las 01:00
+        self._movs([(600, 720), (690, 705), (660, 780), (-120, 60)])
+        s = self._serie()
+        self.assertEqual(s["max"][:14], [1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 3, 1, 0])
+        self.assertEqual(s["promedio"][10:14], [1.0, 2.25, 1.0, 0.0])
+        self.assertEqual(s["t"][1] - s["t"][0], 3600)
+
+    def test_igual_a_la_cuenta_minuto_a_minuto(self):
+        rnd = random.Random(7)
+        tramos = []
+        for _ in range(60):
+            a = rnd.randrange(-300, 1440)
+            tramos.append((a, a + rnd.randrange(1, 600)))
+        self._movs(tramos)
+        s = self._serie(puntos=48)
+        por_minuto = [sum(a <= m < b for a, b in tramos) for m in range(1440)]
+        cubos = [por_minuto[i:i + 30] for i in range(0, 1440, 30)]
+        self.assertEqual(s["max"], [max(c) for c in cubos])
+        self.assertEqual(s["promedio"], [round(sum(c) / 30, 2) for c in cubos])
+
+    def test_lttb(self):
+        self._movs([(m, m + 7) for m in range(0, 1400, 5)])
+        s = self._serie(puntos=50, modo="lttb")
+        self.assertEqual(len(s["t"]), 50)
+        self.assertEqual(s["t"][0], int(self.dia.timestamp()))
+        self.assertEqual(max(s["v"]), 2)
+        # con pocos eventos vuelven todos
+        self.assertLess(len(self._serie(puntos=2000, modo="lttb")["t"]), 2000)
+
+    def test_lo_que_no_paso_no_tiene_dato(self):
+        self.dia = timezone.now().replace(minute=0, second=0, microsecond=0) - timedelta(hours=2)
+        self._movs([(0, None)])
+        s = self._serie(puntos=24)
+        # las dos horas pasadas y la que está corriendo
+        self.assertEqual(len(s["t"]), 3)
+        self.assertEqual(s["max"], [1, 1, 1])
+
+    def test_view_valida(self):
+        self.client.force_login(self.dueno)
+        url = reverse("ocupacion_cochera", args=[self.cochera.id])
+        self.assertEqual(self.client.get(url, {"fecha": "2026-03-02", "puntos": 24}).status_code, 200)
+        for params in ({"modo": "otro"}, {"rango": "semana"}, {"puntos": "x"}, {"fecha": "ayer"}):
+            with self.subTest(**params):
+                self.assertEqual(self.client.get(url, params).status_code, 400)
+
+
+@override_settings(CACHES=CACHE_LOCAL)
+class TicketDeOtraCocheraTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        services_asignacion._pools.clear()
+        self.dueno = get_user_model().objects.create_user("dueno")
+        ensure_default_tipos()
+        self.tipo = TipoEspacio.objects.get(nombre="Auto")
+        self.c1, self.c2 = [Cochera.objects.create(owner=self.dueno, nombre=f"C{i}") for i in range(2)]
+        for c in (self.c1, self.c2):
+            Espacio.objects.create(cochera=c, tipo=self.tipo, etiqueta="A-1", orden=1)
+
+    def _ingresar(self, cochera, ticket):
+        return ingresar_vehiculo(cochera=cochera, operador=self.dueno, tipo=self.tipo, ticket=ticket)
+
+    def test_ingreso_con_ticket_de_otra_cochera(self):
+        ajeno = services_tickets.formatear(self.c2.id, 1)
+        with self.assertRaisesMessage(ValueError, "otra cochera"):
+            self._ingresar(self.c1, ajeno)
+        self.assertFalse(Movimiento.objects.exists())
+        self.assertEqual(self._ingresar(self.c2, ajeno).cochera_id, self.c2.id)
+        # los cargados a mano no llevan cochera
+        self.assertEqual(self._ingresar(self.c1, "MANUAL1").cochera_id, self.c1.id)
+
+    def test_egreso_con_ticket_de_otra_cochera(self):
+        ajeno = services_tickets.formatear(self.c2.id, 1)
+        self._ingresar(self.c2, ajeno)
+        with self.assertRaisesMessage(ValueError, "otra cochera"):
+            egresar_vehiculo(cochera=self.c1, operador=self.dueno, ticket=ajeno)
+
+
+@override_settings(CACHES=CACHE_LOCAL)
+class AdentroTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        services_asignacion._pools.clear()
+        self.dueno = get_user_model().objects.create_user("dueno", is_superuser=True)
+        ensure_default_tipos()
+        self.tipo = TipoEspacio.objects.get(nombre="Auto")
+        self.cochera = Cochera.objects.create(owner=self.dueno, nombre="C")
+        self.espacio = Espacio.objects.create(cochera=self.cochera, tipo=self.tipo, etiqueta="A-1", orden=1)
+        self.vehiculo = Vehiculo.objects.create(cliente=Cliente.objects.create(), ticket="I1", tipo=self.tipo)
+        self.dia = timezone.make_aware(datetime(2026, 3, 2))
+
+    def _movs(self, tramos):
+        """tramos en segundos desde el inicio del día; egreso None = ABIERTO. Indexa los cerrados."""
+        movs = Movimiento.objects.bulk_create([
+            Movimiento(
+                cochera=self.cochera, vehiculo=self.vehiculo, espacio=self.espacio, operador=self.dueno,
+                estado=Movimiento.ABIERTO if b is None else Movimiento.CERRADO,
+                ingreso_at=self.dia + timedelta(seconds=a),
+                egreso_at=None if b is None else self.dia + timedelta(seconds=b),
+            )
+            for a, b in tramos
+        ])
+        services_intervalos.reconstruir()
+        return {m.id: (a, b) for m, (a, b) in zip(movs, tramos)}
+
+    def _ids(self, filas):
+        return {f["movimiento_id"] for f in filas}
+
+    def test_igual_a_la_cuenta_directa(self):
+        rnd = random.Random(11)
+        tramos = []
+        for _ in range(200):
+            a = rnd.randrange(-86400, 86400)
+            tramos.append((a, None if rnd.random() < 0.1 else a + rnd.choice([0, 1, 59, 3600, rnd.randrange(1, 90000)])))
+        movs = self._movs(tramos)
+        for s in [rnd.randrange(-86400, 2 * 86400) for _ in range(40)] + [0, 3600]:
+            t = self.dia + timedelta(seconds=s)
+            esperado = {i for i, (a, b) in movs.items() if a <= s and (b is None or s < b)}
+            with self.subTest(s=s):
+                self.assertEqual(self._ids(services_intervalos.adentro_en(self.cochera.id, t)), esperado)
+        for _ in range(20):
+            a = rnd.randrange(-86400, 86400)
+            b = a + rnd.randrange(1, 20000)
+            esperado = {i for i, (x, y) in movs.items() if x < b and (y is None or max(a, x) < y)}
+            with self.subTest(desde=a, hasta=b):
+                filas = services_intervalos.adentro_entre(
+                    self.cochera.id, self.dia + timedelta(seconds=a), self.dia + timedelta(seconds=b)
+                )
+                self.assertEqual(self._ids(filas), esperado)
+
+    def test_bordes(self):
+        movs = self._movs([(100, 200), (200, 200)])
+        mov_id = next(iter(movs))
+
+        def en(s):
+            return self._ids(services_intervalos.adentro_en(self.cochera.id, self.dia + timedelta(seconds=s)))
+
+        # el ingreso cuenta, el egreso no; uno de duración cero no ocupa nunca
+        self.assertEqual(en(100), {mov_id})
+        self.assertEqual(en(199.999), {mov_id})
+        self.assertEqual(en(200), set())
+        self.assertEqual(en(99.999), set())
+        self.assertEqual(IntervaloOcupacion.objects.count(), 1)
+        with self.assertRaises(ValueError):
+            services_intervalos.adentro_entre(self.cochera.id, self.dia, self.dia)
+
+    def test_el_egreso_lo_indexa(self):
+        mov = ingresar_vehiculo(cochera=self.cochera, operador=self.dueno, tipo=self.tipo, ticket="E1")
+        self.assertFalse(IntervaloOcupacion.objects.exists())
+        self.assertEqual(self._ids(services_intervalos.adentro_en(self.cochera.id, timezone.now())), {mov.id})
+        egresar_vehiculo(cochera=self.cochera, operador=self.dueno, ticket="E1")
+        mov.refresh_from_db()
+        self.assertTrue(IntervaloOcupacion.objects.filter(movimiento_id=mov.id).exists())
+        medio = mov.ingreso_at + (mov.egreso_at - mov.ingreso_at) / 2
+        self.assertEqual(self._ids(services_intervalos.adentro_en(self.cochera.id, medio)), {mov.id})
+        self.assertEqual(self._ids(services_intervalos.adentro_en(self.cochera.id, mov.egreso_at)), set())
+
+    def test_reconstruir_se_puede_volver_a_correr(self):
+        self._movs([(0, 100), (50, 500)])
+        self.assertEqual(services_intervalos.reconstruir(), 2)
+        self.assertEqual(IntervaloOcupacion.objects.count(), 2)
+        IntervaloOcupacion.objects.update(nodo=0)
+        services_intervalos.reconstruir(cochera_id=self.cochera.id, rehacer=True)
+        self.assertEqual(len(services_intervalos.adentro_en(self.cochera.id, self.dia + timedelta(seconds=60))), 2)
+
+    def test_view(self):
+        self._movs([(0, 3600)])
+        self.client.force_login(self.dueno)
+        url = reverse("adentro_cochera", args=[self.cochera.id])
+        r = self.client.get(url, {"t": "2026-03-02T00:30"})
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.json()["cantidad"], 1)
+        ms = services_intervalos.a_ms(self.dia + timedelta(hours=2))
+        self.assertEqual(self.client.get(url, {"t": str(ms)}).json()["cantidad"], 0)
+        r = self.client.get(url, {"desde": "2026-03-01T23:00", "hasta": "2026-03-02T00:00:01"})
+        self.assertEqual(r.json()["cantidad"], 1)
+        for params in ({}, {"t": "ayer"}, {"desde": "2026-03-02T01:00", "hasta": "2026-03-02T00:00"}):
+            with self.subTest(**params):
+                self.assertEqual(self.client.get(url, params).status_code, 400)
+
+
+CACHE_BASE = {"default": {"BACKEND": "django.core.cache.backends.db.DatabaseCache", "LOCATION": "parking_cache"}}
+
+
+@override_settings(CACHES=CACHE_BASE)
+class CatalogoTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        versiones._local.clear()
+        self.addCleanup(versiones._local.clear)
+        self.dueno = get_user_model().objects.create_user("dueno")
+        self.tipo = TipoEspacio.objects.get(nombre="Auto")
+        self.cochera = Cochera.objects.create(owner=self.dueno, nombre="C")
+        with self.captureOnCommitCallbacks(execute=True):
+            ConfigCapacidad.objects.create(cochera=self.cochera, tipo=self.tipo, cantidad=3)
+
+    def test_un_hit_no_hace_queries(self):
+        self.assertEqual(services_catalogo.capacidades(self.cochera.id), {self.tipo.id: 3})
+        self.assertIn("Auto", [t.nombre for t in services_catalogo.tipos()])
+        with self.assertNumQueries(0):
+            services_catalogo.capacidades(self.cochera.id)
+            services_catalogo.tarifas(self.cochera.id)
+            self.assertEqual(services_catalogo.tipo(str(self.tipo.id)), self.tipo)
+
+    def test_el_cambio_de_este_proceso_se_ve_al_toque(self):
+        services_catalogo.capacidades(self.cochera.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            ConfigCapacidad.objects.filter(cochera=self.cochera).update(cantidad=5)
+            ConfigCapacidad.objects.get(cochera=self.cochera).save()
+        self.assertEqual(services_catalogo.capacidades(self.cochera.id), {self.tipo.id: 5})
+
+    def test_el_de_otro_proceso_cuando_vence(self):
+        services_catalogo.capacidades(self.cochera.id)
+        # otro proceso: cambia la fila y la versión compartida, no el memo de este
+        ConfigCapacidad.objects.filter(cochera=self.cochera).update(cantidad=7)
+        cache.set(versiones._key(services_catalogo.VERSION_COCHERA, self.cochera.id), time.time_ns(), None)
+        self.assertEqual(services_catalogo.capacidades(self.cochera.id), {self.tipo.id: 3})
+        despues = time.monotonic() + services_catalogo.FRESCO
+        with mock.patch.object(versiones.time, "monotonic", return_value=despues):
+            self.assertEqual(services_catalogo.capacidades(self.cochera.id), {self.tipo.id: 7})
+            # y vuelve a quedar fresco: sin queries hasta el próximo vencimiento
+            with self.assertNumQueries(0):
+                services_catalogo.capacidades(self.cochera.id)
+
+    @override_settings(CACHES=CACHE_LOCAL)
+    def test_con_cache_local_mira_siempre(self):
+        services_catalogo.capacidades(self.cochera.id)
+        ConfigCapacidad.objects.filter(cochera=self.cochera).update(cantidad=9)
+        cache.set(versiones._key(services_catalogo.VERSION_COCHERA, self.cochera.id), time.time_ns(), None)
+        self.assertEqual(services_catalogo.capacidades(self.cochera.id), {self.tipo.id: 9})
+
+
+
+@override_settings(CACHES=CACHE_LOCAL)
+class PortonTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        services_asignacion._pools.clear()
+        services_porton._cache["cargado"] = float("-inf")
+        self.addCleanup(services_porton._cache.update, {"por_hash": {}, "cargado": float("-inf")})
+        self.dueno = get_user_model().objects.create_user("dueno")
+        ensure_default_tipos()
+        self.tipo = TipoEspacio.objects.get(nombre="Auto")
+        self.cochera = Cochera.objects.create(owner=self.dueno, nombre="C")
+        with self.captureOnCommitCallbacks(execute=True):
+            ConfigCapacidad.objects.create(cochera=self.cochera, tipo=self.tipo, cantidad=1)
+            Espacio.objects.create(cochera=self.cochera, tipo=self.tipo, etiqueta="A 1", orden=1)
+        self.token = services_porton.nuevo_token()
+        self.dispositivo = Dispositivo.objects.create(
+            cochera=self.cochera, nombre="Barrera norte", token_hash=services_porton.hash_token(self.token),
+            operador=self.dueno,
+        )
+
+    def _sesion(self):
+        sesion = services_porton.autenticar(self.token)
+        self.assertIsNotNone(sesion)
+        return sesion
+
+    def test_autenticar(self):
+        sesion = self._sesion()
+        self.assertEqual(services_porton.bienvenida(sesion), f"OK {self.cochera.id} Barrera_norte")
+        self.assertIsNone(services_porton.autenticar("otro"))
+
+    def test_entrada_consulta_y_salida(self):
+        sesion = self._sesion()
+        self.assertEqual(services_porton.ejecutar(sesion, "QUERY", []), "FREE 1 Auto=1")
+        # sin ticket se emite uno (afuera de la transacción: acá se simula)
+        with mock.patch("parking.services_porton.emitir_ticket", return_value="SYS1") as emitir:
+            self.assertEqual(services_porton.ejecutar(sesion, "ENTRY", ["auto"]), "OPEN SYS1 A_1 0")
+        emitir.assert_called_once_with(self.cochera.id)
+        ticket = "SYS1"
+        self.assertTrue(Movimiento.objects.filter(vehiculo__ticket=ticket, estado=Movimiento.ABIERTO).exists())
+        self.assertEqual(services_porton.ejecutar(sesion, "QUERY", []), "FREE 0 Auto=0")
+
+        lleno = services_porton.ejecutar(sesion, "ENTRY", [str(self.tipo.id), "OTRO1", "abc"])
+        self.assertTrue(lleno.startswith("DENY 0 No hay espacios libres"), lleno)
+
+        self.assertRegex(services_porton.ejecutar(sesion, "EXIT", [ticket]), r"^OPEN \d+(\.\d+)? 1$")
+        self.assertTrue(services_porton.ejecutar(sesion, "EXIT", [ticket]).startswith("DENY 1 "))
+
+    def test_errores(self):
+        sesion = self._sesion()
+        self.assertEqual(services_porton.ejecutar(sesion, "BORRAR", []), "ERR Comando desconocido: BORRAR")
+        self.assertEqual(services_porton.ejecutar(sesion, "ENTRY", ["Avion"]), "DENY 1 Tipo de vehículo inválido: Avion")
+        self.assertEqual(services_porton.ejecutar(sesion, "EXIT", []), "DENY 1 Falta el ticket.")
+        with mock.patch("parking.services_porton.libres", side_effect=[RuntimeError("boom")]), \
+                self.assertLogs("parking.services_porton", "ERROR"):
+            self.assertEqual(services_porton.ejecutar(sesion, "QUERY", []), "ERR Error interno.")
+
+    def test_la_baja_corta_la_sesion(self):
+        sesion = self._sesion()
+        Dispositivo.objects.filter(id=self.dispositivo.id).update(activo=False)
+        # hasta que se recarga el directorio sigue andando
+        self.assertTrue(services_porton.ejecutar(sesion, "QUERY", []).startswith("FREE"))
+        services_porton._cache["cargado"] = float("-inf")
+        self.assertEqual(services_porton.ejecutar(sesion, "QUERY", []), "ERR Dispositivo dado de baja.")
+        self.assertIsNone(services_porton.autenticar(self.token))
+
+
+class ServidorPortonTests(SimpleTestCase):
+    """El servidor asyncio con services_porton de mentira: protocolo, AUTH y cupo del pool."""
+
+    def _conversar(self, lineas, *, cupo=4, espera=1.0, ejecutar=None):
+        from parking.management.commands.servidor_porton import Command
+
+        sesion = object()
+        cmd = Command()
+        cmd.opts = {"espera": espera, "max_conexiones": 10, "inactividad": 5, "timeout_auth": 5}
+        cmd.stats = {"conexiones": 0, "abiertas": 0, "comandos": 0, "ocupado": 0}
+
+        async def charla():
+            cmd.pool = ThreadPoolExecutor(max_workers=2)
+            cmd.cupo = asyncio.Semaphore(cupo)
+            server = await asyncio.start_server(cmd._atender, "127.0.0.1", 0, limit=64)
+            async with server:
+                reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+                respuestas = []
+                for linea in lineas:
+                    writer.write(linea.encode() + b"\n")
+                    await writer.drain()
+                    r = await asyncio.wait_for(reader.readline(), 5)
+                    if not r:
+                        break
+                    respuestas.append(r.decode().rstrip("\n"))
+                # lo que quede hasta que el servidor corta (si corta)
+                try:
+                    resto = await asyncio.wait_for(reader.read(), 0.5)
+                except asyncio.TimeoutError:
+                    resto = b""
+                writer.close()
+                await writer.wait_closed()
+                # que la conexión del servidor vea el cierre y termine sola
+                while cmd.stats["abiertas"]:
+                    await asyncio.sleep(0.01)
+            cmd.pool.shutdown()
+            return respuestas, resto
+
+        with mock.patch.object(services_porton, "autenticar", side_effect=lambda t: sesion if t == "bueno" else None), \
+                mock.patch.object(services_porton, "bienvenida", return_value="OK 1 barrera"), \
+                mock.patch.object(services_porton, "ejecutar", side_effect=ejecutar or (lambda s, c, a: f"{c} {' '.join(a)}")):
+            return asyncio.run(charla())
+
+    def test_protocolo(self):
+        respuestas, resto = self._conversar(["PING", "QUERY", "AUTH bueno", "entry Auto - abc", "QUIT"])
+        self.assertEqual(respuestas, ["PONG", "ERR Falta AUTH.", "OK 1 barrera", "ENTRY Auto - abc", "BYE"])
+        self.assertEqual(resto, b"")
+
+    def test_auth_fallidos_cortan(self):
+        respuestas, _ = self._conversar(["AUTH malo", "AUTH", "AUTH otro", "PING"])
+        self.assertEqual(respuestas, ["ERR Token inválido."] * 3)
+
+    def test_linea_larga_corta(self):
+        respuestas, _ = self._conversar(["PING", "X" * 200, "PING"])
+        self.assertEqual(respuestas, ["PONG", "ERR Línea demasiado larga."])
+
+    def test_sin_cupo_contesta_ocupado(self):
+        respuestas, _ = self._conversar(["AUTH bueno"], cupo=0, espera=0.05)
+        self.assertEqual(respuestas, ["ERR Ocupado."])
+
+
+@override_settings(
+    CACHES=CACHE_LOCAL,
+    PARKING_WEBHOOKS=[{"nombre": "avisos", "url": "http://127.0.0.1:1/hook", "eventos": ["UMBRAL"]}],
+)
+class AlertasTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        versiones._local.clear()
+        self.addCleanup(versiones._local.clear)
+        services_asignacion._pools.clear()
+        self.dueno = get_user_model().objects.create_user("dueno")
+        ensure_default_tipos()
+        self.tipo = TipoEspacio.objects.get(nombre="Auto")
+        self.cochera = Cochera.objects.create(owner=self.dueno, nombre="C")
+        with self.captureOnCommitCallbacks(execute=True):
+            ConfigCapacidad.objects.create(cochera=self.cochera, tipo=self.tipo, cantidad=4)
+            Espacio.objects.bulk_create([
+                Espacio(cochera=self.cochera, tipo=self.tipo, etiqueta=f"A-{i}", orden=i) for i in range(4)
+            ])
+            # dispara con 3 de 4 y se rearma con 1
+            self.umbral = UmbralAlerta.objects.create(cochera=self.cochera, porcentaje=75, histeresis=30)
+
+    def _mover(self, *tickets, salir=False):
+        for ticket in tickets:
+            with self.captureOnCommitCallbacks(execute=True):
+                if salir:
+                    egresar_vehiculo(cochera=self.cochera, operador=self.dueno, ticket=ticket)
+                else:
+                    ingresar_vehiculo(cochera=self.cochera, operador=self.dueno, tipo=self.tipo, ticket=ticket)
+
+    def _avisos(self):
+        return [
+            (m.cuerpo["detalle"]["estado"], m.cuerpo["detalle"]["ocupados"])
+            for m in MensajeOutbox.objects.order_by("id")
+        ]
+
+    def test_dispara_y_se_rearma_con_histeresis(self):
+        self._mover("T1", "T2")
+        self.assertEqual(self._avisos(), [])
+        self._mover("T3", "T4")
+        self.assertEqual(self._avisos(), [("ALCANZADO", 3)])
+        self.umbral.refresh_from_db()
+        self.assertTrue(self.umbral.disparado)
+        # bajar a 2 no alcanza para rearmarla
+        self._mover("T4", "T3", salir=True)
+        self.assertEqual(len(self._avisos()), 1)
+        self._mover("T2", salir=True)
+        self.assertEqual(self._avisos(), [("ALCANZADO", 3), ("NORMAL", 1)])
+
+    def test_sin_cruzar_no_hace_queries(self):
+        self._mover("T1")
+        with self.assertNumQueries(0):
+            services_alertas.evaluar(self.cochera.id, self.tipo.id, {self.tipo.id: 2, contadores.TODOS: 2})
+
+    @override_settings(CACHES=CACHE_BASE)
+    def test_con_la_cache_en_la_base_recuenta(self):
+        cache.clear()
+        self._mover("T1")
+        # un incr perdido (dos procesos a la vez) dejó el contador corrido
+        v = versiones.version(services_asignacion.VERSION, self.cochera.id)
+        cache.set(contadores._key(self.cochera.id, v, contadores.TODOS), -5)
+        self._mover("T2", "T3")
+        self.assertEqual(self._avisos(), [("ALCANZADO", 3)])
+        self.assertEqual(contadores.ocupados([self.cochera.id]), {self.cochera.id: 3})
+
+
+@override_settings(CACHES=CACHE_LOCAL)
+class SecuenciadorTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        services_asignacion._pools.clear()
+        self.dueno = get_user_model().objects.create_user("dueno")
+        ensure_default_tipos()
+        self.tipo = TipoEspacio.objects.get(nombre="Auto")
+        self.cochera = Cochera.objects.create(owner=self.dueno, nombre="C")
+        ConfigCapacidad.objects.create(cochera=self.cochera, tipo=self.tipo, cantidad=5)
+        Espacio.objects.bulk_create([
+            Espacio(cochera=self.cochera, tipo=self.tipo, etiqueta=f"A-{i}", orden=i) for i in range(5)
+        ])
+
+    def _secuenciador(self, hilos, **kwargs):
+        sec = secuenciador.Secuenciador(hilos, **kwargs)
+        self.addCleanup(sec.parar)
+        return sec
+
+    def _trabar(self, sec, cochera_id):
+        """Ocupa el hilo de la cochera hasta que se suelte el Event: lo que llegue mientras se junta en un lote."""
+        empezo, soltar = threading.Event(), threading.Event()
+
+        def trabado():
+            empezo.set()
+            soltar.wait(5)
+
+        fut = sec.enviar(cochera_id, trabado)
+        empezo.wait(5)
+        return soltar, fut
+
+    def test_group_commit_y_fallas_por_comando(self):
+        sec = self._secuenciador(2)
+        soltar, trabado = self._trabar(sec, self.cochera.id)
+        futuros = [
+            sec.enviar(self.cochera.id, ingresar_vehiculo, cochera=self.cochera, operador=self.dueno,
+                       tipo=self.tipo, ticket=f"Q{i}")
+            for i in range(6)
+        ]
+        soltar.set()
+        trabado.result(5)
+        movs, errores = [], []
+        for f in futuros:
+            try:
+                movs.append(f.result(10))
+            except ValueError as e:
+                errores.append(e)
+        # seis comandos en un solo lote: el que no tuvo lugar se deshace solo
+        self.assertEqual(sec.stats, {"comandos": 7, "lotes": 2})
+        self.assertEqual(len(movs), 5)
+        self.assertEqual([type(e) for e in errores], [services_movimientos.SinLugar])
+        self.assertEqual(len({m.espacio_id for m in movs}), 5)
+        self.assertEqual(Movimiento.objects.filter(estado=Movimiento.ABIERTO).count(), 5)
+        self.assertEqual(Espacio.objects.filter(ocupado=True).count(), 5)
+
+    def test_cada_cochera_en_su_hilo(self):
+        sec = self._secuenciador(2)
+        hilos = {c: {sec.ejecutar(c, lambda: threading.current_thread().name) for _ in range(3)} for c in (3, 4, 5)}
+        self.assertEqual(hilos, {3: {"secuenciador-1"}, 4: {"secuenciador-0"}, 5: {"secuenciador-1"}})
+
+    def test_cola_llena_rechaza(self):
+        sec = self._secuenciador(1, largo_cola=1)
+        soltar, trabado = self._trabar(sec, 0)
+        # el trabado ya salió de la cola: entra uno más y el siguiente no
+        sec.enviar(0, int)
+        with mock.patch.object(secuenciador, "ESPERA_COLA", 0.05), self.assertRaisesMessage(ValueError, "en espera"):
+            sec.enviar(0, int)
+        soltar.set()
+        trabado.result(5)
+
+    @override_settings(PARKING_SECUENCIADOR=0)
+    def test_apagado_corre_aca(self):
+        self.assertEqual(secuenciador.ejecutar(self.cochera.id, lambda: threading.current_thread().name),
+                         threading.current_thread().name)
+
+
+@override_settings(CACHES=CACHE_LOCAL, TIME_ZONE="America/Argentina/Buenos_Aires")
+class SnapshotTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        versiones._local.clear()
+        carpeta = tempfile.TemporaryDirectory()
+        self.addCleanup(carpeta.cleanup)
+        ajuste = override_settings(PARKING_SNAPSHOTS=Path(carpeta.name))
+        ajuste.enable()
+        self.addCleanup(ajuste.disable)
+
+        self.dueno = get_user_model().objects.create_user("dueno")
+        ensure_default_tipos()
+        self.tipos = list(TipoEspacio.objects.filter(nombre__in=["Auto", "Moto"]).order_by("nombre"))
+        self.cocheras = [Cochera.objects.create(owner=self.dueno, nombre=f"C{i}") for i in range(2)]
+        self.espacios = [
+            Espacio.objects.create(cochera=c, tipo=t, etiqueta=f"{t.nombre}-1", orden=i)
+            for c in self.cocheras for i, t in enumerate(self.tipos)
+        ]
+        self.vehiculo = Vehiculo.objects.create(cliente=Cliente.objects.create(), ticket="S1", tipo=self.tipos[0])
+        self.rnd = random.Random(5)
+
+    def _cerrados(self, n, desde, hasta):
+        """n movimientos cerrados con egreso al azar entre desde y hasta."""
+        movs = []
+        for _ in range(n):
+            espacio = self.rnd.choice(self.espacios)
+            egreso = desde + (hasta - desde) * self.rnd.random()
+            movs.append(Movimiento(
+                cochera_id=espacio.cochera_id, vehiculo=self.vehiculo, espacio=espacio, operador=self.dueno,
+                estado=Movimiento.CERRADO, ingreso_at=egreso - timedelta(minutes=self.rnd.randrange(1, 2000)),
+                egreso_at=egreso, monto=Decimal(self.rnd.randrange(0, 100000)) / 100,
+            ))
+        return Movimiento.objects.bulk_create(movs)
+
+    def _esperado(self, clave):
+        res = {}
+        for m in Movimiento.objects.filter(estado=Movimiento.CERRADO).select_related("espacio"):
+            r = res.setdefault(clave(m), [0, Decimal(0)])
+            r[0] += 1
+            r[1] += m.monto
+        return {k: (n, float(total)) for k, (n, total) in res.items()}
+
+    def _agregado(self, por, **kwargs):
+        return {
+            tuple(f[d] for d in por) if len(por) > 1 else f[por[0]]: (f["n"], f["monto"])
+            for f in services_snapshot.abrir().agregar(por, **kwargs)
+        }
+
+    def test_igual_que_la_base(self):
+        ahora = timezone.now()
+        self._cerrados(300, ahora - timedelta(days=70), ahora - timedelta(minutes=5))
+        self.assertEqual(services_snapshot.actualizar(), (300, 3))
+        self.assertEqual(self._agregado(("tipo",)), self._esperado(lambda m: m.espacio.tipo_id))
+        self.assertEqual(
+            self._agregado(("cochera", "hora")),
+            self._esperado(lambda m: (m.cochera_id, timezone.localtime(m.egreso_at).hour)),
+        )
+        self.assertEqual(
+            self._agregado(("mes",)),
+            self._esperado(lambda m: timezone.localtime(m.egreso_at).strftime("%Y-%m")),
+        )
+        # filtro por cochera y rango
+        desde = ahora - timedelta(days=10)
+        esperado = {
+            k: v for k, v in self._esperado(lambda m: (m.cochera_id, m.egreso_at >= desde)).items() if k[1]
+        }
+        self.assertEqual(
+            self._agregado(("cochera",), desde=desde, cocheras=[self.cocheras[0].id]),
+            {c: v for (c, _), v in esperado.items() if c == self.cocheras[0].id},
+        )
+
+    def test_estadias(self):
+        ahora = timezone.now()
+        self._cerrados(100, ahora - timedelta(days=3), ahora - timedelta(minutes=5))
+        services_snapshot.actualizar()
+        filas = services_snapshot.abrir().agregar(("estadia",))
+        bordes = services_snapshot.BORDES_MIN
+        esperado = {}
+        for m in Movimiento.objects.all():
+            minutos = (m.egreso_at - m.ingreso_at).total_seconds() / 60
+            i = sum(minutos >= b for b in bordes)
+            etiqueta = f"<{bordes[i]}" if i < len(bordes) else f">={bordes[-1]}"
+            esperado[etiqueta] = esperado.get(etiqueta, 0) + 1
+        self.assertEqual({f["estadia"]: f["n"] for f in filas}, esperado)
+
+    def test_incremental_sin_duplicados(self):
+        ahora = timezone.now()
+        self._cerrados(50, ahora - timedelta(days=5), ahora - timedelta(hours=2))
+        self.assertEqual(services_snapshot.actualizar(margen=timedelta(hours=1))[0], 50)
+        # un cierre que commitea tarde con egreso de antes de la marca, y uno nuevo
+        self._cerrados(1, ahora - timedelta(hours=1, minutes=30), ahora - timedelta(hours=1, minutes=20))
+        self._cerrados(1, ahora - timedelta(minutes=50), ahora - timedelta(minutes=40))
+        # el nuevo que está dentro del margen queda para la próxima
+        self._cerrados(1, ahora - timedelta(seconds=20), ahora - timedelta(seconds=10))
+        self.assertEqual(services_snapshot.actualizar()[0], 2)
+        self.assertEqual(services_snapshot.actualizar(margen=timedelta(0))[0], 1)
+        self.assertEqual(services_snapshot.actualizar(margen=timedelta(0))[0], 0)
+
+        snap = services_snapshot.abrir()
+        ids = np.concatenate([snap.columna(p, "id") for p in snap.particiones])
+        self.assertEqual(sorted(ids.tolist()), sorted(Movimiento.objects.values_list("id", flat=True)))
+
+        antes = self._agregado(("cochera", "tipo"))
+        self.assertEqual(services_snapshot.compactar(), 1)
+        self.assertEqual(len(services_snapshot.abrir().particiones), 1)
+        self.assertEqual(self._agregado(("cochera", "tipo")), antes)
+
+    def test_comando(self):
+        ahora = timezone.now()
+        self._cerrados(20, ahora - timedelta(days=40), ahora - timedelta(minutes=5))
+        out = io.StringIO()
+        call_command("snapshot_movimientos", "--rehacer", "--compactar", stdout=out)
+        self.assertIn("20 movimientos", out.getvalue())
+        self.assertEqual(services_snapshot.abrir().filas, 20)
+        nombres = services_snapshot.abrir().nombres
+        self.assertEqual(nombres["cochera"][self.cocheras[0].id], "C0")
+        self.assertEqual(nombres["operador"][self.dueno.id], "dueno")
@@ -23,4 +23,25 @@ urlpatterns = [
     # ----------------------------
     path("<int:cochera_id>/ingreso/", views.ingreso_view, name="ingreso_cochera"),
     path("<int:cochera_id>/egreso/", views.egreso_view, name="egreso_cochera"),
+
+    # ----------------------------
+    # Pronóstico de ocupación
+    # ----------------------------
+    path("<int:cochera_id>/pronostico/", views.pronostico_view, name="pronostico_cochera"),
+    path("<int:cochera_id>/ocupacion/", views.ocupacion_view, name="ocupacion_cochera"),
+    path("<int:cochera_id>/analitica/", views.analitica_view, name="analitica_cochera"),
+    path("<int:cochera_id>/adentro/", views.adentro_view, name="adentro_cochera"),
+    path("<int:cochera_id>/ticket/<int:movimiento_id>/", views.ticket_view, name="ticket_movimiento"),
+
+    # ----------------------------
+    # Reservas
+    # ----------------------------
+    path("<int:cochera_id>/reservas/nueva/", views.reserva_new, name="reserva_new"),
+    path("<int:cochera_id>/disponibilidad/", views.disponibilidad_view, name="disponibilidad_cochera"),
+    path("<int:cochera_id>/cercanas/", views.cercanas_view, name="cercanas_cochera"),
+
+    # ----------------------------
+    # Superadmin
+    # ----------------------------
+    path("admin/shards/", views.shards_resumen_view, name="shards_resumen"),
 ]
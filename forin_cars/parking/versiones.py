@@ -0,0 +1,117 @@
+"""
+Contadores de versión compartidos (via django cache) + memo local por proceso.
+
+Cada proceso guarda lo que compiló junto con la versión que vio; cuando alguien
+hace bump (signals, services) los demás procesos recompilan en el próximo uso.
+Para eso la cache tiene que ser la misma para todos (settings.PARKING_CACHE):
+con LocMem cada proceso tiene sus versiones y no se entera de los bumps de los
+otros, así que solo se acepta declarada a propósito (PARKING_CACHE=local, un
+único proceso).
+
+Una versión nueva (bump, o una clave que no estaba o se expulsó) es siempre
+un valor que no se usó antes: con un valor fijo, una clave expulsada podía
+volver a coincidir con la de un memo viejo.
+
+Con la cache en la base (o Redis/Memcached) mirar la versión ya es una query
+(o un viaje por la red). Lo que casi nunca cambia (el catálogo) pide
+`memo(..., fresco=N)`: durante N segundos después de mirarla se da por buena
+sin consultarla, así un hit no cuesta nada. El proceso que hace el bump lo ve
+al toque; los demás, a lo sumo N segundos tarde.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+
+from . import tenancy
+
+
+_local = {}
+_lock = threading.Lock()
+
+
+def _key(nombre, clave):
+    return f"ver:{tenancy.clave(nombre, clave)}"
+
+
+def version(nombre, clave):
+    key = _key(nombre, clave)
+    v = cache.get(key)
+    if v is None:
+        v = time.time_ns()
+        if not cache.add(key, v, None):
+            v = cache.get(key, v)
+    return v
+
+
+def versiones(nombre, claves):
+    """version() para varias claves con un solo get_many."""
+    keys = {c: _key(nombre, c) for c in claves}
+    hit = cache.get_many(keys.values())
+    res = {}
+    for c, key in keys.items():
+        res[c] = hit[key] if key in hit else version(nombre, c)
+    return res
+
+
+def bump(nombre, clave):
+    v = time.time_ns()
+    cache.set(_key(nombre, clave), v, None)
+    # lo que este proceso tenía memorizado (aunque esté "fresco") ya no vale
+    olvidar(nombre, clave)
+    return v
+
+
+def memo(nombre, clave, construir, *, fresco=0):
+    """
+    Devuelve el valor compilado para (nombre, clave), reconstruyéndolo con
+    `construir()` solo si cambió la versión. Con `fresco` (segundos) no mira
+    la versión si la confirmó hace menos que eso (con una cache local mirarla
+    no cuesta nada y se mira siempre).
+    """
+    local_key = (tenancy.alias_actual(), nombre, clave)
+    hit = _local.get(local_key)
+    ahora = time.monotonic()
+    if hit is not None and ahora < hit[2]:
+        return hit[1]
+
+    v = version(nombre, clave)
+    vence = ahora + fresco if fresco and not cache_local() else 0
+    if hit is not None and hit[0] == v:
+        with _lock:
+            _local[local_key] = (v, hit[1], vence)
+        return hit[1]
+
+    valor = construir()
+    with _lock:
+        _local[local_key] = (v, valor, vence)
+    return valor
+
+
+def olvidar(nombre, clave):
+    with _lock:
+        _local.pop((tenancy.alias_actual(), nombre, clave), None)
+
+
+# para los comandos que corren en su propio proceso
+SOLO_UN_PROCESO = (
+    "Con PARKING_CACHE=local cada proceso tiene su cache: este comando no vería las versiones ni los "
+    "contadores de la web. Configurar una cache compartida (ver settings.PARKING_CACHE)."
+)
+
+
+def cache_local():
+    """True si la cache es de este proceso nomás (LocMem, dummy)."""
+    backend = settings.CACHES["default"]["BACKEND"]
+    return backend.endswith(("LocMemCache", "DummyCache"))
+
+
+def verificar_cache():
+    """Al arrancar: una cache por proceso solo si se pidió a propósito (PARKING_CACHE=local)."""
+    if cache_local() and getattr(settings, "PARKING_CACHE", "") != "local":
+        raise ImproperlyConfigured(
+            "parking necesita una cache compartida entre procesos (PARKING_CACHE=redis://..., memcached://... "
+            "o la tabla de la base); LocMem solo con PARKING_CACHE=local y un único proceso."
+        )
@@ -1,24 +1,50 @@
+import hashlib
+import math
+from datetime import date, datetime, time, timedelta
+
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.db.models import Q
+from django.http import JsonResponse
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from django.urls import reverse
-
-from .models import Cochera, TipoEspacio, TarifaHora
-from .forms import CocheraForm, CapacidadForm, TarifaForm, EmpleadosForm
-from .services import regenerar_espacios, ensure_default_tipos, upsert_capacidades, upsert_tarifas, invitar_empleados
-from .services_movimientos import ingresar_vehiculo, egresar_vehiculo
+from django.utils import timezone
+
+from .models import Cochera, Movimiento, TarifaHora
+from .forms import CocheraForm, CapacidadForm, TarifaForm, EmpleadosForm, ReservaForm
+from .services import regenerar_espacios, upsert_capacidades, upsert_tarifas
+from .services_movimientos import SinLugar, ingresar_vehiculo, egresar_vehiculo
+from .services_pronostico import pronosticar
+from .services_ocupacion import serie_ocupacion
+from .services_analitica import resumen as resumen_analitica
+from .services_reservas import crear_reserva, disponibilidad_dia
+from .services_tickets import emitir_ticket, payload_ticket
+from .services_intervalos import EPOCH, UN_MS, adentro_en, adentro_entre
+from .tenancy import resumen_por_shard
+from . import cola, secuenciador, services_catalogo, services_cercanas, tareas, tenancy
+from users.permissions import roles
 
 
 def is_admin_dueno(user):
-    return user.is_authenticated and (user.is_superuser or user.groups.filter(name="ADMIN_DUENO").exists())
+    return user.is_authenticated and (user.is_superuser or "ADMIN_DUENO" in roles(user))
 
 
 def can_operate(user):
     return user.is_authenticated and (
         user.is_superuser
-        or user.groups.filter(name="ADMIN_DUENO").exists()
-        or user.groups.filter(name="ADMIN_EMPLEADO").exists()
+        or "ADMIN_DUENO" in roles(user)
+        or "ADMIN_EMPLEADO" in roles(user)
+    )
+
+
+def _encolar_invitaciones(cochera, emails_list):
+    # las invitaciones tocan usuarios y grupos: van por la cola, no en el request
+    firma = hashlib.md5(",".join(sorted(emails_list)).encode()).hexdigest()
+    cola.encolar(
+        tareas.invitar_empleados,
+        cochera_id=cochera.id,
+        emails=emails_list,
+        clave=f"invitar:{tenancy.clave(cochera.id, firma)}",
     )
 
 
@@ -31,8 +57,7 @@ def cochera_queryset_for(user):
 @login_required
 @user_passes_test(is_admin_dueno)
 def cochera_new(request):
-    ensure_default_tipos()
-    tipos = TipoEspacio.objects.all().order_by("nombre")
+    tipos = services_catalogo.tipos()
 
     if request.method == "POST":
         cochera_form = CocheraForm(request.POST)
@@ -57,7 +82,7 @@ def cochera_new(request):
 
             emails_list = empleados_form.cleaned_data.get("emails_list", [])
             if emails_list:
-                invitar_empleados(cochera, emails_list)
+                _encolar_invitaciones(cochera, emails_list)
 
             messages.success(request, "Cochera creada y configurada correctamente.")
             return redirect("dashboard")
@@ -84,14 +109,13 @@ def cochera_new(request):
 @login_required
 @user_passes_test(is_admin_dueno)
 def cochera_edit(request, cochera_id):
-    ensure_default_tipos()
-    tipos = TipoEspacio.objects.all().order_by("nombre")
+    tipos = services_catalogo.tipos()
 
     cochera = get_object_or_404(Cochera, id=cochera_id, owner=request.user)
 
     # precargar capacidades y tarifas
-    cap_map = {c.tipo_id: c.cantidad for c in cochera.capacidades.all()}
-    tarifa_map = {t.tipo_id: t.precio_hora for t in cochera.tarifas.all()}
+    cap_map = services_catalogo.capacidades(cochera.id)
+    tarifa_map = services_catalogo.tarifas(cochera.id)
 
     if request.method == "POST":
         cochera_form = CocheraForm(request.POST, instance=cochera)
@@ -113,7 +137,7 @@ def cochera_edit(request, cochera_id):
 
             emails_list = empleados_form.cleaned_data.get("emails_list", [])
             if emails_list:
-                invitar_empleados(cochera, emails_list)
+                _encolar_invitaciones(cochera, emails_list)
 
             messages.success(request, "Cochera actualizada correctamente.")
             return redirect("dashboard")
@@ -190,7 +214,8 @@ def egreso_select_cochera_view(request):
 @user_passes_test(can_operate)
 def ingreso_view(request, cochera_id):
     cochera = get_object_or_404(cochera_queryset_for(request.user), id=cochera_id)
-    tipos = TipoEspacio.objects.all().order_by("nombre")
+    tipos = services_catalogo.tipos()
+    cercanas = None
 
     if request.method == "POST":
         tipo_id = request.POST.get("tipo_id")
@@ -198,13 +223,22 @@ def ingreso_view(request, cochera_id):
         patente_ult3 = request.POST.get("patente_ult3", "")
 
         try:
-            tipo = TipoEspacio.objects.get(id=tipo_id)
-            ingresar_vehiculo(
+            tipo = services_catalogo.tipo(tipo_id)
+            if tipo is None:
+                raise ValueError("Tipo de vehículo inválido.")
+            # sin ticket tipeado se emite uno (antes de abrir la transacción del ingreso)
+            emitido = not ticket.strip()
+            if emitido:
+                ticket = emitir_ticket(cochera.id)
+            mov = secuenciador.ejecutar(
+                cochera.id,
+                ingresar_vehiculo,
                 cochera=cochera,
                 operador=request.user,
                 tipo=tipo,
                 ticket=ticket,
                 patente_ult3=patente_ult3,
+                codigo_reserva=request.POST.get("codigo_reserva", ""),
                 cliente_data={
                     "nombre": request.POST.get("nombre", ""),
                     "apellido": request.POST.get("apellido", ""),
@@ -213,14 +247,60 @@ def ingreso_view(request, cochera_id):
                 },
             )
             messages.success(request, "Ingreso realizado correctamente.")
+            if emitido:
+                return redirect("ticket_movimiento", cochera_id=cochera.id, movimiento_id=mov.id)
             return redirect(f"{reverse('dashboard')}?cochera={cochera.id}")
 
+        except SinLugar as e:
+            messages.error(request, str(e))
+            # algo para ofrecerle al conductor
+            cercanas = services_cercanas.cercanas(cochera, e.tipo_id)
         except ValueError as e:
             messages.error(request, str(e))
-        except TipoEspacio.DoesNotExist:
-            messages.error(request, "Tipo de vehículo inválido.")
 
-    return render(request, "parking/ingreso.html", {"cochera": cochera, "tipos": tipos})
+    return render(request, "parking/ingreso.html", {"cochera": cochera, "tipos": tipos, "cercanas": cercanas})
+
+
+def _instante(valor):
+    """ISO 8601 (sin zona = hora local) o epoch en milisegundos."""
+    valor = (valor or "").strip()
+    if valor.isdigit():
+        return EPOCH + int(valor) * UN_MS
+    try:
+        dt = datetime.fromisoformat(valor)
+    except ValueError:
+        raise ValueError(f"Instante inválido: {valor} (usar AAAA-MM-DDTHH:MM[:SS] o epoch en ms).")
+    return timezone.make_aware(dt) if timezone.is_naive(dt) else dt
+
+
+@login_required
+@user_passes_test(is_admin_dueno)
+def adentro_view(request, cochera_id):
+    """Quién estaba adentro: ?t=<instante> o ?desde=<instante>&hasta=<instante>."""
+    cochera = get_object_or_404(cochera_queryset_for(request.user), id=cochera_id)
+    try:
+        if request.GET.get("t"):
+            t = _instante(request.GET["t"])
+            filas, rango = adentro_en(cochera.id, t), {"t": t.isoformat()}
+        elif request.GET.get("desde") and request.GET.get("hasta"):
+            desde, hasta = _instante(request.GET["desde"]), _instante(request.GET["hasta"])
+            filas, rango = adentro_entre(cochera.id, desde, hasta), {"desde": desde.isoformat(), "hasta": hasta.isoformat()}
+        else:
+            return JsonResponse({"error": "Pasá t, o desde y hasta (ISO 8601 o epoch en ms)."}, status=400)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    return JsonResponse({"cochera": cochera.id, **rango, "cantidad": len(filas), "movimientos": filas})
+
+
+@login_required
+@user_passes_test(can_operate)
+def ticket_view(request, cochera_id, movimiento_id):
+    cochera = get_object_or_404(cochera_queryset_for(request.user), id=cochera_id)
+    mov = get_object_or_404(
+        Movimiento.objects.select_related("cochera", "espacio", "vehiculo__tipo"), cochera=cochera, id=movimiento_id
+    )
+    return render(request, "parking/ticket.html", {"cochera": cochera, "ticket": payload_ticket(mov)})
 
 
 @login_required
@@ -231,10 +311,170 @@ def egreso_view(request, cochera_id):
     if request.method == "POST":
         ticket = request.POST.get("ticket", "")
         try:
-            egresar_vehiculo(cochera=cochera, operador=request.user, ticket=ticket)
-            messages.success(request, "Egreso OK.")
+            mov = secuenciador.ejecutar(
+                cochera.id, egresar_vehiculo, cochera=cochera, operador=request.user, ticket=ticket
+            )
+            messages.success(request, f"Egreso OK. Total: ${mov.monto}")
             return redirect(f"{reverse('dashboard')}?cochera={cochera.id}")
         except ValueError as e:
             messages.error(request, str(e))
 
     return render(request, "parking/egreso.html", {"cochera": cochera})
+
+
+@login_required
+def pronostico_view(request, cochera_id):
+    cochera = get_object_or_404(cochera_queryset_for(request.user), id=cochera_id)
+
+    fecha_raw = request.GET.get("fecha")
+    try:
+        fecha = date.fromisoformat(fecha_raw) if fecha_raw else timezone.localdate()
+    except ValueError:
+        return JsonResponse({"error": "Fecha inválida (usar AAAA-MM-DD)."}, status=400)
+
+    return JsonResponse({
+        "cochera": cochera.id,
+        "fecha": fecha.isoformat(),
+        "tipos": pronosticar(cochera, fecha),
+    })
+
+
+def _rango(rango, fecha):
+    """Límites (aware) del día, mes o año que contiene `fecha`."""
+    if rango == "dia":
+        ini, fin = fecha, fecha + timedelta(days=1)
+    elif rango == "mes":
+        ini = fecha.replace(day=1)
+        fin = (ini + timedelta(days=32)).replace(day=1)
+    elif rango == "anio":
+        ini, fin = fecha.replace(month=1, day=1), fecha.replace(year=fecha.year + 1, month=1, day=1)
+    else:
+        raise ValueError("Rango inválido (dia, mes o anio).")
+    hora_cero = lambda d: timezone.make_aware(datetime.combine(d, time.min))
+    return hora_cero(ini), hora_cero(fin)
+
+
+@login_required
+@user_passes_test(is_admin_dueno)
+def ocupacion_view(request, cochera_id):
+    cochera = get_object_or_404(cochera_queryset_for(request.user), id=cochera_id)
+
+    fecha_raw = request.GET.get("fecha")
+    try:
+        fecha = date.fromisoformat(fecha_raw) if fecha_raw else timezone.localdate()
+    except ValueError:
+        return JsonResponse({"error": "Fecha inválida (usar AAAA-MM-DD)."}, status=400)
+    try:
+        puntos = int(request.GET.get("puntos", 300))
+        tipo_id = int(request.GET["tipo"]) if request.GET.get("tipo") else None
+    except ValueError:
+        return JsonResponse({"error": "puntos y tipo tienen que ser números."}, status=400)
+
+    try:
+        desde, hasta = _rango(request.GET.get("rango", "dia"), fecha)
+        serie = serie_ocupacion(cochera.id, desde, hasta, puntos=puntos, modo=request.GET.get("modo", "max"), tipo_id=tipo_id)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    return JsonResponse({"cochera": cochera.id, **serie})
+
+
+# tope de días por consulta de analítica
+ANALITICA_MAX_DIAS = 366
+
+
+@login_required
+@user_passes_test(is_admin_dueno)
+def analitica_view(request, cochera_id):
+    cochera = get_object_or_404(cochera_queryset_for(request.user), id=cochera_id)
+
+    hoy = timezone.localdate()
+    try:
+        hasta = date.fromisoformat(request.GET["hasta"]) if request.GET.get("hasta") else hoy
+        desde = date.fromisoformat(request.GET["desde"]) if request.GET.get("desde") else hasta - timedelta(days=30)
+    except ValueError:
+        return JsonResponse({"error": "Fecha inválida (usar AAAA-MM-DD)."}, status=400)
+    if desde > hasta:
+        return JsonResponse({"error": "desde tiene que ser anterior a hasta."}, status=400)
+    if (hasta - desde).days > ANALITICA_MAX_DIAS:
+        return JsonResponse({"error": f"El rango no puede pasar de {ANALITICA_MAX_DIAS} días."}, status=400)
+
+    # hasta inclusive
+    hora_cero = lambda d: timezone.make_aware(datetime.combine(d, time.min))
+    datos = resumen_analitica(cochera.id, hora_cero(desde), hora_cero(hasta + timedelta(days=1)))
+    return JsonResponse({"cochera": cochera.id, "desde": desde.isoformat(), "hasta": hasta.isoformat(), **datos})
+
+
+@login_required
+@user_passes_test(can_operate)
+def cercanas_view(request, cochera_id):
+    """Cocheras del mismo dueño con lugar para el tipo, de la más cercana a la más lejana."""
+    cochera = get_object_or_404(cochera_queryset_for(request.user), id=cochera_id)
+    tipo = services_catalogo.tipo(request.GET.get("tipo"))
+    if tipo is None:
+        return JsonResponse({"error": "Falta un tipo válido (?tipo=<id>)."}, status=400)
+    try:
+        n = int(request.GET.get("n", services_cercanas.MAXIMO))
+        radio_km = float(request.GET.get("radio_km", services_cercanas.RADIO_KM))
+    except ValueError:
+        return JsonResponse({"error": "n y radio_km tienen que ser números."}, status=400)
+    # float() acepta "nan" e "inf" (y min(nan, 50) da nan)
+    if not math.isfinite(radio_km) or radio_km <= 0:
+        return JsonResponse({"error": "radio_km tiene que ser un número mayor que 0."}, status=400)
+    n = max(1, min(n, 20))
+    radio_km = min(radio_km, 50)
+
+    cercanas = services_cercanas.cercanas(cochera, tipo.id, n=n, radio_km=radio_km)
+    return JsonResponse({"cochera": cochera.id, "tipo": tipo.id, "cercanas": [c._asdict() for c in cercanas]})
+
+
+@login_required
+@user_passes_test(can_operate)
+def reserva_new(request, cochera_id):
+    cochera = get_object_or_404(cochera_queryset_for(request.user), id=cochera_id)
+    form = ReservaForm(request.POST or None)
+
+    if request.method == "POST" and form.is_valid():
+        try:
+            reserva = crear_reserva(
+                cochera=cochera,
+                tipo=form.cleaned_data["tipo"],
+                desde=form.cleaned_data["desde"],
+                hasta=form.cleaned_data["hasta"],
+                cliente_data=form.cleaned_data,
+            )
+            messages.success(request, f"Reserva confirmada. Código: {reserva.codigo}")
+            return redirect(f"{reverse('dashboard')}?cochera={cochera.id}")
+        except ValueError as e:
+            messages.error(request, str(e))
+
+    return render(request, "parking/reserva_form.html", {"cochera": cochera, "form": form})
+
+
+@login_required
+def disponibilidad_view(request, cochera_id):
+    cochera = get_object_or_404(cochera_queryset_for(request.user), id=cochera_id)
+
+    fecha_raw = request.GET.get("fecha")
+    try:
+        fecha = date.fromisoformat(fecha_raw) if fecha_raw else timezone.localdate()
+    except ValueError:
+        return JsonResponse({"error": "Fecha inválida (usar AAAA-MM-DD)."}, status=400)
+
+    return JsonResponse({
+        "cochera": cochera.id,
+        "fecha": fecha.isoformat(),
+        "tipos": disponibilidad_dia(cochera, fecha),
+    })
+
+
+@login_required
+@user_passes_test(lambda u: u.is_superuser)
+def shards_resumen_view(request):
+    filas = resumen_por_shard()
+    totales = {k: sum(f[k] for f in filas) for k in ["cocheras", "espacios", "ocupados", "movimientos", "abiertos", "facturado"]}
+    return render(
+        request,
+        "parking/admin_shards.html",
+        {"title": "Resumen por shard", "filas": filas, "totales": totales, "actual": getattr(request, "shard", "default")},
+    )
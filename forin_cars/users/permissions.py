@@ -1,9 +1,22 @@
+def roles(user):
+    """
+    Nombres de grupo del usuario en una sola query, memorizados en la instancia
+    (request.user vive lo que dura el request).
+    """
+    if not user.is_authenticated:
+        return frozenset()
+    cache = getattr(user, "_roles_cache", None)
+    if cache is None:
+        cache = frozenset(user.groups.values_list("name", flat=True))
+        user._roles_cache = cache
+    return cache
+
 
 def is_dueno(user):
-    return user.is_authenticated and (user.is_superuser or user.groups.filter(name="ADMIN_DUENO").exists())
+    return user.is_authenticated and (user.is_superuser or "ADMIN_DUENO" in roles(user))
 
 def is_empleado(user):
-    return user.is_authenticated and (user.is_superuser or user.groups.filter(name="ADMIN_EMPLEADO").exists())
+    return user.is_authenticated and (user.is_superuser or "ADMIN_EMPLEADO" in roles(user))
 
 def can_operate_cochera(user, cochera):
     """
@@ -1,3 +1,137 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from parking import services_asignacion
+from parking.models import Cochera, ConfigCapacidad, Espacio, TipoEspacio
+from parking.services import ensure_default_tipos
+from parking.services_movimientos import ingresar_vehiculo
+from users import views
+
+
+CACHE_LOCAL = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+@override_settings(CACHES=CACHE_LOCAL)
+class DashboardTarjetaTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        services_asignacion._pools.clear()
+        self.dueno = get_user_model().objects.create_user("dueno")
+        self.dueno.groups.add(Group.objects.get_or_create(name="ADMIN_DUENO")[0])
+        ensure_default_tipos()
+        self.tipo = TipoEspacio.objects.get(nombre="Auto")
+        self.cochera = Cochera.objects.create(owner=self.dueno, nombre="C")
+        with self.captureOnCommitCallbacks(execute=True):
+            ConfigCapacidad.objects.create(cochera=self.cochera, tipo=self.tipo, cantidad=3)
+            Espacio.objects.bulk_create([
+                Espacio(cochera=self.cochera, tipo=self.tipo, etiqueta=f"A-{i}", orden=i) for i in range(3)
+            ])
+        self.client.force_login(self.dueno)
+        self.url = reverse("dashboard_tarjeta", args=[self.cochera.id])
+
+    def _item(self):
+        r = self.client.get(self.url)
+        self.assertEqual(r.status_code, 200)
+        return r.context["item"]
+
+    def test_tarjeta_cacheada_no_recalcula(self):
+        self.assertEqual(self._item()["ocupados"], 0)
+        with mock.patch("users.views._calcular_tarjetas", wraps=views._calcular_tarjetas) as calcular:
+            self.assertEqual(self._item()["total_espacios"], 3)
+        calcular.assert_not_called()
+
+    def test_un_ingreso_cambia_la_tarjeta(self):
+        self.assertEqual(self._item()["ocupados"], 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            ingresar_vehiculo(cochera=self.cochera, operador=self.dueno, tipo=self.tipo, ticket="D1")
+        item = self._item()
+        self.assertEqual((item["ocupados"], item["libres"], item["mov_abiertos"]), (1, 2, 1))
+
+    def test_paginas_de_porton_livianas(self):
+        for nombre in ("ingreso_cochera", "egreso_cochera"):
+            with self.subTest(pagina=nombre):
+                r = self.client.get(reverse(nombre, args=[self.cochera.id]))
+                self.assertEqual(r.status_code, 200)
+                self.assertTemplateUsed(r, "base_gate.html")
+                self.assertTemplateNotUsed(r, "base.html")
+
+
+@override_settings(CACHES=CACHE_LOCAL)
+class DashboardFragmentosTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        services_asignacion._pools.clear()
+        User = get_user_model()
+        self.dueno = User.objects.create_user("dueno")
+        self.dueno.groups.add(Group.objects.get_or_create(name="ADMIN_DUENO")[0])
+        ensure_default_tipos()
+        self.tipo = TipoEspacio.objects.get(nombre="Auto")
+        self.c1, self.c2 = [Cochera.objects.create(owner=self.dueno, nombre=f"C{i}") for i in (1, 2)]
+        self.ajena = Cochera.objects.create(owner=User.objects.create_user("otro"), nombre="Ajena")
+        with self.captureOnCommitCallbacks(execute=True):
+            for c, n in ((self.c1, 2), (self.c2, 3), (self.ajena, 5)):
+                ConfigCapacidad.objects.create(cochera=c, tipo=self.tipo, cantidad=n)
+                Espacio.objects.bulk_create([
+                    Espacio(cochera=c, tipo=self.tipo, etiqueta=f"A-{i}", orden=i) for i in range(n)
+                ])
+        self.client.force_login(self.dueno)
+
+    def _ingresar(self, cochera, ticket):
+        with self.captureOnCommitCallbacks(execute=True):
+            ingresar_vehiculo(cochera=cochera, operador=self.dueno, tipo=self.tipo, ticket=ticket)
+
+    def _revalidar(self, nombre, etag):
+        return self.client.get(reverse(nombre), HTTP_IF_NONE_MATCH=etag)
+
+    def test_esqueleto_sin_cocheras(self):
+        r = self.client.get(reverse("dashboard"))
+        self.assertEqual(r.status_code, 200)
+        self.assertNotContains(r, "Ajena")
+
+    def test_cocheras_visibles_y_etag(self):
+        r = self.client.get(reverse("dashboard_cocheras"))
+        self.assertEqual([c["nombre"] for c in r.json()["cocheras"]], ["C2", "C1"])
+        self.assertIn("no-cache", r["Cache-Control"])
+        etag = r["ETag"]
+        self.assertEqual(self._revalidar("dashboard_cocheras", etag).status_code, 304)
+        # editar una cochera cambia su versión
+        with self.captureOnCommitCallbacks(execute=True):
+            self.c1.nombre = "Centro"
+            self.c1.save()
+        r = self._revalidar("dashboard_cocheras", etag)
+        self.assertEqual(r.status_code, 200)
+        self.assertIn("Centro", [c["nombre"] for c in r.json()["cocheras"]])
+
+    def test_tarjeta_de_cochera_ajena(self):
+        r = self.client.get(reverse("dashboard_tarjeta", args=[self.ajena.id]))
+        self.assertEqual(r.status_code, 404)
+
+    def test_totales_suman_las_visibles(self):
+        self._ingresar(self.c1, "T1")
+        self._ingresar(self.ajena, "T2")
+        r = self.client.get(reverse("dashboard_totales"))
+        self.assertEqual(r.status_code, 200)
+        ctx = r.context
+        self.assertEqual((ctx["total_espacios"], ctx["ocupados"], ctx["libres"], ctx["mov_abiertos"]), (5, 1, 4, 1))
+        self.assertEqual(ctx["ocupacion_pct"], 20.0)
+        etag = r["ETag"]
+        self.assertEqual(self._revalidar("dashboard_totales", etag).status_code, 304)
+        self._ingresar(self.c2, "T3")
+        r = self._revalidar("dashboard_totales", etag)
+        self.assertEqual((r.status_code, r.context["ocupados"]), (200, 2))
+
+    def test_ultimos(self):
+        self._ingresar(self.c1, "T1")
+        self._ingresar(self.ajena, "T2")
+        r = self.client.get(reverse("dashboard_ultimos"))
+        self.assertContains(r, "T1")
+        self.assertNotContains(r, "T2")
+        etag = r["ETag"]
+        self.assertEqual(self._revalidar("dashboard_ultimos", etag).status_code, 304)
+        self._ingresar(self.c2, "T3")
+        self.assertContains(self._revalidar("dashboard_ultimos", etag), "T3")
@@ -5,5 +5,9 @@ urlpatterns = [
     path("login/", views.login_view, name="login"),
     path("registro/", views.registro_view, name="registro"),
     path("dashboard/", views.dashboard_view, name="dashboard"),
+    path("dashboard/cocheras/", views.dashboard_cocheras_view, name="dashboard_cocheras"),
+    path("dashboard/cochera/<int:cochera_id>/", views.dashboard_tarjeta_view, name="dashboard_tarjeta"),
+    path("dashboard/totales/", views.dashboard_totales_view, name="dashboard_totales"),
+    path("dashboard/ultimos/", views.dashboard_ultimos_view, name="dashboard_ultimos"),
     path("logout/", views.logout_view, name="logout"),
 ]
@@ -1,16 +1,27 @@
 # users/views.py
-from collections import defaultdict
+import hashlib
 
 from django.contrib import messages
 from django.contrib.auth import login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.forms import AuthenticationForm
-from django.db.models import Q
-from django.shortcuts import render, redirect
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404, render, redirect
 from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
 
 from .forms import RegistroForm
-from parking.models import Cochera, Movimiento
+from .permissions import roles
+from parking import tenancy, versiones
+from parking.models import Cochera, ConfigCapacidad, Espacio, Movimiento
+from parking.services_asignacion import VERSION_OCUPACION
+
+
+# las tarjetas se invalidan por versión; el TTL es solo para no acumular claves viejas
+CACHE_TARJETA = 60 * 10
 
 
 def login_view(request):
@@ -48,148 +59,212 @@ def registro_view(request):
     return render(request, "users/registro.html", {"form": form})
 
 
-@login_required
-def dashboard_view(request):
-    user = request.user
-
-    # Roles por grupos (evita hacer .exists() en template)
-    is_superadmin = user.is_superuser
-    is_admin_dueno = is_superadmin or user.groups.filter(name="ADMIN_DUENO").exists()
-    is_admin_empleado = is_superadmin or user.groups.filter(name="ADMIN_EMPLEADO").exists()
-
-    can_manage_cochera = is_admin_dueno
-    can_operate = is_admin_dueno or is_admin_empleado
-
-    # ✅ Cocheras visibles: dueño o empleado asignado (y cochera activa)
-    # OJO: el campo es "activa", NO "activo". :contentReference[oaicite:2]{index=2}
-    cocheras = (
-        Cochera.objects.filter(
-            Q(owner=user) |
-            Q(cocheraempleado__empleado=user, cocheraempleado__activo=True)
+def _calcular_tarjetas(cochera_ids):
+    """Totales/ocupados por tipo y abiertos de varias cocheras en 3 queries agrupadas."""
+    datos = {cid: {"tipos": {}, "mov_abiertos": 0} for cid in cochera_ids}
+
+    # totales por tipo según ConfigCapacidad (lo que “debería haber”)
+    for cid, tipo_id, nombre, cantidad in ConfigCapacidad.objects.filter(cochera_id__in=cochera_ids).values_list(
+        "cochera_id", "tipo_id", "tipo__nombre", "cantidad"
+    ):
+        datos[cid]["tipos"][tipo_id] = {"tipo": {"id": tipo_id, "nombre": nombre}, "total": cantidad, "ocupados": 0}
+
+    # ocupados reales según Espacios; si aparece un tipo sin capacidad, lo incluimos igual
+    for fila in (
+        Espacio.objects.filter(cochera_id__in=cochera_ids)
+        .values("cochera_id", "tipo_id", "tipo__nombre")
+        .annotate(ocupados=Count("id", filter=Q(ocupado=True)))
+        .order_by()
+    ):
+        t = datos[fila["cochera_id"]]["tipos"].setdefault(
+            fila["tipo_id"], {"tipo": {"id": fila["tipo_id"], "nombre": fila["tipo__nombre"]}, "total": 0, "ocupados": 0}
         )
+        t["ocupados"] = fila["ocupados"]
+
+    for cid, n in (
+        Movimiento.objects.filter(cochera_id__in=cochera_ids, estado="ABIERTO")
+        .values_list("cochera_id").annotate(n=Count("id")).order_by()
+    ):
+        datos[cid]["mov_abiertos"] = n
+
+    res = {}
+    for cid, d in datos.items():
+        por_tipo = sorted(d["tipos"].values(), key=lambda r: r["tipo"]["nombre"])
+        for r in por_tipo:
+            r["libres"] = max(r["total"] - r["ocupados"], 0)
+        total_c = sum(r["total"] for r in por_tipo)
+        ocupados_c = sum(r["ocupados"] for r in por_tipo)
+        res[cid] = {
+            "total_espacios": total_c,
+            "ocupados": ocupados_c,
+            "libres": max(total_c - ocupados_c, 0),
+            "mov_abiertos": d["mov_abiertos"],
+            "por_tipo": por_tipo,
+        }
+    return res
+
+
+def _tarjetas(cochera_ids):
+    """
+    Números de cada cochera, cacheados por su versión de ocupación (cambia con
+    cada ingreso/egreso o edición). Solo se recalculan las que cambiaron.
+    """
+    vers = versiones.versiones(VERSION_OCUPACION, cochera_ids)
+    claves = {cid: tenancy.clave(cid, vers[cid]) for cid in cochera_ids}
+    keys = {cid: f"dash:tarjeta:{clave}" for cid, clave in claves.items()}
+
+    hit = cache.get_many(keys.values())
+    datos = {cid: hit[key] for cid, key in keys.items() if key in hit}
+    faltan = [cid for cid in keys if cid not in datos]
+    if faltan:
+        nuevos = _calcular_tarjetas(faltan)
+        cache.set_many({keys[cid]: d for cid, d in nuevos.items()}, CACHE_TARJETA)
+        datos.update(nuevos)
+    return datos, claves
+
+
+def _cocheras_visibles(user):
+    # dueño o empleado asignado (y cochera activa); el campo es "activa", no "activo"
+    return (
+        Cochera.objects.filter(Q(owner=user) | Q(cocheraempleado__empleado=user, cocheraempleado__activo=True))
         .filter(activa=True)
         .distinct()
-        .order_by("-created_at", "-id")
-        .prefetch_related("capacidades__tipo", "espacios__tipo")
     )
 
-    # --- Métricas globales ---
-    total_espacios = 0
-    ocupados = 0
-    libres = 0
-    mov_abiertos = 0
-
-    # Totales globales por tipo
-    totales_por_tipo = {}  # tipo_id -> dict(tipo,total,ocupados,libres)
-
-    # Detalle por cochera (para pintar tarjetas)
-    cocheras_data = []
-
-    for c in cocheras:
-        # Totales por tipo según ConfigCapacidad (lo que “debería haber”)
-        caps = list(c.capacidades.all())
-
-        total_por_tipo = {cap.tipo_id: cap.cantidad for cap in caps}
-        tipo_obj = {cap.tipo_id: cap.tipo for cap in caps}
-
-        # Ocupados reales según Espacios (lo que “hay ocupado”)
-        espacios = list(c.espacios.all())
-        ocupados_por_tipo = defaultdict(int)
-        for e in espacios:
-            if e.ocupado:
-                ocupados_por_tipo[e.tipo_id] += 1
-            # si aparece un tipo en espacios que no esté en capacidades, lo incluimos igual
-            if e.tipo_id not in tipo_obj:
-                tipo_obj[e.tipo_id] = e.tipo
-                total_por_tipo.setdefault(e.tipo_id, 0)
-
-        por_tipo_list = []
-        total_c = 0
-        ocupados_c = 0
-
-        for tipo_id, tipo in sorted(tipo_obj.items(), key=lambda kv: kv[1].nombre):
-            t_total = int(total_por_tipo.get(tipo_id, 0))
-            t_ocup = int(ocupados_por_tipo.get(tipo_id, 0))
-            t_lib = max(t_total - t_ocup, 0)
-
-            por_tipo_list.append({
-                "tipo": tipo,
-                "total": t_total,
-                "ocupados": t_ocup,
-                "libres": t_lib,
-            })
-
-            total_c += t_total
-            ocupados_c += t_ocup
-
-            # acumular globales por tipo
-            if tipo_id not in totales_por_tipo:
-                totales_por_tipo[tipo_id] = {"tipo": tipo, "total": 0, "ocupados": 0, "libres": 0}
-            totales_por_tipo[tipo_id]["total"] += t_total
-            totales_por_tipo[tipo_id]["ocupados"] += t_ocup
-
-        libres_c = max(total_c - ocupados_c, 0)
-        abiertos_c = c.movimientos.filter(estado="ABIERTO").count()
-
-        # acumular globales
-        total_espacios += total_c
-        ocupados += ocupados_c
-        libres += libres_c
-        mov_abiertos += abiertos_c
-
-        cocheras_data.append({
-            "cochera": c,
-            "is_owner": (c.owner_id == user.id),
-            "total_espacios": total_c,
-            "ocupados": ocupados_c,
-            "libres": libres_c,
-            "mov_abiertos": abiertos_c,
-            "por_tipo": por_tipo_list,
-        })
 
-    # terminar globales por tipo
-    totales_por_tipo_list = []
-    for d in totales_por_tipo.values():
-        d["libres"] = max(d["total"] - d["ocupados"], 0)
-        totales_por_tipo_list.append(d)
-    totales_por_tipo_list.sort(key=lambda x: x["tipo"].nombre)
+def _flags(user):
+    is_admin_dueno = user.is_superuser or "ADMIN_DUENO" in roles(user)
+    is_admin_empleado = user.is_superuser or "ADMIN_EMPLEADO" in roles(user)
+    return {
+        "is_superadmin": user.is_superuser,
+        "can_manage_cochera": is_admin_dueno,
+        "can_operate": is_admin_dueno or is_admin_empleado,
+    }
 
-    ocupacion_pct = round((ocupados / total_espacios * 100) if total_espacios else 0, 1)
 
-    ultimos = (
-        Movimiento.objects.filter(cochera__in=cocheras)
-        .select_related("cochera", "vehiculo", "vehiculo__tipo", "espacio", "espacio__tipo")
-        .order_by("-ingreso_at")[:10]
-    )
+def _fragmento(request, etag, construir):
+    """
+    Respuesta de un fragmento del dashboard con ETag: si el navegador ya tiene
+    esa versión, 304 sin construir nada. no-cache = se guarda pero se revalida
+    siempre (los números cambian con cada ingreso/egreso).
+    """
+    etag = quote_etag(hashlib.md5(etag.encode()).hexdigest())
+    resp = get_conditional_response(request, etag=etag)
+    if resp is None:
+        resp = construir()
+    resp["ETag"] = etag
+    patch_cache_control(resp, private=True, no_cache=True)
+    return resp
 
-    # ⚠️ “Monto total”: hoy no existe un campo monto/facturación en Movimiento ni en services,
-    # así que te dejo placeholder hasta que metas Tarifa/Pago.
-    total_facturado = None
 
-    ctx = {
-        "cocheras": cocheras,
-        "cocheras_data": cocheras_data,
+def _visibles(user):
+    """(id, nombre) de las cocheras visibles y la clave de versión de cada una (una query + un get_many)."""
+    cocheras = list(_cocheras_visibles(user).order_by("-created_at", "-id").values_list("id", "nombre"))
+    vers = versiones.versiones(VERSION_OCUPACION, [cid for cid, _ in cocheras])
+    return cocheras, {cid: tenancy.clave(cid, vers[cid]) for cid, _ in cocheras}
+
+
+@login_required
+def dashboard_view(request):
+    """
+    Solo el esqueleto, sin tocar cocheras: la lista, cada tarjeta, los totales
+    y los últimos movimientos los pide el navegador aparte. Cuesta lo mismo con
+    1 o con 100 cocheras.
+    """
+    return render(request, "users/dashboard.html")
 
-        # métricas (mantenidas)
+
+@login_required
+def dashboard_cocheras_view(request):
+    """Las cocheras del dashboard (para armar las tarjetas). Editar una cochera cambia su versión."""
+    cocheras, claves = _visibles(request.user)
+    etag = "cocheras|" + "|".join(claves[cid] for cid, _ in cocheras)
+
+    def construir():
+        return JsonResponse({"cocheras": [
+            {"id": cid, "nombre": nombre, "url": reverse("dashboard_tarjeta", args=[cid])} for cid, nombre in cocheras
+        ]})
+
+    return _fragmento(request, etag, construir)
+
+
+@login_required
+def dashboard_tarjeta_view(request, cochera_id):
+    user = request.user
+    c = get_object_or_404(_cocheras_visibles(user), id=cochera_id)
+    flags = _flags(user)
+    is_owner = c.owner_id == user.id
+    clave = tenancy.clave(c.id, versiones.version(VERSION_OCUPACION, c.id))
+    etag = f"tarjeta|{clave}|{is_owner}|{flags['can_manage_cochera']}|{flags['can_operate']}"
+
+    def construir():
+        datos, claves = _tarjetas([c.id])
+        item = {"cochera": c, "clave": claves[c.id], "is_owner": is_owner, **datos[c.id]}
+        return render(request, "users/_tarjeta.html", {"item": item, "cache_ttl": CACHE_TARJETA, **flags})
+
+    return _fragmento(request, etag, construir)
+
+
+def _totales(datos):
+    """Suma las tarjetas: totales globales y por tipo."""
+    por_tipo = {}
+    total_espacios = ocupados = libres = mov_abiertos = 0
+    for d in datos.values():
+        for row in d["por_tipo"]:
+            t = por_tipo.setdefault(row["tipo"]["id"], {"tipo": row["tipo"], "total": 0, "ocupados": 0, "libres": 0})
+            t["total"] += row["total"]
+            t["ocupados"] += row["ocupados"]
+        total_espacios += d["total_espacios"]
+        ocupados += d["ocupados"]
+        libres += d["libres"]
+        mov_abiertos += d["mov_abiertos"]
+
+    for t in por_tipo.values():
+        t["libres"] = max(t["total"] - t["ocupados"], 0)
+    return {
         "total_espacios": total_espacios,
         "ocupados": ocupados,
         "libres": libres,
         "mov_abiertos": mov_abiertos,
-        "ocupacion_pct": ocupacion_pct,
-        "ultimos": ultimos,
+        "ocupacion_pct": round((ocupados / total_espacios * 100) if total_espacios else 0, 1),
+        "totales_por_tipo": sorted(por_tipo.values(), key=lambda x: x["tipo"]["nombre"]),
+    }
 
-        # detalle global por tipo
-        "totales_por_tipo": totales_por_tipo_list,
 
-        # roles
-        "is_superadmin": is_superadmin,
-        "can_manage_cochera": can_manage_cochera,
-        "can_operate": can_operate,
+@login_required
+def dashboard_totales_view(request):
+    cocheras, claves = _visibles(request.user)
+    ids = [cid for cid, _ in cocheras]
+    etag = "totales|" + "|".join(claves[cid] for cid in sorted(ids))
 
-        # placeholder monetario
-        "total_facturado": total_facturado,
-    }
-    return render(request, "users/dashboard.html", ctx)
+    def construir():
+        # las tarjetas salen de la misma cache que los fragmentos de cada cochera
+        datos, _ = _tarjetas(ids)
+        # ⚠️ “Monto total”: hoy no existe un campo monto/facturación en Movimiento ni en services,
+        # así que te dejo placeholder hasta que metas Tarifa/Pago.
+        return render(request, "users/_totales.html", {**_totales(datos), "total_facturado": None})
+
+    return _fragmento(request, etag, construir)
+
+
+@login_required
+def dashboard_ultimos_view(request):
+    cocheras, claves = _visibles(request.user)
+    ids = [cid for cid, _ in cocheras]
+    ultimos_clave = hashlib.md5("|".join(sorted(claves.values())).encode()).hexdigest()
+
+    def construir():
+        # lazy: solo se ejecuta si el fragmento no está en cache
+        ultimos = (
+            Movimiento.objects.filter(cochera__in=ids)
+            .select_related("cochera", "vehiculo", "vehiculo__tipo", "espacio", "espacio__tipo")
+            .order_by("-ingreso_at")[:10]
+        )
+        return render(request, "users/_ultimos.html", {
+            "ultimos": ultimos, "ultimos_clave": ultimos_clave, "cache_ttl": CACHE_TARJETA,
+        })
+
+    return _fragmento(request, f"ultimos|{ultimos_clave}", construir)
 
 
 def logout_view(request):